@@ -0,0 +1,171 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException, TimeoutException
+
+from scraper import URL, get_credentials, _create_driver, _login
+
+
+LOGIN_FIELD_XPATH = "//input[@placeholder='User name']"
+SIDEBAR_MENU_XPATH = "//ul[contains(@class, 'el-menu')]"
+
+
+class BrowserManager:
+    """
+    Keeps one logged-in headless Chrome alive for the lifetime of the server process
+    and lends it to one scraper job at a time.
+
+    Settings (environment):
+      - WARM_BROWSER_SESSION: '1' (default) to enable, '0' to always start a fresh browser per job
+      - WARM_BROWSER_MAX_AGE_HOURS: recycle the browser after this many hours (default 12)
+    """
+
+    def __init__(self, headless=True):
+        self.headless = headless
+        self.enabled = os.getenv('WARM_BROWSER_SESSION', '1') != '0'
+        self.max_age_seconds = float(os.getenv('WARM_BROWSER_MAX_AGE_HOURS', '12')) * 3600
+        self._lock = threading.Lock()
+        self._driver = None
+        self._started_at = None
+        # Startup + login time of the most recent cold start; every reuse saves roughly this much.
+        self._cold_start_seconds = None
+        self.reuse_count = 0
+
+    # --- Lifecycle ---
+    def _start(self):
+        started = time.monotonic()
+        username, password = get_credentials()
+        driver = _create_driver(self.headless)
+        try:
+            _login(driver, WebDriverWait(driver, 30), username, password)
+            self._wait_for_app(driver)
+        except Exception:
+            driver.quit()
+            raise
+        self._driver = driver
+        self._started_at = time.monotonic()
+        self._cold_start_seconds = self._started_at - started
+        logging.info(f"Warm browser session started in {self._cold_start_seconds:.1f}s.")
+
+    def _wait_for_app(self, driver, timeout=30):
+        """Waits until the SPA shows either the logged-in menu or the login form; returns True if logged in."""
+        WebDriverWait(driver, timeout).until(EC.any_of(
+            EC.presence_of_element_located((By.XPATH, SIDEBAR_MENU_XPATH)),
+            EC.presence_of_element_located((By.XPATH, LOGIN_FIELD_XPATH))
+        ))
+        return not driver.find_elements(By.XPATH, LOGIN_FIELD_XPATH)
+
+    def _discard(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception:
+                pass
+        self._driver = None
+        self._started_at = None
+
+    @property
+    def is_warm(self):
+        """True while a browser is kept alive."""
+        return self._driver is not None
+
+    def shutdown(self):
+        with self._lock:
+            self._discard()
+
+    def _ensure_ready(self, stats):
+        """Returns a logged-in driver, restarting or re-authenticating it when needed."""
+        if self._driver is not None and time.monotonic() - self._started_at > self.max_age_seconds:
+            logging.info("Warm browser session reached its max age; recycling.")
+            self._discard()
+
+        if self._driver is not None:
+            try:
+                self._driver.get(URL)
+                if not self._wait_for_app(self._driver):
+                    logging.info("Warm browser session expired; logging in again.")
+                    started = time.monotonic()
+                    username, password = get_credentials()
+                    _login(self._driver, WebDriverWait(self._driver, 30), username, password)
+                    self._wait_for_app(self._driver)
+                    stats['relogin_seconds'] = round(time.monotonic() - started, 1)
+                stats['mode'] = 'warm'
+                stats['saved_seconds'] = round(self._cold_start_seconds or 0, 1)
+                self.reuse_count += 1
+                return self._driver
+            except (WebDriverException, TimeoutException) as e:
+                logging.warning(f"Warm browser session is not usable, restarting it: {e}")
+                self._discard()
+
+        self._start()
+        stats['mode'] = 'cold_start'
+        stats['startup_seconds'] = round(self._cold_start_seconds, 1)
+        return self._driver
+
+    # --- Public API ---
+    @contextmanager
+    def borrow(self, job_name):
+        """
+        Lends the shared driver to `job_name` as (driver, stats).
+        Yields driver=None when the warm session is disabled, busy with another job
+        or fails to start, in which case the job should launch its own browser.
+        """
+        stats = {'mode': 'disabled'}
+        if not self.enabled:
+            yield None, stats
+            return
+        if not self._lock.acquire(blocking=False):
+            logging.info(f"Warm browser session is busy; '{job_name}' will start its own browser.")
+            stats['mode'] = 'busy'
+            yield None, stats
+            return
+        try:
+            try:
+                driver = self._ensure_ready(stats)
+            except Exception as e:
+                logging.error(f"Could not start warm browser session for '{job_name}': {e}", exc_info=True)
+                self._discard()
+                stats['mode'] = 'unavailable'
+                driver = None
+            logging.info(f"Lending browser session to '{job_name}' ({stats['mode']}).")
+            try:
+                yield driver, stats
+            except WebDriverException:
+                # The browser itself broke; start a fresh one next time.
+                self._discard()
+                raise
+        finally:
+            self._lock.release()
+
+
+def set_download_dir(driver, download_dir):
+    """Points an already running Chrome at a new download directory (prefs only apply at startup)."""
+    driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+        "behavior": "allow",
+        "downloadPath": download_dir,
+        "eventsEnabled": False
+    })
+
+
+def describe_browser_stats(stats):
+    """Short human-readable summary for UpdateLog details."""
+    mode = stats.get('mode')
+    if mode == 'warm':
+        text = f"Warm browser reused (saved ~{stats.get('saved_seconds', 0)}s startup/login)"
+        if stats.get('relogin_seconds') is not None:
+            text += f", re-login {stats['relogin_seconds']}s"
+        return text + "."
+    if mode == 'cold_start':
+        return f"Warm browser started (startup/login {stats.get('startup_seconds', 0)}s)."
+    return ""
+
+
+browser_manager = BrowserManager()
+atexit.register(browser_manager.shutdown)
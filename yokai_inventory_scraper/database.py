@@ -1,7 +1,8 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, DateTime, ForeignKey, Table, text
+import json
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, Text, Date, DateTime, Float, ForeignKey, Table, Index, text, inspect, bindparam
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
@@ -10,21 +11,104 @@ from dotenv import load_dotenv
 # Render provides the DATABASE_URL environment variable
 # For local development, we can fall back to a local SQLite database
 DATABASE_URL = os.getenv("DATABASE_URL")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Engine tuning, all overridable from the environment:
+#   PostgreSQL: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (s), DB_POOL_RECYCLE (s),
+#               DB_POOL_PRE_PING ('1'/'0'), DB_STATEMENT_TIMEOUT_MS (0 = none), DB_SSLMODE
+#   SQLite:     SQLITE_POOL ('queue' | 'thread' | 'null'), DB_POOL_SIZE, SQLITE_BUSY_TIMEOUT_MS,
+#               SQLITE_JOURNAL_MODE (WAL), SQLITE_SYNCHRONOUS (NORMAL)
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def engine_options(database_url):
+    """
+    Returns (create_engine kwargs, sqlite pragmas) for `database_url`.
+    PostgreSQL gets a sized, pre-pinged, recycled pool and a server-side statement timeout.
+    SQLite reuses pooled connections instead of opening the file for every session, and
+    runs in WAL mode with a busy timeout so readers and the scraper's writes don't block each other.
+    """
+    if database_url.startswith('sqlite'):
+        busy_timeout_ms = _env_int('SQLITE_BUSY_TIMEOUT_MS', 15000)
+        pool = os.getenv('SQLITE_POOL', 'queue').lower()
+        options = {'connect_args': {'check_same_thread': False, 'timeout': busy_timeout_ms / 1000}}
+        if pool == 'null':
+            options['poolclass'] = NullPool
+        elif pool == 'thread':
+            options['poolclass'] = SingletonThreadPool
+            options['pool_size'] = _env_int('DB_POOL_SIZE', 5)
+        else:
+            options['poolclass'] = QueuePool
+            options['pool_size'] = _env_int('DB_POOL_SIZE', 5)
+            options['max_overflow'] = _env_int('DB_MAX_OVERFLOW', 10)
+            options['pool_timeout'] = _env_int('DB_POOL_TIMEOUT', 30)
+        pragmas = {
+            'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+            'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            'busy_timeout': busy_timeout_ms,
+        }
+        return options, pragmas
+
+    connect_args = {}
+    # Render's PostgreSQL needs `sslmode=require`, which also prevents
+    # intermittent SSL-related errors on cloud platforms.
+    sslmode = os.getenv('DB_SSLMODE', 'require')
+    if sslmode:
+        connect_args['sslmode'] = sslmode
+    statement_timeout_ms = _env_int('DB_STATEMENT_TIMEOUT_MS', 60000)
+    if statement_timeout_ms > 0:
+        connect_args['options'] = f"-c statement_timeout={statement_timeout_ms}"
+    options = {
+        'connect_args': connect_args,
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        # Render closes idle connections; recycle before that and test each checkout
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') != '0',
+    }
+    return options, {}
+
+
+def make_engine(database_url):
+    """Creates the engine for `database_url` with the settings from engine_options()."""
+    options, pragmas = engine_options(database_url)
+    new_engine = create_engine(database_url, **options)
+    if pragmas:
+        @event.listens_for(new_engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    return new_engine
+
+
+def describe_engine(target=None):
+    """Backend and pool settings of `target` (default: the app engine), for startup logs and diagnostics."""
+    target = target or engine
+    pool = target.pool
+    info = {
+        'backend': target.dialect.name,
+        'pool': type(pool).__name__,
+        'poolStatus': pool.status(),
+    }
+    if isinstance(pool, QueuePool):
+        info.update({'poolSize': pool.size(), 'maxOverflow': pool._max_overflow, 'poolTimeout': pool._timeout,
+                     'poolRecycle': pool._recycle, 'prePing': pool._pre_ping})
+    if target.dialect.name == 'sqlite':
+        with target.connect() as conn:
+            for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                info[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+    else:
+        info['statementTimeoutMs'] = _env_int('DB_STATEMENT_TIMEOUT_MS', 60000)
+    return info
+
 
 # If DATABASE_URL is provided (i.e., on Render), use PostgreSQL.
 # Otherwise, use a local SQLite database.
-if DATABASE_URL:
-    # Render's PostgreSQL setup might require a specific dialect name.
-    # The URL from Render should start with 'postgresql://'
-    # We add `sslmode=require` to enforce a secure connection, which can prevent
-    # intermittent SSL-related errors on cloud platforms.
-    engine = create_engine(DATABASE_URL, connect_args={"sslmode": "require"})
-else:
-    # For local development and testing, use SQLite.
-    # NullPool is recommended for SQLite to avoid issues with thread safety in web apps.
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(script_dir, "inventory.db")
-    engine = create_engine(f"sqlite:///{db_path}", poolclass=NullPool)
+engine = make_engine(DATABASE_URL or f"sqlite:///{os.path.join(script_dir, 'inventory.db')}")
 
 # --- Session Management ---
 # The Session is the primary interface for all database operations.
@@ -61,9 +145,12 @@ class Warehouse(Base):
 class Inventory(Base):
     """
     Represents the inventory of a product in a specific machine.
-    This table will be completely cleared and repopulated on each scrape.
+    Each scrape is applied as a diff keyed on (store, machine_id, product_name).
     """
     __tablename__ = "inventory"
+    __table_args__ = (
+        Index('uq_inventory_store_machine_product', 'store', 'machine_id', 'product_name', unique=True),
+    )
 
     # A unique ID for each row
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -150,6 +237,10 @@ class User(Base):
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    # Natural key: re-ingesting the same export never duplicates a sale
+    __table_args__ = (
+        Index('uq_transactions_natural_key', 'store_key', 'transaction_time', 'product_name', 'amount', 'payment_type', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     store_key = Column(String, ForeignKey('stores.store_key'), nullable=False, index=True)
     transaction_time = Column(DateTime, nullable=False, index=True)
@@ -160,6 +251,70 @@ class Transaction(Base):
     store = relationship("Store", back_populates="transactions")
 
 
+class SalesDaily(Base):
+    """
+    Daily sales rollup per (store_key, product, day, unit-price bucket), kept in step with
+    `transactions` by sales_ingest (see sales_rollup.py). Read paths that only need counts
+    or amounts per day query this instead of every transaction row.
+    """
+    __tablename__ = 'sales_daily'
+
+    store_key = Column(String, primary_key=True)
+    product_name = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    unit_price = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    amount = Column(Integer, nullable=False, default=0)
+
+
+class DemandForecast(Base):
+    """
+    Expected daily sales per (store_key, product), written by the 'forecast' job (see
+    forecasting.py) and replaced as a whole on every run. method is 'ses' or 'croston'.
+    """
+    __tablename__ = 'demand_forecasts'
+
+    store_key = Column(String, primary_key=True)
+    product_name = Column(String, primary_key=True)
+    method = Column(String, nullable=False)
+    alpha = Column(Float, nullable=False)
+    daily_rate = Column(Float, nullable=False)
+    # In-sample root mean squared one-step error (units per day)
+    rmse = Column(Float, nullable=True)
+    history_days = Column(Integer, nullable=False)
+    trained_through = Column(Date, nullable=False)
+    trained_at = Column(DateTime(timezone=True), default=lambda: datetime.now(pytz.utc))
+
+
+class InventorySync(Base):
+    """
+    One row per inventory sync (scraper run or file upload, see scraper.sync_inventory).
+    Unchanged inventory rows are not rewritten, so every row in the table was last
+    confirmed at the latest synced_at; /get-data serves that as the rows' processTime.
+    """
+    __tablename__ = 'inventory_syncs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    synced_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    inserted = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    unchanged = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+
+
+class MachineScrape(Base):
+    """
+    When each machine's 'Inventory inquiry' tab was last actually read (scraped, fetched
+    from the API or uploaded). Machines the incremental scrape carries forward are not
+    updated here, so their sales can be compared with the inventory the scrape last saw.
+    """
+    __tablename__ = 'machine_scrapes'
+
+    store = Column(String, primary_key=True)
+    machine_id = Column(String, primary_key=True)
+    scraped_at = Column(DateTime(timezone=True), nullable=False)
+
+
 class UpdateLog(Base):
     """
     Stores a record of each scraper run, whether it was for inventory or sales.
@@ -172,6 +327,42 @@ class UpdateLog(Base):
     details = Column(Text, nullable=True)  # e.g., 'Updated 62 items' or error message
 
 
+class DataVersion(Base):
+    """
+    A counter per data set ('inventory', 'stores', 'users', 'transactions', 'warehouse',
+    'forecasts') that is bumped in the same transaction as every write to it. Response
+    caches compare these numbers to know whether their copy is still current, also across
+    processes.
+    """
+    __tablename__ = 'data_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(pytz.utc), onupdate=lambda: datetime.now(pytz.utc))
+
+
+class StoreInventoryScope(Base):
+    """
+    Materialized answer to "which Inventory.store names does an assigned store_key cover".
+    rule='view' uses the part before the last '-' (get-data), rule='notify' the part before
+    the first '-' (low-inventory notifications); both match case-insensitively anywhere in
+    the name, like the ILIKE '%...%' filters they replace. Rebuilt by user_scope.ensure_scope.
+    """
+    __tablename__ = 'store_inventory_scope'
+
+    store_key = Column(String, primary_key=True)
+    rule = Column(String, primary_key=True)
+    inventory_store = Column(String, primary_key=True, index=True)
+
+
+class StoreTransactionScope(Base):
+    """Materialized mapping of an assigned store_key to the Transaction.store_key values it covers."""
+    __tablename__ = 'store_transaction_scope'
+
+    store_key = Column(String, primary_key=True)
+    transaction_store_key = Column(String, primary_key=True, index=True)
+
+
 class NotificationSent(Base):
     """
     Tracks notifications sent to users for specific stores.
@@ -193,12 +384,164 @@ class NotificationSent(Base):
         }
 
 
+class OutboundEmail(Base):
+    """
+    Mail queue (see mailer.py). Rows go queued -> sending -> sent / failed; transient
+    SendGrid errors put them back to queued with a later next_attempt_at.
+    store_keys (JSON list) are the stores a low-inventory email reports as newly low;
+    they get their NotificationSent rows only once the email was accepted by SendGrid.
+    """
+    __tablename__ = 'outbound_emails'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    html_content = Column(Boolean, nullable=False, default=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    store_keys = Column(Text, nullable=True)
+    status = Column(String, nullable=False, default='queued', index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    claim_token = Column(String, nullable=True, index=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(pytz.utc))
+    sent_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'to': self.to_email,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'lastError': self.last_error,
+            'sentAt': self.sent_at.isoformat() if self.sent_at else None
+        }
+
+
+class Job(Base):
+    """
+    Background job (see jobs.py). Rows go queued -> running -> succeeded / failed.
+    A running job whose heartbeat_at stops moving belonged to a process that died
+    and is marked failed, so a restart never leaves a type blocked forever.
+    """
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_type = Column(String, nullable=False, index=True)
+    params = Column(Text, nullable=True)
+    status = Column(String, nullable=False, default='queued', index=True)
+    progress = Column(Text, nullable=True)
+    output = Column(Text, nullable=True)
+    worker_id = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(pytz.utc))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    duration_seconds = Column(Float, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.job_type,
+            'params': json.loads(self.params) if self.params else {},
+            'status': self.status,
+            'progress': self.progress,
+            'output': self.output,
+            'createdAt': self.created_at.isoformat() if self.created_at else None,
+            'startedAt': self.started_at.isoformat() if self.started_at else None,
+            'finishedAt': self.finished_at.isoformat() if self.finished_at else None,
+            'durationSeconds': self.duration_seconds
+        }
+
+
+class JobTypeLock(Base):
+    """
+    One row per job type, written first in every claim and deduplicated submit of that
+    type (see jobs.py). The row lock serializes them across processes until commit, so
+    their checks always see the other transaction's committed result.
+    """
+    __tablename__ = 'job_type_locks'
+
+    job_type = Column(String, primary_key=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class LeaderLease(Base):
+    """
+    One row per leader role (e.g. 'scheduler'), see leader.py. The holder renews
+    expires_at while it is alive; once it lapses any process may take the role over.
+    """
+    __tablename__ = 'leader_leases'
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=True)
+    acquired_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class ScheduledSlot(Base):
+    """A scheduled run that already fired (e.g. 'inventory' for '2025-08-18T05'); never fired twice."""
+    __tablename__ = 'scheduled_slots'
+
+    name = Column(String, primary_key=True)
+    slot = Column(String, primary_key=True)
+    fired_by = Column(String, nullable=True)
+    fired_at = Column(DateTime(timezone=True), default=lambda: datetime.now(pytz.utc))
+
+
+DEDUPE_BATCH_SIZE = 1000
+
+
+def _has_index(conn, table, index_name):
+    return index_name in {index['name'] for index in inspect(conn).get_indexes(table)}
+
+
+def ensure_unique_index(table, index_name, columns, keep_newest, target=None):
+    """
+    Runtime migration for databases created before `index_name` existed: deletes the
+    duplicate rows per key (keeping the newest or the oldest id), then creates the unique
+    index. Returns False without touching the table once the index exists, so only the
+    first start pays for it. On PostgreSQL an advisory lock lets one worker migrate
+    while the others wait and then find the index. Failures raise.
+    """
+    target = target or engine
+    with target.connect() as conn:
+        if _has_index(conn, table, index_name):
+            return False
+    key = ', '.join(columns)
+    try:
+        with target.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {'name': index_name})
+                if _has_index(conn, table, index_name):
+                    return False
+                # One-off: the scan and the index build may outlast the request statement timeout
+                conn.execute(text("SET LOCAL statement_timeout = 0"))
+            duplicates = [row[0] for row in conn.execute(text(
+                f"SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                f"(PARTITION BY {key} ORDER BY id {'DESC' if keep_newest else 'ASC'}) AS copy FROM {table}) copies "
+                f"WHERE copy > 1"
+            ))]
+            delete = text(f"DELETE FROM {table} WHERE id IN :ids").bindparams(bindparam('ids', expanding=True))
+            for start in range(0, len(duplicates), DEDUPE_BATCH_SIZE):
+                conn.execute(delete, {'ids': duplicates[start:start + DEDUPE_BATCH_SIZE]})
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({key})"))
+    except Exception as e:
+        raise RuntimeError(f"Could not create the unique index {index_name} on {table}: {e}") from e
+    print(f"Migrated {table}: removed {len(duplicates)} duplicate rows, created {index_name}.")
+    return True
+
+
 def init_db():
     """
     Creates all the tables in the database.
     This function should be called once when the application starts.
     """
     print("Initializing database...")
+    print(f"Database engine: {describe_engine()}")
     try:
         Base.metadata.create_all(bind=engine)
         print("Database tables created successfully (if they didn't exist).")
@@ -219,10 +562,17 @@ def init_db():
             conn.close()
         except Exception as me:
             print(f"Runtime migration check failed: {me}")
-
     except Exception as e:
         print(f"An error occurred during database initialization: {e}")
 
+    # Older DBs have no unique keys on inventory and transaction rows, which the differential
+    # upserts (ON CONFLICT) need. Without them every sync would fail, so these raise.
+    ensure_unique_index('inventory', 'uq_inventory_store_machine_product',
+                        ('store', 'machine_id', 'product_name'), keep_newest=True)
+    # Transactions were filled by delete-and-reinsert and may hold duplicates; keep the first copy
+    ensure_unique_index('transactions', 'uq_transactions_natural_key',
+                        ('store_key', 'transaction_time', 'product_name', 'amount', 'payment_type'), keep_newest=False)
+
 
 class Feedback(Base):
     """
@@ -240,6 +590,42 @@ class Feedback(Base):
     def to_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
+def dialect_insert(db, model):
+    """
+    Returns an INSERT for `model` that supports on_conflict_do_update / on_conflict_do_nothing
+    on both backends we run on (PostgreSQL on Render, SQLite locally).
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on '{dialect}'.")
+    return insert(model.__table__)
+
+
+def bump_data_version(db, *names):
+    """Increments the version of each data set in `names` inside the caller's transaction."""
+    for name in names:
+        stmt = dialect_insert(db, DataVersion).values(name=name, version=1, updated_at=datetime.now(pytz.utc))
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': DataVersion.version + 1, 'updated_at': stmt.excluded.updated_at}
+        ))
+
+
+def get_data_versions(db, names):
+    """Returns the current versions of `names` as a tuple in the same order (0 if never bumped)."""
+    rows = dict(db.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(names)).all())
+    return tuple(rows.get(name, 0) for name in names)
+
+
+def latest_inventory_sync(db):
+    """synced_at of the most recent inventory sync, or None before the first one."""
+    return db.query(InventorySync.synced_at).order_by(InventorySync.id.desc()).limit(1).scalar()
+
+
 # --- Convenience function for getting a DB session ---
 def get_db():
     """
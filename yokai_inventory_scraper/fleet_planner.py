@@ -0,0 +1,164 @@
+"""
+Fleet-wide replenishment plan: one allocation of the selected warehouses' stock over all
+machines of a route. The per-machine suggestions each assume the whole warehouse is
+theirs, so ten machines can all be told to take the same 20 units; here every unit is
+handed out once.
+
+Units are given out one at a time to the (machine, product) where the next unit is worth
+most: a priority queue keyed by weight / (quantity after the unit), the highest-averages
+rule used for proportional apportionment. With weight = daily sales that is the product
+with the fewest days of cover anywhere in the fleet, and each machine ends up stocked in
+proportion to its sales. The strategies only change the weights:
+
+    stable       the machine's share of its store's 30-day sales
+    aggressive   the machine's top 3 sellers are boosted to 80% of its weight
+    exploratory  products without sales (those selling elsewhere in the fleet first) get
+                 EXPLORATORY_NEW_ITEMS of the form rows and share 20% of the weight
+
+Constraints: warehouse stock per product, each machine's max_total_qty, at most
+MAX_ITEMS_PER_MACHINE products topped up per machine (the rows a machine has on the
+replenishment form), and nothing is taken out of a machine.
+"""
+import time
+import heapq
+
+
+MAX_ITEMS_PER_MACHINE = 7
+AGGRESSIVE_TOP_PRODUCTS = 3
+AGGRESSIVE_TOP_SHARE = 0.8
+EXPLORATORY_NEW_SHARE = 0.2
+# Rows of the form kept for products a machine has no sales for
+EXPLORATORY_NEW_ITEMS = 2
+
+
+def machine_demand(store_keys, sales):
+    """
+    {store_key: {product: units}} — a store's 30-day sales split evenly over its machines in
+    the plan (sales are recorded per store name, see replenishment.load_sales_counts).
+    """
+    machines_per_store = {}
+    for store_key in store_keys:
+        store_name = store_key.split('-', 1)[0]
+        machines_per_store[store_name] = machines_per_store.get(store_name, 0) + 1
+    demand = {}
+    for store_key in store_keys:
+        store_name = store_key.split('-', 1)[0]
+        share = machines_per_store[store_name]
+        demand[store_key] = {product: count / share for product, count in sales.get(store_name, {}).items() if count > 0}
+    return demand
+
+
+def strategy_weights(strategy, demand, products, fleet_demand=None):
+    """{product: weight} over `products` (those the warehouses have) for one machine."""
+    weights = {product: demand[product] for product in products if demand.get(product, 0) > 0}
+    total = sum(weights.values())
+    if not total:
+        return weights
+    if strategy == 'aggressive':
+        top = sorted(weights, key=lambda product: weights[product], reverse=True)[:AGGRESSIVE_TOP_PRODUCTS]
+        top_share = sum(weights[product] for product in top) / total
+        if top_share < AGGRESSIVE_TOP_SHARE:
+            # Boost b with b*s / (b*s + 1 - s) == AGGRESSIVE_TOP_SHARE
+            boost = AGGRESSIVE_TOP_SHARE * (1 - top_share) / ((1 - AGGRESSIVE_TOP_SHARE) * top_share)
+            for product in top:
+                weights[product] *= boost
+    elif strategy != 'stable':  # exploratory
+        new_products = [product for product in products if product not in weights]
+        if new_products:
+            new_count = min(len(new_products), max(EXPLORATORY_NEW_ITEMS, MAX_ITEMS_PER_MACHINE - len(weights)))
+            fleet_demand = fleet_demand or {}
+            new_products = sorted(new_products, key=lambda product: fleet_demand.get(product, 0), reverse=True)[:new_count]
+            sellers = sorted(weights, key=lambda product: weights[product], reverse=True)[:MAX_ITEMS_PER_MACHINE - new_count]
+            weights = {product: weights[product] for product in sellers}
+            total = sum(weights.values())
+            new_weight = total * EXPLORATORY_NEW_SHARE / (1 - EXPLORATORY_NEW_SHARE) / len(new_products)
+            weights.update((product, new_weight) for product in new_products)
+    return weights
+
+
+def plan_fleet(store_keys, strategy, capacities, warehouse_inventory, inventories, sales):
+    """
+    Allocates `warehouse_inventory` ({product: quantity}) over the machines in `store_keys`.
+
+    capacities: {store_key: max_total_qty}; inventories: {store_key: {product: quantity}};
+    sales: {store_name: {product: 30-day units}} (the replenishment.py loaders' shapes).
+    Machines without any sales are weighted by the fleet's average demand instead.
+    Returns (results, summary): one suggestion body per machine, in the same format as
+    /api/warehouse-replenishment-suggestion, and the fleet totals.
+    """
+    started = time.perf_counter()
+    products = [product for product, quantity in warehouse_inventory.items() if quantity > 0]
+    stock = {product: warehouse_inventory[product] for product in products}
+    demand = machine_demand(store_keys, sales)
+
+    fleet_demand = {}
+    machines_with_sales = [store_key for store_key in store_keys if demand[store_key]]
+    for store_key in machines_with_sales:
+        for product, units in demand[store_key].items():
+            fleet_demand[product] = fleet_demand.get(product, 0) + units / len(machines_with_sales)
+
+    weights, room, added = [], [], []
+    heap = []
+    for m, store_key in enumerate(store_keys):
+        current = inventories.get(store_key, {})
+        machine_weights = strategy_weights(strategy, demand[store_key] or fleet_demand, products, fleet_demand)
+        if not machine_weights:  # no sales anywhere in the fleet: spread evenly
+            machine_weights = {product: 1.0 for product in products}
+        weights.append(machine_weights)
+        room.append(max(0, capacities[store_key] - sum(current.values())))
+        added.append({})
+        heap.extend((-weight / (current.get(product, 0) + 1), m, product) for product, weight in machine_weights.items())
+    heapq.heapify(heap)
+
+    # Entries of full machines and exhausted products are dropped as they come up
+    while heap:
+        _, m, product = heapq.heappop(heap)
+        if not stock[product] or not room[m]:
+            continue
+        machine_added = added[m]
+        if product not in machine_added and len(machine_added) >= MAX_ITEMS_PER_MACHINE:
+            continue
+        stock[product] -= 1
+        room[m] -= 1
+        machine_added[product] = machine_added.get(product, 0) + 1
+        quantity = inventories.get(store_keys[m], {}).get(product, 0) + machine_added[product]
+        heapq.heappush(heap, (-weights[m][product] / (quantity + 1), m, product))
+
+    results = []
+    for m, store_key in enumerate(store_keys):
+        current = inventories.get(store_key, {})
+        store_sales = sales.get(store_key.split('-', 1)[0], {})
+        names = list(current) + [product for product in added[m] if product not in current]
+        suggestion = [{
+            'productName': product,
+            'currentQty': current.get(product, 0),
+            'suggestedQty': current.get(product, 0) + added[m].get(product, 0),
+            'warehouseQty': warehouse_inventory.get(product, 0),
+            'salesCount30d': store_sales.get(product, 0)
+        } for product in names]
+        suggestion.sort(key=lambda item: (item['suggestedQty'] - item['currentQty'], item['salesCount30d']), reverse=True)
+        current_total = sum(current.values())
+        warning = None
+        if current_total >= capacities[store_key]:
+            warning = f"現有庫存總和({current_total})已達最大補貨總數量({capacities[store_key]})，無需補貨。"
+        elif room[m]:
+            warning = f"倉庫庫存不足，尚有 {room[m]} 個空位未補滿。"
+        results.append({
+            "success": True,
+            "store_key": store_key,
+            "strategy_used": strategy,
+            "suggestion": suggestion,
+            "warning": warning
+        })
+
+    allocated = {product: warehouse_inventory[product] - stock[product] for product in products
+                 if stock[product] != warehouse_inventory[product]}
+    summary = {
+        "machines": len(store_keys),
+        "allocated": sum(allocated.values()),
+        "allocatedByProduct": allocated,
+        "warehouseRemaining": {product: quantity for product, quantity in stock.items() if quantity},
+        "unfilledSlots": sum(room),
+        "planSeconds": round(time.perf_counter() - started, 4)
+    }
+    return results, summary
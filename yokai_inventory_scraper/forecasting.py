@@ -0,0 +1,243 @@
+"""
+Demand forecasts per (store_key, product) from the daily sales rollup, an alternative to
+the flat 30-day counts the replenishment suggestions weight by.
+
+The 'forecast' job (tasks.py) fits every series of the fleet in one go:
+
+    daily_matrix      sales_daily -> (series × days) array of units sold per day
+    fit_ses           simple exponential smoothing, for series that sell on most days
+    fit_croston       Croston's method with the Syntetos-Boylan correction, for intermittent
+                      series (average interval between sales days above INTERMITTENT_ADI)
+    fit_forecasts     the right method per series, with the alpha of ALPHAS that has the
+                      smallest squared one-step error (absolute error would favour
+                      forecasting zero for series that sell on few days)
+    backtest          forecasts vs. the 30-day counts over the last days of history
+    train_forecasts   fits and replaces the demand_forecasts table
+
+The recursions step through the days, but every step is one NumPy operation over all
+series and alphas of a block; FORECAST_WORKERS threads fit the blocks side by side (NumPy
+releases the GIL inside those operations). A series starts on its first sale, so a product
+stocked last week is not averaged with months of zeros from before it was listed.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, insert, or_
+from sqlalchemy.orm import Session
+
+from database import SalesDaily, DemandForecast, bump_data_version
+
+
+FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '180'))
+FORECAST_WORKERS = int(os.getenv('FORECAST_WORKERS', str(min(4, os.cpu_count() or 1))))
+ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5)
+# Average days between sales above which a series counts as intermittent (Syntetos-Boylan)
+INTERMITTENT_ADI = 1.32
+# Series per block handed to a worker thread
+BLOCK_ROWS = 2048
+# Days the forecasts are scored on by backtest (the window of the sales counts)
+BACKTEST_DAYS = 30
+INSERT_CHUNK_SIZE = 500
+
+
+def daily_matrix(db: Session, since_day, until_day):
+    """
+    (keys, sales): keys is [(store_key, product)] and sales the units sold per key (rows)
+    and day (columns, since_day to until_day inclusive). One grouped query on sales_daily.
+    """
+    days = (until_day - since_day).days + 1
+    rows = (
+        db.query(SalesDaily.store_key, SalesDaily.product_name, SalesDaily.day, func.sum(SalesDaily.count))
+        .filter(SalesDaily.day >= since_day, SalesDaily.day <= until_day, SalesDaily.product_name != '')
+        .group_by(SalesDaily.store_key, SalesDaily.product_name, SalesDaily.day)
+        .all()
+    )
+    if not rows:
+        return [], np.zeros((0, days))
+    frame = pd.DataFrame(rows, columns=['store_key', 'product', 'day', 'count'])
+    grouped = frame.groupby(['store_key', 'product'], sort=True)
+    keys = list(grouped.size().index)
+    columns = (pd.to_datetime(frame['day']) - pd.Timestamp(since_day)).dt.days.to_numpy()
+    sales = np.zeros((len(keys), days))
+    np.add.at(sales, (grouped.ngroup().to_numpy(), columns), frame['count'].to_numpy(dtype=float))
+    return keys, sales
+
+
+def _starts(sales):
+    """Column of the first sale per row (the number of columns for rows without any)."""
+    sold = sales > 0
+    return np.where(sold.any(axis=1), sold.argmax(axis=1), sales.shape[1])
+
+
+def fit_ses(sales, alphas=ALPHAS):
+    """
+    Simple exponential smoothing of every row for every alpha. Returns (rate, mse), both
+    (alphas × rows): the final level (expected units per day) and the mean squared
+    one-step error from the day after the first sale on.
+    """
+    sales = np.asarray(sales, dtype=float)
+    rows, days = sales.shape
+    alpha = np.asarray(alphas, dtype=float)[:, None]
+    starts = _starts(sales)
+    level = np.tile(sales[np.arange(rows), np.minimum(starts, days - 1)], (len(alpha), 1))
+    error = np.zeros(level.shape)
+    for t in range(days):
+        active = t > starts
+        step = sales[:, t] - level
+        error += np.where(active, step * step, 0.0)
+        level += np.where(active, alpha * step, 0.0)
+    return level, error / np.maximum(days - 1 - starts, 1)
+
+
+def fit_croston(sales, alphas=ALPHAS):
+    """
+    Croston's method with the Syntetos-Boylan (SBA) correction: the quantities of the sales
+    days and the intervals between them are smoothed separately, and the expected units per
+    day are (1 - alpha / 2) * quantity / interval. Returns (rate, mse) like fit_ses.
+    """
+    sales = np.asarray(sales, dtype=float)
+    rows, days = sales.shape
+    alpha = np.asarray(alphas, dtype=float)[:, None]
+    starts = _starts(sales)
+    sold = sales > 0
+    # Start from the first sale's quantity and the average interval of the whole history
+    size = np.tile(sales[np.arange(rows), np.minimum(starts, days - 1)], (len(alpha), 1))
+    interval = np.tile((days - starts) / np.maximum(sold.sum(axis=1), 1), (len(alpha), 1))
+    since = np.ones(rows)
+    correction = 1 - alpha / 2
+    error = np.zeros(size.shape)
+    for t in range(days):
+        active = t > starts
+        y = sales[:, t]
+        error += np.where(active, (y - correction * size / interval) ** 2, 0.0)
+        update = active & sold[:, t]
+        size += np.where(update, alpha * (y - size), 0.0)
+        interval += np.where(update, alpha * (since - interval), 0.0)
+        since = np.where(sold[:, t], 1.0, since + 1)
+    return correction * size / interval, error / np.maximum(days - 1 - starts, 1)
+
+
+def _fit_block(sales):
+    rows, days = sales.shape
+    starts = _starts(sales)
+    intermittent = (days - starts) / np.maximum((sales > 0).sum(axis=1), 1) > INTERMITTENT_ADI
+    rate, mse = np.zeros((len(ALPHAS), rows)), np.zeros((len(ALPHAS), rows))
+    for method, selected in ((fit_croston, intermittent), (fit_ses, ~intermittent)):
+        if selected.any():
+            rate[:, selected], mse[:, selected] = method(sales[selected])
+    best = mse.argmin(axis=0)
+    picked = (best, np.arange(rows))
+    return {'croston': intermittent, 'alpha': np.asarray(ALPHAS)[best], 'rate': rate[picked], 'rmse': np.sqrt(mse[picked])}
+
+
+def fit_forecasts(sales, workers=None):
+    """
+    Expected units per day for every row of `sales` (series × days). Returns a dict of
+    per-row arrays: croston (the method used), alpha, rate and rmse (one-step error).
+    """
+    sales = np.asarray(sales, dtype=float)
+    blocks = [sales[start:start + BLOCK_ROWS] for start in range(0, len(sales), BLOCK_ROWS)] or [sales]
+    workers = min(workers or FORECAST_WORKERS, len(blocks))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='forecast') as pool:
+            fitted = list(pool.map(_fit_block, blocks))
+    else:
+        fitted = [_fit_block(block) for block in blocks]
+    return {name: np.concatenate([block[name] for block in fitted]) for name in fitted[0]}
+
+
+def backtest(sales, horizon=BACKTEST_DAYS, workers=None):
+    """
+    Fits on all but the last `horizon` days and compares the units predicted for those days
+    with what actually sold, next to what the suggestions assume without forecasts (the
+    last 30 days' sales repeated). Only rows with sales in the fitted part are scored.
+    Errors are over all rows: mae (units per series), wape (absolute error / units sold)
+    and bias ((predicted - sold) / units sold).
+    """
+    sales = np.asarray(sales, dtype=float)
+    train = sales[:, :-horizon]
+    scored = (train > 0).any(axis=1)
+    train, actual = train[scored], sales[scored, -horizon:].sum(axis=1)
+    predicted = fit_forecasts(train, workers)['rate'] * horizon
+    last_days = min(30, train.shape[1])
+    naive = train[:, -last_days:].sum(axis=1) * horizon / last_days
+
+    def score(predicted):
+        total = max(actual.sum(), 1)
+        return {
+            'mae': round(float(np.abs(predicted - actual).mean()), 3) if len(actual) else None,
+            'wape': round(float(np.abs(predicted - actual).sum() / total), 3),
+            'bias': round(float((predicted - actual).sum() / total), 3)
+        }
+
+    return {'series': int(scored.sum()), 'horizonDays': horizon, 'forecast': score(predicted), 'last30Days': score(naive)}
+
+
+def train_forecasts(db: Session, now=None, workers=None, progress=None):
+    """
+    Fits every (store_key, product) with sales in the last FORECAST_HISTORY_DAYS (up to
+    yesterday, today is still selling) and replaces demand_forecasts inside the caller's
+    transaction. Returns a summary including a backtest on the same history.
+    """
+    started = time.monotonic()
+    until_day = (now or datetime.now()).date() - timedelta(days=1)
+    since_day = until_day - timedelta(days=FORECAST_HISTORY_DAYS - 1)
+    keys, sales = daily_matrix(db, since_day, until_day)
+    if progress:
+        progress(f"Fitting {len(keys)} series over {sales.shape[1]} days")
+    fit_started = time.monotonic()
+    fitted = fit_forecasts(sales, workers)
+    fit_seconds = time.monotonic() - fit_started
+
+    rows = [{
+        'store_key': store_key,
+        'product_name': product,
+        'method': 'croston' if fitted['croston'][i] else 'ses',
+        'alpha': float(fitted['alpha'][i]),
+        'daily_rate': float(fitted['rate'][i]),
+        'rmse': float(fitted['rmse'][i]),
+        'history_days': FORECAST_HISTORY_DAYS,
+        'trained_through': until_day
+    } for i, (store_key, product) in enumerate(keys)]
+    db.query(DemandForecast).delete(synchronize_session=False)
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert(DemandForecast), rows[start:start + INSERT_CHUNK_SIZE])
+    bump_data_version(db, 'forecasts')
+
+    summary = {
+        'series': len(keys),
+        'croston': int(fitted['croston'].sum()),
+        'trainedThrough': until_day.isoformat(),
+        'fitSeconds': round(fit_seconds, 3),
+        'backtest': backtest(sales, workers=workers) if sales.shape[1] > BACKTEST_DAYS else None,
+        'seconds': round(time.monotonic() - started, 3)
+    }
+    logging.info(f"Trained {summary['series']} demand forecasts ({summary['croston']} Croston) "
+                 f"in {summary['seconds']:.2f}s, fitting {summary['fitSeconds']:.2f}s.")
+    return summary
+
+
+def forecast_counts_by_store(db: Session, store_names, days):
+    """
+    {store_name: {product: units expected over `days`}} for every machine whose store_key
+    starts with the name (like sales_rollup.sales_counts_by_store), rounded to whole units;
+    products expected to sell less than half a unit are left out.
+    """
+    counts = {name: {} for name in store_names}
+    if not counts:
+        return counts
+    rows = (
+        db.query(DemandForecast.store_key, DemandForecast.product_name, DemandForecast.daily_rate)
+        .filter(or_(*[DemandForecast.store_key.startswith(name) for name in counts]))
+        .all()
+    )
+    frame = pd.DataFrame(rows, columns=['store_key', 'product', 'rate'])
+    for name in counts:
+        totals = frame[frame['store_key'].str.startswith(name)].groupby('product')['rate'].sum() * days
+        counts[name] = {product: int(round(units)) for product, units in totals.items() if round(units) > 0}
+    return counts
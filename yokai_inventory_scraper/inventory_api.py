@@ -0,0 +1,267 @@
+"""
+Inventory straight from the manager site's JSON API, instead of scraping its pages.
+
+UNVERIFIED: the endpoints and response shapes below are guesses from the SPA's
+behaviour. They have never been checked against the live backend, and the tests only
+run against the hand-written fixtures in tests/fixtures/yokai_api. The hourly job
+therefore keeps INVENTORY_FETCH_MODE=browser by default and logs a warning whenever
+'auto' or 'api' is selected. Capture real responses into those fixtures (and adjust the
+parsing) before relying on it.
+
+    POST {base}/login                  {"username", "password"} -> {"code": 200, "data": {"token": ...}}
+    GET  {base}/standStore/list        ?pageNum&pageSize -> {"data": {"list": [store], "total": n}}
+    GET  {base}/standStore/inventory   ?storeId&pageNum&pageSize -> {"data": {"list": [item], "total": n}}
+
+store: id, storeName, machineName, lastReplenishmentTime; item: productName,
+inventoryQuantity (alternative key names are accepted, see _pick).
+"""
+import os
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytz
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# --- Configurable Variables ---
+# The manager site is a Vue/Element SPA; these are the XHR endpoints it is believed to call
+# (unverified, see above). All of them can be overridden from the environment.
+DEFAULT_API_BASE = "https://manager.yokaiexpress.com/api"
+DEFAULT_LOGIN_PATH = "/login"
+DEFAULT_STORE_LIST_PATH = "/standStore/list"
+DEFAULT_INVENTORY_PATH = "/standStore/inventory"
+
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+
+UNVERIFIED_WARNING = ("the backend API endpoints and response shapes in inventory_api.py are unverified guesses, "
+                      "never checked against the live site; inventory rows may be missing or wrong. "
+                      "Use INVENTORY_FETCH_MODE=browser until real responses have been captured.")
+
+
+def _default_headers():
+    return {
+        'Accept': 'application/json, text/plain, */*',
+        'Content-Type': 'application/json;charset=UTF-8',
+        'User-Agent': 'yokai-inventory-scraper/1.0'
+    }
+
+
+def _pick(row, *keys, default=None):
+    """Returns the first non-empty value among `keys` (the backend is not consistent about naming)."""
+    for key in keys:
+        value = row.get(key)
+        if value not in (None, ''):
+            return value
+    return default
+
+
+def _unwrap_list(payload):
+    """
+    Extracts (rows, total) from the backend's list envelope.
+    Accepts {"data": {"list": [...], "total": n}}, {"data": [...]}, {"rows": [...], "total": n} or a bare list.
+    """
+    if isinstance(payload, list):
+        return payload, len(payload)
+    data = payload.get('data', payload) if isinstance(payload, dict) else {}
+    if isinstance(data, list):
+        return data, len(data)
+    rows = _pick(data, 'list', 'records', 'rows', default=[]) or []
+    total = _pick(data, 'total', 'totalCount', default=len(rows))
+    try:
+        total = int(total)
+    except (TypeError, ValueError):
+        total = len(rows)
+    return rows, total
+
+
+def _format_replenish_time(value):
+    """Formats the last replenishment time like the scraped text: '2025-02-13 23:46:54 (Asia/Taipei)'."""
+    if value in (None, ''):
+        return "N/A"
+    if isinstance(value, (int, float)):
+        # Epoch timestamps (seconds or milliseconds)
+        seconds = value / 1000 if value > 1e11 else value
+        value = datetime.fromtimestamp(seconds, TAIPEI_TZ).strftime('%Y-%m-%d %H:%M:%S')
+    value = str(value).strip()
+    if '(' not in value:
+        value = f"{value} (Asia/Taipei)"
+    return value
+
+
+class YokaiApiClient:
+    """
+    Talks to the manager site's JSON endpoints with one pooled requests.Session.
+    """
+
+    def __init__(self, base_url=None, session=None, timeout=30, page_size=100, max_workers=8):
+        self.base_url = (base_url or os.getenv('YOKAI_API_BASE') or DEFAULT_API_BASE).rstrip('/')
+        self.login_path = os.getenv('YOKAI_API_LOGIN_PATH', DEFAULT_LOGIN_PATH)
+        self.store_list_path = os.getenv('YOKAI_API_STORE_LIST_PATH', DEFAULT_STORE_LIST_PATH)
+        self.inventory_path = os.getenv('YOKAI_API_INVENTORY_PATH', DEFAULT_INVENTORY_PATH)
+        self.timeout = timeout
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.session = session or self._make_session(max_workers)
+
+    @staticmethod
+    def _make_session(pool_size):
+        session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST']))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(_default_headers())
+        return session
+
+    def _url(self, path):
+        return f"{self.base_url}{path}"
+
+    def _check(self, resp):
+        resp.raise_for_status()
+        try:
+            payload = resp.json()
+        except ValueError as e:
+            raise ValueError(f'Failed to parse JSON from {resp.url}: {e}')
+        # The backend reports application errors as {"code": <non-zero>, "msg": "..."} with HTTP 200
+        if isinstance(payload, dict) and payload.get('code') not in (None, 0, 200, '0', '200'):
+            raise RuntimeError(f"API error from {resp.url}: code={payload.get('code')} msg={payload.get('msg') or payload.get('message')}")
+        return payload
+
+    # --- Authentication ---
+    def login(self, username, password):
+        """Logs in over HTTP and stores the auth token on the session."""
+        resp = self.session.post(self._url(self.login_path),
+                                 json={'username': username, 'password': password},
+                                 timeout=self.timeout)
+        payload = self._check(resp)
+        data = payload.get('data') if isinstance(payload.get('data'), dict) else payload
+        token = _pick(data, 'token', 'accessToken', 'access_token')
+        if not token:
+            raise RuntimeError('Login response did not contain a token.')
+        self.set_token(token)
+        logging.info("API login successful.")
+
+    def set_token(self, token):
+        self.session.headers['Authorization'] = token if token.lower().startswith('bearer ') else f"Bearer {token}"
+
+    def use_browser_auth(self, driver):
+        """
+        Copies the auth state from a logged-in Selenium driver (cookies and the
+        token the SPA keeps in localStorage) so Chrome is only needed for login.
+        """
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        token = driver.execute_script(
+            "return window.localStorage.getItem('token') || window.localStorage.getItem('Admin-Token') "
+            "|| window.sessionStorage.getItem('token');"
+        )
+        if token:
+            self.set_token(token)
+        logging.info(f"Captured browser session: {len(driver.get_cookies())} cookies, token={'yes' if token else 'no'}")
+
+    # --- Data ---
+    def _get_all_pages(self, path, params=None):
+        rows = []
+        page = 1
+        while True:
+            query = dict(params or {})
+            query.update({'pageNum': page, 'pageSize': self.page_size})
+            resp = self.session.get(self._url(path), params=query, timeout=self.timeout)
+            page_rows, total = _unwrap_list(self._check(resp))
+            rows.extend(page_rows)
+            if not page_rows or len(rows) >= total:
+                return rows
+            page += 1
+
+    def list_stores(self):
+        return self._get_all_pages(self.store_list_path)
+
+    def get_store_inventory(self, store_row):
+        store_id = _pick(store_row, 'id', 'storeId', 'standStoreId')
+        return self._get_all_pages(self.inventory_path, {'storeId': store_id})
+
+    def fetch_inventory(self):
+        """
+        Returns every product row for every store, in the dict shape save_to_database expects.
+        Stores are fetched concurrently over the shared connection pool.
+        """
+        started = time.monotonic()
+        stores = self.list_stores()
+        logging.info(f"API returned {len(stores)} stores.")
+        process_time = datetime.now(TAIPEI_TZ)
+
+        def fetch_one(store_row):
+            return store_row, self.get_store_inventory(store_row)
+
+        result = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for store_row, items in executor.map(fetch_one, stores):
+                result.extend(self._to_inventory_rows(store_row, items, process_time))
+
+        logging.info(f"API inventory fetch complete: {len(result)} product items in {time.monotonic() - started:.1f}s.")
+        return result
+
+    @staticmethod
+    def _to_inventory_rows(store_row, items, process_time):
+        last_updated = _format_replenish_time(_pick(store_row, 'lastReplenishmentTime', 'replenishmentTime', 'lastReplenishTime'))
+        rows = []
+        for item in items:
+            store_name = _pick(item, 'storeName', 'standStoreName', default=_pick(store_row, 'storeName', 'name'))
+            machine_id = _pick(item, 'machineName', 'machineCode', 'machineId', default=_pick(store_row, 'machineName', 'machineCode'))
+            product_name = _pick(item, 'productName', 'goodsName', 'name')
+            quantity = _pick(item, 'inventoryQuantity', 'stock', 'quantity', default=0)
+            if not store_name or not machine_id or not product_name:
+                logging.warning(f"Skipping API inventory row with missing fields: {item}")
+                continue
+            try:
+                quantity = int(quantity)
+            except (TypeError, ValueError):
+                logging.warning(f"Expected a number for quantity but got '{quantity}'. Skipping entry.")
+                continue
+            item_updated = _pick(item, 'lastReplenishmentTime', 'replenishmentTime')
+            rows.append({
+                'store': str(store_name).strip(),
+                'machine_id': str(machine_id).strip(),
+                'product_name': str(product_name).strip(),
+                'quantity': quantity,
+                'last_updated': _format_replenish_time(item_updated) if item_updated else last_updated,
+                'process_time': process_time
+            })
+        return rows
+
+
+def _login_with_browser(client, username, password):
+    """Uses Selenium only to log in, then hands the cookies/token to the HTTP client."""
+    from selenium.webdriver.support.ui import WebDriverWait
+    from scraper import _create_driver, _login_and_open_store_list
+
+    driver = _create_driver(headless=True)
+    try:
+        _login_and_open_store_list(driver, WebDriverWait(driver, 30), username, password)
+        client.use_browser_auth(driver)
+    finally:
+        driver.quit()
+
+
+def fetch_inventory_via_api(client=None):
+    """
+    Logs in once and pulls the whole inventory from the JSON endpoints.
+    YOKAI_API_LOGIN_MODE=http (default) logs in over HTTP; =browser logs in with Selenium
+    and reuses its session.
+    """
+    username = os.getenv('YOKAI_USERNAME')
+    password = os.getenv('YOKAI_PASSWORD')
+    if not username or not password:
+        raise ValueError("錯誤：環境變數 YOKAI_USERNAME 或 YOKAI_PASSWORD 未設定。")
+
+    client = client or YokaiApiClient()
+    if os.getenv('YOKAI_API_LOGIN_MODE', 'http').lower() == 'browser':
+        _login_with_browser(client, username, password)
+    else:
+        client.login(username, password)
+    return client.fetch_inventory()
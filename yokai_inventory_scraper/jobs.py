@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import func, select, and_
+from sqlalchemy.orm import aliased
+
+from database import Job, JobTypeLock, dialect_insert
+
+
+# --- Settings ---
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '3'))
+# How often the dispatcher looks for queued jobs when nobody wakes it up
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '2'))
+JOB_HEARTBEAT_SECONDS = 30
+# A running job without a heartbeat for this long belonged to a dead process
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '300'))
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# The app's job types and how many of each may run at once (functions: tasks.py)
+JOB_TYPES = {
+    'inventory': 1,
+    'sales': 1,
+    'warehouse': 1,
+    'astra_sales': 1,
+    'notify_low_inventory': 1,
+    'forecast': 1,
+    'mail': 1,
+}
+
+
+class JobFailed(Exception):
+    """Raised by a job function to end as 'failed' with a message instead of a traceback."""
+
+
+class JobContext:
+    """Handed to every job function: its id and a way to report progress."""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.id = job_id
+
+    def progress(self, message):
+        logging.info(f"Job {self.id}: {message}")
+        self.runner._update(self.id, progress=message, heartbeat_at=datetime.now(pytz.utc))
+
+
+class JobRunner:
+    """
+    Runs registered job types from the persisted `jobs` table on a bounded thread pool.
+
+    Each job type has a concurrency limit that is checked against the running rows in the
+    database when a job is claimed, so it also holds between processes sharing one DB.
+    Queued jobs survive a restart and are picked up by the next runner that starts.
+    """
+
+    def __init__(self, session_factory, workers=None, poll_seconds=None):
+        self.session_factory = session_factory
+        self.workers = workers or JOB_WORKERS
+        self.poll_seconds = JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._types = {}
+        self._pool = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+        # Cleared by pause(): heartbeats go on, but no new jobs are claimed
+        self._claiming = threading.Event()
+        self._claiming.set()
+
+    # --- Registry ---
+    def register(self, job_type, func, concurrency=1):
+        """`func(job, **params)` returns an output message; raising marks the job failed."""
+        self._types[job_type] = {'func': func, 'concurrency': concurrency}
+
+    def job_types(self):
+        return sorted(self._types)
+
+    # --- Submitting and reading ---
+    def submit(self, job_type, params=None, dedupe=True):
+        """
+        Queues a job and returns (job dict, created). With `dedupe`, an already queued or
+        running job of the same type is returned instead of queueing another one.
+        """
+        if job_type not in self._types:
+            raise ValueError(f"Unknown job type '{job_type}'.")
+        db = self.session_factory()
+        try:
+            if dedupe:
+                _lock_job_type(db, job_type)
+                active = db.query(Job).filter(Job.job_type == job_type, Job.status.in_(ACTIVE_STATUSES)).order_by(Job.id).first()
+                if active is not None:
+                    return active.to_dict(), False
+            job = Job(job_type=job_type, params=json.dumps(params) if params else None, status='queued')
+            db.add(job)
+            db.commit()
+            result = job.to_dict()
+        finally:
+            db.close()
+        logging.info(f"Queued job {result['id']} ({job_type}).")
+        self._wake.set()
+        return result, True
+
+    def get(self, job_id):
+        db = self.session_factory()
+        try:
+            job = db.get(Job, job_id)
+            return job.to_dict() if job else None
+        finally:
+            db.close()
+
+    def latest(self, job_type):
+        """The most recent job of a type, or None if it never ran."""
+        db = self.session_factory()
+        try:
+            job = db.query(Job).filter(Job.job_type == job_type).order_by(Job.id.desc()).first()
+            return job.to_dict() if job else None
+        finally:
+            db.close()
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._thread = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+        self._thread.start()
+        logging.info(f"Job runner {self.worker_id} started with {self.workers} workers for: {', '.join(self.job_types())}")
+
+    def pause(self):
+        """Stops claiming new jobs; jobs already running here finish and keep their heartbeats."""
+        if self._claiming.is_set():
+            self._claiming.clear()
+            logging.info(f"Job runner {self.worker_id} paused.")
+
+    def resume(self):
+        if not self._claiming.is_set():
+            self._claiming.set()
+            self._wake.set()
+            logging.info(f"Job runner {self.worker_id} resumed.")
+
+    @property
+    def paused(self):
+        return not self._claiming.is_set()
+
+    def running_count(self):
+        """Jobs this runner is executing right now."""
+        with self._lock:
+            return len(self._running)
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+    def wait_idle(self, timeout=None):
+        """Blocks until nothing is queued or running here (used by tests and scripts)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                busy = bool(self._running)
+            if not busy and not self._queued_count():
+                return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.05)
+
+    # --- Dispatching ---
+    def _dispatch_loop(self):
+        last_heartbeat = 0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_heartbeat >= JOB_HEARTBEAT_SECONDS:
+                    self._heartbeat()
+                    self._fail_stale_jobs()
+                    last_heartbeat = time.monotonic()
+                if self._claiming.is_set():
+                    self._claim_and_run()
+            except Exception as e:
+                logging.error(f"Job dispatcher error: {e}", exc_info=True)
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _queued_count(self):
+        db = self.session_factory()
+        try:
+            return db.query(func.count(Job.id)).filter(Job.status == 'queued', Job.job_type.in_(self.job_types())).scalar() or 0
+        finally:
+            db.close()
+
+    def _claim_and_run(self):
+        with self._lock:
+            free = self.workers - len(self._running)
+        if free <= 0 or not self._types:
+            return
+        db = self.session_factory()
+        try:
+            candidates = db.query(Job.id, Job.job_type).filter(
+                Job.status == 'queued', Job.job_type.in_(self.job_types())
+            ).order_by(Job.id).all()
+            # Every claim is its own transaction that starts with the type lock
+            db.rollback()
+            for job_id, job_type in candidates:
+                if free <= 0:
+                    break
+                if self._claim(db, job_id, job_type):
+                    free -= 1
+                    with self._lock:
+                        self._running.add(job_id)
+                    self._pool.submit(self._execute, job_id)
+        finally:
+            db.close()
+
+    def _claim(self, db, job_id, job_type):
+        """
+        Flips one queued job to running if its type is below its concurrency limit.
+        The type lock is taken first, so claims of one type run one after another across
+        processes and the running count in the UPDATE includes every committed claim.
+        (Without it, two Postgres transactions under READ COMMITTED would each count
+        the running jobs without the other's uncommitted claim and both take the last slot.)
+        """
+        _lock_job_type(db, job_type)
+        running = aliased(Job)
+        running_count = select(func.count(running.id)).where(
+            and_(running.job_type == job_type, running.status == 'running')
+        ).scalar_subquery()
+        now = datetime.now(pytz.utc)
+        claimed = db.query(Job).filter(
+            Job.id == job_id, Job.status == 'queued', running_count < self._types[job_type]['concurrency']
+        ).update({'status': 'running', 'worker_id': self.worker_id, 'started_at': now, 'heartbeat_at': now,
+                  'progress': 'Started'}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    def _execute(self, job_id):
+        started = time.monotonic()
+        db = self.session_factory()
+        try:
+            job = db.get(Job, job_id)
+            job_type, params = job.job_type, json.loads(job.params) if job.params else {}
+        finally:
+            db.close()
+        logging.info(f"Job {job_id} ({job_type}) started.")
+        try:
+            output = self._types[job_type]['func'](JobContext(self, job_id), **params)
+            status = 'succeeded'
+        except JobFailed as e:
+            output, status = str(e), 'failed'
+            logging.warning(f"Job {job_id} ({job_type}) failed: {output}")
+        except Exception as e:
+            output, status = f"{type(e).__name__}: {e}", 'failed'
+            logging.error(f"Job {job_id} ({job_type}) crashed: {e}", exc_info=True)
+        duration = round(time.monotonic() - started, 3)
+        try:
+            self._update(job_id, status=status, output=None if output is None else str(output), progress=None,
+                         finished_at=datetime.now(pytz.utc), duration_seconds=duration)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            self._wake.set()
+        logging.info(f"Job {job_id} ({job_type}) {status} in {duration}s.")
+
+    def _update(self, job_id, **values):
+        db = self.session_factory()
+        try:
+            db.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Failed to update job {job_id}: {e}", exc_info=True)
+        finally:
+            db.close()
+
+    def _heartbeat(self):
+        with self._lock:
+            running = list(self._running)
+        if not running:
+            return
+        db = self.session_factory()
+        try:
+            db.query(Job).filter(Job.id.in_(running)).update({'heartbeat_at': datetime.now(pytz.utc)}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _fail_stale_jobs(self):
+        """Running jobs of crashed processes would block their type forever; mark them failed."""
+        cutoff = datetime.now(pytz.utc) - timedelta(seconds=JOB_STALE_SECONDS)
+        with self._lock:
+            ours = list(self._running)
+        db = self.session_factory()
+        try:
+            stale = db.query(Job).filter(Job.status == 'running', Job.heartbeat_at < cutoff, Job.id.notin_(ours)).all()
+            for job in stale:
+                job.status = 'failed'
+                job.output = f"Worker {job.worker_id} stopped sending heartbeats; job abandoned."
+                job.finished_at = datetime.now(pytz.utc)
+                logging.warning(f"Job {job.id} ({job.job_type}) marked failed: {job.output}")
+            db.commit()
+        finally:
+            db.close()
+
+
+def _lock_job_type(db, job_type):
+    """
+    Writes the JobTypeLock row of `job_type` as the first statement of the caller's
+    transaction. Postgres holds the row lock and SQLite the database write lock until
+    the caller commits or rolls back, so later statements see other claims and submits
+    of the type that committed first.
+    """
+    stmt = dialect_insert(db, JobTypeLock).values(job_type=job_type, locked_at=datetime.now(pytz.utc))
+    db.execute(stmt.on_conflict_do_update(index_elements=['job_type'], set_={'locked_at': stmt.excluded.locked_at}))
+
+
+def legacy_status(job):
+    """Maps a job dict to the {'status', 'last_run_output'} shape of the old status endpoints."""
+    if job is None:
+        return {'status': 'idle', 'last_run_output': ''}
+    status = {'queued': 'running', 'running': 'running', 'succeeded': 'success', 'failed': 'error'}[job['status']]
+    return {'status': status, 'last_run_output': job['output'] or job['progress'] or '', 'job': job}
@@ -0,0 +1,179 @@
+import os
+import time
+import uuid
+import socket
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+import schedule
+from sqlalchemy import or_, case
+
+from database import LeaderLease, ScheduledSlot, dialect_insert
+
+
+# --- Settings ---
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '60'))
+
+SLOT_FORMATS = {
+    'minute': '%Y-%m-%dT%H:%M',
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+}
+
+
+class LeaderElection:
+    """
+    A time-limited lease on a row of `leader_leases`, so that exactly one of several
+    processes (gunicorn workers, boxes) holds a role such as running the scheduler.
+
+    The holder renews the lease every third of its duration; if the holder dies the
+    lease lapses and the next process asking takes it over. Works the same on SQLite
+    and PostgreSQL because it only needs a conditional UPDATE.
+    """
+
+    def __init__(self, session_factory, name, lease_seconds=None, holder=None):
+        self.session_factory = session_factory
+        self.name = name
+        self.lease_seconds = LEADER_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._is_leader = False
+        self._checked_at = None
+
+    def is_leader(self):
+        """Cheap to call in a loop: only talks to the database when the lease is due for renewal."""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.lease_seconds / 3:
+            self._is_leader = self.acquire()
+            self._checked_at = now
+        return self._is_leader
+
+    def acquire(self):
+        """Takes or renews the lease; returns True while this process holds it."""
+        db = self.session_factory()
+        try:
+            now = datetime.now(pytz.utc)
+            db.execute(dialect_insert(db, LeaderLease).values(name=self.name).on_conflict_do_nothing(index_elements=['name']))
+            taken = db.query(LeaderLease).filter(
+                LeaderLease.name == self.name,
+                or_(LeaderLease.holder == self.holder, LeaderLease.holder.is_(None), LeaderLease.expires_at < now)
+            ).update({
+                'holder': self.holder,
+                'expires_at': now + timedelta(seconds=self.lease_seconds),
+                # keeps acquired_at while renewing, sets it when taking over
+                'acquired_at': case((LeaderLease.holder == self.holder, LeaderLease.acquired_at), else_=now)
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Leader lease '{self.name}' check failed: {e}")
+            taken = 0
+        finally:
+            db.close()
+        if taken and not self._is_leader:
+            logging.info(f"{self.holder} is now the leader for '{self.name}'.")
+        elif not taken and self._is_leader:
+            logging.warning(f"{self.holder} lost the leader lease for '{self.name}'.")
+        self._is_leader = bool(taken)
+        return self._is_leader
+
+    def release(self):
+        """Gives the lease up right away (on shutdown) instead of letting it lapse."""
+        db = self.session_factory()
+        try:
+            db.query(LeaderLease).filter(LeaderLease.name == self.name, LeaderLease.holder == self.holder).update(
+                {'holder': None, 'expires_at': None}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+        self._is_leader = False
+        self._checked_at = None
+
+    def current_holder(self):
+        db = self.session_factory()
+        try:
+            row = db.get(LeaderLease, self.name)
+            if row is None or row.holder is None:
+                return None
+            expires_at = row.expires_at if row.expires_at.tzinfo else pytz.utc.localize(row.expires_at)
+            return row.holder if expires_at > datetime.now(pytz.utc) else None
+        finally:
+            db.close()
+
+
+class LeaderSchedule:
+    """
+    A `schedule.Scheduler` whose runs fire only in the holder of `lease`.
+
+    Followers keep no pending runs: the jobs are registered afresh (by `register`, called
+    with this object) each time the process becomes leader, so runs that fell due while
+    following do not all fire at the takeover. Runs whose time fell into the failover gap
+    (two leases before the takeover) are fired right away instead; `every_run` keys each
+    run on its scheduled time, so one the old leader already fired is dropped.
+    """
+
+    def __init__(self, session_factory, lease, register):
+        self.session_factory = session_factory
+        self.lease = lease
+        self.register = register
+        self.scheduler = schedule.Scheduler()
+        self._leading = False
+        self._once_per_run = []
+
+    def every_run(self, job, name, func, *args):
+        """
+        Schedules `func(*args)` as `job` (e.g. self.scheduler.every().day.at("15:55")), fired
+        once per scheduled run time however many processes see it as due.
+        """
+        def fire():
+            slot = current_slot('minute', job.next_run)
+            if not claim_slot(self.session_factory, name, slot, holder=self.lease.holder):
+                logging.info(f"Scheduled {name} run of {slot} already fired elsewhere.")
+                return
+            func(*args)
+        job.do(fire)
+        self._once_per_run.append(job)
+        return job
+
+    def tick(self):
+        """One pass of the scheduler loop; returns whether this process is the leader."""
+        leader = self.lease.is_leader()
+        if leader and not self._leading:
+            self._take_over()
+        self._leading = leader
+        if leader:
+            self.scheduler.run_pending()
+        return leader
+
+    def _take_over(self):
+        self.scheduler.clear()
+        self._once_per_run = []
+        self.register(self)
+        gap_start = datetime.now() - timedelta(seconds=2 * self.lease.lease_seconds)
+        for job in self._once_per_run:
+            previous = job.next_run - timedelta(**{job.unit: job.interval})
+            if previous >= gap_start:
+                job.next_run = previous
+        logging.info(f"{self.lease.holder} took over the schedule: {len(self.scheduler.get_jobs())} jobs.")
+
+
+def current_slot(period, now_utc=None):
+    """The schedule slot `now` falls into, e.g. '2025-08-18T05' for period='hour' (UTC)."""
+    return (now_utc or datetime.now(pytz.utc)).strftime(SLOT_FORMATS[period])
+
+
+def claim_slot(session_factory, name, slot, holder=None):
+    """
+    Records that `name` fired for `slot`; returns False if it already had. This backs up
+    the lease during a handover, when an old and a new leader could both see a run as due.
+    """
+    db = session_factory()
+    try:
+        result = db.execute(dialect_insert(db, ScheduledSlot).values(
+            name=name, slot=slot, fired_by=holder, fired_at=datetime.now(pytz.utc)
+        ).on_conflict_do_nothing(index_elements=['name', 'slot']))
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
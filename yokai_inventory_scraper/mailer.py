@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import or_, and_, func
+
+from database import OutboundEmail, NotificationSent
+
+
+# --- Settings ---
+SENDGRID_URL = os.getenv('SENDGRID_API_URL', 'https://api.sendgrid.com/v3/mail/send')
+MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', '4'))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', '5'))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv('MAIL_RETRY_BASE_SECONDS', '2'))
+MAIL_RETRY_MAX_SECONDS = 300
+# How long a drain keeps waiting for retries that are due soon
+MAIL_DRAIN_SECONDS = float(os.getenv('MAIL_DRAIN_SECONDS', '60'))
+# How often the scheduler checks for due messages and queues a 'mail' job to send them
+MAIL_QUEUE_CHECK_MINUTES = int(os.getenv('MAIL_QUEUE_CHECK_MINUTES', '5'))
+# A 'sending' row older than this belongs to a crashed worker and is picked up again
+STALE_CLAIM_SECONDS = 600
+# SendGrid accepts up to 1000 personalizations per request
+MAX_PERSONALIZATIONS = 1000
+CLAIM_BATCH_SIZE = 200
+
+# Notifications (and the daily limit) count as "same day" after this UTC hour (16:00 UTC = Taiwan midnight)
+RESET_HOUR_UTC = 16
+
+
+def notification_day_start(now_utc=None):
+    """Start of the current notification day (naive UTC, like the stored sent_at comparisons)."""
+    now_utc = now_utc or datetime.utcnow()
+    today_start = now_utc.replace(hour=RESET_HOUR_UTC, minute=0, second=0, microsecond=0)
+    if now_utc.hour < RESET_HOUR_UTC:
+        # Before 16:00 UTC the day started at the previous day's 16:00
+        today_start = today_start - timedelta(days=1)
+    return today_start
+
+
+def get_daily_email_limit():
+    return int(os.getenv('DAILY_EMAIL_LIMIT', '100'))
+
+
+class SendGridClient:
+    """
+    Thin SendGrid v3 client on a pooled requests.Session, so the worker threads reuse
+    their HTTPS connections instead of opening one per email.
+    """
+
+    def __init__(self, api_key=None, from_email=None, url=None, timeout=10, pool_size=MAIL_WORKERS):
+        self.api_key = api_key or os.getenv('SENDGRID_API_KEY') or os.getenv('SMTP_PASS')
+        self.from_email = from_email or os.getenv('FROM_EMAIL') or os.getenv('SMTP_USER')
+        self.url = url or SENDGRID_URL
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.from_email)
+
+    def send(self, recipients, subject, body, html_content=False):
+        """
+        Sends one message to every address in `recipients` (one personalization each).
+        Returns {'ok': bool, 'status': http status or None, 'error': str, 'retryAfter': seconds or None}.
+        """
+        if not self.configured:
+            logging.warning(f"Email not sent (missing config): sendgrid_key_set={bool(self.api_key)} from={self.from_email}")
+            return {'ok': False, 'status': None, 'error': 'SendGrid API key or from address missing', 'retryAfter': None}
+
+        # Build content: always include plain text; add HTML part when requested
+        if html_content:
+            plain = '此郵件包含 HTML 內容，請使用支援 HTML 的郵件客戶端查看。'
+            content = [
+                {'type': 'text/plain', 'value': plain},
+                {'type': 'text/html', 'value': body}
+            ]
+        else:
+            content = [{'type': 'text/plain', 'value': body}]
+
+        payload = {
+            'personalizations': [{'to': [{'email': email}]} for email in recipients],
+            'from': {'email': self.from_email},
+            'subject': subject,
+            'content': content
+        }
+        headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+        try:
+            resp = self.session.post(self.url, json=payload, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logging.error(f"Failed to reach SendGrid for {len(recipients)} recipient(s): {e}")
+            return {'ok': False, 'status': None, 'error': str(e), 'retryAfter': None}
+        if 200 <= resp.status_code < 300:
+            logging.info(f"Sent email to {', '.join(recipients)} from {self.from_email} via SendGrid API")
+            return {'ok': True, 'status': resp.status_code, 'error': None, 'retryAfter': None}
+        logging.error(f"SendGrid API returned {resp.status_code}: {resp.text}")
+        retry_after = resp.headers.get('Retry-After')
+        return {
+            'ok': False,
+            'status': resp.status_code,
+            'error': f'SendGrid API error {resp.status_code}: {resp.text}',
+            'retryAfter': float(retry_after) if retry_after and retry_after.replace('.', '', 1).isdigit() else None
+        }
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_sendgrid_client():
+    """Process-wide client (one connection pool) built from the environment."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = SendGridClient()
+        return _default_client
+
+
+def is_retryable(result):
+    """Network errors, 429 and 5xx are worth another attempt; other 4xx are not."""
+    status = result.get('status')
+    if status is None:
+        return result.get('error') != 'SendGrid API key or from address missing'
+    return status == 429 or status >= 500
+
+
+def retry_delay(attempts, retry_after=None):
+    """Exponential backoff (base * 2^(attempts-1)), at least SendGrid's Retry-After."""
+    delay = MAIL_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return min(delay, MAIL_RETRY_MAX_SECONDS)
+
+
+def enqueue_email(db, to_email, subject, body, html_content=False, user_id=None, store_keys=None):
+    """Adds a message to the queue inside the caller's transaction (the caller commits)."""
+    email = OutboundEmail(
+        to_email=to_email, subject=subject, body=body, html_content=html_content,
+        user_id=user_id, store_keys=json.dumps(store_keys) if store_keys else None, status='queued'
+    )
+    db.add(email)
+    return email
+
+
+def emails_sent_today(db, now_utc=None):
+    """Messages accepted by SendGrid (or in flight) since the notification day started."""
+    day_start = notification_day_start(now_utc)
+    return db.query(func.count(OutboundEmail.id)).filter(or_(
+        and_(OutboundEmail.status == 'sent', OutboundEmail.sent_at >= day_start),
+        OutboundEmail.status == 'sending'
+    )).scalar() or 0
+
+
+def pending_notification_keys(db):
+    """(user_id, store_key) pairs of low-inventory emails that are queued but not delivered yet."""
+    rows = db.query(OutboundEmail.user_id, OutboundEmail.store_keys).filter(
+        OutboundEmail.status.in_(('queued', 'sending')), OutboundEmail.store_keys.isnot(None)
+    )
+    return {(user_id, store_key) for user_id, store_keys in rows for store_key in json.loads(store_keys)}
+
+
+def _due(now):
+    """Messages that can be claimed at `now`: queued and due, or claimed by a crashed worker."""
+    return or_(
+        and_(OutboundEmail.status == 'queued',
+             or_(OutboundEmail.next_attempt_at.is_(None), OutboundEmail.next_attempt_at <= now)),
+        and_(OutboundEmail.status == 'sending', OutboundEmail.claimed_at < now - timedelta(seconds=STALE_CLAIM_SECONDS))
+    )
+
+
+def mail_drain_due(db):
+    """True if a drain would send something: a message is due and today's DAILY_EMAIL_LIMIT is not used up."""
+    if not db.query(OutboundEmail.id).filter(_due(datetime.now(pytz.utc))).limit(1).first():
+        return False
+    return emails_sent_today(db) < get_daily_email_limit()
+
+
+def _claim_due(db, limit):
+    """Atomically marks up to `limit` due messages as ours; other processes skip them."""
+    now = datetime.now(pytz.utc)
+    due = _due(now)
+    ids = [row[0] for row in db.query(OutboundEmail.id).filter(due).order_by(OutboundEmail.id).limit(limit)]
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # The status condition is re-checked by the UPDATE, so a row claimed meanwhile is not taken twice
+    db.query(OutboundEmail).filter(OutboundEmail.id.in_(ids), due).update(
+        {'status': 'sending', 'claim_token': token, 'claimed_at': now}, synchronize_session=False
+    )
+    db.commit()
+    return db.query(OutboundEmail).filter(OutboundEmail.claim_token == token).order_by(OutboundEmail.id).all()
+
+
+def _group_messages(messages):
+    """Identical messages (same subject and body) go out as one request with several personalizations."""
+    groups = defaultdict(list)
+    for message in messages:
+        groups[(message.subject, message.body, bool(message.html_content))].append(message.id)
+    batches = []
+    for (subject, body, html_content), ids in groups.items():
+        for start in range(0, len(ids), MAX_PERSONALIZATIONS):
+            batches.append((subject, body, html_content, ids[start:start + MAX_PERSONALIZATIONS]))
+    return batches
+
+
+def _deliver_batch(session_factory, client, subject, body, html_content, ids):
+    """Worker: sends one batch and records the outcome of each message in its own session."""
+    db = session_factory()
+    try:
+        messages = db.query(OutboundEmail).filter(OutboundEmail.id.in_(ids)).all()
+        result = client.send([m.to_email for m in messages], subject, body, html_content=html_content)
+        now = datetime.now(pytz.utc)
+        outcome = {'sent': 0, 'retrying': 0, 'failed': 0}
+        for message in messages:
+            message.attempts = (message.attempts or 0) + 1
+            message.claim_token = None
+            if result['ok']:
+                message.status = 'sent'
+                message.sent_at = now
+                message.last_error = None
+                # Only now do the reported stores count as notified for today
+                for store_key in json.loads(message.store_keys or '[]'):
+                    db.add(NotificationSent(user_id=message.user_id, store_key=store_key, sent_at=now))
+                outcome['sent'] += 1
+            elif is_retryable(result) and message.attempts < MAIL_MAX_ATTEMPTS:
+                message.status = 'queued'
+                message.last_error = result['error']
+                message.next_attempt_at = now + timedelta(seconds=retry_delay(message.attempts, result.get('retryAfter')))
+                outcome['retrying'] += 1
+            else:
+                message.status = 'failed'
+                message.last_error = result['error']
+                outcome['failed'] += 1
+        db.commit()
+        return outcome
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Failed to deliver email batch {ids}: {e}", exc_info=True)
+        return {'sent': 0, 'retrying': 0, 'failed': 0, 'errors': len(ids)}
+    finally:
+        db.close()
+
+
+def process_outbound_queue(session_factory, client=None, workers=None):
+    """
+    One pass over the queue: claims the due messages that still fit into today's
+    DAILY_EMAIL_LIMIT and sends them on a worker pool.
+    Returns {'claimed': n, 'sent': n, 'retrying': n, 'failed': n, 'deferred': n}.
+    """
+    client = client or get_sendgrid_client()
+    counts = {'claimed': 0, 'sent': 0, 'retrying': 0, 'failed': 0, 'deferred': 0}
+    db = session_factory()
+    try:
+        remaining = get_daily_email_limit() - emails_sent_today(db)
+        queued = db.query(func.count(OutboundEmail.id)).filter(OutboundEmail.status == 'queued').scalar() or 0
+        if remaining <= 0:
+            if queued:
+                logging.warning(f"Daily email limit reached ({get_daily_email_limit()}). {queued} emails stay queued.")
+            counts['deferred'] = queued
+            return counts
+        messages = _claim_due(db, min(remaining, CLAIM_BATCH_SIZE))
+        counts['claimed'] = len(messages)
+        batches = _group_messages(messages)
+    finally:
+        db.close()
+
+    if not batches:
+        return counts
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or MAIL_WORKERS, len(batches)))) as pool:
+        futures = [pool.submit(_deliver_batch, session_factory, client, *batch) for batch in batches]
+        for future in futures:
+            for key, value in future.result().items():
+                counts[key] = counts.get(key, 0) + value
+    return counts
+
+
+def drain_outbound_queue(session_factory, client=None, max_wait=None, workers=None):
+    """
+    Processes the queue until nothing is due, waiting for retries that come due within
+    `max_wait` seconds (MAIL_DRAIN_SECONDS). Later retries stay queued for the next drain.
+    """
+    max_wait = MAIL_DRAIN_SECONDS if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    totals = {'claimed': 0, 'sent': 0, 'retrying': 0, 'failed': 0, 'deferred': 0}
+    while True:
+        counts = process_outbound_queue(session_factory, client=client, workers=workers)
+        for key in ('claimed', 'sent', 'retrying', 'failed'):
+            totals[key] += counts.get(key, 0)
+        totals['deferred'] = counts['deferred']
+        if counts['deferred']:
+            break
+        if counts['claimed']:
+            continue
+
+        db = session_factory()
+        try:
+            next_attempt = db.query(func.min(OutboundEmail.next_attempt_at)).filter(OutboundEmail.status == 'queued').scalar()
+        finally:
+            db.close()
+        if next_attempt is None:
+            break
+        if next_attempt.tzinfo is None:
+            next_attempt = pytz.utc.localize(next_attempt)
+        wait = (next_attempt - datetime.now(pytz.utc)).total_seconds()
+        if time.monotonic() + max(wait, 0) > deadline:
+            break
+        time.sleep(max(wait, 0.05))
+    return totals
+
+
+def get_delivery_status(db, ids):
+    """{id: OutboundEmail.to_dict()} for the given message ids."""
+    return {email.id: email.to_dict() for email in db.query(OutboundEmail).filter(OutboundEmail.id.in_(ids))}
@@ -0,0 +1,203 @@
+import time
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import User, Store, NotificationSent, OutboundEmail, user_stores
+from user_scope import ensure_scope, notify_store_totals
+from mailer import (notification_day_start, get_daily_email_limit, emails_sent_today, pending_notification_keys,
+                    enqueue_email, drain_outbound_queue, get_delivery_status, get_sendgrid_client)
+
+
+PRESENTATION_URL = 'https://swsad3.onrender.com/presentation'
+
+
+def load_notification_inputs(db: Session, today_start):
+    """
+    Reads everything the planner needs with a fixed number of queries, independent of
+    the number of users and stores:
+      - users with an email and a positive threshold, with their assigned store keys
+      - total quantity per assigned store (one aggregate, see user_scope)
+      - hidden store keys
+      - (user_id, store_key) pairs already notified today or still waiting in the mail queue
+    """
+    ensure_scope(db)
+    users = {}
+    rows = (
+        db.query(User.id, User.username, User.display_name, User.email, User.low_inventory_threshold, user_stores.c.store_key)
+        .outerjoin(user_stores, user_stores.c.user_id == User.id)
+        .order_by(User.id)
+    )
+    for user_id, username, display_name, email, threshold, store_key in rows:
+        user = users.setdefault(user_id, {
+            'id': user_id, 'username': username, 'display_name': display_name,
+            'email': email, 'threshold': threshold, 'store_keys': []
+        })
+        if store_key:
+            user['store_keys'].append(store_key)
+
+    hidden_store_keys = {row[0] for row in db.query(Store.store_key).filter(Store.is_hidden == True)}
+    already_notified = {
+        (user_id, store_key) for user_id, store_key in
+        db.query(NotificationSent.user_id, NotificationSent.store_key).filter(NotificationSent.sent_at >= today_start)
+    } | pending_notification_keys(db)
+    return list(users.values()), notify_store_totals(db), hidden_store_keys, already_notified
+
+
+def _threshold(value):
+    try:
+        return int(value or 0)
+    except Exception:
+        return 0
+
+
+def plan_low_inventory_notifications(users, store_totals, hidden_store_keys, already_notified, daily_limit):
+    """
+    Pure threshold evaluation: returns one entry per user that has to be emailed.
+
+    A user is emailed when at least one visible assigned store has total quantity <= threshold
+    and was not notified today. The email lists all low stores ('allLowStores'); only the
+    newly-notified ones ('lowStores') get a NotificationSent row. At most `daily_limit` entries.
+    """
+    plan = []
+    for user in users:
+        threshold = _threshold(user['threshold'])
+        if not user['email'] or threshold <= 0:
+            continue
+
+        low_stores = []
+        for store_key in user['store_keys']:
+            # Respect the authoritative Store.is_hidden value from the DB (admin may toggle this)
+            if store_key in hidden_store_keys:
+                continue
+            total = store_totals.get(store_key, 0)
+            if total <= threshold:
+                display_name = store_key.replace('-provisional_sales', '') if store_key.endswith('-provisional_sales') else store_key
+                low_stores.append({'store_key': store_key, 'display': display_name, 'total': total})
+
+        new_low_stores = [ls for ls in low_stores if (user['id'], ls['store_key']) not in already_notified]
+        if not new_low_stores:
+            continue
+        if len(plan) >= daily_limit:
+            logging.warning(f"Daily email limit reached ({daily_limit}). Skipping notifications.")
+            break
+        plan.append({
+            'user_id': user['id'],
+            'user': user['username'],
+            'display_name': user['display_name'],
+            'email': user['email'],
+            'threshold': threshold,
+            'lowStores': new_low_stores,
+            'allLowStores': low_stores
+        })
+    return plan
+
+
+def render_low_inventory_email(entry):
+    """Returns (subject, html body) for one plan entry."""
+    subject = f"【SWSAD】庫存通知 - {len(entry['lowStores'])} 個機台需要您的關注"
+
+    # 使用 HTML 格式
+    body_html_lines = [
+        f"<!DOCTYPE html><html><body>",
+        f"<h1 style='text-align:center; font-weight:bold;'>SWSAD</h1>",
+        f"<p>親愛的 {entry['display_name'] or entry['user']}，</p>",
+        f"<p>這是一則來自SWSAD小幫手的通知：</p>",
+        f"<p>系統發現有幾台機器的庫存已經低於您設定的警戒值囉！為了確保銷售不中斷，建議您盡快安排補貨。</p>",
+
+        # 開始建立表格
+        f"<table style='width:100%; border-collapse:collapse; text-align:left;'>",
+        f"   <tr style='background-color:#f2f2f2;'>",
+        f"       <th style='padding:8px; border:1px solid #ddd;'>機台名稱</th>",
+        f"       <th style='padding:8px; border:1px solid #ddd;'>目前庫存</th>",
+        f"   </tr>"
+    ]
+
+    for ls in entry['allLowStores']:
+        # 每一行資料
+        body_html_lines.append(f"<tr>")
+        body_html_lines.append(f"    <td style='padding:8px; border:1px solid #ddd;'>{ls.get('display', ls['store_key'])}</td>")
+        body_html_lines.append(f"    <td style='padding:8px; border:1px solid #ddd;'>{ls['total']} 個</td>")
+        body_html_lines.append(f"</tr>")
+
+    body_html_lines.extend([
+        f"</table>",  # 表格結束
+
+        f"<p>點擊下方連結，即可前往網站查看詳細庫存狀況並安排補貨：</p>",
+        f'<p><a href="{PRESENTATION_URL}">👉 智慧倉儲與銷售分析儀表板-Smart Warehousing and Sales Analysis Dashboard</a></p>',
+        f"<p>此為系統自動通知，請勿回覆。</p>",
+        f"</body></html>"
+    ])
+    return subject, "\n".join(body_html_lines)
+
+
+def _notification_payload(entry):
+    return {'user': entry['user'], 'email': entry['email'], 'lowStores': entry['lowStores'],
+            'allLowStores': entry['allLowStores'], 'threshold': entry['threshold']}
+
+
+def dispatch_notification_plan(db: Session, plan, session_factory, client=None):
+    """
+    Queues the planned emails and delivers them through the mail queue (see mailer.py).
+    The queue is drained on every run, also without new emails, so retries left over
+    from earlier runs go out too (the 'mail' job drains it between runs).
+    NotificationSent rows are written by the queue once SendGrid accepted an email,
+    so a failed send is retried on the next run instead of counting as notified.
+    """
+    client = client or get_sendgrid_client()
+    if not client.configured:
+        # Nothing could be delivered; queueing would only pile up failed rows every run
+        if plan:
+            logging.warning(f"Email not configured: {len(plan)} low-inventory notifications not sent.")
+        error = {'ok': False, 'error': 'SendGrid API key or from address missing'}
+        return [dict(_notification_payload(entry), sent=error) for entry in plan], None
+
+    queued = []
+    for entry in plan:
+        subject, body_html = render_low_inventory_email(entry)
+        queued.append(enqueue_email(db, entry['email'], subject, body_html, html_content=True,
+                                    user_id=entry['user_id'], store_keys=[ls['store_key'] for ls in entry['lowStores']]))
+    db.commit()
+
+    mail_counts = drain_outbound_queue(session_factory, client=client)
+    db.expire_all()
+    statuses = get_delivery_status(db, [email.id for email in queued])
+    notifications = []
+    for entry, email in zip(plan, queued):
+        status = statuses.get(email.id, {})
+        notifications.append(dict(_notification_payload(entry), sent={
+            'ok': status.get('status') == 'sent', 'status': status.get('status'), 'attempts': status.get('attempts'),
+            'error': status.get('lastError'), 'outboundId': email.id
+        }))
+    return notifications, mail_counts
+
+
+def run_low_inventory_notifications(db: Session, session_factory, client=None, now_utc=None):
+    """
+    Loads, plans and dispatches the low-inventory notifications.
+    Returns {'notifications': [...], 'mail': queue counts, 'users': n,
+             'timing': {'load': s, 'plan': s, 'dispatch': s, 'total': s}}.
+    """
+    started = time.monotonic()
+    users, store_totals, hidden_store_keys, already_notified = load_notification_inputs(db, notification_day_start(now_utc))
+    # DAILY_EMAIL_LIMIT is global: emails sent earlier today and still queued count against it
+    queued = db.query(func.count(OutboundEmail.id)).filter(OutboundEmail.status == 'queued').scalar() or 0
+    daily_limit = max(get_daily_email_limit() - emails_sent_today(db, now_utc) - queued, 0)
+    loaded = time.monotonic()
+    plan = plan_low_inventory_notifications(users, store_totals, hidden_store_keys, already_notified, daily_limit)
+    planned = time.monotonic()
+    logging.info(f"Checked low-inventory for {len(users)} users: {len(plan)} emails planned.")
+    notifications, mail_counts = dispatch_notification_plan(db, plan, session_factory, client=client)
+    finished = time.monotonic()
+    return {
+        'notifications': notifications,
+        'mail': mail_counts,
+        'users': len(users),
+        'timing': {
+            'load': round(loaded - started, 3),
+            'plan': round(planned - loaded, 3),
+            'dispatch': round(finished - planned, 3),
+            'total': round(finished - started, 3)
+        }
+    }
@@ -0,0 +1,108 @@
+"""
+Cursor (keyset) pagination and streamed JSON arrays for the listing endpoints
+(/get-data, /api/transactions, /api/warehouses, /api/update-logs).
+
+    ?limit=N[&cursor=...]  one page ordered by the endpoint's key columns, plus
+                           "nextCursor" (null on the last page). The cursor holds the
+                           last row's key, so a page costs an index seek, not an OFFSET scan.
+    ?stream=1              the usual response, written out while rows are read
+                           with yield_per, so memory stays flat however big the table is.
+"""
+import json
+import base64
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+STREAM_BATCH_ROWS = 1000
+
+
+class CursorError(ValueError):
+    """Invalid ?limit or ?cursor, answered with 400."""
+
+
+def wants_page(args):
+    return 'limit' in args or 'cursor' in args
+
+
+def wants_stream(args):
+    return args.get('stream') in ('1', 'true')
+
+
+def page_size(args, default=DEFAULT_PAGE_SIZE):
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise CursorError('limit must be an integer')
+    if limit < 1:
+        raise CursorError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(values):
+    tagged = [{'dt': v.isoformat()} if isinstance(v, datetime) else {'d': v.isoformat()} if isinstance(v, date) else v
+              for v in values]
+    return base64.urlsafe_b64encode(json.dumps(tagged).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        values = [(datetime.fromisoformat(v['dt']) if 'dt' in v else date.fromisoformat(v['d'])) if isinstance(v, dict) else v
+                  for v in values]
+    except Exception:
+        raise CursorError('invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise CursorError('invalid cursor')
+    return values
+
+
+def _after(columns, values, descending):
+    """(c1, c2, ...) > (v1, v2, ...) spelled out, so every value is bound with its column's type."""
+    conditions = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        beyond = column < value if descending else column > value
+        conditions.append(and_(*[c == v for c, v in zip(columns[:i], values[:i])], beyond))
+    return or_(*conditions)
+
+
+def keyset_page(query, columns, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=False):
+    """
+    One page of an ORM query ordered by `columns` (which must be unique together, e.g.
+    end with the primary key). Returns (rows, next_cursor or None).
+    """
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, len(columns)), descending))
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+
+def stream_json_array(session_factory, build_query, serialize, prefix='[', suffix=']', dumps=json.dumps,
+                      batch_rows=STREAM_BATCH_ROWS):
+    """
+    Response body generator: prefix, serialize(row) for each row of build_query(db) as a
+    JSON array, suffix. Uses its own session, which stays open while the response streams.
+    Pass app.json.dumps to encode values (e.g. datetimes) the way jsonify() does.
+    """
+    db = session_factory()
+    try:
+        yield prefix.encode('utf-8')
+        separator = ''
+        batch = []
+        for row in build_query(db).yield_per(batch_rows):
+            batch.append(dumps(serialize(row)))
+            if len(batch) >= batch_rows:
+                yield (separator + ','.join(batch)).encode('utf-8')
+                separator, batch = ',', []
+        if batch:
+            yield (separator + ','.join(batch)).encode('utf-8')
+        yield suffix.encode('utf-8')
+    finally:
+        db.close()
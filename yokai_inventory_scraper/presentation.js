@@ -116,7 +116,7 @@
                 // 並行獲取庫存、交易和倉庫數據
                 const [inventoryRes, transactionsRes, warehousesRes] = await Promise.all([
                     fetch('/get-data'),
-                    fetch('/api/transactions'),
+                    fetch('/api/transactions/columnar'),
                     fetch('/api/warehouses')
                 ]);
 
@@ -136,7 +136,7 @@
                 if (!inventoryResult.success) throw new Error(inventoryResult.message);
                 
                 if (!transactionsRes.ok) throw new Error(`獲取交易數據失敗: ${transactionsRes.statusText}`);
-                window.fullSalesData = await transactionsRes.json();
+                window.fullSalesData = decodeColumnarTransactions(await transactionsRes.json());
 
                 // --- NEW CENTRALIZED DATE PARSING ---
                 if (window.fullSalesData) {
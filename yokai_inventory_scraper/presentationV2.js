@@ -3095,9 +3095,9 @@
     if(salesLoadPromise) return salesLoadPromise;
     salesLoadPromise = (async ()=>{
       try{
-        log('fetching /api/transactions');
-        const res = await fetch('/api/transactions'); if(!res.ok){ log('/api/transactions response not ok', res.status); return; }
-        const data = await res.json(); log('/api/transactions returned', Array.isArray(data)?data.length:'non-array');
+        log('fetching /api/transactions/columnar');
+        const res = await fetch('/api/transactions/columnar'); if(!res.ok){ log('/api/transactions/columnar response not ok', res.status); return; }
+        const data = decodeColumnarTransactions(await res.json()); log('/api/transactions/columnar returned', data.length);
         const today = new Date();
         today.setHours(0, 0, 0, 0);
         const end = new Date(today);
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+from selenium.webdriver.common.by import By
+from selenium.common.exceptions import WebDriverException
+
+
+# --- Configurable Variables ---
+# Upper bound for any single readiness wait; the scrapers' own WebDriverWait calls still
+# guard the elements they need, so hitting this bound only means "carry on".
+READY_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_READY_TIMEOUT", "10"))
+# How long the network / row count has to stay quiet before the page counts as settled.
+NETWORK_IDLE_SECONDS = 0.3
+ROW_STABLE_SECONDS = 0.3
+POLL_INTERVAL_SECONDS = 0.1
+# Requests still open after this long (long-polling, aborted by navigation) are ignored.
+STALE_REQUEST_SECONDS = 10
+
+LOADING_MASK_SCRIPT = """
+return Array.prototype.some.call(document.querySelectorAll('.el-loading-mask'), function (el) {
+    return el.offsetParent !== null && window.getComputedStyle(el).display !== 'none';
+});
+"""
+
+# Request types whose completion means the SPA has its data (images, fonts, etc. are ignored).
+TRACKED_REQUEST_TYPES = ('XHR', 'Fetch', 'Document')
+
+_inflight_requests = weakref.WeakKeyDictionary()
+_inflight_lock = threading.Lock()
+
+
+def enable_performance_log(options):
+    """Turns on Chrome's DevTools performance log (network events only) for network-idle detection."""
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+    return options
+
+
+class StepTimer:
+    """
+    Collects how long a scrape spends waiting for the page versus doing actual work.
+    Use `with timer.waiting('step'):` around every wait; everything else counts as work.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.steps = {}
+
+    @contextmanager
+    def waiting(self, step):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            count, seconds = self.steps.get(step, (0, 0.0))
+            self.steps[step] = (count + 1, seconds + time.monotonic() - started)
+
+    @property
+    def wait_seconds(self):
+        return sum(seconds for _, seconds in self.steps.values())
+
+    def report(self):
+        total = time.monotonic() - self.started
+        waited = self.wait_seconds
+        share = (waited / total * 100) if total else 0
+        lines = [f"[{self.name}] total {total:.1f}s: waiting {waited:.1f}s ({share:.0f}%), working {total - waited:.1f}s"]
+        for step, (count, seconds) in sorted(self.steps.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  - {step}: {count}x, {seconds:.1f}s waiting (avg {seconds / count:.2f}s)")
+        return "\n".join(lines)
+
+
+@contextmanager
+def _timed(timer, step):
+    if timer is None:
+        yield
+    else:
+        with timer.waiting(step):
+            yield
+
+
+def _drain_network_events(driver, inflight):
+    """Reads new performance log entries into `inflight` (requestId -> start time)."""
+    now = time.monotonic()
+    activity = False
+    for entry in driver.get_log('performance'):
+        message = json.loads(entry['message'])['message']
+        method = message.get('method')
+        params = message.get('params', {})
+        request_id = params.get('requestId')
+        if method == 'Network.requestWillBeSent' and params.get('type') in TRACKED_REQUEST_TYPES:
+            inflight[request_id] = now
+            activity = True
+        elif method in ('Network.loadingFinished', 'Network.loadingFailed') and request_id in inflight:
+            del inflight[request_id]
+            activity = True
+    for request_id, sent_at in list(inflight.items()):
+        if now - sent_at > STALE_REQUEST_SECONDS:
+            del inflight[request_id]
+    return activity
+
+
+def wait_for_network_idle(driver, timeout=None, idle_seconds=NETWORK_IDLE_SECONDS):
+    """
+    Waits until no XHR/fetch request has been open or started for `idle_seconds`.
+    Returns False on timeout or when the driver has no performance log.
+    """
+    timeout = READY_TIMEOUT_SECONDS if timeout is None else timeout
+    with _inflight_lock:
+        inflight = _inflight_requests.setdefault(driver, {})
+    deadline = time.monotonic() + timeout
+    quiet_since = time.monotonic()
+    while time.monotonic() < deadline:
+        try:
+            if _drain_network_events(driver, inflight) or inflight:
+                quiet_since = time.monotonic()
+        except WebDriverException:
+            # Browser started without enable_performance_log (e.g. a local debugging session)
+            return driver.execute_script("return document.readyState") == 'complete'
+        if time.monotonic() - quiet_since >= idle_seconds:
+            return True
+        time.sleep(POLL_INTERVAL_SECONDS)
+    logging.debug(f"Network did not go idle within {timeout}s ({len(inflight)} requests open).")
+    return False
+
+
+def wait_for_loading_mask_gone(driver, timeout=None):
+    """Waits until no Element-UI loading mask (v-loading) is visible."""
+    timeout = READY_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not driver.execute_script(LOADING_MASK_SCRIPT):
+            return True
+        time.sleep(POLL_INTERVAL_SECONDS)
+    logging.debug(f"Loading mask still visible after {timeout}s.")
+    return False
+
+
+def wait_for_stable_row_count(driver, rows_xpath, timeout=None, settle_seconds=ROW_STABLE_SECONDS, min_rows=1):
+    """
+    Waits until the number of rows matching `rows_xpath` is at least `min_rows`
+    and has not changed for `settle_seconds`. Returns the final row count.
+    """
+    timeout = READY_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    last_count = -1
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        count = len(driver.find_elements(By.XPATH, rows_xpath))
+        if count != last_count:
+            last_count = count
+            stable_since = time.monotonic()
+        elif count >= min_rows and time.monotonic() - stable_since >= settle_seconds:
+            return count
+        time.sleep(POLL_INTERVAL_SECONDS)
+    logging.debug(f"Row count for {rows_xpath} did not settle within {timeout}s (last {last_count}).")
+    return max(last_count, 0)
+
+
+def wait_for_active_page(driver, page_number, timeout=None):
+    """Waits until a visible Element-UI pager marks `page_number` as the active page."""
+    timeout = READY_TIMEOUT_SECONDS if timeout is None else timeout
+    xpath = f"//ul[contains(@class, 'el-pager')]//li[contains(@class, 'active') and normalize-space()='{page_number}']"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(li.is_displayed() for li in driver.find_elements(By.XPATH, xpath)):
+            return True
+        time.sleep(POLL_INTERVAL_SECONDS)
+    logging.debug(f"Pager did not switch to page {page_number} within {timeout}s.")
+    return False
+
+
+def wait_for_page_ready(driver, timer=None, step='page_ready', rows_xpath=None, page_number=None, timeout=None):
+    """
+    Bounded replacement for the fixed time.sleep() after a click or navigation:
+    pager switched (optional) -> network idle -> loading mask gone -> row count stable (optional).
+    """
+    with _timed(timer, step):
+        if page_number is not None:
+            wait_for_active_page(driver, page_number, timeout)
+        wait_for_network_idle(driver, timeout)
+        wait_for_loading_mask_gone(driver, timeout)
+        if rows_xpath is not None:
+            return wait_for_stable_row_count(driver, rows_xpath, timeout)
+
+
+def wait_for_download_start(download_dir, timeout, timer=None, step='download_start'):
+    """Polls `download_dir` until any file (.xlsx or .crdownload) appears; returns False on timeout."""
+    with _timed(timer, step):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.listdir(download_dir):
+                return True
+            time.sleep(POLL_INTERVAL_SECONDS * 2)
+        return False
@@ -198,30 +198,30 @@ async function generateReplenishmentSuggestion() {
     const selectedStrategy = selectedStrategyCard.dataset.strategy;
 
     try {
-        // 為每個選中的機台生成建議
-        const suggestions = [];
-        for (const machine of selectedMachines) {
-            const [store, machineId] = machine.split('-');
-            
-            const response = await fetch(`/api/warehouse-replenishment-suggestion/${store}-${machineId}`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    strategy: selectedStrategy,
-                    warehouses: Array.from(selectedWarehouses)
-                })
-            });
+        // 所有選中機台一起規劃，倉庫庫存只分配一次
+        const machines = Array.from(selectedMachines);
+        const response = await fetch('/api/fleet-replenishment-plan', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                store_keys: machines,
+                strategy: selectedStrategy,
+                warehouses: Array.from(selectedWarehouses)
+            })
+        });
 
-            const result = await response.json();
-            if (result.success) {
-                suggestions.push({
-                    machine,
-                    ...result
-                });
-            }
+        const batch = await response.json();
+        if (!batch.success) {
+            throw new Error(batch.message);
         }
+        const suggestions = batch.results
+            .filter(result => result.success)
+            .map(result => ({
+                machine: result.store_key,
+                ...result
+            }));
 
         // 顯示建議結果
         renderSuggestions(suggestions);
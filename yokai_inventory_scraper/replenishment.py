@@ -0,0 +1,333 @@
+"""
+Replenishment suggestions per machine, shared by the single-machine endpoints and the
+batch endpoints in server.py.
+
+The suggestion functions are adapters around strategy_kernel: they take the warehouse
+stock, the machines' inventories and 30-day sales already loaded, compute all machines
+with one kernel call per step and return (response body, HTTP status) per machine, the
+same body each machine got from the per-machine code before. The loaders
+read each table once for any number of machines, so a batch of N machines costs the
+same three queries as a single one; warehouse totals and sales counts are additionally
+served from snapshot_cache while their data versions are unchanged.
+
+The demand the strategies weight by is either the last 30 days' sales (default) or, with
+demand='forecast', the units forecasting.py expects over the next 30 days.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from database import Inventory, Warehouse, get_data_versions
+from sales_rollup import ROLLUP_MARKER, daily_sales_counts, partial_day_counts, first_whole_day, add_counts
+from snapshot_cache import warehouse_totals, store_sales, store_forecasts
+from forecasting import forecast_counts_by_store
+from strategy_kernel import tab_additions, target_quantities, replenish_quantities, no_sales_quantities
+
+
+SALES_WINDOW_DAYS = 30
+# Data versions the cached warehouse totals and sales counts are checked against
+WAREHOUSE_VERSIONS = ('warehouse',)
+SALES_VERSIONS = ('transactions', ROLLUP_MARKER)
+FORECAST_VERSIONS = ('forecasts',)
+# Products the presentation page tops up from the targets (the rows of the replenishment form)
+MAX_ITEMS = 7
+
+
+def _warehouse_totals(db: Session, warehouse_names):
+    """{warehouse_name: {product: total quantity}} in row order, one query for all names."""
+    totals = {warehouse_name: {} for warehouse_name in warehouse_names}
+    for item in (db.query(Warehouse).filter(Warehouse.warehouse_name.in_(warehouse_names))
+                 .order_by(Warehouse.id)):
+        products = totals[item.warehouse_name]
+        products[item.product_name] = products.get(item.product_name, 0) + item.quantity
+    return totals
+
+
+def load_warehouse_inventory(db: Session, warehouse_names):
+    """{product: total quantity} over the selected warehouses, in warehouse then row order."""
+    versions = get_data_versions(db, WAREHOUSE_VERSIONS)
+    totals = warehouse_totals.get_many(list(dict.fromkeys(warehouse_names)), versions,
+                                       lambda missing: _warehouse_totals(db, missing))
+    warehouse_inventory = {}
+    for warehouse_name in warehouse_names:
+        for product, quantity in totals[warehouse_name].items():
+            if product in warehouse_inventory:
+                warehouse_inventory[product] += quantity
+            else:
+                warehouse_inventory[product] = quantity
+    return warehouse_inventory
+
+
+def load_machine_inventories(db: Session, store_keys):
+    """
+    {store_key: {product: quantity}} for machines given as 'store-machineId' keys, each in
+    product order (the order SQLite used to return for the per-machine query, via the
+    unique store/machine/product index), which the strategies use to break ties.
+    """
+    pairs = {tuple(store_key.split('-', 1)): store_key for store_key in store_keys}
+    inventories = {store_key: {} for store_key in store_keys}
+    if pairs:
+        for item in (db.query(Inventory).filter(tuple_(Inventory.store, Inventory.machine_id).in_(list(pairs)))
+                     .order_by(Inventory.store, Inventory.machine_id, Inventory.product_name)):
+            inventories[pairs[(item.store, item.machine_id)]][item.product_name] = item.quantity
+    return inventories
+
+
+def load_sales_counts(db: Session, store_keys, now=None):
+    """
+    {store name: {product: units sold}} over the last 30 days, counted from now - 30 days
+    like the per-machine code did. Sales are shared by all machines of a store name, so
+    machines of the same store share one entry. The whole days come from the snapshot
+    cache; the partial first day is read fresh, since its cutoff moves with every request.
+    """
+    since = (now or datetime.now()) - timedelta(days=SALES_WINDOW_DAYS)
+    first_day = first_whole_day(since)
+    store_names = list(dict.fromkeys(store_key.split('-', 1)[0] for store_key in store_keys))
+    keys = [(store_name, first_day) for store_name in store_names]
+
+    def load(missing):
+        counts = daily_sales_counts(db, [store_name for store_name, _ in missing], first_day)
+        return {(store_name, first_day): counts[store_name] for store_name, _ in missing}
+
+    sales = store_sales.get_many(keys, get_data_versions(db, SALES_VERSIONS), load)
+    partial = partial_day_counts(db, store_names, since)
+    return {store_name: add_counts(sales[(store_name, first_day)], partial[store_name]) for store_name in store_names}
+
+
+def load_forecast_counts(db: Session, store_keys):
+    """
+    {store name: {product: units expected over the next 30 days}}, the shape of
+    load_sales_counts. Stores without forecasts (new ones, or before the first 'forecast'
+    job) get their 30-day sales instead.
+    """
+    store_names = list(dict.fromkeys(store_key.split('-', 1)[0] for store_key in store_keys))
+    forecasts = store_forecasts.get_many(store_names, get_data_versions(db, FORECAST_VERSIONS),
+                                         lambda missing: forecast_counts_by_store(db, missing, SALES_WINDOW_DAYS))
+    without = [store_name for store_name in store_names if not forecasts[store_name]]
+    sales = load_sales_counts(db, without) if without else {}
+    return {store_name: forecasts[store_name] or sales[store_name] for store_name in store_names}
+
+
+def load_demand(db: Session, store_keys, source=None):
+    """Demand per store name for the strategies: 30-day sales, or forecasts for source='forecast'."""
+    if source == 'forecast':
+        return load_forecast_counts(db, store_keys)
+    return load_sales_counts(db, store_keys)
+
+
+def _matrices(store_keys, warehouse_inventory, inventories, sales):
+    """
+    Products and the arrays strategy_kernel works on: current quantity and 30-day sales
+    per product and machine, warehouse stock per product, and the order of every
+    machine's inventory and of its store's sales (inf where a product is not in it),
+    which the strategies use to break ties. The warehouse products come first in
+    warehouse order, the others sorted.
+    """
+    products = list(warehouse_inventory)
+    others = set()
+    for store_key in store_keys:
+        others.update(inventories[store_key], sales[store_key.split('-', 1)[0]])
+    products += sorted(others.difference(warehouse_inventory))
+    index = {product: i for i, product in enumerate(products)}
+    shape = (len(products), len(store_keys))
+    current = np.zeros(shape, dtype=int)
+    sold = np.zeros(shape)
+    held_order = np.full(shape, np.inf)
+    sales_order = np.full(shape, np.inf)
+    for m, store_key in enumerate(store_keys):
+        for rank, (product, quantity) in enumerate(inventories[store_key].items()):
+            current[index[product], m] = quantity
+            held_order[index[product], m] = rank
+        for rank, (product, count) in enumerate(sales[store_key.split('-', 1)[0]].items()):
+            sold[index[product], m] = count
+            sales_order[index[product], m] = rank
+    stock = np.array([warehouse_inventory.get(product, 0) for product in products], dtype=int)
+    return products, current, sold, stock, held_order, sales_order
+
+
+def _listed(order):
+    """Rows of one machine's list in list order, from a kernel position column (-1: not listed)."""
+    rows = np.flatnonzero(order >= 0)
+    return rows[np.argsort(order[rows])].tolist()
+
+
+def warehouse_tab_suggestions(store_keys, strategy, machine_capacity, selected_warehouses,
+                              warehouse_inventory, inventories, sales):
+    """
+    [(response body, HTTP status)] per machine for the replenishment tab
+    (/api/warehouse-replenishment-suggestion[s]); the rules are in strategy_kernel.tab_additions.
+    """
+    if not warehouse_inventory:
+        return [({
+            "success": False,
+            "message": "選擇的倉庫中沒有可用庫存"
+        }, 400) for _ in store_keys]
+
+    products, current, sold, stock, held_order, _ = _matrices(store_keys, warehouse_inventory, inventories, sales)
+    additions, order = tab_additions(strategy, sold, stock, held_order, machine_capacity - current.sum(axis=0))
+    warehouse_info = [{
+        "name": w,
+        "products": len([p for p in warehouse_inventory if w in selected_warehouses])
+    } for w in selected_warehouses]
+
+    results = []
+    for m, store_key in enumerate(store_keys):
+        sales_counts = sales[store_key.split('-', 1)[0]]
+        current_m, additions_m = current[:, m].tolist(), additions[:, m].tolist()
+        suggestion_list = [{
+            'productName': products[i],
+            'currentQty': current_m[i],
+            'suggestedQty': current_m[i] + additions_m[i],
+            'warehouseQty': warehouse_inventory.get(products[i], 0),
+            'salesCount30d': sales_counts.get(products[i], 0)
+        } for i in _listed(order[:, m])]
+        suggestion_list.sort(key=lambda x: (x['suggestedQty'] - x['currentQty']), reverse=True)
+        results.append(({
+            "success": True,
+            "store_key": store_key,
+            "strategy_used": strategy,
+            "suggestion": suggestion_list,
+            "warning": None,
+            "warehouse_info": warehouse_info
+        }, 200))
+    return results
+
+
+def _presentation_list(current_inventory, sales_counts, suggestion_map, distributed_map, machine_capacity, only_add):
+    """
+    (suggestion list, warning) of the presentation page from the kernel's targets and
+    additions of one machine. Kept as the page always built it: the MAX_ITEMS targets
+    with the largest increase are listed next to the rows with the additions, and any
+    total above the capacity is taken back from the largest suggestions.
+    """
+    final_suggestion = []
+    all_product_names = set(current_inventory.keys()) | set(suggestion_map.keys())
+    total_current = sum(current_inventory.get(name, 0) for name in all_product_names)
+
+    # 建議數量不低於當前庫存
+    for name in all_product_names:
+        current_qty = current_inventory.get(name, 0)
+        suggested_qty = max(current_qty, suggestion_map.get(name, current_qty))
+        final_suggestion.append({
+            'productName': name,
+            'currentQty': current_qty,
+            'suggestedQty': suggested_qty,
+            'salesCount30d': sales_counts.get(name, 0)
+        })
+
+    # 按照調整量（建議數量-當前數量）排序，只保留需要調整的前 MAX_ITEMS 個項目
+    final_suggestion.sort(key=lambda x: (
+        x['suggestedQty'] - x['currentQty'],
+        x['salesCount30d']
+    ), reverse=True)
+    needs_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] > 0]
+    no_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] <= 0]
+    final_suggestion = needs_adjustment[:MAX_ITEMS] + no_adjustment
+    final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+
+    if total_current >= machine_capacity:
+        warning = f"現有庫存總和({total_current})已達最大補貨總數量({machine_capacity})，無需補貨。"
+        for name in all_product_names:
+            final_suggestion.append({
+                'productName': name,
+                'currentQty': current_inventory.get(name, 0),
+                'suggestedQty': current_inventory.get(name, 0),
+                'salesCount30d': sales_counts.get(name, 0)
+            })
+        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+        return final_suggestion, warning
+
+    # 建議數量 = 現有庫存 + 分配到的補貨量
+    for name in all_product_names:
+        current_qty = current_inventory.get(name, 0)
+        suggested_qty = current_qty + distributed_map.get(name, 0)
+        # 只補貨模式下，不建議減少現有庫存
+        if only_add and suggested_qty < current_qty:
+            suggested_qty = current_qty
+        final_suggestion.append({
+            'productName': name,
+            'currentQty': current_qty,
+            'suggestedQty': suggested_qty,
+            'salesCount30d': sales_counts.get(name, 0)
+        })
+    final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+
+    # 總和超過 machine_capacity 時，從建議數量最大的項目依序減少
+    warning = None
+    total_final = sum(item['suggestedQty'] for item in final_suggestion)
+    if total_final > machine_capacity:
+        warning = f"分配後總庫存({total_final})超過最大補貨總數量({machine_capacity})，已自動調整至上限。"
+        over = total_final - machine_capacity
+        for item in sorted(final_suggestion, key=lambda x: x['suggestedQty'], reverse=True):
+            if over <= 0:
+                break
+            reducible = item['suggestedQty'] - item['currentQty']
+            if reducible > 0:
+                reduce_by = min(reducible, over)
+                item['suggestedQty'] -= reduce_by
+                over -= reduce_by
+        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+    return final_suggestion, warning
+
+
+def machine_suggestions(store_keys, strategy, reserve_slots, only_add, machine_capacity,
+                        warehouse_inventory, inventories, sales):
+    """
+    [(response body, HTTP status)] per machine for the presentation page
+    (/api/replenishment-suggestion[s]). The targets come from capacity - reserve_slots
+    (strategy_kernel.target_quantities), the additions fill the capacity above the
+    current stock (strategy_kernel.replenish_quantities).
+    """
+    if not warehouse_inventory:
+        return [({
+            "success": False,
+            "message": "選擇的倉庫中沒有可用庫存"
+        }, 400) for _ in store_keys]
+
+    products, current, sold, stock, _, sales_order = _matrices(store_keys, warehouse_inventory, inventories, sales)
+    available_slots = machine_capacity - reserve_slots
+    in_warehouse = np.arange(len(products)) < len(warehouse_inventory)
+    targets, target_order = target_quantities(strategy, sold, sales_order, stock, in_warehouse, available_slots)
+    replenish = replenish_quantities(strategy, sold, sales_order, machine_capacity - current.sum(axis=0))
+    no_sales = None
+
+    results = []
+    for m, store_key in enumerate(store_keys):
+        sales_counts = sales[store_key.split('-', 1)[0]]
+        if sum(sales_counts.values()) == 0:
+            # 如果沒有銷售數據，則根據倉庫庫存情況提供建議
+            if no_sales is None:
+                rows, quantities = no_sales_quantities(strategy, stock[:len(warehouse_inventory)], available_slots)
+                no_sales = ({
+                    "success": True,
+                    "strategy_used": f"{strategy}_no_sales",
+                    "suggestion": [{'productName': products[i], 'suggestedQty': q}
+                                   for i, q in zip(rows.tolist(), quantities.tolist())],
+                    "message": "根據倉庫庫存生成建議"
+                }, 200)
+            results.append(no_sales)
+            continue
+
+        # 只考慮倉庫中有庫存的產品的銷售數據
+        if not any(product in warehouse_inventory for product in sales_counts):
+            results.append(({
+                "success": False,
+                "message": "倉庫中沒有任何有銷售記錄的產品"
+            }, 400))
+            continue
+
+        targets_m, replenish_m = targets[:, m].tolist(), replenish[:, m].tolist()
+        suggestion_map = {products[i]: targets_m[i] for i in _listed(target_order[:, m])}
+        distributed_map = {products[i]: replenish_m[i] for i in np.flatnonzero(replenish[:, m]).tolist()}
+        final_suggestion, warning = _presentation_list(inventories[store_key], sales_counts, suggestion_map,
+                                                       distributed_map, machine_capacity, only_add)
+        results.append(({
+            "success": True,
+            "store_key": store_key,
+            "strategy_used": strategy,
+            "suggestion": final_suggestion,
+            "warning": warning
+        }, 200))
+    return results
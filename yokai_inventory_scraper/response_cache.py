@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+
+class VersionedResponseCache:
+    """
+    Keeps the already-serialized JSON body of an endpoint per scope (e.g. one per user),
+    tagged with the data versions it was built from. A lookup with different versions
+    is a miss, so a bump_data_version() anywhere invalidates every scope at once.
+    """
+
+    def __init__(self, name, max_scopes=256):
+        self.name = name
+        self.max_scopes = max_scopes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, scope, versions):
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is not None and entry['versions'] == versions:
+                self._entries.move_to_end(scope)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, scope, versions, body):
+        entry = {
+            'versions': versions,
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest()
+        }
+        with self._lock:
+            self._entries[scope] = entry
+            self._entries.move_to_end(scope)
+            while len(self._entries) > self.max_scopes:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, app, entry):
+        """Builds the response for a cache entry, answering 304 when the browser already has it."""
+        response = app.response_class(entry['body'], mimetype='application/json')
+        response.set_etag(entry['etag'])
+        # Per-user data: browsers may keep it but must revalidate every time
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            with self._lock:
+                self.not_modified += 1
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'notModified': self.not_modified,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None,
+                'scopes': len(self._entries),
+                'bytes': sum(len(entry['body']) for entry in self._entries.values())
+            }
+
+
+_caches = {}
+
+
+def get_cache(name, **kwargs):
+    """Returns the process-wide cache called `name`, creating it on first use."""
+    if name not in _caches:
+        _caches[name] = VersionedResponseCache(name, **kwargs)
+    return _caches[name]
+
+
+def register_cache(cache):
+    """Adds another kind of cache (anything with .name and .stats()) to all_cache_stats()."""
+    _caches[cache.name] = cache
+    return cache
+
+
+def all_cache_stats():
+    return {name: cache.stats() for name, cache in _caches.items()}
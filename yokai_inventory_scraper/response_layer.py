@@ -0,0 +1,216 @@
+"""
+JSON encoding and response compression for every Flask response.
+
+- OrjsonProvider replaces app.json, so jsonify() and app.json.dumps() encode with orjson
+  (the stdlib encoder when orjson is not installed). Dates and datetimes are written as
+  ISO 8601 strings, so views can hand them over as they are.
+- init_response_layer(app) compresses responses of at least COMPRESS_MIN_BYTES with
+  brotli (when the brotli package is installed) or gzip, whichever the client accepts;
+  streamed responses are compressed chunk by chunk.
+- Per-route counters (bytes before/after compression, JSON encode time) are kept for
+  GET /api/response-stats.
+"""
+import os
+import json
+import time
+import zlib
+import decimal
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from flask import g, request, has_request_context
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+# Cheap levels: these bodies are compressed on every request (or on every cache refill)
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'application/vnd.apache.arrow.stream',
+                          'text/html', 'text/css', 'text/plain', 'text/csv')
+# Compressed bodies of responses with an ETag (e.g. the cached /get-data), keyed by (etag, encoding)
+COMPRESSED_CACHE_SIZE = 64
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+_compressed = OrderedDict()
+_compressed_lock = threading.Lock()
+
+
+def _default(obj):
+    """Types neither orjson nor the stdlib encoder handle, encoded like Flask's default provider."""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, set, frozenset)):
+        return list(obj) if isinstance(obj, (set, frozenset)) else str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    if hasattr(obj, 'item'):  # numpy / pandas scalars
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _record_encode(seconds):
+    if has_request_context():
+        g.json_encode_seconds = g.get('json_encode_seconds', 0.0) + seconds
+
+
+def dumps_bytes(obj):
+    started = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    _record_encode(time.perf_counter() - started)
+    return body
+
+
+class OrjsonProvider(JSONProvider):
+    """app.json provider backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+
+def negotiate_encoding(accept_encodings):
+    """'br', 'gzip' or None for the request's Accept-Encoding."""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding='gzip'):
+    """Compresses a stream of bytes chunks on the fly."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        compressed = process(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def _compressed_body(response, data, encoding):
+    etag = response.get_etag()[0]
+    if not etag:
+        return compress(data, encoding)
+    key = (etag, encoding)
+    with _compressed_lock:
+        body = _compressed.get(key)
+        if body is not None:
+            _compressed.move_to_end(key)
+            return body
+    body = compress(data, encoding)
+    with _compressed_lock:
+        _compressed[key] = body
+        while len(_compressed) > COMPRESSED_CACHE_SIZE:
+            _compressed.popitem(last=False)
+    return body
+
+
+def _record(route, size_in, size_out, encoding, encode_seconds=0.0):
+    with _metrics_lock:
+        stats = _metrics.setdefault(route, {'responses': 0, 'compressed': 0, 'bytesIn': 0, 'bytesOut': 0,
+                                            'encodeSeconds': 0.0})
+        stats['responses'] += 1
+        stats['compressed'] += 1 if encoding else 0
+        stats['bytesIn'] += size_in
+        stats['bytesOut'] += size_out
+        stats['encodeSeconds'] += encode_seconds
+
+
+def _streamed(chunks, route, encoding):
+    """Compresses (if `encoding`) a streamed body, recording its sizes once the stream is done."""
+    size_in = size_out = 0
+
+    def measured():
+        nonlocal size_in
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            size_in += len(chunk)
+            yield chunk
+
+    for chunk in (compress_chunks(measured(), encoding) if encoding else measured()):
+        size_out += len(chunk)
+        yield chunk
+    _record(route, size_in, size_out, encoding)
+
+
+def finish_response(response):
+    """after_request hook: compression and metrics."""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    compressible = (response.mimetype in COMPRESSIBLE_MIMETYPES and 200 <= response.status_code < 300
+                    and response.status_code != 204 and 'Content-Encoding' not in response.headers)
+    encoding = negotiate_encoding(request.accept_encodings) if compressible else None
+
+    if response.is_streamed:
+        if response.direct_passthrough:  # files from send_from_directory
+            return response
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+        response.response = _streamed(response.response, route, encoding)
+        return response
+
+    data = response.get_data()
+    if encoding and len(data) >= COMPRESS_MIN_BYTES:
+        body = _compressed_body(response, data, encoding)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The compressed bytes differ per encoding, so the tag may only claim equivalence
+            response.set_etag(etag, weak=True)
+    else:
+        encoding = None
+    _record(route, len(data), response.content_length or 0, encoding, g.get('json_encode_seconds', 0.0))
+    return response
+
+
+def response_stats():
+    with _metrics_lock:
+        stats = {route: dict(values) for route, values in _metrics.items()}
+    for values in stats.values():
+        values['ratio'] = round(values['bytesOut'] / values['bytesIn'], 3) if values['bytesIn'] else None
+        values['encodeSeconds'] = round(values['encodeSeconds'], 4)
+    return stats
+
+
+def init_response_layer(app):
+    app.json = OrjsonProvider(app)
+    app.after_request(finish_response)
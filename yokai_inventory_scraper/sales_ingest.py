@@ -0,0 +1,163 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Store, Transaction, dialect_insert, bump_data_version
+from sales_rollup import aggregate, apply_sales_delta
+from snapshot_cache import store_sales
+
+
+TRANSACTION_KEY_COLUMNS = ('store_key', 'transaction_time', 'product_name', 'amount', 'payment_type')
+INSERT_CHUNK_SIZE = 500
+# What the sales_daily rollup needs of a transaction (see sales_rollup.aggregate)
+ROLLUP_COLUMNS = (Transaction.store_key, Transaction.transaction_time, Transaction.product_name, Transaction.amount)
+
+
+def _build_store_name_map(db: Session):
+    """Maps shop name -> Store, using the part of store_key before the machine id."""
+    store_name_map = {}
+    for s in db.query(Store).all():
+        name = s.store_key.rsplit('-', 1)[0]
+        if name not in store_name_map:
+            store_name_map[name] = s
+    return store_name_map
+
+
+def _resolve_store(db: Session, store_name_map, shop_name):
+    """Returns the store for a shop name, creating a provisional one for unknown shops."""
+    store = store_name_map.get(shop_name)
+    if not store:
+        logging.info(f"Shop '{shop_name}' not found in DB. Creating a new provisional store.")
+        new_store_key = f"{shop_name}-provisional_sales"
+        store = db.query(Store).filter(Store.store_key == new_store_key).first()
+        if not store:
+            store = Store(store_key=new_store_key)
+            db.add(store)
+            db.flush()
+            bump_data_version(db, 'stores')
+        store_name_map[shop_name] = store
+    return store
+
+
+def _to_naive_datetime(value):
+    value = pd.to_datetime(value)
+    if pd.isna(value):
+        return None
+    value = value.to_pydatetime()
+    return value.replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def ingest_transactions(db: Session, transactions_data, replace_window=False):
+    """
+    Appends transactions ({shopName, product, date, amount, payType}) without touching
+    rows that are already stored. Rows are identified by the natural key
+    (store_key, transaction_time, product_name, amount, payment_type), so running the
+    same export twice inserts nothing the second time; identical sales in the same
+    second therefore count once.
+
+    replace_window=True first deletes the stored rows of the batch's days (same stores and
+    payment types); used for sources that send daily aggregates whose amounts change during the day.
+
+    The sales_daily rollup is updated by exactly the rows inserted or deleted here.
+
+    Runs inside the caller's transaction (the caller commits).
+    Returns {'new': n, 'duplicate': n, 'skipped': n, 'replaced': n}.
+    """
+    store_name_map = _build_store_name_map(db)
+    counts = {'new': 0, 'duplicate': 0, 'skipped': 0, 'replaced': 0}
+
+    rows = {}
+    for item in transactions_data:
+        shop_name_raw = item.get('shopName')
+        transaction_time = _to_naive_datetime(item.get('date'))
+        if not shop_name_raw or pd.isna(shop_name_raw) or transaction_time is None:
+            counts['skipped'] += 1
+            continue
+
+        store = _resolve_store(db, store_name_map, str(shop_name_raw).strip())
+        row = {
+            'store_key': store.store_key,
+            'transaction_time': transaction_time,
+            'product_name': str(item.get('product')),
+            'amount': int(float(item.get('amount', 0))),
+            'payment_type': str(item.get('payType'))
+        }
+        key = tuple(row[column] for column in TRANSACTION_KEY_COLUMNS)
+        if key in rows:
+            counts['duplicate'] += 1
+        rows[key] = row
+
+    if not rows:
+        return counts
+
+    start = min(key[1] for key in rows)
+    end = max(key[1] for key in rows)
+
+    if replace_window:
+        # Whole days, limited to the stores and payment types this source reports
+        day_start = datetime.combine(start.date(), datetime.min.time())
+        day_end = datetime.combine(end.date(), datetime.min.time()) + timedelta(days=1)
+        replaced = db.query(Transaction).filter(
+            Transaction.transaction_time >= day_start,
+            Transaction.transaction_time < day_end,
+            Transaction.store_key.in_({key[0] for key in rows}),
+            Transaction.payment_type.in_({key[4] for key in rows})
+        )
+        apply_sales_delta(db, aggregate(replaced.with_entities(*ROLLUP_COLUMNS)), sign=-1)
+        counts['replaced'] = replaced.delete(synchronize_session=False)
+    else:
+        window = db.query(Transaction).filter(Transaction.transaction_time.between(start, end))
+        # Only the batch's time range can contain duplicates, so that is all we read back
+        existing = window.with_entities(*(getattr(Transaction, column) for column in TRANSACTION_KEY_COLUMNS))
+        for key in existing:
+            if tuple(key) in rows:
+                del rows[tuple(key)]
+                counts['duplicate'] += 1
+
+    new_rows = list(rows.values())
+    insert = dialect_insert(db, Transaction)
+    for start_index in range(0, len(new_rows), INSERT_CHUNK_SIZE):
+        chunk = new_rows[start_index:start_index + INSERT_CHUNK_SIZE]
+        # ON CONFLICT DO NOTHING covers rows another process inserted after our read;
+        # RETURNING yields only the rows actually inserted, which is what the rollup adds
+        inserted = db.execute(
+            insert.values(chunk).on_conflict_do_nothing(index_elements=list(TRANSACTION_KEY_COLUMNS)).returning(*ROLLUP_COLUMNS)
+        ).all()
+        apply_sales_delta(db, aggregate(inserted))
+        counts['new'] += len(inserted)
+        counts['duplicate'] += len(chunk) - len(inserted)
+
+    if counts['new'] or counts['replaced']:
+        bump_data_version(db, 'transactions')
+        store_sales.invalidate()
+    return counts
+
+
+def describe_ingest_counts(counts):
+    text = f"{counts['new']} new, {counts['duplicate']} duplicate"
+    if counts.get('replaced'):
+        text += f", {counts['replaced']} replaced"
+    if counts.get('skipped'):
+        text += f", {counts['skipped']} skipped"
+    return text
+
+
+def get_sales_high_watermark(db: Session):
+    """Time of the latest stored transaction (None if there are none)."""
+    return db.query(func.max(Transaction.transaction_time)).scalar()
+
+
+def get_sales_export_start_date(db: Session):
+    """
+    First day the sales export has to cover: the high-watermark day minus
+    SALES_LOOKBACK_DAYS (default 1) to pick up late-posted sales. None = full history.
+    """
+    watermark = get_sales_high_watermark(db)
+    if watermark is None:
+        return None
+    lookback_days = int(os.getenv('SALES_LOOKBACK_DAYS', '1'))
+    return (watermark - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
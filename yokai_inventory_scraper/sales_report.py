@@ -0,0 +1,138 @@
+"""
+Sales detail workbook (/api/generate-sales-detail): a block per store name listing its
+products with one row per (reverted) unit price, a subtotal per store and a grand total.
+
+The rows arrive already summed per store_key / product / price bucket from sales_daily
+(sales_rollup.sales_detail_rows); group_sales only merges the machines of a store name.
+write_sales_detail streams the sheet with openpyxl's write-only mode, so rows go to the
+file as they are appended instead of piling up as cell objects, and every cell takes one
+of the named styles registered once per workbook instead of new Font / Fill / Border
+objects per cell.
+"""
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, PatternFill, Border, Side, Alignment
+from openpyxl.worksheet.cell_range import CellRange, MultiCellRange
+
+
+FONT_NAME = '微軟正黑體'
+HEADERS = ['商品', '單價', '份數', '小計']
+COLUMN_WIDTHS = {'A': 45, 'B': 15, 'C': 12, 'D': 18}
+NUMBER_FORMAT = '#,##0'
+
+
+def group_sales(rollup_rows):
+    """
+    [(store name, products, units, amount)] from (store_key, product_name, unit_price,
+    count, amount) rows, stores by name. products is [(product, [(price, units, amount)])]
+    with the best-selling product (by amount) first and the prices from high to low.
+    """
+    summary = {}
+    for store_key, product_name, unit_price, count, amount in rollup_rows:
+        prices = summary.setdefault(store_key.split('-')[0], {}).setdefault(product_name or 'UNKNOWN', {})
+        entry = prices.setdefault(unit_price, [0, 0])
+        entry[0] += count
+        entry[1] += amount or 0
+
+    groups = []
+    for store_name in sorted(summary):
+        products = []
+        for product_name in sorted(summary[store_name]):
+            prices = summary[store_name][product_name]
+            products.append((product_name, [(price, *prices[price]) for price in sorted(prices, reverse=True)]))
+        products.sort(key=lambda product: sum(amount for _, _, amount in product[1]), reverse=True)
+        units = sum(count for _, price_rows in products for _, count, _ in price_rows)
+        amount = sum(total for _, price_rows in products for _, _, total in price_rows)
+        groups.append((store_name, products, units, amount))
+    return groups
+
+
+def _named_styles():
+    thin = Side(style='thin', color='BFBFBF')
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    # Header row: a thicker blue line underneath
+    header_border = Border(left=thin, right=thin, top=thin, bottom=Side(style='medium', color='2F75B5'))
+    left = Alignment(horizontal='left', vertical='center')
+    right = Alignment(horizontal='right', vertical='center')
+    bold = Font(bold=True, size=11, name=FONT_NAME)
+    normal = Font(size=10, name=FONT_NAME)
+
+    def fill(color):
+        return PatternFill(start_color=color, end_color=color, fill_type='solid')
+
+    subtotal_fill, alternate_fill = fill('BDD7EE'), fill('F5F5F5')
+    styles = [
+        NamedStyle('sales-header', font=Font(bold=True, size=11, name=FONT_NAME, color='FFFFFF'), fill=fill('2F75B5'),
+                   border=header_border, alignment=Alignment(horizontal='center', vertical='center')),
+        NamedStyle('sales-store', font=bold, fill=subtotal_fill, border=border, alignment=left),
+        NamedStyle('sales-border', border=border),
+        NamedStyle('sales-product', font=normal, alignment=left),
+        NamedStyle('sales-product-alt', font=normal, fill=alternate_fill, alignment=left),
+        NamedStyle('sales-number', font=normal, border=border, alignment=right, number_format=NUMBER_FORMAT),
+        NamedStyle('sales-number-alt', font=normal, fill=alternate_fill, border=border, alignment=right,
+                   number_format=NUMBER_FORMAT),
+    ]
+    for name, row_fill in (('sales-subtotal', subtotal_fill), ('sales-total', fill('8EA9DB'))):
+        styles += [
+            NamedStyle(f"{name}-label", font=bold, fill=row_fill, border=border, alignment=left),
+            NamedStyle(name, font=bold, fill=row_fill, border=border, alignment=right),
+            NamedStyle(f"{name}-number", font=bold, fill=row_fill, border=border, alignment=right,
+                       number_format=NUMBER_FORMAT),
+        ]
+    return styles
+
+
+def write_sales_detail(path, groups):
+    """Writes the workbook for group_sales() output to `path`; returns the number of rows."""
+    wb = Workbook(write_only=True)
+    for style in _named_styles():
+        wb.add_named_style(style)
+    ws = wb.create_sheet('銷售明細')
+    for column, width in COLUMN_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+    ws.row_dimensions[1].height = 25
+    ws.freeze_panes = 'A2'
+    ws.sheet_view.showGridLines = False
+
+    def cell(value, style):
+        styled = WriteOnlyCell(ws, value)
+        styled.style = style
+        return styled
+
+    def totals_row(label, units, amount, style):
+        return [cell(label, f"{style}-label"), cell(None, style), cell(units, f"{style}-number"),
+                cell(amount, f"{style}-number")]
+
+    ws.append([cell(header, 'sales-header') for header in HEADERS])
+    merged = []
+    row = 2
+    for index, (store_name, products, units, amount) in enumerate(groups):
+        if index:
+            # An empty row between stores
+            ws.append([])
+            row += 1
+        ws.append([cell(store_name, 'sales-store')] + [cell(None, 'sales-border') for _ in range(3)])
+        merged.append(CellRange(min_col=1, min_row=row, max_col=4, max_row=row))
+        row += 1
+
+        # Every other product block is shaded, all its price rows alike
+        for block, (product_name, price_rows) in enumerate(products):
+            suffix = '-alt' if block % 2 else ''
+            first_row = row
+            for price, count, total in price_rows:
+                name = cell(product_name, f"sales-product{suffix}") if row == first_row else None
+                ws.append([name, cell(price, f"sales-number{suffix}"), cell(count, f"sales-number{suffix}"),
+                           cell(total, f"sales-number{suffix}")])
+                row += 1
+            if row - first_row > 1:
+                # The product name spans all of its price rows
+                merged.append(CellRange(min_col=1, min_row=first_row, max_col=1, max_row=row - 1))
+
+        ws.append(totals_row(f"{store_name} 小計", units, amount, 'sales-subtotal'))
+        row += 1
+
+    ws.append(totals_row('總計', sum(group[2] for group in groups), sum(group[3] for group in groups), 'sales-total'))
+    # Set at once: merged_cells.add() checks every range already there (quadratic for big reports)
+    ws.merged_cells = MultiCellRange(merged)
+    wb.save(path)
+    return row
@@ -0,0 +1,218 @@
+import time
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import func, insert, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import Transaction, SalesDaily, dialect_insert, bump_data_version, get_data_versions
+
+
+UPSERT_CHUNK_SIZE = 500
+# DataVersion row that is set once the rollup has been built from the existing transactions
+ROLLUP_MARKER = 'sales_daily_built'
+
+
+def unit_price_bucket(amount):
+    """
+    Unit price a transaction amount is reported under in the sales detail: amounts ending
+    in 1 or 2 (card / e-payment surcharges) are folded back onto the list price.
+    """
+    try:
+        price = int(round(amount))
+    except Exception:
+        price = int(amount)
+    last_digit = price % 10
+    if last_digit in (1, 2):
+        return price - 2
+    return price
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def aggregate(rows):
+    """
+    Sums (store_key, transaction_time, product_name, amount[, count]) rows into
+    {(store_key, product_name, day, unit_price): [count, amount]}. A missing product
+    name is stored as '' since it is part of the rollup's primary key.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        store_key, transaction_time, product_name, amount = row[:4]
+        count = row[4] if len(row) > 4 else 1
+        entry = deltas[(store_key, product_name or '', _as_date(transaction_time), unit_price_bucket(amount or 0))]
+        entry[0] += count
+        entry[1] += (amount or 0) * count
+    return deltas
+
+
+def _delta_rows(deltas, sign=1):
+    return [{'store_key': store_key, 'product_name': product_name, 'day': day, 'unit_price': unit_price,
+             'count': sign * count, 'amount': sign * amount}
+            for (store_key, product_name, day, unit_price), (count, amount) in deltas.items()]
+
+
+def apply_sales_delta(db: Session, deltas, sign=1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) aggregated transactions to sales_daily inside
+    the caller's transaction. Rows that drop to zero sales are removed.
+    """
+    if not deltas:
+        return
+    rows = _delta_rows(deltas, sign)
+    upsert = dialect_insert(db, SalesDaily)
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = upsert.values(rows[start:start + UPSERT_CHUNK_SIZE])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=['store_key', 'product_name', 'day', 'unit_price'],
+            set_={'count': SalesDaily.count + stmt.excluded.count, 'amount': SalesDaily.amount + stmt.excluded.amount}
+        ))
+    if sign < 0:
+        db.query(SalesDaily).filter(
+            SalesDaily.count <= 0, SalesDaily.store_key.in_({key[0] for key in deltas})
+        ).delete(synchronize_session=False)
+
+
+def rebuild_sales_daily(db: Session):
+    """Recomputes the whole rollup from `transactions` (first start, or after manual repairs)."""
+    started = time.monotonic()
+    grouped = (
+        db.query(Transaction.store_key, func.date(Transaction.transaction_time), Transaction.product_name,
+                 Transaction.amount, func.count(Transaction.id))
+        .group_by(Transaction.store_key, func.date(Transaction.transaction_time), Transaction.product_name, Transaction.amount)
+    )
+    deltas = aggregate(grouped)
+    db.query(SalesDaily).delete(synchronize_session=False)
+    # Plain INSERT: a concurrent rebuild then fails on the primary key instead of doubling the sums
+    rows = _delta_rows(deltas)
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        db.execute(insert(SalesDaily), rows[start:start + UPSERT_CHUNK_SIZE])
+    logging.info(f"Rebuilt sales_daily: {len(deltas)} rows in {time.monotonic() - started:.2f}s.")
+
+
+def ensure_sales_daily(db: Session):
+    """
+    Builds the rollup once for databases that have transactions from before it existed
+    (and commits). Afterwards ingest keeps it current, so this is a cheap version check.
+    """
+    if get_data_versions(db, (ROLLUP_MARKER,))[0]:
+        return False
+    try:
+        rebuild_sales_daily(db)
+        bump_data_version(db, ROLLUP_MARKER)
+        db.commit()
+    except IntegrityError:
+        # Another gunicorn worker built it at the same time
+        db.rollback()
+        return False
+    return True
+
+
+def _counts_by_name(store_names, rows):
+    """{store_name: {product: count}} from (store_key, product, count) rows, by store_key prefix."""
+    frame = pd.DataFrame(rows, columns=['store_key', 'product', 'count'])
+    frame = frame[frame['product'] != '']
+    counts = {}
+    for name in store_names:
+        totals = frame[frame['store_key'].str.startswith(name)].groupby('product')['count'].sum()
+        counts[name] = {product: int(count) for product, count in totals.items()}
+    return counts
+
+
+def daily_sales_counts(db: Session, store_names, since_day):
+    """
+    {store_name: {product: units sold}} for every machine whose store_key starts with the
+    name, from the start of `since_day` on. One grouped query on the rollup covers all
+    names; the per-name prefix match then runs on the (store_key, product) totals in pandas.
+    """
+    store_names = list(dict.fromkeys(store_names))
+    if not store_names:
+        return {}
+    rows = (
+        db.query(SalesDaily.store_key, SalesDaily.product_name, func.sum(SalesDaily.count))
+        .filter(SalesDaily.day >= since_day, or_(*[SalesDaily.store_key.startswith(name) for name in store_names]))
+        .group_by(SalesDaily.store_key, SalesDaily.product_name)
+        .all()
+    )
+    return _counts_by_name(store_names, rows)
+
+
+def first_whole_day(since):
+    """The first day the rollup can count in full for a window starting at `since` (a date or datetime)."""
+    day = _as_date(since)
+    if isinstance(since, datetime) and since.time() != datetime.min.time():
+        return day + timedelta(days=1)
+    return day
+
+
+def partial_day_counts(db: Session, store_names, since):
+    """
+    {store_name: {product: units sold}} from `since` to the end of its day, counted on
+    `transactions` since the rollup only has whole days. Empty when `since` is a day
+    (or midnight): the rollup then covers the whole window.
+    """
+    store_names = list(dict.fromkeys(store_names))
+    until = first_whole_day(since)
+    if not store_names or until == _as_date(since):
+        return {name: {} for name in store_names}
+    rows = (
+        db.query(Transaction.store_key, Transaction.product_name, func.count(Transaction.id))
+        .filter(Transaction.transaction_time >= since, Transaction.transaction_time < datetime.combine(until, datetime.min.time()),
+                or_(*[Transaction.store_key.startswith(name) for name in store_names]))
+        .group_by(Transaction.store_key, Transaction.product_name)
+        .all()
+    )
+    return _counts_by_name(store_names, rows)
+
+
+def add_counts(*counts):
+    """Sums {product: count} dicts."""
+    total = {}
+    for entry in counts:
+        for product, count in entry.items():
+            total[product] = total.get(product, 0) + count
+    return total
+
+
+def sales_counts_by_store(db: Session, store_names, since):
+    """
+    {store_name: {product: units sold}} for every machine whose store_key starts with the
+    name, from `since` on. A datetime is a rolling cutoff, as `transaction_time >= since`
+    on the raw rows: the rollup counts the whole days after it and `transactions` the
+    rest of its own day.
+    """
+    whole_days = daily_sales_counts(db, store_names, first_whole_day(since))
+    partial = partial_day_counts(db, store_names, since)
+    return {name: add_counts(whole_days[name], partial[name]) for name in whole_days}
+
+
+def sales_counts_by_product(db: Session, store_name, since):
+    """{product: units sold} for every machine of `store_name` from `since` (a date or datetime) on."""
+    return sales_counts_by_store(db, [store_name], since)[store_name]
+
+
+def sales_detail_rows(db: Session, start_day, end_day, stores=None, products=None):
+    """
+    (store_key, product_name, unit_price, count, amount) between two days (inclusive),
+    optionally limited to store name prefixes and products.
+    """
+    query = (
+        db.query(SalesDaily.store_key, SalesDaily.product_name, SalesDaily.unit_price,
+                 func.sum(SalesDaily.count), func.sum(SalesDaily.amount))
+        .filter(SalesDaily.day >= start_day, SalesDaily.day <= end_day)
+    )
+    if stores:
+        query = query.filter(or_(*[SalesDaily.store_key.startswith(s) for s in stores]))
+    if products:
+        query = query.filter(SalesDaily.product_name.in_(products))
+    return (query.group_by(SalesDaily.store_key, SalesDaily.product_name, SalesDaily.unit_price)
+            .order_by(SalesDaily.store_key, SalesDaily.product_name).all())
@@ -3,6 +3,7 @@ import os
 import sys
 import uuid
 import logging
+from datetime import datetime, timedelta
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -12,6 +13,9 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from dotenv import load_dotenv
 
+from browser_manager import set_download_dir
+from readiness import StepTimer, enable_performance_log, wait_for_page_ready, wait_for_download_start
+
 # --- Configurable Variables ---
 URL = "https://manager.yokaiexpress.com/#/standStoreManager"
 
@@ -23,55 +27,73 @@ def get_credentials():
         raise ValueError("錯誤：環境變數 YOKAI_USERNAME 或 YOKAI_PASSWORD 未設定。")
     return username, password
 
-def run_sales_scraper(headless=False):
+DEFAULT_START_DATE = "2025-01-01"
+
+
+def run_sales_scraper(headless=False, driver=None, start_date=None, end_date=None):
     """
     Launches a browser, logs in, navigates, and downloads the sales report.
     Can be run in headless (default for server) or headed mode (for local debugging).
+    start_date / end_date ('YYYY-mm-dd') default to the full history up to tomorrow.
     """
+    start_date = start_date or DEFAULT_START_DATE
+    end_date = end_date or (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
     download_dir = os.path.join(os.getcwd(), 'temp_downloads', str(uuid.uuid4()))
     os.makedirs(download_dir, exist_ok=True)
     logging.info(f"Created temporary download directory: {download_dir}")
 
-    options = webdriver.ChromeOptions()
-    if headless:
-        options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("window-size=1920,1080")
+    # When a logged-in browser is lent by BrowserManager, only the download directory changes
+    owns_driver = driver is None
+    timer = StepTimer("sales")
+    if owns_driver:
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-gpu")
+        options.add_argument("window-size=1920,1080")
+        enable_performance_log(options)
     
-    prefs = {
-        "download.default_directory": download_dir,
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "plugins.always_open_pdf_externally": True
-    }
-    options.add_experimental_option("prefs", prefs)
-
-    driver = webdriver.Chrome(options=options)
+        prefs = {
+            "download.default_directory": download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "plugins.always_open_pdf_externally": True
+        }
+        options.add_experimental_option("prefs", prefs)
+
+        driver = webdriver.Chrome(options=options)
+    else:
+        set_download_dir(driver, download_dir)
     
     try:
-        # --- Login (only happens once) ---
-        username, password = get_credentials()
-        driver.get(URL)
-        wait = WebDriverWait(driver, 30)
+        if owns_driver:
+            # --- Login (only happens once) ---
+            username, password = get_credentials()
+            driver.get(URL)
+            wait = WebDriverWait(driver, 30)
         
-        logging.info("Step 1: Logging in...")
-        logging.info("Waiting for username field...")
-        username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
-        logging.info("Username field found. Sending keys...")
-        username_field.send_keys(username)
+            logging.info("Step 1: Logging in...")
+            logging.info("Waiting for username field...")
+            username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
+            logging.info("Username field found. Sending keys...")
+            username_field.send_keys(username)
         
-        logging.info("Waiting for password field...")
-        password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
-        logging.info("Password field found. Sending keys...")
-        password_field.send_keys(password)
+            logging.info("Waiting for password field...")
+            password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
+            logging.info("Password field found. Sending keys...")
+            password_field.send_keys(password)
 
-        logging.info("Waiting for login button...")
-        login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
-        logging.info("Login button found. Clicking...")
-        login_button.click()
-        logging.info("Login successful.")
+            logging.info("Waiting for login button...")
+            login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
+            logging.info("Login button found. Clicking...")
+            login_button.click()
+            logging.info("Login successful.")
+        else:
+            driver.get(URL)
+            wait = WebDriverWait(driver, 30)
+            logging.info("Step 1: Reusing the logged-in browser session.")
 
         # 登入後直接點父選單展開，再點子選單
         logging.info("Expanding Order Management parent menu...")
@@ -81,6 +103,7 @@ def run_sales_scraper(headless=False):
         logging.info(" > Parent menu clicked, waiting for submenu...")
         WebDriverWait(driver, 5).until(EC.element_to_be_clickable((By.XPATH, order_management_item_xpath))).click()
         logging.info(" > Submenu item clicked.")
+        wait_for_page_ready(driver, timer, 'open_page')
 
         # The main process now runs only once. The page-refresh retry loop is removed.
         try:
@@ -91,22 +114,21 @@ def run_sales_scraper(headless=False):
             # Step 3: Set date range (Search click is removed as per new strategy)
             logging.info("Waiting for date fields to be present...")
             wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Select start date']")))
-            logging.info("Date fields found. Setting date range...")
+            logging.info(f"Date fields found. Setting date range {start_date} ~ {end_date}...")
             start_date_input = driver.find_element(By.XPATH, "//input[@placeholder='Select start date']")
             start_date_input.clear()
-            start_date_input.send_keys("2025-01-01")
+            start_date_input.send_keys(start_date)
             end_date_input = driver.find_element(By.XPATH, "//input[@placeholder='Select end date']")
             end_date_input.clear()
-            end_date_input.send_keys("2026-01-01")
+            end_date_input.send_keys(end_date)
 
             # 新增：輸入完日期後先送出 Enter，再點擊 body，確保日期選擇器事件觸發
             end_date_input.send_keys(Keys.ENTER)
-            time.sleep(0.2)
             try:
                 ActionChains(driver).move_to_element(driver.find_element(By.TAG_NAME, 'body')).click().perform()
             except Exception:
                 driver.find_element(By.TAG_NAME, 'body').click()
-            time.sleep(0.5) # Brief pause to allow any JS events to fire.
+            wait_for_page_ready(driver, timer, 'date_range') # Let the date picker events and any reload finish.
 
             logging.info("Date range set and finalized. Checking region...")
 
@@ -118,7 +140,6 @@ def run_sales_scraper(headless=False):
                 logging.info(f"Current region is {current_region}, changing to TW...")
                 # 點擊 region 選擇器
                 region_input.click()
-                time.sleep(0.5)
                 
                 # 在下拉選單中找到並點擊 TW 選項
                 tw_option = wait.until(EC.element_to_be_clickable((
@@ -126,7 +147,13 @@ def run_sales_scraper(headless=False):
                     "//li[contains(@class, 'el-select-dropdown__item')]//span[text()='TW']"
                 )))
                 driver.execute_script("arguments[0].click();", tw_option.find_element(By.XPATH, ".."))
-                time.sleep(1.5)  # 增加等待時間確保選擇生效
+                # 等待選擇生效（最多 10 秒）
+                with timer.waiting('select_region'):
+                    try:
+                        WebDriverWait(driver, 10).until(lambda d: region_input.get_attribute("value") == "TW")
+                    except TimeoutException:
+                        pass
+                wait_for_page_ready(driver, timer, 'select_region')
                 
                 # 確認 region 已經變更為 TW
                 if region_input.get_attribute("value") != "TW":
@@ -152,26 +179,16 @@ def run_sales_scraper(headless=False):
                 except Exception as e:
                     logging.error(f" > Could not click export button on attempt {attempt + 1}: {e}", exc_info=True)
                     if attempt + 1 < max_export_attempts:
-                        time.sleep(2) # Wait before next major attempt
+                        wait_for_page_ready(driver, timer, 'export_retry') # Wait before next major attempt
                         continue # Go to the next export attempt
                     else:
                         raise Exception("Failed to click export button after multiple attempts.")
 
-                # 2. Wait and then check the filesystem to see if the download started
-                logging.info(" > Waiting 3 seconds before checking filesystem...")
-                time.sleep(3)
-
-                max_file_checks = 5
-                download_started = False
-                for check_num in range(max_file_checks):
-                    # If any file (.xlsx or .crdownload) exists, the download has started
-                    if os.listdir(download_dir):
-                        logging.info(" > SUCCESS: File detected in download directory. Download has started.")
-                        download_started = True
-                        break # Exit the filesystem check loop
-                    
-                    logging.info(f" > Filesystem check {check_num + 1}/{max_file_checks}... No file found. Waiting 2 seconds.")
-                    time.sleep(2)
+                # 2. Check the filesystem to see if the download started (same 13s budget as the old 3s + 5x2s checks)
+                logging.info(" > Waiting for a file to appear in the download directory...")
+                download_started = wait_for_download_start(download_dir, 13, timer)
+                if download_started:
+                    logging.info(" > SUCCESS: File detected in download directory. Download has started.")
 
                 if download_started:
                     # 3. If download has started, poll for completion and return the path
@@ -191,8 +208,10 @@ def run_sales_scraper(headless=False):
             raise  # Re-raise the exception to be handled by the server.py background job runner
 
     finally:
-        driver.quit()
-        logging.info("Browser closed.")
+        logging.info(timer.report())
+        if owns_driver:
+            driver.quit()
+            logging.info("Browser closed.")
 
 
 def poll_for_download(download_dir, timeout_seconds):
@@ -213,8 +232,8 @@ def poll_for_download(download_dir, timeout_seconds):
         else:
             logging.info("Download directory is empty. Waiting for download to start...")
         
-        time.sleep(2)
-        time_waited += 2
+        time.sleep(0.5)
+        time_waited += 0.5
     
     raise Exception(f"Download poll timed out after {timeout_seconds} seconds.")
 
@@ -10,12 +10,16 @@ import pytz
 import re
 import json
 import logging
+import threading
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
 from dateutil.parser import parse as parse_date
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- Custom Imports from our project ---
-from database import SessionLocal, Inventory, Store, init_db
+from database import SessionLocal, Inventory, InventorySync, MachineScrape, Store, Transaction, init_db, dialect_insert, bump_data_version
+from readiness import StepTimer, enable_performance_log, wait_for_page_ready
 
 # --- Configurable Variables ---
 URL = "https://manager.yokaiexpress.com/#/standStoreManager"
@@ -68,8 +72,8 @@ def scrape_all_inventory_text():
         login_button.click()
         logging.info("Login successful.")
 
-        # --- 等待一下下 ---
-        time.sleep(3) # 等待 3 秒，你可以根據需要調整秒數
+        # --- 等待登入後的頁面載入完成 ---
+        wait_for_page_ready(driver, step='login')
 
         # --- Navigate to Inventory ---
         logging.info("Navigating to Store Management...")
@@ -119,7 +123,7 @@ def scrape_all_inventory_text():
                     target_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{page_number}']"
                     target_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, target_page_button_xpath)))
                     target_page_button.click()
-                    time.sleep(0.5)
+                    wait_for_page_ready(driver, rows_xpath=rows_xpath, page_number=page_number)
                     logging.info(f"  > Returned to page {page_number}.")
 
             # --- Go to next page ---
@@ -129,7 +133,7 @@ def scrape_all_inventory_text():
                 next_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{next_page_to_click}']"
                 next_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, next_page_button_xpath)))
                 next_page_button.click()
-                time.sleep(2)
+                wait_for_page_ready(driver, rows_xpath=rows_xpath, page_number=next_page_to_click)
                 page_number += 1
             except Exception:
                 logging.info(f"\nCould not find button for page {next_page_to_click}. Assuming it's the last page.")
@@ -152,10 +156,16 @@ def scrape_all_inventory_text():
         driver.quit()
 
 
-def parse_inventory_from_text(raw_text):
+# Store blocks of machines carried forward by the incremental scrape ('--- Store #carried.1 ---')
+CARRIED_BLOCK_PREFIX = 'carried.'
+
+
+def parse_inventory_from_text(raw_text, scraped_at=None):
     """
     Parses the raw inventory text string, which is grouped by store,
     into a structured list of dictionaries.
+    process_time is `scraped_at` (when the scrape started) or else the time of parsing.
+    Rows of machines the incremental scrape carried forward are marked with 'carried'.
     """
     logging.info("\nStarting to parse data in Python...")
     final_result = []
@@ -172,6 +182,7 @@ def parse_inventory_from_text(raw_text):
 
     for block in store_blocks:
         lines = [line.strip() for line in block.split('\n') if line.strip()]
+        carried = block.startswith(CARRIED_BLOCK_PREFIX)
         
         if "No Data" in lines:
             continue
@@ -212,16 +223,19 @@ def parse_inventory_from_text(raw_text):
                 continue
 
             # Parse process_time string back to a datetime object
-            process_time_dt = parse_date(datetime.now(taipei_tz).isoformat())
+            process_time_dt = scraped_at or parse_date(datetime.now(taipei_tz).isoformat())
 
-            final_result.append({
+            item = {
                 'store': store_name,
                 'machine_id': machine_id,
                 'product_name': product_name,
                 'quantity': int(quantity_str),
                 'last_updated': last_updated,
                 'process_time': process_time_dt
-            })
+            }
+            if carried:
+                item['carried'] = True
+            final_result.append(item)
 
     if not final_result:
         logging.warning("Warning: Failed to parse any product items from the raw data.")
@@ -231,14 +245,112 @@ def parse_inventory_from_text(raw_text):
     return final_result
 
 
+INVENTORY_KEY_COLUMNS = ('store', 'machine_id', 'product_name')
+SYNC_CHUNK_SIZE = 500
+
+
+def _chunks(items, size=SYNC_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_inventory(db: Session, data: list):
+    """
+    Brings the inventory table in line with `data` without clearing it first.
+    Rows are matched on (store, machine_id, product_name):
+      - new keys are inserted and changed quantity/last_updated are updated, via INSERT ... ON CONFLICT
+      - unchanged rows are not written at all
+      - keys missing from `data` are deleted
+    The sync time is recorded once, as an InventorySync row, instead of on every row, and
+    machines read in this sync (rows not marked 'carried') get their MachineScrape time.
+    Runs inside the caller's transaction (the caller commits). Returns the counts per action.
+    """
+    incoming, scraped = {}, {}
+    for item in data:
+        key = tuple(str(item[column]).strip() for column in INVENTORY_KEY_COLUMNS)
+        if not item.get('carried'):
+            scraped[key[:2]] = {'store': key[0], 'machine_id': key[1], 'scraped_at': item['process_time']}
+        incoming[key] = {
+            'store': key[0],
+            'machine_id': key[1],
+            'product_name': key[2],
+            'quantity': int(item['quantity']),
+            'last_updated': item.get('last_updated'),
+            'process_time': item['process_time']
+        }
+
+    existing = {
+        (row.store, row.machine_id, row.product_name): row
+        for row in db.query(Inventory.id, Inventory.store, Inventory.machine_id, Inventory.product_name,
+                            Inventory.quantity, Inventory.last_updated)
+    }
+
+    upserts = []
+    inserted = unchanged = 0
+    for key, item in incoming.items():
+        row = existing.get(key)
+        if row is None:
+            inserted += 1
+            upserts.append(item)
+        elif row.quantity != item['quantity'] or row.last_updated != item['last_updated']:
+            upserts.append(item)
+        else:
+            unchanged += 1
+    deleted_ids = [row.id for key, row in existing.items() if key not in incoming]
+    counts = {
+        'inserted': inserted,
+        'updated': len(upserts) - inserted,
+        'unchanged': unchanged,
+        'deleted': len(deleted_ids)
+    }
+
+    if upserts:
+        insert = dialect_insert(db, Inventory)
+        for chunk in _chunks(upserts):
+            stmt = insert.values(chunk)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=list(INVENTORY_KEY_COLUMNS),
+                set_={
+                    'quantity': stmt.excluded.quantity,
+                    'last_updated': stmt.excluded.last_updated,
+                    'process_time': stmt.excluded.process_time
+                }
+            ))
+
+    for chunk in _chunks(deleted_ids):
+        db.query(Inventory).filter(Inventory.id.in_(chunk)).delete(synchronize_session=False)
+
+    if scraped:
+        insert = dialect_insert(db, MachineScrape)
+        for chunk in _chunks(list(scraped.values())):
+            stmt = insert.values(chunk)
+            db.execute(stmt.on_conflict_do_update(index_elements=['store', 'machine_id'],
+                                                  set_={'scraped_at': stmt.excluded.scraped_at}))
+    machines = {key[:2] for key in incoming}
+    gone = [key for key in db.query(MachineScrape.store, MachineScrape.machine_id) if tuple(key) not in machines]
+    for store, machine_id in gone:
+        db.query(MachineScrape).filter_by(store=store, machine_id=machine_id).delete(synchronize_session=False)
+
+    db.add(InventorySync(synced_at=max(item['process_time'] for item in incoming.values()), **counts))
+    # Every sync moves the processTime /get-data serves, so cached responses are always stale now
+    bump_data_version(db, 'inventory')
+    return counts
+
+
+def describe_sync_counts(counts):
+    return (f"inserted {counts['inserted']}, updated {counts['updated']}, "
+            f"unchanged {counts['unchanged']}, deleted {counts['deleted']}")
+
+
 def save_to_database(data: list):
     """
     Saves the structured data to the database using SQLAlchemy, with a retry mechanism
-    for transient network errors.
+    for transient network errors. Only changed rows are written (see sync_inventory).
+    Returns the counts per action, or None if there was nothing to save.
     """
     if not data:
         logging.info("No data to save to database.")
-        return
+        return None
 
     max_retries = 3
     retry_delay_seconds = 5
@@ -248,15 +360,11 @@ def save_to_database(data: list):
         try:
             db.begin()
 
-            num_deleted = db.query(Inventory).delete()
-            logging.info(f"Cleared {num_deleted} old records from the inventory table.")
-
-            inventory_objects = [Inventory(**item) for item in data]
-            db.bulk_save_objects(inventory_objects)
+            counts = sync_inventory(db, data)
 
             db.commit()
-            logging.info(f"Successfully saved {len(inventory_objects)} new records to the database.")
-            return  # Success, exit the function
+            logging.info(f"Inventory synced: {describe_sync_counts(counts)}.")
+            return counts  # Success, exit the function
 
         except OperationalError as e:
             db.rollback()
@@ -289,20 +397,169 @@ def save_to_json(data, filename):
         logging.error(f"Error saving data to {filename}: {e}", exc_info=True)
 
 
-def run_scraper(headless=True):
+# --- Store list selectors shared by the single-driver and sharded paths ---
+STORE_MANAGEMENT_XPATH = "//li[.//span[contains(text(), 'Store management')]]"
+STORE_ROWS_XPATH = "//div[contains(@class, 'el-table__body-wrapper')]//tr"
+INQUIRY_BUTTON_XPATH = "//button[.//span[contains(text(), 'Inventory inquiry')]]"
+INVENTORY_CONTAINER_XPATH = "//div[@data-v-d0a9a5c0 and @class='container']"
+CLOSE_TAB_XPATH = "//li[contains(@class, 'tags-li') and contains(@class, 'active')]//i[contains(@class, 'el-icon-close')]"
+PAGER_NUMBERS_XPATH = "//ul[contains(@class, 'el-pager')]//li[contains(@class, 'number')]"
+
+
+def get_scraper_workers():
     """
-    啟動爬蟲的主函數。
-    :param headless: 是否以無頭模式運行瀏覽器。
+    讀取分片爬蟲的 worker 數量 (SCRAPER_WORKERS)。
+    1 (預設) 代表使用原本的單一瀏覽器流程。
     """
-    logging.info("正在啟動爬蟲...")
-    
     try:
-        username, password = get_credentials()
-    except ValueError as e:
-        logging.error(e, file=sys.stderr)
-        sys.exit(1) # 終止腳本
+        workers = int(os.getenv("SCRAPER_WORKERS", "1"))
+    except ValueError:
+        logging.warning("SCRAPER_WORKERS is not a valid integer, falling back to 1.")
+        workers = 1
+    return max(1, workers)
+
+
+# --- Incremental mode ---
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?')
+# Metrics of the most recent run_scraper() call, shown in the UpdateLog details.
+LAST_RUN_STATS = {}
+_last_full_refresh_at = None
+
+
+def get_incremental_settings():
+    """
+    SCRAPER_INCREMENTAL=1 只進入可能有變動的機台 (預設 0 = 每次全部重抓)。
+    INVENTORY_FULL_REFRESH_HOURS: 增量模式下強制全部重抓的間隔 (預設 6 小時)。
+    """
+    enabled = os.getenv("SCRAPER_INCREMENTAL", "0") == "1"
+    try:
+        full_refresh_hours = float(os.getenv("INVENTORY_FULL_REFRESH_HOURS", "6"))
+    except ValueError:
+        logging.warning("INVENTORY_FULL_REFRESH_HOURS is not a valid number, falling back to 6.")
+        full_refresh_hours = 6.0
+    return enabled, full_refresh_hours
+
+
+def _to_taipei_naive(dt):
+    """Timestamps come back aware from Postgres and naive (Taipei wall clock) from SQLite."""
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.timezone('Asia/Taipei')).replace(tzinfo=None)
+    return dt
+
+
+class IncrementalPlan:
+    """
+    Decides per store list row whether the 'Inventory inquiry' tab has to be opened.
+    A machine is skipped only when it is already in the Inventory table, the store list
+    shows the same last replenishment time we stored, and its store had no sales since
+    the machine was last actually read (MachineScrape; carrying it forward does not count).
+    Skipped machines are carried forward from the database.
+    """
+
+    def __init__(self, known_machines, last_sale_by_store):
+        self.known = known_machines
+        self._machine_ids = {}
+        for store, machine_id in known_machines:
+            self._machine_ids.setdefault(store, []).append(machine_id)
+        self.last_sale_by_store = last_sale_by_store
+        self.carried = {}
+        self.stats = {'visited': 0, 'skipped': 0, 'new': 0, 'replenished': 0, 'sold': 0, 'no_timestamp': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_database(cls):
+        db: Session = SessionLocal()
+        try:
+            scraped_at = {(row.store, row.machine_id): _to_taipei_naive(row.scraped_at)
+                          for row in db.query(MachineScrape)}
+            known = {}
+            for item in db.query(Inventory).all():
+                machine = known.setdefault((item.store, item.machine_id), {
+                    'last_updated': item.last_updated,
+                    'scraped_at': scraped_at.get((item.store, item.machine_id)),
+                    'rows': []
+                })
+                machine['rows'].append((item.product_name, item.quantity))
+            # Sales are matched to a store by shop name only, so any sale for the store name counts
+            last_sale_by_store = {}
+            for store_key, last_sale in db.query(Transaction.store_key, func.max(Transaction.transaction_time)).group_by(Transaction.store_key):
+                name = store_key.rsplit('-', 1)[0]
+                if last_sale and (name not in last_sale_by_store or last_sale > last_sale_by_store[name]):
+                    last_sale_by_store[name] = last_sale
+            return cls(known, last_sale_by_store)
+        finally:
+            db.close()
 
-    # --- Modern Selenium Setup ---
+    def _match(self, cells):
+        """The known (store, machine_id) whose store name and machine id are both cells of the row."""
+        values = [cell.strip() for cell in cells]
+        for position, store in enumerate(values):
+            others = values[:position] + values[position + 1:]
+            machine_ids = [machine_id for machine_id in self._machine_ids.get(store, ()) if machine_id in others]
+            if machine_ids:
+                return store, min(machine_ids, key=others.index)
+        return None
+
+    def should_scrape(self, cells):
+        """
+        Returns True if the row, given as its cells' texts, must be drilled into;
+        otherwise carries the machine forward.
+        """
+        key = self._match(cells)
+        row_text = " ".join(cells)
+        reason = None
+        if key is None:
+            reason = 'new'
+        else:
+            machine = self.known[key]
+            shown = TIMESTAMP_PATTERN.search(row_text)
+            stored = TIMESTAMP_PATTERN.search(machine['last_updated'] or '')
+            last_sale = self.last_sale_by_store.get(key[0])
+            if not shown:
+                reason = 'no_timestamp'
+            elif not stored or shown.group(0).replace('T', ' ') != stored.group(0).replace('T', ' '):
+                reason = 'replenished'
+            elif last_sale and (machine['scraped_at'] is None or last_sale > machine['scraped_at']):
+                reason = 'sold'
+
+        with self._lock:
+            if reason:
+                self.stats['visited'] += 1
+                self.stats[reason] += 1
+                return True
+            self.stats['skipped'] += 1
+            self.carried[key] = self.known[key]
+        logging.info(f"  > Unchanged since last scrape, carrying forward {key[0]} / {key[1]}.")
+        return False
+
+    def carry_forward_text(self):
+        """Raw text blocks for skipped machines, in the format parse_inventory_from_text reads."""
+        blocks = []
+        for index, ((store, machine_id), machine) in enumerate(sorted(self.carried.items()), start=1):
+            lines = [f"--- Store #{CARRIED_BLOCK_PREFIX}{index} ---", f"上次補貨時間 : {machine['last_updated']}",
+                     "Store name Machine name Product name Inventory quantity"]
+            for product_name, quantity in machine['rows']:
+                lines.extend([store, machine_id, product_name, str(quantity)])
+            blocks.append("\n".join(lines) + f"\n{'-'*20}\n\n")
+        return "".join(blocks)
+
+
+def describe_incremental_stats():
+    """Short summary of LAST_RUN_STATS for the UpdateLog details ('' in full mode)."""
+    if not LAST_RUN_STATS.get('incremental'):
+        return ""
+    if LAST_RUN_STATS.get('full_refresh'):
+        return "Incremental scrape: forced full refresh."
+    return (f"Incremental scrape: skipped {LAST_RUN_STATS['skipped']} of "
+            f"{LAST_RUN_STATS['skipped'] + LAST_RUN_STATS['visited']} machines "
+            f"(new {LAST_RUN_STATS['new']}, replenished {LAST_RUN_STATS['replenished']}, "
+            f"sold {LAST_RUN_STATS['sold']}, no timestamp {LAST_RUN_STATS['no_timestamp']}).")
+
+
+def _build_chrome_options(headless=True):
+    """Builds the Chrome options used by every inventory scraping driver."""
     options = webdriver.ChromeOptions()
     if headless:
         # These are the crucial arguments for running Chrome in a containerized environment
@@ -311,139 +568,383 @@ def run_scraper(headless=True):
         options.add_argument("--disable-dev-shm-usage")
         options.add_argument("--disable-gpu")
         options.add_argument("window-size=1920,1080")
+    # DevTools network events let the readiness waits detect when the SPA's XHRs have finished
+    enable_performance_log(options)
+    return options
 
+
+def _create_driver(headless=True):
     # Selenium's built-in manager will handle the chromedriver
-    service = webdriver.ChromeService() 
-    driver = webdriver.Chrome(service=service, options=options)
-    
-    all_scraped_text = ""
+    service = webdriver.ChromeService()
+    return webdriver.Chrome(service=service, options=_build_chrome_options(headless))
 
-    try:
-        driver.get(URL)
-        # Increase the wait time from 30 to 30 seconds to handle slower server response times
-        wait = WebDriverWait(driver, 30)
 
-        # --- Login ---
-        logging.info("Logging in...")
-        logging.info(f"找到輸入框，正在輸入帳號: {username[:4]}****") # 出於安全，只顯示部分帳號
-        username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
-        username_field.send_keys(username)
-        password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
-        password_field.send_keys(password)
-        login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
-        login_button.click()
-        logging.info("Login successful.")
+def _login(driver, wait, username, password):
+    """Opens the manager site and submits the login form."""
+    driver.get(URL)
 
-        # --- Navigate to Inventory ---
-        logging.info("Navigating to Store Management...")
-        store_management_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[.//span[contains(text(), 'Store management')]]")))
-        store_management_link.click()
+    # --- Login ---
+    logging.info("Logging in...")
+    logging.info(f"找到輸入框，正在輸入帳號: {username[:4]}****") # 出於安全，只顯示部分帳號
+    username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
+    username_field.send_keys(username)
+    password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
+    password_field.send_keys(password)
+    login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
+    login_button.click()
+    logging.info("Login successful.")
 
-        # --- Full Inventory Scraping Logic with Pagination ---
-        page_number = 1
-        total_stores_processed = 0
 
-        # --- Retry logic for initial page load ---
-        page_load_retries = 3
-        for attempt in range(page_load_retries):
-            try:
-                logging.info(f"Attempting to load store list (Attempt {attempt + 1}/{page_load_retries})...")
-                rows_xpath = "//div[contains(@class, 'el-table__body-wrapper')]//tr"
-                # Wait for the first row to be present.
-                wait.until(EC.presence_of_element_located((By.XPATH, rows_xpath)))
-                # Also check for the inquiry buttons as a secondary confirmation.
-                wait.until(EC.presence_of_element_located((By.XPATH, "//button[.//span[contains(text(), 'Inventory inquiry')]]")))
-                logging.info("Store list loaded successfully.")
-                break  # If successful, exit the retry loop.
-            except Exception as e:
-                logging.warning(f"Store list failed to load on attempt {attempt + 1}: {e}")
-                if attempt + 1 < page_load_retries:
-                    logging.info("Refreshing page and retrying...")
-                    driver.refresh()
-                    time.sleep(2) # Wait a moment after refresh
-                    # After refresh, we need to re-navigate.
-                    store_management_link = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[.//span[contains(text(), 'Store management')]]")))
-                    store_management_link.click()
-                else:
-                    logging.error("Failed to load store list after multiple retries. Aborting.")
-                    raise # Re-raise the last exception to be caught by the main handler
+def _open_store_list(driver, wait, timer=None):
+    """
+    Opens Store management on a logged-in session, retrying the initial store list load.
+    """
+    # --- Navigate to Inventory ---
+    logging.info("Navigating to Store Management...")
+    store_management_link = wait.until(EC.element_to_be_clickable((By.XPATH, STORE_MANAGEMENT_XPATH)))
+    store_management_link.click()
+    wait_for_page_ready(driver, timer, 'open_store_list', rows_xpath=STORE_ROWS_XPATH)
+
+    # --- Retry logic for initial page load ---
+    page_load_retries = 3
+    for attempt in range(page_load_retries):
+        try:
+            logging.info(f"Attempting to load store list (Attempt {attempt + 1}/{page_load_retries})...")
+            # Wait for the first row to be present.
+            wait.until(EC.presence_of_element_located((By.XPATH, STORE_ROWS_XPATH)))
+            # Also check for the inquiry buttons as a secondary confirmation.
+            wait.until(EC.presence_of_element_located((By.XPATH, INQUIRY_BUTTON_XPATH)))
+            logging.info("Store list loaded successfully.")
+            break  # If successful, exit the retry loop.
+        except Exception as e:
+            logging.warning(f"Store list failed to load on attempt {attempt + 1}: {e}")
+            if attempt + 1 < page_load_retries:
+                logging.info("Refreshing page and retrying...")
+                driver.refresh()
+                wait_for_page_ready(driver, timer, 'refresh')
+                # After refresh, we need to re-navigate.
+                store_management_link = wait.until(EC.element_to_be_clickable((By.XPATH, STORE_MANAGEMENT_XPATH)))
+                store_management_link.click()
+                wait_for_page_ready(driver, timer, 'open_store_list', rows_xpath=STORE_ROWS_XPATH)
+            else:
+                logging.error("Failed to load store list after multiple retries. Aborting.")
+                raise # Re-raise the last exception to be caught by the main handler
 
-        while True:
-            logging.info(f"--- Preparing to process Page {page_number} ---")
-            rows_xpath = "//div[contains(@class, 'el-table__body-wrapper')]//tr"
-            wait.until(EC.presence_of_all_elements_located((By.XPATH, rows_xpath)))
 
-            num_rows_on_page = len(driver.find_elements(By.XPATH, rows_xpath))
-            if num_rows_on_page == 0:
-                logging.info("No stores found on the page, assuming end of scraping.")
-                break
-            logging.info(f"Found {num_rows_on_page} stores on page {page_number}.")
+def _login_and_open_store_list(driver, wait, username, password, timer=None):
+    _login(driver, wait, username, password)
+    _open_store_list(driver, wait, timer)
+
+
+def _get_store_page_count(driver):
+    """Reads the highest page number shown in the store list pager (1 if there is no pager)."""
+    numbers = []
+    for li in driver.find_elements(By.XPATH, PAGER_NUMBERS_XPATH):
+        text = li.text.strip()
+        if text.isdigit():
+            numbers.append(int(text))
+    return max(numbers) if numbers else 1
+
+
+def _go_to_store_page(driver, wait, page_number, timer=None):
+    """
+    Moves the store list to `page_number`.
+    Element's pager only renders a window of page numbers, so when the target
+    is not visible yet we step forward with the 'next' button until it is.
+    """
+    target_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{page_number}']"
+    for _ in range(page_number):
+        target = driver.find_elements(By.XPATH, target_xpath)
+        if target:
+            wait.until(EC.element_to_be_clickable((By.XPATH, target_xpath))).click()
+            wait_for_page_ready(driver, timer, 'store_list_page', rows_xpath=STORE_ROWS_XPATH, page_number=page_number)
+            return
+        next_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(@class, 'btn-next')]")))
+        next_button.click()
+        wait_for_page_ready(driver, timer, 'store_list_page', rows_xpath=STORE_ROWS_XPATH)
+    raise Exception(f"Could not navigate to store list page {page_number}.")
+
+
+def _scrape_store_row(driver, wait, row_index, store_label, timer=None):
+    """
+    Opens the 'Inventory inquiry' tab for one row of the current store list page,
+    collects every inventory sub-page and closes the tab again.
+    Returns the raw text blocks for this store ('' if the row button was not found).
+    """
+    inquiry_buttons = wait.until(EC.presence_of_all_elements_located((By.XPATH, INQUIRY_BUTTON_XPATH)))
+    if row_index < len(inquiry_buttons):
+        driver.execute_script("arguments[0].click();", inquiry_buttons[row_index])
+        wait_for_page_ready(driver, timer, 'open_inventory_tab')
+    else:
+        logging.error(f"  > Error: Could not find button for row {row_index+1}. Skipping.")
+        return ""
+
+    # 收集所有頁面的庫存資料
+    store_text = ""
+    inventory_page = 1
+
+    while True:
+        # 等待並取得目前頁面的庫存資料
+        inventory_container = wait.until(EC.visibility_of_element_located((By.XPATH, INVENTORY_CONTAINER_XPATH)))
+        current_page_text = inventory_container.text
+
+        # 為每一頁創建單獨的記錄
+        store_text += f"--- Store #{store_label} Page {inventory_page} ---\n{current_page_text}\n{'-'*20}\n\n"
+        logging.info(f"  > 已抓取庫存查詢第 {inventory_page} 頁資料")
+
+        # 檢查是否有下一頁按鈕
+        next_page_elements = driver.find_elements(By.XPATH, f"//ul[contains(@class, 'el-pager')]//li[text()='{inventory_page + 1}']")
+
+        if not next_page_elements:
+            logging.info("  > 無更多庫存頁面")
+            break
+
+        # 點擊下一頁
+        next_page_button = next_page_elements[0]
+        driver.execute_script("arguments[0].click();", next_page_button)
+        inventory_page += 1
+        wait_for_page_ready(driver, timer, 'inventory_page', page_number=inventory_page)  # 等待頁面加載
+    logging.info(f"  > 完成抓取所有庫存資料，共 {inventory_page} 頁")
+
+    close_button = wait.until(EC.element_to_be_clickable((By.XPATH, CLOSE_TAB_XPATH)))
+    close_button.click()
+    logging.info("  > Closed inventory tab.")
+    wait.until(EC.presence_of_element_located((By.XPATH, STORE_ROWS_XPATH)))
+    wait_for_page_ready(driver, timer, 'close_inventory_tab', rows_xpath=STORE_ROWS_XPATH)
+    return store_text
+
+
+def _scrape_all_pages(driver, wait, timer=None, plan=None):
+    """
+    The original single-driver walk: every row of every store list page, in order.
+    With an IncrementalPlan, rows it marks as unchanged are not opened.
+    """
+    all_scraped_text = ""
+    page_number = 1
+    total_stores_processed = 0
+
+    while True:
+        logging.info(f"--- Preparing to process Page {page_number} ---")
+        wait.until(EC.presence_of_all_elements_located((By.XPATH, STORE_ROWS_XPATH)))
+
+        num_rows_on_page = len(driver.find_elements(By.XPATH, STORE_ROWS_XPATH))
+        if num_rows_on_page == 0:
+            logging.info("No stores found on the page, assuming end of scraping.")
+            break
+        logging.info(f"Found {num_rows_on_page} stores on page {page_number}.")
+
+        for i in range(num_rows_on_page):
+            total_stores_processed += 1
+            logging.info(f"Processing store #{total_stores_processed} (Page {page_number}, Row {i+1})...")
+            if plan is not None and not plan.should_scrape(_store_row_cells(driver, i)):
+                continue
+            all_scraped_text += _scrape_store_row(driver, wait, i, total_stores_processed, timer)
+
+            if page_number > 1:
+                logging.info(f"  > Navigating back to page {page_number}...")
+                target_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{page_number}']"
+                target_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, target_page_button_xpath)))
+                target_page_button.click()
+                wait_for_page_ready(driver, timer, 'return_to_page', rows_xpath=STORE_ROWS_XPATH, page_number=page_number)
+                logging.info(f"  > Returned to page {page_number}.")
 
+        # --- Go to next page ---
+        try:
+            next_page_to_click = page_number + 1
+            logging.info(f"\nFinished page {page_number}. Attempting to move to page {next_page_to_click}...")
+            next_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{next_page_to_click}']"
+            next_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, next_page_button_xpath)))
+            next_page_button.click()
+            wait_for_page_ready(driver, timer, 'store_list_page', rows_xpath=STORE_ROWS_XPATH, page_number=next_page_to_click)
+            page_number += 1
+        except Exception:
+            logging.info(f"\nCould not find button for page {next_page_to_click}. Assuming it's the last page.")
+            break
+
+    logging.info(f"\nScraping complete. Processed {total_stores_processed} stores in total.")
+    return all_scraped_text
+
+
+def _store_row_cells(driver, row_index):
+    rows = driver.find_elements(By.XPATH, STORE_ROWS_XPATH)
+    return [cell.text for cell in rows[row_index].find_elements(By.TAG_NAME, 'td')] if row_index < len(rows) else []
+
+
+def _split_pages(total_pages, workers):
+    """Splits pages 1..total_pages into at most `workers` contiguous, non-empty ranges."""
+    workers = max(1, min(workers, total_pages))
+    base, extra = divmod(total_pages, workers)
+    shards = []
+    start = 1
+    for shard_index in range(workers):
+        size = base + (1 if shard_index < extra else 0)
+        shards.append(list(range(start, start + size)))
+        start += size
+    return shards
+
+
+def _scrape_shard(shard_index, pages, headless, username, password, driver=None, plan=None):
+    """
+    Scrapes a contiguous range of store list pages with its own logged-in browser.
+    Returns {page_number: raw_text} so the coordinator can merge shards in page order.
+    When `driver` is given it must already be logged in and showing the store list.
+    """
+    started = time.monotonic()
+    timer = StepTimer(f"shard {shard_index}")
+    owns_driver = driver is None
+    results = {}
+    stores_processed = 0
+    try:
+        if owns_driver:
+            driver = _create_driver(headless)
+            wait = WebDriverWait(driver, 30)
+            _login_and_open_store_list(driver, wait, username, password, timer)
+        else:
+            wait = WebDriverWait(driver, 30)
+
+        for page_number in pages:
+            if page_number > 1:
+                _go_to_store_page(driver, wait, page_number, timer)
+            wait.until(EC.presence_of_all_elements_located((By.XPATH, STORE_ROWS_XPATH)))
+            num_rows_on_page = len(driver.find_elements(By.XPATH, STORE_ROWS_XPATH))
+            logging.info(f"[shard {shard_index}] Found {num_rows_on_page} stores on page {page_number}.")
+
+            page_text = ""
             for i in range(num_rows_on_page):
-                total_stores_processed += 1
-                logging.info(f"Processing store #{total_stores_processed} (Page {page_number}, Row {i+1})...")
-                
-                inquiry_buttons = wait.until(EC.presence_of_all_elements_located((By.XPATH, "//button[.//span[contains(text(), 'Inventory inquiry')]]")))
-                if i < len(inquiry_buttons):
-                    driver.execute_script("arguments[0].click();", inquiry_buttons[i])
-                else:
-                    logging.error(f"  > Error: Could not find button for row {i+1}. Skipping.")
+                logging.info(f"[shard {shard_index}] Processing store (Page {page_number}, Row {i+1})...")
+                if plan is not None and not plan.should_scrape(_store_row_cells(driver, i)):
                     continue
+                page_text += _scrape_store_row(driver, wait, i, f"{page_number}.{i+1}", timer)
+                stores_processed += 1
+                # Closing the inventory tab resets the list to page 1
+                if page_number > 1:
+                    _go_to_store_page(driver, wait, page_number, timer)
+            results[page_number] = page_text
+    finally:
+        if owns_driver and driver is not None:
+            driver.quit()
+        elapsed = time.monotonic() - started
+        logging.info(
+            f"[shard {shard_index}] pages {pages[0]}-{pages[-1]}: "
+            f"{stores_processed} stores in {elapsed:.1f}s"
+        )
+        logging.info(timer.report())
+    return results
+
+
+def _scrape_sharded(driver, wait, headless, username, password, workers, plan=None):
+    """
+    Splits the store list pages across `workers` browsers.
+    `driver` is the coordinator that already logged in; it is reused as shard 0.
+    Returns None when there is only one page so the caller keeps the single-driver path.
+    """
+    total_pages = _get_store_page_count(driver)
+    if total_pages <= 1:
+        logging.info("Store list has a single page; sharding is not needed.")
+        return None
 
-                # 收集所有頁面的庫存資料
-                all_inventory_text = ""
-                inventory_page = 1
-                
-                while True:
-                    # 等待並取得目前頁面的庫存資料
-                    inventory_container = wait.until(EC.visibility_of_element_located((By.XPATH, "//div[@data-v-d0a9a5c0 and @class='container']")))
-                    current_page_text = inventory_container.text
-
-                    # 為每一頁創建單獨的記錄
-                    all_scraped_text += f"--- Store #{total_stores_processed} Page {inventory_page} ---\n{current_page_text}\n{'-'*20}\n\n"
-                    logging.info(f"  > 已抓取庫存查詢第 {inventory_page} 頁資料")
-                    
-                    # 檢查是否有下一頁按鈕
-                    next_page_elements = driver.find_elements(By.XPATH, f"//ul[contains(@class, 'el-pager')]//li[text()='{inventory_page + 1}']")
-                    
-                    if not next_page_elements:
-                        logging.info("  > 無更多庫存頁面")
-                        break
-                        
-                    # 點擊下一頁
-                    next_page_button = next_page_elements[0]
-                    driver.execute_script("arguments[0].click();", next_page_button)
-                    time.sleep(1)  # 等待頁面加載
-                    inventory_page += 1
-                logging.info(f"  > 完成抓取所有庫存資料，共 {inventory_page} 頁")
+    shards = _split_pages(total_pages, workers)
+    logging.info(f"Sharding {total_pages} store list pages across {len(shards)} workers: "
+                 + ", ".join(f"{s[0]}-{s[-1]}" for s in shards))
 
-                close_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//li[contains(@class, 'tags-li') and contains(@class, 'active')]//i[contains(@class, 'el-icon-close')]")))
-                close_button.click()
-                logging.info("  > Closed inventory tab.")
-                wait.until(EC.presence_of_element_located((By.XPATH, rows_xpath)))
+    page_texts = {}
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = []
+        for shard_index, pages in enumerate(shards):
+            shard_driver = driver if shard_index == 0 else None
+            futures.append(executor.submit(_scrape_shard, shard_index, pages, headless, username, password, shard_driver, plan))
+        for future in as_completed(futures):
+            # Any failed shard propagates so run_scraper can fall back to the single-driver path
+            page_texts.update(future.result())
 
-                if page_number > 1:
-                    logging.info(f"  > Navigating back to page {page_number}...")
-                    target_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{page_number}']"
-                    target_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, target_page_button_xpath)))
-                    target_page_button.click()
-                    time.sleep(0.5)
-                    logging.info(f"  > Returned to page {page_number}.")
+    return "".join(page_texts[page] for page in sorted(page_texts))
 
-            # --- Go to next page ---
+
+def run_scraper(headless=True, workers=None, driver=None):
+    """
+    啟動爬蟲的主函數。
+    :param headless: 是否以無頭模式運行瀏覽器。
+    :param workers: 分片模式的瀏覽器數量，None 時讀取 SCRAPER_WORKERS (預設 1 = 單一瀏覽器)。
+    :param driver: 已登入的共用瀏覽器 (BrowserManager)；提供時不會重新登入也不會關閉它。
+    """
+    logging.info("正在啟動爬蟲...")
+    
+    try:
+        username, password = get_credentials()
+    except ValueError as e:
+        logging.error(e, file=sys.stderr)
+        sys.exit(1) # 終止腳本
+
+    if workers is None:
+        workers = get_scraper_workers()
+
+    global _last_full_refresh_at
+    incremental, full_refresh_hours = get_incremental_settings()
+    LAST_RUN_STATS.clear()
+    plan = None
+    if incremental:
+        full_refresh_due = (_last_full_refresh_at is None
+                            or time.monotonic() - _last_full_refresh_at >= full_refresh_hours * 3600)
+        LAST_RUN_STATS.update({'incremental': True, 'full_refresh': full_refresh_due})
+        if full_refresh_due:
+            logging.info("Incremental mode: full refresh is due, visiting every machine.")
+        else:
             try:
-                next_page_to_click = page_number + 1
-                logging.info(f"\nFinished page {page_number}. Attempting to move to page {next_page_to_click}...")
-                next_page_button_xpath = f"//ul[contains(@class, 'el-pager')]//li[text()='{next_page_to_click}']"
-                next_page_button = wait.until(EC.element_to_be_clickable((By.XPATH, next_page_button_xpath)))
-                next_page_button.click()
-                time.sleep(2)
-                page_number += 1
-            except Exception:
-                logging.info(f"\nCould not find button for page {next_page_to_click}. Assuming it's the last page.")
-                break
-        
-        logging.info(f"\nScraping complete. Processed {total_stores_processed} stores in total.")
+                plan = IncrementalPlan.from_database()
+                logging.info(f"Incremental mode: {len(plan.known)} machines known from the last scrape.")
+            except Exception as e:
+                logging.error(f"Could not load the previous inventory, doing a full scrape: {e}", exc_info=True)
+                LAST_RUN_STATS['full_refresh'] = True
+
+    owns_driver = driver is None
+    if owns_driver:
+        driver = _create_driver(headless)
+    
+    all_scraped_text = ""
+    timer = StepTimer("inventory")
+
+    try:
+        # Increase the wait time from 30 to 30 seconds to handle slower server response times
+        wait = WebDriverWait(driver, 30)
+        if owns_driver:
+            _login_and_open_store_list(driver, wait, username, password, timer)
+        else:
+            driver.get(URL)
+            _open_store_list(driver, wait, timer)
+
+        sharded_text = None
+        if workers > 1:
+            started = time.monotonic()
+            try:
+                sharded_text = _scrape_sharded(driver, wait, headless, username, password, workers, plan)
+                if sharded_text is not None:
+                    logging.info(f"Sharded scrape finished in {time.monotonic() - started:.1f}s with {workers} workers.")
+            except Exception as e:
+                logging.error(f"Sharded scrape failed, falling back to the single-driver path: {e}", exc_info=True)
+                sharded_text = None
+                if plan is not None:
+                    plan = IncrementalPlan(plan.known, plan.last_sale_by_store)
+                # The coordinator driver may be left on any page; start over from a clean state.
+                if owns_driver:
+                    driver.quit()
+                    driver = _create_driver(headless)
+                    wait = WebDriverWait(driver, 30)
+                    _login_and_open_store_list(driver, wait, username, password, timer)
+                else:
+                    driver.get(URL)
+                    _open_store_list(driver, wait, timer)
+
+        if sharded_text is not None:
+            all_scraped_text = sharded_text
+        else:
+            all_scraped_text = _scrape_all_pages(driver, wait, timer, plan)
+
+        if plan is not None:
+            all_scraped_text += plan.carry_forward_text()
+            LAST_RUN_STATS.update(plan.stats)
+            logging.info(describe_incremental_stats())
+        elif incremental and all_scraped_text:
+            _last_full_refresh_at = time.monotonic()
         
         # Replace text in the accumulated string before returning
         logging.info("\nReplacing 'Last replenishment time' with '上次補貨時間' in memory...")
@@ -456,8 +957,10 @@ def run_scraper(headless=True):
         logging.error(f"An error occurred during scraping: {e}", exc_info=True)
         return "" # Return empty string on error
     finally:
-        logging.info("Closing the browser.")
-        driver.quit()
+        logging.info(timer.report())
+        if owns_driver:
+            logging.info("Closing the browser.")
+            driver.quit()
 
 
 if __name__ == "__main__":
@@ -3,9 +3,9 @@ import os
 from datetime import datetime, timedelta
 from flask import Flask, jsonify, send_from_directory, request, redirect, render_template, session, flash
 from flask_cors import CORS
-import schedule
 import time
 import threading
+import atexit
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import OperationalError
@@ -18,18 +18,31 @@ import pandas as pd
 import shutil
 import json
 import pytz
-from openpyxl import load_workbook, Workbook
+from openpyxl import load_workbook
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-import requests
 
 
 # --- Custom Imports ---
-from database import init_db, get_db, Inventory, Store, Transaction, UpdateLog, Warehouse, User, NotificationSent, Feedback
-from scraper import run_scraper as run_inventory_scraper_function, parse_inventory_from_text, save_to_database, save_to_json
-from salesscraper import run_sales_scraper
-from warehousescraper import run_warehouse_scraper
-from vendor_astra import fetch_astra_sales, build_transactions_from_astra_rows
+from database import init_db, get_db, SessionLocal, describe_engine, Inventory, Store, Transaction, SalesDaily, UpdateLog, Warehouse, User, NotificationSent, Feedback, bump_data_version, get_data_versions, latest_inventory_sync
+from scraper import sync_inventory, describe_sync_counts
+from sales_ingest import ingest_transactions, describe_ingest_counts
+from sales_rollup import ensure_sales_daily, sales_detail_rows
+from sales_report import group_sales, write_sales_detail
+from replenishment import (load_warehouse_inventory, load_machine_inventories, load_demand,
+                           warehouse_tab_suggestions, machine_suggestions)
+from fleet_planner import plan_fleet
+from response_cache import get_cache, all_cache_stats
+from snapshot_cache import warehouse_totals, store_sales
+from user_scope import ensure_scope, scoped_inventory_query, scoped_transactions_query, visible_transaction_keys
+from pagination import CursorError, wants_page, wants_stream, page_size, keyset_page, stream_json_array
+from transaction_columns import transactions_select, columnar_json_chunks, arrow_ipc_chunks, arrow_available
+from response_layer import init_response_layer, response_stats
+from mailer import get_sendgrid_client, mail_drain_due, MAIL_QUEUE_CHECK_MINUTES
+from jobs import JobRunner, legacy_status
+from tasks import register_tasks, log_db_update, notify_low_inventory
+from browser_manager import browser_manager
+from leader import LeaderElection, LeaderSchedule
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -55,27 +68,24 @@ app = Flask(__name__,
             static_url_path='',
             template_folder=os.path.join(script_dir, 'templates')) # Point to the templates folder
 CORS(app) # 允許所有來源的跨域請求，方便本地開發
+# orjson for every JSON response, gzip/brotli compression and per-route size metrics
+init_response_layer(app)
 
 # --- Secret Key for Session Management ---
 # It's crucial this is set and kept secret in production.
 # We'll load it from an environment variable.
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key-for-local-testing")
 
-# --- Global State for Scraper ---
-# This dictionary will hold the state of our scraper job.
-# Using a lock to ensure thread-safe updates.
-scraper_state = {
-    "status": "idle", # Can be 'idle', 'running', 'success', 'error'
-    "last_run_output": ""
-}
-state_lock = threading.Lock()
-
-# --- Global State for Sales Scraper ---
-sales_scraper_state = {
-    "status": "idle", # Can be 'idle', 'running', 'success', 'error'
-    "last_run_output": ""
-}
-sales_state_lock = threading.Lock()
+# --- Background Jobs ---
+# Scraper and ingest runs are rows in the `jobs` table, executed by the job runner
+# (see jobs.py, tasks.py). Each job type has its own concurrency limit, so e.g. the
+# warehouse scraper no longer blocks the sales scraper.
+# JOB_WORKER_MODE=external leaves running them to a separate `python -m worker`
+# process; the web process then only queues jobs and reads their status. Inline, only
+# the gunicorn worker holding the scheduler lease claims jobs (see follow_scheduler_lease).
+JOB_WORKER_MODE = os.getenv('JOB_WORKER_MODE', 'inline').lower()
+job_runner = JobRunner(SessionLocal)
+register_tasks(job_runner)
 
 
 # --- Global Variables & Constants ---
@@ -89,466 +99,28 @@ sales_state_lock = threading.Lock()
 # This is crucial for the first run on a new server deployment.
 logging.info(f"Initializing database at: {script_dir}")
 init_db() # This command creates the tables in our PostgreSQL or SQLite database if they don't exist.
+_rollup_db = SessionLocal()
+try:
+    # Databases from before the sales_daily rollup get it built once here
+    ensure_sales_daily(_rollup_db)
+finally:
+    _rollup_db.close()
 logging.info("Database initialization complete.")
 
 
-def run_inventory_scraper_background():
-    """
-    This function runs the scraper in a background thread and updates the global state.
-    It now uses the new database functions.
-    It's also thread-safe, checking if another job is already running.
-    """
-    global scraper_state
-    
-    with state_lock:
-        if scraper_state['status'] == 'running':
-            logging.warning(f"[{datetime.now()}] Scraper start requested, but a job is already in progress. Aborting.")
-            return
-        
-        # Update state to 'running'
-        scraper_state['status'] = 'running'
-        scraper_state['last_run_output'] = ''
-        logging.info(f"[{datetime.now()}] Scraper status set to 'running'. Starting job.")
-
-    try:
-        # We need to call the actual scraper logic here.
-        # Since scraper.py's main execution block is complex,
-        # we directly call the necessary functions.
-        
-        # 1. Execute the web scraper to get raw text
-        raw_inventory_text = run_inventory_scraper_function(headless=True)
-        
-        if raw_inventory_text:
-            # 2. Parse the raw text into structured data
-            structured_data = parse_inventory_from_text(raw_inventory_text)
-            
-            # --- Define output paths ---
-            output_json_path = os.path.join(script_dir, 'structured_inventory.json')
-            
-            # 3. Save to JSON and Database
-            # Convert datetime objects for JSON serialization
-            json_serializable_data = []
-            for item in structured_data:
-                item_copy = item.copy()
-                if 'process_time' in item_copy and hasattr(item_copy['process_time'], 'isoformat'):
-                    item_copy['process_time'] = item_copy['process_time'].isoformat()
-                json_serializable_data.append(item_copy)
-            
-            save_to_json(json_serializable_data, output_json_path)
-            
-            # The data is already parsed with datetime objects, so we can save it directly
-            items_saved_count = len(structured_data)
-            save_to_database(structured_data)
-
-            # After saving inventory to database, immediately run low-inventory notifications
-            # Run notifications in a non-blocking daemon thread to avoid delaying the scraper
-            try:
-                def _notify_runner():
-                    try:
-                        res = _notify_low_inventory_internal()
-                        logging.info(f"Low-inventory notification run after scraper: {res}")
-                    except Exception as e:
-                        logging.error(f"Error running notifications in background thread: {e}", exc_info=True)
-
-                t = threading.Thread(target=_notify_runner, daemon=True)
-                t.start()
-                logging.info("Started background notification thread after scraper run.")
-            except Exception as e:
-                logging.error(f"Failed to start notification thread: {e}", exc_info=True)
-
-            output = f"Scraper finished successfully. Processed {items_saved_count} items. Notifications run." 
-            status = "success"
-        else:
-            output = "Scraper ran but returned no data."
-            status = "error"
-            
-    except Exception as e:
-        output = f"An error occurred in background scraper: {str(e)}"
-        status = "error"
-        logging.error(output, exc_info=True)
-    
-    # Update state with the final result
-    with state_lock:
-        scraper_state['status'] = status
-        scraper_state['last_run_output'] = output
-        
-    # Log the update to the database with a retry mechanism
-    log_db_update(scraper_type='inventory', status=status, details=output)
-
-
-def run_sales_scraper_background():
-    """
-    Runs the sales scraper in a background thread, processes the downloaded file,
-    and updates the database with a retry mechanism.
-    """
-    global sales_scraper_state
-    
-    with sales_state_lock:
-        if sales_scraper_state['status'] == 'running':
-            logging.warning(f"[{datetime.now()}] Sales scraper start requested, but a job is already in progress. Aborting.")
-            return
-        sales_scraper_state['status'] = 'running'
-        sales_scraper_state['last_run_output'] = ''
-        logging.info(f"[{datetime.now()}] Sales scraper status set to 'running'. Starting job.")
-
-    downloaded_file_path = None
-    try:
-        # 1. Run the scraper to download the file
-        # We explicitly set headless=True to ensure it runs without a GUI on the server.
-        downloaded_file_path = run_sales_scraper(headless=True)
-        
-        # 2. Process the downloaded Excel file
-        if downloaded_file_path:
-            df = pd.read_excel(downloaded_file_path)
-            df.rename(columns={
-                'Shop name': 'shopName',
-                'Product': 'product',
-                'Trasaction Date': 'date',
-                'Total Transaction Amount': 'amount',
-                'Pay type': 'payType'
-            }, inplace=True)
-            transactions_data = df.to_dict('records')
-            
-            # 3. Add transactions to the DB with retry logic
-            max_retries = 3
-            retry_delay_seconds = 5
-            for attempt in range(max_retries):
-                db: Session = next(get_db())
-                try:
-                    # This block is a simplified version of the logic in add_transactions endpoint
-                    db.query(Transaction).delete()
-                    
-                    all_stores = db.query(Store).all()
-                    store_name_map = {}
-                    for s in all_stores:
-                        name_parts = s.store_key.rsplit('-', 1)
-                        name = name_parts[0]
-                        if name not in store_name_map:
-                            store_name_map[name] = s
-
-                    new_transactions = []
-                    for item in transactions_data:
-                        shop_name_raw = item.get('shopName')
-                        if not shop_name_raw or pd.isna(item.get('date')):
-                            continue
-                        
-                        shop_name = str(shop_name_raw).strip()
-                        store = store_name_map.get(shop_name)
-                        
-                        if not store:
-                            new_store_key = f"{shop_name}-provisional_sales"
-                            store = db.query(Store).filter(Store.store_key == new_store_key).first()
-                            if not store:
-                                store = Store(store_key=new_store_key)
-                                db.add(store)
-                                db.flush()
-                            store_name_map[shop_name] = store
-
-                        new_transactions.append(Transaction(
-                            store_key=store.store_key,
-                            transaction_time=pd.to_datetime(item.get('date')),
-                            amount=int(float(item.get('amount', 0))),
-                            product_name=str(item.get('product')),
-                            payment_type=str(item.get('payType'))
-                        ))
-
-                    if new_transactions:
-                        db.bulk_save_objects(new_transactions)
-                    
-                    db.commit()
-                    processed_count = len(new_transactions)
-                    output = f"Sales scraper finished successfully. Processed {processed_count} transactions."
-                    status = "success"
-                    logging.info(f"Database operation successful on attempt {attempt + 1}.")
-                    db.close()
-                    break # Exit retry loop on success
-                except OperationalError as e:
-                    db.rollback()
-                    db.close()
-                    logging.error(f"Sales DB error (Attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt + 1 >= max_retries:
-                        output = f"Sales scraper failed after {max_retries} attempts: {e}"
-                        status = "error"
-                        raise
-                    logging.info(f"Retrying in {retry_delay_seconds} seconds...")
-                    time.sleep(retry_delay_seconds)
-                finally:
-                    # Ensure db is closed if it's still open
-                    if 'db' in locals() and db.is_active:
-                         db.close()
-        else:
-            output = "Sales scraper ran but did not return a file path."
-            status = "error"
-            
-    except Exception as e:
-        output = f"An error occurred in background sales scraper: {str(e)}"
-        status = "error"
-        logging.error(output, exc_info=True)
-    finally:
-        # 4. Clean up downloaded file and temp directory
-        if downloaded_file_path:
-            download_dir = os.path.dirname(downloaded_file_path)
-            try:
-                shutil.rmtree(download_dir)
-                logging.info(f"Successfully cleaned up temporary directory: {download_dir}")
-            except OSError as e:
-                logging.error(f"Error removing directory {download_dir}: {e.strerror}")
-                
-        with sales_state_lock:
-            sales_scraper_state['status'] = status
-            sales_scraper_state['last_run_output'] = output
-            
-        # Log the update to the database with a retry mechanism
-        log_db_update(scraper_type='sales', status=status, details=output)
-
-
-def log_db_update(scraper_type, status, details):
-    """Logs an update record to the database with a retry mechanism."""
-    max_retries = 3
-    retry_delay = 5
-    for attempt in range(max_retries):
-        db_log: Session = next(get_db())
-        try:
-            log_entry = UpdateLog(scraper_type=scraper_type, status=status, details=details)
-            db_log.add(log_entry)
-            db_log.commit()
-            logging.info(f"Successfully logged '{status}' for '{scraper_type}' scraper.")
-            return
-        except OperationalError as e:
-            db_log.rollback()
-            logging.error(f"Failed to write to update_logs (Attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt + 1 >= max_retries:
-                logging.error(f"Giving up on logging after {max_retries} attempts.")
-            else:
-                logging.info(f"Retrying log write in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-        except Exception as e:
-            db_log.rollback()
-            logging.error(f"An unexpected error occurred while writing to update_logs: {e}", exc_info=True)
-            return # Don't retry on unexpected errors
-        finally:
-            db_log.close()
-
-
-# --- Warehouse Scraper Background Function ---
-def run_warehouse_scraper_background():
-    """
-    在背景執行倉庫爬蟲，處理下載的檔案並更新資料庫。
-    """
-    global sales_scraper_state
-    
-    with sales_state_lock:
-        if sales_scraper_state['status'] == 'running':
-            logging.warning(f"[{datetime.now()}] Warehouse scraper start requested, but a job is already in progress. Aborting.")
-            return
-        sales_scraper_state['status'] = 'running'
-        sales_scraper_state['last_run_output'] = ''
-        logging.info(f"[{datetime.now()}] Warehouse scraper status set to 'running'. Starting job.")
-
-    downloaded_file_path = None
-    try:
-        # 1. 執行爬蟲下載檔案
-        downloaded_file_path = run_warehouse_scraper(headless=True)
-        
-        # 2. 處理下載的 Excel 檔案
-        if downloaded_file_path:
-            df = pd.read_excel(downloaded_file_path)
-            
-            # 確保必要的欄位存在
-            required_columns = ['Warehouse name', 'Product name', 'Remain quantity']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"Excel 檔案缺少必要欄位: {', '.join(missing_columns)}")
-            
-            # 更新資料庫
-            max_retries = 3
-            retry_delay_seconds = 5
-            
-            for attempt in range(max_retries):
-                db: Session = next(get_db())
-                try:
-                    # 記錄當前時間作為更新時間
-                    update_time = datetime.now()
-                    
-                    # 將資料轉換為資料庫記錄
-                    warehouse_records = []
-                    for _, row in df.iterrows():
-                        warehouse_records.append(Warehouse(
-                            warehouse_name=row['Warehouse name'],
-                            product_name=row['Product name'],
-                            quantity=int(row['Remain quantity']),
-                            updated_at=update_time
-                        ))
-                    
-                    # 刪除舊的倉庫資料
-                    db.query(Warehouse).delete()
-                    
-                    # 新增新的倉庫資料
-                    db.bulk_save_objects(warehouse_records)
-                    db.commit()
-                    
-                    output = f"成功更新倉庫資料。處理了 {len(warehouse_records)} 筆記錄。"
-                    status = "success"
-                    break
-                    
-                except OperationalError as e:
-                    db.rollback()
-                    if attempt + 1 >= max_retries:
-                        raise
-                    logging.error(f"資料庫操作失敗 (嘗試 {attempt + 1}/{max_retries}): {e}")
-                    time.sleep(retry_delay_seconds)
-                finally:
-                    db.close()
-        else:
-            output = "倉庫爬蟲執行完成但未返回檔案路徑。"
-            status = "error"
-            
-    except Exception as e:
-        output = f"倉庫爬蟲過程中發生錯誤: {str(e)}"
-        status = "error"
-        logging.error(output, exc_info=True)
-    finally:
-        # 清理下載的檔案和暫存目錄
-        if downloaded_file_path:
-            download_dir = os.path.dirname(downloaded_file_path)
-            try:
-                shutil.rmtree(download_dir)
-                logging.info(f"成功清理暫存目錄: {download_dir}")
-            except OSError as e:
-                logging.error(f"移除目錄時發生錯誤 {download_dir}: {e.strerror}")
-                
-        with sales_state_lock:
-            sales_scraper_state['status'] = status
-            sales_scraper_state['last_run_output'] = output
-            
-        # 記錄更新到資料庫
-        log_db_update(scraper_type='warehouse', status=status, details=output)
-
-
-# --- Astra Vendor Sales Background Function ---
-def run_astra_sales_background(start_date=None, end_date=None):
-    """Fetches sales from Astra API and writes transactions to DB in a background thread."""
-    global sales_scraper_state
-
-    with sales_state_lock:
-        if sales_scraper_state['status'] == 'running':
-            logging.warning(f"[{datetime.now()}] Astra sales start requested, but a job is already in progress. Aborting.")
-            return
-        sales_scraper_state['status'] = 'running'
-        sales_scraper_state['last_run_output'] = ''
-        logging.info(f"[{datetime.now()}] Astra sales status set to 'running'. Starting job.")
-
-    try:
-        # Default to last 7 days if not provided
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        if not start_date:
-            start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-
-        # Fetch rows from Astra
-        logging.info(f"Fetching Astra sales between {start_date} and {end_date}")
-        rows = fetch_astra_sales(start_date=start_date, end_date=end_date)
-        transactions_data = build_transactions_from_astra_rows(rows, store_key=os.getenv('ASTRA_STORE_KEY', 'ASTRA-provisional'))
-
-        if not transactions_data:
-            output = 'Astra API returned no rows.'
-            status = 'error'
-            logging.warning(output)
-        else:
-            # Insert transactions into DB (clear and replace similar to other flows)
-            max_retries = 3
-            retry_delay_seconds = 5
-            for attempt in range(max_retries):
-                db: Session = next(get_db())
-                try:
-                    db.query(Transaction).delete()
-
-                    all_stores = db.query(Store).all()
-                    store_name_map = {}
-                    for s in all_stores:
-                        name_parts = s.store_key.rsplit('-', 1)
-                        name = name_parts[0]
-                        if name not in store_name_map:
-                            store_name_map[name] = s
-
-                    new_transactions = []
-                    for item in transactions_data:
-                        shop_name_raw = item.get('shopName')
-                        if not shop_name_raw or not item.get('date'):
-                            continue
-
-                        shop_name = str(shop_name_raw).strip()
-                        store = store_name_map.get(shop_name)
-                        if not store:
-                            new_store_key = f"{shop_name}-provisional_sales"
-                            store = db.query(Store).filter(Store.store_key == new_store_key).first()
-                            if not store:
-                                store = Store(store_key=new_store_key)
-                                db.add(store)
-                                db.flush()
-                            store_name_map[shop_name] = store
-
-                        new_transactions.append(Transaction(
-                            store_key=store.store_key,
-                            transaction_time=pd.to_datetime(item.get('date')),
-                            amount=int(float(item.get('amount', 0))),
-                            product_name=str(item.get('product')),
-                            payment_type=str(item.get('payType'))
-                        ))
-
-                    if new_transactions:
-                        db.bulk_save_objects(new_transactions)
-
-                    db.commit()
-                    processed_count = len(new_transactions)
-                    output = f"Astra sales fetch finished successfully. Processed {processed_count} transactions."
-                    status = 'success'
-                    logging.info(output)
-                    db.close()
-                    break
-
-                except OperationalError as e:
-                    db.rollback()
-                    db.close()
-                    logging.error(f"Astra DB error (Attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt + 1 >= max_retries:
-                        output = f"Astra sales fetch failed after {max_retries} attempts: {e}"
-                        status = 'error'
-                        raise
-                    logging.info(f"Retrying in {retry_delay_seconds} seconds...")
-                    time.sleep(retry_delay_seconds)
-                finally:
-                    if 'db' in locals() and db.is_active:
-                        db.close()
-
-    except Exception as e:
-        output = f"An error occurred in Astra sales background job: {str(e)}"
-        status = 'error'
-        logging.error(output, exc_info=True)
-    finally:
-        with sales_state_lock:
-            sales_scraper_state['status'] = status
-            sales_scraper_state['last_run_output'] = output
-
-        log_db_update(scraper_type='astra_sales', status=status, details=output)
-
 # --- API Endpoints ---
 @app.route('/run-scraper', methods=['POST'])
 def trigger_scraper():
     """
-    Triggers the scraper script to run in a background thread.
+    Queues the inventory scraper job.
     Returns immediately so the client doesn't time out.
     """
-    with state_lock:
-        if scraper_state['status'] == 'running':
-            return jsonify({'success': False, 'message': 'Scraper is already running.'}), 409
-
     logging.info(f"[{datetime.now()}] Received request to run scraper in background.")
-    # Run the scraper in a separate thread
-    thread = threading.Thread(target=run_inventory_scraper_background)
-    thread.start()
-    
-    return jsonify({'success': True, 'message': 'Scraper job started in the background.'}), 202
+    job, created = job_runner.submit('inventory')
+    if not created:
+        return jsonify({'success': False, 'message': 'Scraper is already running.', 'jobId': job['id']}), 409
+
+    return jsonify({'success': True, 'message': 'Scraper job started in the background.', 'jobId': job['id']}), 202
 
 
 @app.route('/run-astra-sales', methods=['POST'])
@@ -561,14 +133,11 @@ def trigger_astra_sales():
     start_date = data.get('start_date')
     end_date = data.get('end_date')
 
-    with sales_state_lock:
-        if sales_scraper_state['status'] == 'running':
-            return jsonify({'success': False, 'message': 'Sales job is already running.'}), 409
-
     logging.info(f"Received request to fetch Astra sales: {start_date} -> {end_date}")
-    thread = threading.Thread(target=run_astra_sales_background, args=(start_date, end_date))
-    thread.start()
-    return jsonify({'success': True, 'message': 'Astra sales job started in the background.'}), 202
+    job, created = job_runner.submit('astra_sales', {'start_date': start_date, 'end_date': end_date})
+    if not created:
+        return jsonify({'success': False, 'message': 'Sales job is already running.', 'jobId': job['id']}), 409
+    return jsonify({'success': True, 'message': 'Astra sales job started in the background.', 'jobId': job['id']}), 202
 
 @app.route('/upload-inventory-file', methods=['POST'])
 def upload_inventory_file():
@@ -633,23 +202,18 @@ def upload_inventory_file():
         for attempt in range(max_retries):
             db: Session = next(get_db())
             try:
-                # 清空現有庫存數據
-                num_deleted = db.query(Inventory).delete()
-                logging.info(f"Cleared {num_deleted} old records from the inventory table.")
-                
-                # 創建新的庫存對象
-                inventory_objects = [Inventory(**item) for item in inventory_data]
-                db.bulk_save_objects(inventory_objects)
+                # 只寫入有變動的庫存資料（以 store/machine_id/product_name 比對）
+                sync_counts = sync_inventory(db, inventory_data)
                 
                 db.commit()
-                items_saved_count = len(inventory_objects)
-                logging.info(f"Successfully saved {items_saved_count} new records to the database via file upload.")
+                items_saved_count = len(inventory_data)
+                logging.info(f"Inventory synced via file upload: {describe_sync_counts(sync_counts)}.")
                 
                 # 記錄更新日誌
                 log_db_update(
                     scraper_type='inventory_upload', 
                     status='success', 
-                    details=f'File upload successful. Processed {items_saved_count} items from {file.filename}'
+                    details=f'File upload successful. Processed {items_saved_count} items from {file.filename} ({describe_sync_counts(sync_counts)})'
                 )
                 
                 db.close()
@@ -657,6 +221,7 @@ def upload_inventory_file():
                     'success': True, 
                     'message': f'成功上傳並處理 {items_saved_count} 項庫存數據',
                     'items_processed': items_saved_count,
+                    'changes': sync_counts,
                     'filename': file.filename
                 })
                 
@@ -697,31 +262,55 @@ def get_scraper_status():
     """
     Returns the current status of the scraper job.
     """
-    with state_lock:
-        return jsonify(scraper_state)
+    return jsonify(legacy_status(job_runner.latest('inventory')))
 
 @app.route('/run-sales-scraper', methods=['POST'])
 def trigger_sales_scraper():
     """
-    Triggers the sales scraper to run in a background thread.
+    Queues the sales scraper job.
     """
-    with sales_state_lock:
-        if sales_scraper_state['status'] == 'running':
-            return jsonify({'success': False, 'message': 'Sales scraper is already running.'}), 409
-
     logging.info(f"[{datetime.now()}] Received request to run sales scraper in background.")
-    thread = threading.Thread(target=run_sales_scraper_background)
-    thread.start()
-    
-    return jsonify({'success': True, 'message': 'Sales scraper job started in the background.'}), 202
+    job, created = job_runner.submit('sales')
+    if not created:
+        return jsonify({'success': False, 'message': 'Sales scraper is already running.', 'jobId': job['id']}), 409
+
+    return jsonify({'success': True, 'message': 'Sales scraper job started in the background.', 'jobId': job['id']}), 202
 
 @app.route('/sales-scraper-status', methods=['GET'])
 def get_sales_scraper_status():
     """
     Returns the current status of the sales scraper job.
     """
-    with sales_state_lock:
-        return jsonify(sales_scraper_state)
+    return jsonify(legacy_status(job_runner.latest('sales')))
+
+
+@app.route('/run-forecast', methods=['POST'])
+def trigger_forecast():
+    """
+    Queues the demand forecast training (also runs daily after the sales import).
+    """
+    logging.info(f"[{datetime.now()}] Received request to train demand forecasts in background.")
+    job, created = job_runner.submit('forecast')
+    if not created:
+        return jsonify({'success': False, 'message': 'Forecast training is already running.', 'jobId': job['id']}), 409
+
+    return jsonify({'success': True, 'message': 'Forecast training job started in the background.', 'jobId': job['id']}), 202
+
+@app.route('/forecast-status', methods=['GET'])
+def get_forecast_status():
+    """
+    Returns the current status of the demand forecast job.
+    """
+    return jsonify(legacy_status(job_runner.latest('forecast')))
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Returns status, progress, output and duration of any background job."""
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found.'}), 404
+    return jsonify({'success': True, 'job': job})
 
 def to_camel_case(snake_str):
     """
@@ -733,48 +322,82 @@ def to_camel_case(snake_str):
     # and join them together.
     return components[0] + ''.join(x.title() for x in components[1:])
 
+# /get-data only changes when one of these data sets is written
+GET_DATA_VERSIONS = ('inventory', 'stores', 'users')
+get_data_cache = get_cache('get-data')
+
+
+def merged_inventory_item(item, store_info_map, synced_at=None):
+    """
+    An inventory row merged with its machine's custom store data, with camelCase keys.
+    Unchanged rows keep the process_time of their last change, so every row is served
+    with the time of the latest sync that confirmed it (`synced_at`) when there is one.
+    """
+    item_dict = item.to_dict()
+    if synced_at is not None:
+        item_dict['process_time'] = synced_at
+    store_key = f"{item.store}-{item.machine_id}"
+    
+    # Get custom data for this store, if it exists
+    custom_store_data = store_info_map.get(store_key, {})
+    
+    # Merge inventory data with custom store data
+    full_item_data = {**item_dict, **custom_store_data}
+    
+    # Convert all keys to camelCase for the frontend
+    camel_case_data = {to_camel_case(key): value for key, value in full_item_data.items()}
+    return camel_case_data
+
+
 @app.route('/get-data', methods=['GET'])
 def get_data():
     """
     Retrieves all inventory and custom store data, merges them,
     and returns them as a single JSON response with camelCase keys.
+    The serialized response is cached per user until the data versions change,
+    and served with an ETag so unchanged data is answered with 304.
+    ?limit/?cursor returns one page by inventory id, ?stream=1 streams (see pagination.py);
+    neither is cached.
     """
     db: Session = next(get_db())
     try:
         # If a normal user is logged in (session['user_id']), restrict results to their assigned stores
         user_id = session.get('user_id')
+
+        def inventory_query(query_db):
+            # Machines whose store name contains an assigned store's name (case-insensitive),
+            # resolved ahead of time in the scope tables (see user_scope.py)
+            return scoped_inventory_query(query_db, int(user_id)) if user_id else query_db.query(Inventory)
+
+        if wants_page(request.args):
+            if user_id:
+                ensure_scope(db)
+            items, next_cursor = keyset_page(inventory_query(db), [Inventory.id], request.args.get('cursor'),
+                                             page_size(request.args))
+            page_keys = {f"{item.store}-{item.machine_id}" for item in items}
+            store_info_map = {store.store_key: store.to_dict()
+                              for store in db.query(Store).filter(Store.store_key.in_(page_keys))}
+            synced_at = latest_inventory_sync(db)
+            return jsonify({"success": True, "data": [merged_inventory_item(item, store_info_map, synced_at) for item in items],
+                            "nextCursor": next_cursor})
+        if wants_stream(request.args):
+            if user_id:
+                ensure_scope(db)
+            store_info_map = {store.store_key: store.to_dict() for store in db.query(Store).all()}
+            synced_at = latest_inventory_sync(db)
+            body = stream_json_array(SessionLocal, inventory_query, lambda item: merged_inventory_item(item, store_info_map, synced_at),
+                                     prefix='{"success":true,"data":[', suffix=']}', dumps=app.json.dumps)
+            return app.response_class(body, mimetype='application/json')
+
+        scope = f"user:{user_id}" if user_id else 'all'
+        versions = get_data_versions(db, GET_DATA_VERSIONS)
+        entry = get_data_cache.get(scope, versions)
+        if entry is not None:
+            return get_data_cache.respond(app, entry)
+
         if user_id:
-            user = db.query(User).filter(User.id == int(user_id)).first()
-            allowed_store_keys = set()
-            if user:
-                # user's stores contain store_key strings
-                allowed_store_keys = set(s.store_key for s in user.stores)
-            # Query inventory with flexible matching: allow matching by
-            # 1) exact store + machine (if applicable),
-            # 2) Inventory.store equals the prefix part of store_key,
-            # 3) Inventory.store LIKE prefix% fallback.
-            inventory_items = []
-            filters = []
-            for sk in allowed_store_keys:
-                # if store_key looks like 'store-machine', try exact match first
-                if '-' in sk:
-                    left, right = sk.rsplit('-', 1)
-                    # exact store+machine
-                    filters.append(and_(Inventory.store == left, Inventory.machine_id == right))
-                    # any machine for that store (case-insensitive)
-                    filters.append(Inventory.store.ilike(left))
-                    # fallback patterns: startswith and contains (case-insensitive)
-                    filters.append(Inventory.store.ilike(f"{left}%"))
-                    filters.append(Inventory.store.ilike(f"%{left}%"))
-                else:
-                    filters.append(Inventory.store.ilike(sk))
-                    filters.append(Inventory.store.ilike(f"{sk}%"))
-                    filters.append(Inventory.store.ilike(f"%{sk}%"))
-            if filters:
-                # combine with OR and query
-                inventory_items = db.query(Inventory).filter(or_(*filters)).all()
-        else:
-            inventory_items = db.query(Inventory).all()
+            ensure_scope(db)
+        inventory_items = inventory_query(db).all()
         
         # 2. Fetch all custom store data
         stores = db.query(Store).all()
@@ -782,28 +405,15 @@ def get_data():
         store_info_map = {store.store_key: store.to_dict() for store in stores}
 
         # 3. Merge the data
-        merged_data = []
-        for item in inventory_items:
-            item_dict = item.to_dict()
-            store_key = f"{item.store}-{item.machine_id}"
-            
-            # Get custom data for this store, if it exists
-            custom_store_data = store_info_map.get(store_key, {})
-            
-            # Merge inventory data with custom store data
-            full_item_data = {**item_dict, **custom_store_data}
-            
-            # 4. Convert all keys to camelCase for the frontend
-            camel_case_data = {to_camel_case(key): value for key, value in full_item_data.items()}
-            
-            # Ensure process_time is in ISO format string
-            if 'processTime' in camel_case_data and hasattr(camel_case_data['processTime'], 'isoformat'):
-                camel_case_data['processTime'] = camel_case_data['processTime'].isoformat()
-
-            merged_data.append(camel_case_data)
+        synced_at = latest_inventory_sync(db)
+        merged_data = [merged_inventory_item(item, store_info_map, synced_at) for item in inventory_items]
         
-        return jsonify({"success": True, "data": merged_data})
+        body = jsonify({"success": True, "data": merged_data}).get_data()
+        entry = get_data_cache.put(scope, versions, body)
+        return get_data_cache.respond(app, entry)
         
+    except CursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
@@ -814,6 +424,18 @@ def is_admin():
     return bool(session.get('logged_in'))
 
 
+@app.route('/api/response-stats', methods=['GET'])
+def api_response_stats():
+    """Per-route response sizes before/after compression and JSON encode time (see response_layer.py)."""
+    return jsonify({'success': True, 'routes': response_stats()})
+
+
+@app.route('/api/cache-stats', methods=['GET'])
+def api_cache_stats():
+    """Hit/miss counters of the in-process caches (responses and replenishment snapshots)."""
+    return jsonify({'success': True, 'caches': all_cache_stats()})
+
+
 @app.route('/api/stores-list', methods=['GET'])
 def api_stores_list():
     """Return list of stores for admin forms.
@@ -886,6 +508,7 @@ def api_create_user():
                 user.stores.append(store)
 
         db.add(user)
+        bump_data_version(db, 'users', 'stores')
         db.commit()
         db.refresh(user)
         return jsonify({'success': True, 'user': user.to_dict()})
@@ -958,6 +581,7 @@ def api_update_user(user_id):
                     user.stores.append(store)
 
         db.add(user)
+        bump_data_version(db, 'users', 'stores')
         db.commit()
         db.refresh(user)
         return jsonify({'success': True, 'user': user.to_dict()})
@@ -996,6 +620,7 @@ def api_delete_user(user_id):
 
         # Delete user
         db.delete(user)
+        bump_data_version(db, 'users')
         db.commit()
         return jsonify({'success': True})
     except Exception as e:
@@ -1162,7 +787,7 @@ def api_user_change_password():
 
 
 def send_email_if_configured(to_email, subject, body, html_content=False):
-    """Send email via SendGrid REST API (HTTPS).
+    """Send one email right away via SendGrid REST API (HTTPS), bypassing the mail queue.
 
     Environment variables used (backwards-compatible):
     - SENDGRID_API_KEY (preferred) or SMTP_PASS (SendGrid API key when using smtp auth)
@@ -1170,50 +795,10 @@ def send_email_if_configured(to_email, subject, body, html_content=False):
 
     Returns dict: {'ok': True} or {'ok': False, 'error': '...'}
     """
-    sendgrid_api_key = os.getenv('SENDGRID_API_KEY') or os.getenv('SMTP_PASS')
-    from_email = os.getenv('FROM_EMAIL') or os.getenv('SMTP_USER')
-    if not sendgrid_api_key or not to_email or not from_email:
-        logging.warning(f"Email not sent (missing config): sendgrid_key_set={bool(sendgrid_api_key)} to={to_email} from={from_email}")
+    if not to_email:
         return {'ok': False, 'error': 'SendGrid API key or from/to address missing'}
-
-    url = 'https://api.sendgrid.com/v3/mail/send'
-    headers = {
-        'Authorization': f'Bearer {sendgrid_api_key}',
-        'Content-Type': 'application/json'
-    }
-
-    # Build content: always include plain text; add HTML part when requested
-    if html_content:
-        plain = '此郵件包含 HTML 內容，請使用支援 HTML 的郵件客戶端查看。'
-        content = [
-            {'type': 'text/plain', 'value': plain},
-            {'type': 'text/html', 'value': body}
-        ]
-    else:
-        content = [{'type': 'text/plain', 'value': body}]
-
-    payload = {
-        'personalizations': [
-            {
-                'to': [{'email': to_email}],
-            }
-        ],
-        'from': {'email': from_email},
-        'subject': subject,
-        'content': content
-    }
-
-    try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
-        if 200 <= resp.status_code < 300:
-            logging.info(f"Sent email to {to_email} from {from_email} via SendGrid API")
-            return {'ok': True}
-        else:
-            logging.error(f"SendGrid API returned {resp.status_code}: {resp.text}")
-            return {'ok': False, 'error': f'SendGrid API error {resp.status_code}: {resp.text}'}
-    except Exception as e:
-        logging.error(f"Failed to send email to {to_email} via SendGrid: {e}", exc_info=True)
-        return {'ok': False, 'error': str(e)}
+    result = get_sendgrid_client().send([to_email], subject, body, html_content=html_content)
+    return {'ok': True} if result['ok'] else {'ok': False, 'error': result['error']}
 
 
 @app.route('/api/notify-low-inventory', methods=['POST'])
@@ -1222,154 +807,19 @@ def api_notify_low_inventory():
 
     This can be used in a scheduled job; here it's exposed for testing.
     """
-    result = _notify_low_inventory_internal()
+    result = notify_low_inventory()
     if result.get('error'):
         return jsonify({'success': False, 'message': result['error']}), 500
-    return jsonify({'success': True, 'notifications': result.get('notifications', [])})
+    return jsonify({'success': True, 'notifications': result.get('notifications', []), 'mail': result.get('mail'), 'timing': result.get('timing')})
     
 
-def _notify_low_inventory_internal():
-    db: Session = next(get_db())
-    notifications = []
-    # Daily limits and tracking
-    DAILY_EMAIL_LIMIT = int(os.getenv('DAILY_EMAIL_LIMIT', '100'))
-    emails_sent_today = 0
-    # compute today's reset boundary at 16:00 UTC (which corresponds to Taiwan midnight)
-    # This means notifications are considered "same day" if sent after the previous 16:00 UTC.
-    from datetime import datetime, timedelta
-    now_utc = datetime.utcnow()
-    # reset happens at 16:00 UTC each UTC day
-    reset_hour_utc = 16
-    today_start = now_utc.replace(hour=reset_hour_utc, minute=0, second=0, microsecond=0)
-    if now_utc.hour < reset_hour_utc:
-        # If current UTC time is before 16:00, the 'today' start is the previous day's 16:00
-        today_start = today_start - timedelta(days=1)
-    try:
-        users = db.query(User).all()
-        logging.info(f'Checking low-inventory for {len(users)} users')
-        for u in users:
-            try:
-                thresh = int(u.low_inventory_threshold or 0)
-            except Exception:
-                thresh = 0
-            if not u.email or thresh <= 0:
-                logging.debug(f"Skipping user {u.username}: no email or threshold={thresh}")
-                continue
-            # Check each assigned store individually (single-machine total), and notify if any store <= threshold
-            low_stores = []
-            for s in u.stores:
-                # Respect the authoritative Store.is_hidden value from the DB (admin may toggle this)
-                try:
-                    db_store = db.query(Store).filter(Store.store_key == s.store_key).first()
-                except Exception:
-                    db_store = None
-
-                if db_store and getattr(db_store, 'is_hidden', False):
-                    logging.debug(f"Skipping hidden store {s.store_key} for user {u.username} because is_hidden")
-                    continue
-
-                left = s.store_key.split('-')[0]
-                qty_rows = db.query(Inventory).filter(Inventory.store.ilike(f"%{left}%")).with_entities(Inventory.quantity).all()
-                total_for_store = sum([q[0] or 0 for q in qty_rows])
-
-                # Only log and include stores that are actually below threshold
-                if total_for_store <= thresh:
-                    logging.info(f"User {u.username} store {s.store_key} totalQuantity={total_for_store} threshold={thresh}")
-                    # Prepare display name without provisional suffix
-                    display_name = s.store_key
-                    if display_name.endswith('-provisional_sales'):
-                        display_name = display_name.replace('-provisional_sales', '')
-                    low_stores.append({'store_key': s.store_key, 'display': display_name, 'total': total_for_store})
-
-            if low_stores:
-                # Filter out stores that have already triggered a notification for this user today
-                filtered_low_stores = []
-                for ls in low_stores:
-                    already = db.query(NotificationSent).filter(
-                        NotificationSent.user_id == u.id,
-                        NotificationSent.store_key == ls['store_key'],
-                        NotificationSent.sent_at >= today_start
-                    ).first()
-                    if not already:
-                        filtered_low_stores.append(ls)
-
-                if not filtered_low_stores:
-                    logging.debug(f"User {u.username}: all low stores already notified today; skipping.")
-                    continue
-
-                # Check global daily limit
-                if emails_sent_today >= DAILY_EMAIL_LIMIT:
-                    logging.warning(f"Daily email limit reached ({DAILY_EMAIL_LIMIT}). Skipping notifications.")
-                    break
-
-                # We'll send one email per user containing ALL current low_stores (for context),
-                # but only record NotificationSent for the newly-notified stores (filtered_low_stores).
-                # Compose a single email listing all low stores for this user
-                subject = f"【SWSAD】庫存通知 - {len(filtered_low_stores)} 個機台需要您的關注"
-
-                # 使用 HTML 格式
-                body_html_lines = [
-                    f"<!DOCTYPE html><html><body>",
-                    f"<h1 style='text-align:center; font-weight:bold;'>SWSAD</h1>",
-                    f"<p>親愛的 {u.display_name or u.username}，</p>",
-                    f"<p>這是一則來自SWSAD小幫手的通知：</p>",
-                    f"<p>系統發現有幾台機器的庫存已經低於您設定的警戒值囉！為了確保銷售不中斷，建議您盡快安排補貨。</p>",
-                    
-                    # 開始建立表格
-                    f"<table style='width:100%; border-collapse:collapse; text-align:left;'>",
-                    f"   <tr style='background-color:#f2f2f2;'>",
-                    f"       <th style='padding:8px; border:1px solid #ddd;'>機台名稱</th>",
-                    f"       <th style='padding:8px; border:1px solid #ddd;'>目前庫存</th>",
-                    f"   </tr>"
-                ]
-
-                for ls in low_stores:
-                    # 每一行資料
-                    body_html_lines.append(f"<tr>")
-                    body_html_lines.append(f"    <td style='padding:8px; border:1px solid #ddd;'>{ls.get('display', ls['store_key'])}</td>")
-                    body_html_lines.append(f"    <td style='padding:8px; border:1px solid #ddd;'>{ls['total']} 個</td>")
-                    body_html_lines.append(f"</tr>")
-                    
-                body_html_lines.extend([
-                    f"</table>", # 表格結束
-                    
-                    f"<p>點擊下方連結，即可前往網站查看詳細庫存狀況並安排補貨：</p>",
-                    f'<p><a href="https://swsad3.onrender.com/presentation">👉 智慧倉儲與銷售分析儀表板-Smart Warehousing and Sales Analysis Dashboard</a></p>',
-                    f"<p>此為系統自動通知，請勿回覆。</p>",
-                    f"</body></html>"
-                ])
-
-                body_html = "\n".join(body_html_lines)
-                send_result = send_email_if_configured(u.email, subject, body_html, html_content=True)
-                # If sent successfully (or attempted), record sent notifications for each newly-notified store only
-                try:
-                    for ls in filtered_low_stores:
-                        ns = NotificationSent(user_id=u.id, store_key=ls['store_key'])
-                        db.add(ns)
-                    db.commit()
-                except Exception as e:
-                    db.rollback()
-                    logging.error(f"Failed to record NotificationSent: {e}", exc_info=True)
-
-                emails_sent_today += 1
-                notifications.append({'user': u.username, 'email': u.email, 'lowStores': filtered_low_stores, 'allLowStores': low_stores, 'threshold': thresh, 'sent': send_result})
-            else:
-                logging.debug(f"User {u.username} has no assigned stores below threshold {thresh}")
-        return {'notifications': notifications}
-    except Exception as e:
-        logging.error(f"Error in notify-low-inventory internal: {e}", exc_info=True)
-        return {'error': str(e)}
-    finally:
-        db.close()
-
-
 @app.route('/api/notify-low-inventory/trigger', methods=['GET'])
 def api_notify_low_inventory_trigger():
     """Convenience GET endpoint to trigger low-inventory notifications (for testing via browser)."""
-    result = _notify_low_inventory_internal()
+    result = notify_low_inventory()
     if result.get('error'):
         return jsonify({'success': False, 'message': result['error']}), 500
-    return jsonify({'success': True, 'notifications': result.get('notifications', [])})
+    return jsonify({'success': True, 'notifications': result.get('notifications', []), 'mail': result.get('mail'), 'timing': result.get('timing')})
 
 
 # Serve presentation page but redirect unauthenticated users to the presentation login
@@ -1443,22 +893,37 @@ def submit_feedback():
     finally:
         db.close()
 
+def update_log_item(log):
+    return {
+        "scraperType": log.scraper_type,
+        "ranAt": log.ran_at,
+        "status": log.status,
+        "details": log.details
+    }
+
+
 @app.route('/api/update-logs', methods=['GET'])
 def get_update_logs():
-    """Returns the last 50 update log entries, newest first."""
+    """
+    Returns the last 50 update log entries, newest first.
+    ?limit/?cursor pages further back in time, ?stream=1 streams every entry (see pagination.py).
+    """
     db: Session = next(get_db())
     try:
-        logs = db.query(UpdateLog).order_by(UpdateLog.ran_at.desc()).limit(50).all()
-        result = [
-            {
-                "scraperType": log.scraper_type,
-                "ranAt": log.ran_at.isoformat(),
-                "status": log.status,
-                "details": log.details
-            }
-            for log in logs
-        ]
+        if wants_page(request.args):
+            logs, next_cursor = keyset_page(db.query(UpdateLog), [UpdateLog.ran_at, UpdateLog.id], request.args.get('cursor'),
+                                            page_size(request.args, default=50), descending=True)
+            return jsonify({"data": [update_log_item(log) for log in logs], "nextCursor": next_cursor})
+        if wants_stream(request.args):
+            body = stream_json_array(SessionLocal, lambda query_db: query_db.query(UpdateLog).order_by(UpdateLog.ran_at.desc(), UpdateLog.id.desc()),
+                                     update_log_item, dumps=app.json.dumps)
+            return app.response_class(body, mimetype='application/json')
+
+        logs = db.query(UpdateLog).order_by(UpdateLog.ran_at.desc(), UpdateLog.id.desc()).limit(50).all()
+        result = [update_log_item(log) for log in logs]
         return jsonify(result)
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting update logs: {e}", exc_info=True)
         return jsonify({"error": "Could not retrieve update logs"}), 500
@@ -1492,6 +957,7 @@ def update_store_data(store_key):
         if 'isHidden' in data:
             store.is_hidden = data['isHidden']
             
+        bump_data_version(db, 'stores')
         db.commit()
         db.refresh(store)
         
@@ -1506,7 +972,7 @@ def update_store_data(store_key):
 @app.route('/api/transactions', methods=['POST'])
 def add_transactions():
     """
-    Receives a list of transactions, clears existing ones, and saves the new ones.
+    Receives a list of transactions and appends the ones not stored yet.
     Includes a retry mechanism for database operations.
     """
     transactions_data = request.get_json()
@@ -1518,58 +984,18 @@ def add_transactions():
     for attempt in range(max_retries):
         db: Session = next(get_db())
         try:
-            # Clear existing transactions
-            db.query(Transaction).delete()
-            logging.info("Cleared existing transactions.")
-            
-            new_transactions = []
-            
-            all_stores = db.query(Store).all()
-            store_name_map = {}
-            for s in all_stores:
-                name_parts = s.store_key.rsplit('-', 1)
-                name = name_parts[0]
-                if name not in store_name_map:
-                    store_name_map[name] = s
-
-            for item in transactions_data:
-                shop_name_raw = item.get('shopName')
-                if not shop_name_raw or not item.get('date'):
-                    continue
-                
-                shop_name = shop_name_raw.strip()
-                store = store_name_map.get(shop_name)
-                
-                if not store:
-                    logging.info(f"Shop '{shop_name}' not found in DB. Creating a new provisional store.")
-                    new_store_key = f"{shop_name}-provisional_sales"
-                    
-                    existing_provisional = db.query(Store).filter(Store.store_key == new_store_key).first()
-                    if existing_provisional:
-                        store = existing_provisional
-                    else:
-                        store = Store(store_key=new_store_key)
-                        db.add(store)
-                        db.flush()
-                    
-                    store_name_map[shop_name] = store
-
-                new_transactions.append(Transaction(
-                    store_key=store.store_key,
-                    transaction_time=parse_date(item.get('date')),
-                    amount=int(float(item.get('amount', 0))),
-                    product_name=item.get('product'),
-                    payment_type=item.get('payType')
-                ))
-
-            if new_transactions:
-                db.bulk_save_objects(new_transactions)
-                logging.info(f"Preparing to save {len(new_transactions)} new transactions.")
+            # Append-only: rows already stored (same natural key) are skipped
+            ingest_counts = ingest_transactions(db, transactions_data)
             
             db.commit()
-            logging.info("Successfully committed transactions.")
+            logging.info(f"Successfully committed transactions: {describe_ingest_counts(ingest_counts)}.")
             db.close()
-            return jsonify({"success": True, "message": f"Successfully added {len(new_transactions)} transactions."})
+            return jsonify({
+                "success": True,
+                "message": f"Successfully added {ingest_counts['new']} transactions ({ingest_counts['duplicate']} already stored).",
+                "new": ingest_counts['new'],
+                "duplicate": ingest_counts['duplicate']
+            })
 
         except OperationalError as e:
             db.rollback()
@@ -1650,7 +1076,9 @@ def upload_warehouse_file():
                     ))
                 
                 db.bulk_save_objects(warehouse_records)
+                bump_data_version(db, 'warehouse')
                 db.commit()
+                warehouse_totals.invalidate()
                 
                 return jsonify({
                     'success': True,
@@ -1675,32 +1103,66 @@ def upload_warehouse_file():
         logging.error(f"Error in warehouse file upload: {e}", exc_info=True)
         return jsonify({'success': False, 'message': f'文件上傳失敗: {str(e)}'}), 500
 
+def warehouse_item(w):
+    return {
+        'warehouseName': w.warehouse_name,
+        'productName': w.product_name,
+        'quantity': w.quantity,
+        'updatedAt': w.updated_at
+    }
+
+
 @app.route('/api/warehouses', methods=['GET'])
 def get_warehouses():
     """
     獲取所有倉庫數據
+    ?limit/?cursor 依 id 分頁，?stream=1 以串流回傳（見 pagination.py）
     """
     db: Session = next(get_db())
     try:
+        if wants_page(request.args):
+            warehouses, next_cursor = keyset_page(db.query(Warehouse), [Warehouse.id], request.args.get('cursor'),
+                                                  page_size(request.args))
+            return jsonify({"data": [warehouse_item(w) for w in warehouses], "nextCursor": next_cursor})
+        if wants_stream(request.args):
+            body = stream_json_array(SessionLocal, lambda query_db: query_db.query(Warehouse).order_by(Warehouse.id),
+                                     warehouse_item, dumps=app.json.dumps)
+            return app.response_class(body, mimetype='application/json')
+
         logging.info("Fetching warehouse data from database...")
         warehouses = db.query(Warehouse).all()
         logging.info(f"Found {len(warehouses)} warehouse records")
         
-        result = [{
-            'warehouseName': w.warehouse_name,
-            'productName': w.product_name,
-            'quantity': w.quantity,
-            'updatedAt': w.updated_at.isoformat() if w.updated_at else None
-        } for w in warehouses]
+        result = [warehouse_item(w) for w in warehouses]
         
         logging.info(f"Returning {len(result)} warehouse records")
         return jsonify(result)
+    except CursorError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting warehouses: {e}", exc_info=True)
         return jsonify({"error": "Could not retrieve warehouse data"}), 500
     finally:
         db.close()
 
+def warehouse_suggestion_params(data):
+    """(strategy, machine_capacity, selected_warehouses) of a replenishment-tab request."""
+    strategy = data.get("strategy", "stable")
+    machine_capacity = int(data.get("max_total_qty", 50))
+    if machine_capacity < 1 or machine_capacity > 50:
+        machine_capacity = 50
+    return strategy, machine_capacity, data.get("warehouses", [])
+
+
+def valid_store_keys(store_keys):
+    """The requested machines without duplicates, or None if the list is malformed."""
+    if not isinstance(store_keys, list) or not store_keys:
+        return None
+    if not all(isinstance(key, str) and '-' in key for key in store_keys):
+        return None
+    return list(dict.fromkeys(store_keys))
+
+
 @app.route('/api/warehouse-replenishment-suggestion/<string:store_key>', methods=['POST'])
 def get_warehouse_replenishment_suggestion(store_key):
     """
@@ -1710,244 +1172,118 @@ def get_warehouse_replenishment_suggestion(store_key):
     if not data:
         return jsonify({"success": False, "message": "No data provided"}), 400
 
-    selected_warehouses = data.get("warehouses", [])
+    strategy, machine_capacity, selected_warehouses = warehouse_suggestion_params(data)
     if not selected_warehouses:
         return jsonify({
             "success": False,
             "message": "請選擇至少一個倉庫"
         }), 400
 
-    strategy = data.get("strategy", "stable")
-    machine_capacity = int(data.get("max_total_qty", 50))
-    if machine_capacity < 1 or machine_capacity > 50:
-        machine_capacity = 50
-
     db: Session = next(get_db())
     try:
         store_name, machine_id = store_key.split('-', 1)
         
-        # 1. 獲取倉庫庫存數據
-        warehouse_inventory = {}
-        for warehouse_name in selected_warehouses:
-            warehouse_items = db.query(Warehouse).filter_by(warehouse_name=warehouse_name).all()
-            for item in warehouse_items:
-                if item.product_name in warehouse_inventory:
-                    warehouse_inventory[item.product_name] += item.quantity
-                else:
-                    warehouse_inventory[item.product_name] = item.quantity
+        # 倉庫庫存、機台當前庫存與30天銷售數據或需求預測 (demand="forecast")（策略計算見 replenishment.py）
+        warehouse_inventory = load_warehouse_inventory(db, selected_warehouses)
+        inventories = load_machine_inventories(db, [store_key])
+        sales = load_demand(db, [store_key], data.get("demand"))
+
+        body, status = warehouse_tab_suggestions([store_key], strategy, machine_capacity, selected_warehouses,
+                                                 warehouse_inventory, inventories, sales)[0]
+        return jsonify(body), status
+
+    except Exception as e:
+        logging.error(f"Error generating warehouse replenishment suggestion: {e}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "message": f"生成補貨建議時發生錯誤: {str(e)}"
+        }), 500
+    finally:
+        db.close()
 
+
+@app.route('/api/warehouse-replenishment-suggestions', methods=['POST'])
+def get_warehouse_replenishment_suggestions():
+    """
+    補貨分頁的批次版本：{store_keys: [...], strategy, warehouses, max_total_qty, demand?}。
+    倉庫、庫存與銷售資料各只查詢一次，每台機台的結果與單台 API 相同。
+    demand: "sales"（預設，過去30天銷量）或 "forecast"（需求預測，見 forecasting.py）。
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
+
+    strategy, machine_capacity, selected_warehouses = warehouse_suggestion_params(data)
+    if not selected_warehouses:
+        return jsonify({
+            "success": False,
+            "message": "請選擇至少一個倉庫"
+        }), 400
+    store_keys = valid_store_keys(data.get("store_keys"))
+    if store_keys is None:
+        return jsonify({"success": False, "message": "store_keys must be a list of 'store-machineId' keys"}), 400
+
+    db: Session = next(get_db())
+    try:
+        warehouse_inventory = load_warehouse_inventory(db, selected_warehouses)
+        inventories = load_machine_inventories(db, store_keys)
+        sales = load_demand(db, store_keys, data.get("demand"))
+        suggestions = warehouse_tab_suggestions(store_keys, strategy, machine_capacity, selected_warehouses,
+                                                warehouse_inventory, inventories, sales)
+        results = [{"store_key": store_key, **body} for store_key, (body, _) in zip(store_keys, suggestions)]
+        return jsonify({"success": True, "results": results})
+
+    except Exception as e:
+        logging.error(f"Error generating warehouse replenishment suggestions: {e}", exc_info=True)
+        return jsonify({
+            "success": False,
+            "message": f"生成補貨建議時發生錯誤: {str(e)}"
+        }), 500
+    finally:
+        db.close()
+
+
+@app.route('/api/fleet-replenishment-plan', methods=['POST'])
+def get_fleet_replenishment_plan():
+    """
+    補貨路線的整體規劃：{store_keys: [...], strategy, warehouses, max_total_qty, capacities?, demand?}。
+    所選倉庫的庫存只分配一次（見 fleet_planner.py），不會讓多台機台各自拿走同一批庫存。
+    capacities 可按 store_key 覆寫個別機台的 max_total_qty。
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
+
+    strategy, machine_capacity, selected_warehouses = warehouse_suggestion_params(data)
+    if not selected_warehouses:
+        return jsonify({
+            "success": False,
+            "message": "請選擇至少一個倉庫"
+        }), 400
+    store_keys = valid_store_keys(data.get("store_keys"))
+    if store_keys is None:
+        return jsonify({"success": False, "message": "store_keys must be a list of 'store-machineId' keys"}), 400
+    capacities = {store_key: machine_capacity for store_key in store_keys}
+    for store_key, capacity in (data.get("capacities") or {}).items():
+        if store_key in capacities:
+            capacity = int(capacity)
+            capacities[store_key] = capacity if 1 <= capacity <= 50 else 50
+
+    db: Session = next(get_db())
+    try:
+        warehouse_inventory = load_warehouse_inventory(db, selected_warehouses)
         if not warehouse_inventory:
             return jsonify({
                 "success": False,
                 "message": "選擇的倉庫中沒有可用庫存"
             }), 400
-
-        # 2. 獲取機台當前庫存
-        inventory_items = db.query(Inventory).filter_by(store=store_name, machine_id=machine_id).all()
-        current_inventory = {item.product_name: item.quantity for item in inventory_items}
-
-        # 3. 獲取銷售數據
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        transactions = db.query(Transaction).filter(
-            Transaction.store_key.startswith(store_name),
-            Transaction.transaction_time >= thirty_days_ago
-        ).all()
-
-        sales_counts = {}
-        for t in transactions:
-            if t.product_name:
-                sales_counts[t.product_name] = sales_counts.get(t.product_name, 0) + 1
-
-        # 4. 根據策略生成建議
-        suggestion_list = []
-        warning = None
-
-        # 根據不同策略生成建議
-        if strategy == 'stable':
-            # 穩健策略：根據銷量比例分配剩餘空間
-            sales_products = []
-            current_total = sum(current_inventory.values())  # 當前總數
-            remaining_space = machine_capacity - current_total  # 剩餘可用空間
-            
-            for product, warehouse_qty in warehouse_inventory.items():
-                current_qty = current_inventory.get(product, 0)
-                sales = sales_counts.get(product, 0)
-                
-                if warehouse_qty > 0:  # 只考慮倉庫有庫存的產品
-                    sales_products.append({
-                        'productName': product,
-                        'currentQty': current_qty,
-                        'warehouseQty': warehouse_qty,
-                        'salesCount30d': sales,
-                        'suggestedQty': current_qty  # 初始設為當前數量
-                    })
-            
-            if sales_products and remaining_space > 0:
-                # 根據銷量計算額外分配
-                total_sales = sum(p['salesCount30d'] for p in sales_products)
-                products_to_add = [p for p in sales_products if p['warehouseQty'] > 0]
-                
-                if total_sales > 0 and products_to_add:
-                    # 有銷量的產品按比例分配剩餘空間
-                    base_additions = []
-                    for product in products_to_add:
-                        ratio = product['salesCount30d'] / total_sales
-                        addition = round(ratio * remaining_space)
-                        base_additions.append((product, addition))
-                        
-                    # 調整以確保總數正確
-                    total_addition = sum(addition for _, addition in base_additions)
-                    if total_addition != remaining_space:
-                        diff = remaining_space - total_addition
-                        # 按比例調整差異
-                        for i, (product, _) in enumerate(base_additions):
-                            if i < abs(diff):
-                                base_additions[i] = (product, base_additions[i][1] + (1 if diff > 0 else -1))
-                    
-                    # 應用調整後的數量
-                    for product, addition in base_additions:
-                        product['suggestedQty'] = product['currentQty'] + addition
-                else:
-                    # 無銷量時平均分配剩餘空間
-                    base_qty = remaining_space // len(products_to_add)
-                    remainder = remaining_space % len(products_to_add)
-                    for i, product in enumerate(products_to_add):
-                        addition = base_qty + (1 if i < remainder else 0)
-                        product['suggestedQty'] = product['currentQty'] + addition
-                
-                suggestion_list.extend(sales_products)
-
-        elif strategy == 'aggressive':
-            # 積極策略：優先分配給熱銷品，確保總量為50
-            current_total = sum(current_inventory.values())
-            remaining_space = machine_capacity - current_total
-            
-            # 先加入所有現有產品
-            suggestion_list = [{
-                'productName': product,
-                'currentQty': qty,
-                'suggestedQty': qty,  # 初始設為當前數量
-                'warehouseQty': warehouse_inventory.get(product, 0),
-                'salesCount30d': sales_counts.get(product, 0)
-            } for product, qty in current_inventory.items()]
-            
-            # 根據銷量排序所有可能的新增產品
-            available_products = [(p, warehouse_inventory.get(p, 0), sales_counts.get(p, 0))
-                                for p in warehouse_inventory.keys()
-                                if p not in current_inventory and warehouse_inventory.get(p, 0) > 0]
-            
-            sorted_products = sorted(available_products,
-                                  key=lambda x: x[2],  # 按銷量排序
-                                  reverse=True)
-            
-            if remaining_space > 0 and sorted_products:
-                # 新產品中的前3名分配80%的剩餘空間
-                top_3 = sorted_products[:3]
-                top_3_space = round(remaining_space * 0.8)
-                base_qty = top_3_space // len(top_3)
-                remainder = top_3_space % len(top_3)
-                
-                for i, (product, warehouse_qty, sales) in enumerate(top_3):
-                    suggested_qty = base_qty + (1 if i < remainder else 0)
-                    suggestion_list.append({
-                        'productName': product,
-                        'currentQty': 0,
-                        'suggestedQty': suggested_qty,
-                        'warehouseQty': warehouse_qty,
-                        'salesCount30d': sales
-                    })
-            
-            # 剩餘產品分配剩餘空間
-            other_products = sorted_products[3:]
-            remaining_space_for_others = remaining_space - top_3_space
-            
-            if other_products and remaining_space_for_others > 0:
-                base_qty = remaining_space_for_others // len(other_products)
-                remainder = remaining_space_for_others % len(other_products)
-                
-                for i, (product, warehouse_qty, sales) in enumerate(other_products):
-                    suggested_qty = base_qty + (1 if i < remainder else 0)
-                    suggestion_list.append({
-                        'productName': product,
-                        'currentQty': 0,
-                        'suggestedQty': suggested_qty,
-                        'warehouseQty': warehouse_qty,
-                        'salesCount30d': sales
-                    })
-
-        else:  # exploratory
-            # 探索策略：80%空間給現有產品，20%給新產品
-            suggestion_list = []
-            current_total = sum(current_inventory.values())
-            remaining_space = machine_capacity - current_total
-            
-            # 先加入所有現有產品
-            for product, qty in current_inventory.items():
-                suggestion_list.append({
-                    'productName': product,
-                    'currentQty': qty,
-                    'suggestedQty': qty,  # 保持當前數量
-                    'warehouseQty': warehouse_inventory.get(product, 0),
-                    'salesCount30d': sales_counts.get(product, 0)
-                })
-            
-            if remaining_space > 0:
-                # 處理有銷量但不在當前庫存的產品（佔剩餘空間的80%）
-                existing_space = round(remaining_space * 0.8)
-                sales_products = [(p, warehouse_inventory[p], sales_counts.get(p, 0))
-                                for p in warehouse_inventory.keys()
-                                if p not in current_inventory and sales_counts.get(p, 0) > 0 and warehouse_inventory[p] > 0]
-                
-                if sales_products:
-                    base_qty = existing_space // len(sales_products)
-                    remainder = existing_space % len(sales_products)
-                    
-                    for i, (product, warehouse_qty, sales) in enumerate(sales_products):
-                        suggested_qty = base_qty + (1 if i < remainder else 0)
-                        suggestion_list.append({
-                            'productName': product,
-                            'currentQty': 0,
-                            'suggestedQty': suggested_qty,
-                            'warehouseQty': warehouse_qty,
-                            'salesCount30d': sales
-                        })
-            
-            # 處理新產品（沒有銷量的產品）
-            new_space = remaining_space - existing_space  # 剩餘20%空間給新產品
-            new_products = [(p, warehouse_inventory[p])
-                          for p in warehouse_inventory.keys()
-                          if p not in current_inventory and p not in [x['productName'] for x in suggestion_list] 
-                          and warehouse_inventory[p] > 0]
-            
-            if new_products and new_space > 0:
-                base_qty = new_space // len(new_products)
-                remainder = new_space % len(new_products)
-                
-                for i, (product, warehouse_qty) in enumerate(new_products):
-                    suggested_qty = base_qty + (1 if i < remainder else 0)
-                    suggestion_list.append({
-                        'productName': product,
-                        'currentQty': 0,
-                        'suggestedQty': suggested_qty,
-                        'warehouseQty': warehouse_qty,
-                        'salesCount30d': 0
-                    })        # 5. 排序並返回結果
-        suggestion_list.sort(key=lambda x: (x['suggestedQty'] - x['currentQty']), reverse=True)
-        
-        return jsonify({
-            "success": True,
-            "store_key": store_key,
-            "strategy_used": strategy,
-            "suggestion": suggestion_list,
-            "warning": warning,
-            "warehouse_info": [{
-                "name": w,
-                "products": len([p for p in warehouse_inventory if w in selected_warehouses])
-            } for w in selected_warehouses]
-        })
+        inventories = load_machine_inventories(db, store_keys)
+        sales = load_demand(db, store_keys, data.get("demand"))
+        results, summary = plan_fleet(store_keys, strategy, capacities, warehouse_inventory, inventories, sales)
+        return jsonify({"success": True, "strategy_used": strategy, "results": results, "summary": summary})
 
     except Exception as e:
-        logging.error(f"Error generating warehouse replenishment suggestion: {e}", exc_info=True)
+        logging.error(f"Error planning fleet replenishment: {e}", exc_info=True)
         return jsonify({
             "success": False,
             "message": f"生成補貨建議時發生錯誤: {str(e)}"
@@ -1955,50 +1291,73 @@ def get_warehouse_replenishment_suggestion(store_key):
     finally:
         db.close()
 
+
+def transaction_item(t, stores):
+    return {
+        "shopName": stores.get(t.store_key, t.store_key), # Fallback to store_key if not in map
+        "date": t.transaction_time,
+        "amount": t.amount,
+        "product": t.product_name,
+        "payType": t.payment_type,
+    }
+
+
+def daily_sales_item(r, stores):
+    return {
+        "shopName": stores.get(r.store_key, r.store_key),
+        "date": r.day,
+        "product": r.product_name,
+        "unitPrice": r.unit_price,
+        "count": r.count,
+        "amount": r.amount,
+    }
+
+
 @app.route('/api/transactions', methods=['GET'])
 def get_transactions():
     """
     Returns all transactions in the format expected by presentation.html.
+    ?aggregate=daily returns the sales_daily rollup instead (one row per store, product,
+    day and unit price with count and amount), for callers that do not need each sale.
+    ?limit/?cursor returns one page by transaction time, ?stream=1 streams (see pagination.py).
     """
     db: Session = next(get_db())
     try:
+        daily = request.args.get('aggregate') == 'daily'
+        model = SalesDaily if daily else Transaction
         # If a user is logged in, restrict transactions to user's assigned stores
         user_id = session.get('user_id')
-        transactions_query = db.query(Transaction)
+        scope_user_id = None
         if user_id:
             user = db.query(User).filter(User.id == int(user_id)).first()
-            if user:
-                user_store_keys = [s.store_key for s in user.stores]
-                # build filters similar to inventory matching
-                trans_filters = []
-                for sk in user_store_keys:
-                    if '-' in sk:
-                        left = sk.rsplit('-', 1)[0]
-                        trans_filters.append(Transaction.store_key == sk)
-                        trans_filters.append(Transaction.store_key.ilike(f"{left}%"))
-                        trans_filters.append(Transaction.store_key.ilike(f"%{left}%"))
-                    else:
-                        trans_filters.append(Transaction.store_key.ilike(sk))
-                        trans_filters.append(Transaction.store_key.ilike(f"%{sk}%"))
-                if trans_filters:
-                    transactions_query = transactions_query.filter(or_(*trans_filters))
-
-        transactions = transactions_query.all()
+            # A user without assigned stores keeps seeing every transaction (unchanged behavior)
+            if user and user.stores:
+                ensure_scope(db)
+                scope_user_id = user.id
+
+        def transactions_query(query_db):
+            if scope_user_id is not None:
+                return scoped_transactions_query(query_db, scope_user_id, model)
+            return query_db.query(model)
 
         # Create a map of store_key to store_name for quick lookup
         stores = {s.store_key: s.store_key.rsplit('-', 1)[0] for s in db.query(Store).all()}
-
-        result = [
-            {
-                "shopName": stores.get(t.store_key, t.store_key), # Fallback to store_key if not in map
-                "date": t.transaction_time.isoformat(),
-                "amount": t.amount,
-                "product": t.product_name,
-                "payType": t.payment_type,
-            }
-            for t in transactions
-        ]
-        return jsonify(result)
+        serialize = (lambda r: daily_sales_item(r, stores)) if daily else (lambda t: transaction_item(t, stores))
+
+        if wants_page(request.args):
+            key_columns = ([SalesDaily.day, SalesDaily.store_key, SalesDaily.product_name, SalesDaily.unit_price] if daily
+                           else [Transaction.transaction_time, Transaction.id])
+            rows, next_cursor = keyset_page(transactions_query(db), key_columns, request.args.get('cursor'),
+                                            page_size(request.args))
+            return jsonify({"data": [serialize(r) for r in rows], "nextCursor": next_cursor})
+        if wants_stream(request.args):
+            body = stream_json_array(SessionLocal, transactions_query, serialize, dumps=app.json.dumps)
+            return app.response_class(body, mimetype='application/json')
+
+        transactions = transactions_query(db).all()
+        return jsonify([serialize(t) for t in transactions])
+    except CursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         logging.error(f"Error getting transactions: {e}")
         traceback.print_exc()
@@ -2007,6 +1366,59 @@ def get_transactions():
         db.close()
 
 
+@app.route('/api/transactions/columnar', methods=['GET'])
+def get_transactions_columnar():
+    """
+    Transactions for the dashboards in column-oriented form (see transaction_columns.py),
+    streamed batch by batch (compressed by the response layer when the client accepts it).
+    Query parameters (all optional):
+      start, end   first and last day (YYYY-MM-DD, inclusive)
+      store        shop name, may be repeated
+      format       'json' (default) or 'arrow' (Arrow IPC stream, needs pyarrow)
+    """
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'arrow'):
+        return jsonify({"success": False, "message": "format must be 'json' or 'arrow'"}), 400
+    if output_format == 'arrow' and not arrow_available():
+        return jsonify({"success": False, "message": "Arrow output needs pyarrow installed on the server"}), 400
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d') if request.args.get('start') else None
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"success": False, "message": "start/end must be YYYY-MM-DD"}), 400
+
+    db: Session = next(get_db())
+    try:
+        # Same visibility as /api/transactions
+        store_keys = None
+        user_id = session.get('user_id')
+        if user_id:
+            user = db.query(User).filter(User.id == int(user_id)).first()
+            if user and user.stores:
+                ensure_scope(db)
+                store_keys = visible_transaction_keys(user.id)
+        stmt = transactions_select(start, end, request.args.getlist('store'), store_keys)
+    except Exception as e:
+        db.close()
+        logging.error(f"Error preparing columnar transactions: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    def generate(chunks):
+        # The session stays open while the response streams
+        try:
+            yield from chunks
+        finally:
+            db.close()
+
+    if output_format == 'arrow':
+        chunks, mimetype = arrow_ipc_chunks(db, stmt), 'application/vnd.apache.arrow.stream'
+    else:
+        chunks, mimetype = columnar_json_chunks(db, stmt), 'application/json'
+    response = app.response_class(generate(chunks), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 @app.route('/api/inventory/<store_key>', methods=['DELETE'])
 def delete_inventory_data(store_key):
     """
@@ -2022,8 +1434,11 @@ def delete_inventory_data(store_key):
         db.query(Inventory).filter_by(store=store_name, machine_id=machine_id).delete(synchronize_session=False)
         db.query(Store).filter_by(store_key=store_key).delete(synchronize_session=False)
         db.query(Transaction).filter_by(store_key=store_key).delete(synchronize_session=False)
+        db.query(SalesDaily).filter_by(store_key=store_key).delete(synchronize_session=False)
+        bump_data_version(db, 'inventory', 'stores', 'transactions')
 
         db.commit()
+        store_sales.invalidate()
 
         return jsonify({"success": True, "message": "Data deleted successfully."})
 
@@ -2034,27 +1449,16 @@ def delete_inventory_data(store_key):
         db.close()
 
 
-def distribute_remainder(items, total_slots):
-    """
-    一個輔助函數，用於處理補貨建議數量計算中的小數問題。
-    它會確保所有產品的建議數量加總後剛好等於機台的目標總容量。
-    """
-    # 根據小數部分由大到小排序，小數越大的越優先獲得 +1
-    items.sort(key=lambda x: x['suggestedQty_float'] - int(x['suggestedQty_float']), reverse=True)
-    
-    # 計算所有品項無條件捨去後的總和
-    current_total = sum(int(item['suggestedQty_float']) for item in items)
-    remainder = total_slots - current_total
-    
-    result = []
-    for i, item in enumerate(items):
-        qty = int(item['suggestedQty_float'])
-        # 將餘下的數量逐一分配給排序最前面的品項
-        if i < remainder:
-            qty += 1
-        result.append({'productName': item['productName'], 'suggestedQty': qty, 'sales_count': item.get('sales_count', 0)})
-    
-    return result
+def machine_suggestion_params(data):
+    """(strategy, reserve_slots, only_add, machine_capacity, selected_warehouses) of a presentation request."""
+    strategy = data.get("strategy", "stable")
+    reserve_slots = int(data.get("reserve_slots", 0))
+    only_add = bool(data.get("only_add", False))
+    machine_capacity = int(data.get("max_total_qty", 50))
+    if machine_capacity < 1 or machine_capacity > 50:
+        machine_capacity = 50
+    return strategy, reserve_slots, only_add, machine_capacity, data.get("warehouses", [])
+
 
 @app.route('/api/replenishment-suggestion/<string:store_key>', methods=['POST'])
 def get_replenishment_suggestion(store_key):
@@ -2066,339 +1470,68 @@ def get_replenishment_suggestion(store_key):
     if not data:
         return jsonify({"success": False, "message": "No data provided"}), 400
 
-    strategy = data.get("strategy", "stable")
-    reserve_slots = int(data.get("reserve_slots", 0))
-    only_add = bool(data.get("only_add", False))
-    machine_capacity = int(data.get("max_total_qty", 50))
-    selected_warehouses = data.get("warehouses", [])
-    
+    strategy, reserve_slots, only_add, machine_capacity, selected_warehouses = machine_suggestion_params(data)
     if not selected_warehouses:
         return jsonify({
             "success": False,
             "message": "請選擇至少一個倉庫"
         }), 400
 
-    if machine_capacity < 1 or machine_capacity > 50:
-        machine_capacity = 50
-    
-    available_slots = machine_capacity - reserve_slots
-
     db: Session = next(get_db())
     try:
         store_name, machine_id = store_key.split('-', 1)
         
-        # 1. 獲取目前庫存
-        inventory_items = db.query(Inventory).filter_by(store=store_name, machine_id=machine_id).all()
-        current_inventory = {item.product_name: item.quantity for item in inventory_items}
-
-        # 2. 獲取過去30天的銷售數據 (此處假設同店鋪名的所有機台共享銷售數據)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        transactions = db.query(Transaction).filter(
-            Transaction.store_key.startswith(store_name),
-            Transaction.transaction_time >= thirty_days_ago
-        ).all()
-
-        sales_counts = {}
-        for t in transactions:
-            if t.product_name:
-                sales_counts[t.product_name] = sales_counts.get(t.product_name, 0) + 1
-        
-        total_sales_volume = sum(sales_counts.values())
-
-        # 2.5 獲取所選倉庫的庫存數據
-        warehouse_inventory = {}
-        for warehouse_name in selected_warehouses:
-            warehouse_items = db.query(Warehouse).filter_by(warehouse_name=warehouse_name).all()
-            for item in warehouse_items:
-                if item.product_name in warehouse_inventory:
-                    warehouse_inventory[item.product_name] += item.quantity
-                else:
-                    warehouse_inventory[item.product_name] = item.quantity
-
-        if not warehouse_inventory:
-            return jsonify({
-                "success": False,
-                "message": "選擇的倉庫中沒有可用庫存"
-            }), 400
+        # 目前庫存、過去30天的銷售數據或需求預測 (同店鋪名的所有機台共享) 與所選倉庫的庫存
+        inventories = load_machine_inventories(db, [store_key])
+        sales = load_demand(db, [store_key], data.get("demand"))
+        warehouse_inventory = load_warehouse_inventory(db, selected_warehouses)
 
-        if total_sales_volume == 0:
-            # 如果沒有銷售數據，則根據倉庫庫存情況提供建議
-            available_products = list(warehouse_inventory.items())
-            if strategy == 'stable':
-                # 平均分配倉庫中有的商品
-                slots_per_product = available_slots // len(available_products)
-                suggestion_list = [
-                    {'productName': p, 'suggestedQty': min(slots_per_product, q)} 
-                    for p, q in available_products
-                ]
-            elif strategy == 'aggressive':
-                # 按倉庫庫存量排序，優先分配庫存量大的商品
-                sorted_products = sorted(available_products, key=lambda x: x[1], reverse=True)
-                top_products = sorted_products[:3]
-                suggestion_list = [
-                    {'productName': p, 'suggestedQty': min(round(available_slots * 0.3), q)} 
-                    for p, q in top_products
-                ]
-            else:  # exploratory
-                # 少量嘗試倉庫中的所有商品
-                suggestion_list = [
-                    {'productName': p, 'suggestedQty': min(2, q)} 
-                    for p, q in available_products
-                ]
-            
-            return jsonify({
-                "success": True,
-                "strategy_used": f"{strategy}_no_sales",
-                "suggestion": suggestion_list,
-                "message": "根據倉庫庫存生成建議"
-            })
-
-        # 3. 應用不同策略（考慮銷售數據和倉庫庫存）
-        suggestion_list = []
-        # 只考慮倉庫中有庫存的產品的銷售數據
-        filtered_sales = {
-            product: count for product, count in sales_counts.items() 
-            if product in warehouse_inventory
-        }
-        if not filtered_sales:
-            return jsonify({
-                "success": False,
-                "message": "倉庫中沒有任何有銷售記錄的產品"
-            }), 400
-            
-        total_filtered_sales = sum(filtered_sales.values())
-        sorted_sales = sorted(filtered_sales.items(), key=lambda item: item[1], reverse=True)
-
-        if strategy == 'stable':
-            # 穩健策略：根據銷售比例分配，但受倉庫庫存限制
-            temp_suggestions = []
-            for p, c in filtered_sales.items():
-                suggested_qty = (c / total_filtered_sales) * available_slots
-                # 確保不超過倉庫庫存
-                warehouse_qty = warehouse_inventory.get(p, 0)
-                suggested_qty = min(suggested_qty, warehouse_qty)
-                temp_suggestions.append({
-                    'productName': p,
-                    'suggestedQty_float': suggested_qty,
-                    'sales_count': c,
-                    'warehouse_qty': warehouse_qty
-                })
-            suggestion_list = distribute_remainder(temp_suggestions, available_slots)
-        
-        elif strategy == 'aggressive':
-            # 積極策略：優先分配銷量前三的產品，但受倉庫庫存限制
-            top_3_products = sorted_sales[:3]
-            other_products = sorted_sales[3:]
-            
-            slots_for_top_3 = round(available_slots * 0.8)
-            slots_for_others = available_slots - slots_for_top_3
-            
-            temp_suggestions = []
-            # 處理前三名產品
-            for p, c in top_3_products:
-                warehouse_qty = warehouse_inventory.get(p, 0)
-                suggested_qty = min(slots_for_top_3 / len(top_3_products), warehouse_qty)
-                temp_suggestions.append({
-                    'productName': p,
-                    'suggestedQty_float': suggested_qty,
-                    'sales_count': c,
-                    'warehouse_qty': warehouse_qty
-                })
-            
-            # 處理其他產品
-            if other_products:
-                qty_per_other = slots_for_others / len(other_products)
-                for p, c in other_products:
-                    warehouse_qty = warehouse_inventory.get(p, 0)
-                    suggested_qty = min(qty_per_other, warehouse_qty)
-                    temp_suggestions.append({
-                        'productName': p,
-                        'suggestedQty_float': suggested_qty,
-                        'sales_count': c,
-                        'warehouse_qty': warehouse_qty
-                    })
-            
-            suggestion_list = distribute_remainder(temp_suggestions, available_slots)
-
-        elif strategy == 'exploratory':
-            # 探索策略：保留20%空間給新產品，其餘根據銷量分配
-            slots_for_existing = round(available_slots * 0.8)
-            slots_for_new = available_slots - slots_for_existing
-
-            # 處理現有產品
-            temp_suggestions = []
-            for p, c in filtered_sales.items():
-                warehouse_qty = warehouse_inventory.get(p, 0)
-                suggested_qty = min(
-                    (c / total_filtered_sales) * slots_for_existing,
-                    warehouse_qty
-                )
-                temp_suggestions.append({
-                    'productName': p,
-                    'suggestedQty_float': suggested_qty,
-                    'sales_count': c,
-                    'warehouse_qty': warehouse_qty
-                })
+        body, status = machine_suggestions([store_key], strategy, reserve_slots, only_add, machine_capacity,
+                                           warehouse_inventory, inventories, sales)[0]
+        return jsonify(body), status
 
-            # 尋找倉庫中有庫存但尚未銷售的新產品
-            new_products = [
-                p for p in warehouse_inventory.keys()
-                if p not in filtered_sales and warehouse_inventory[p] > 0
-            ]
-            
-            # 為新產品分配空間
-            if new_products:
-                slots_per_new = slots_for_new / len(new_products)
-                for p in new_products:
-                    warehouse_qty = warehouse_inventory[p]
-                    suggested_qty = min(slots_per_new, warehouse_qty)
-                    temp_suggestions.append({
-                        'productName': p,
-                        'suggestedQty_float': suggested_qty,
-                        'sales_count': 0,
-                        'warehouse_qty': warehouse_qty
-                    })
-            
-            suggestion_list = distribute_remainder(temp_suggestions, available_slots)
-            temp_suggestions = [{'productName': p, 'suggestedQty_float': (c / total_sales_volume) * slots_for_existing, 'sales_count': c} for p, c in sales_counts.items()]
-            suggestion_list = distribute_remainder(temp_suggestions, slots_for_existing)
-
-        # 4. 組合最終結果
-        final_suggestion = []
-        suggestion_map = {item['productName']: item['suggestedQty'] for item in suggestion_list}
-        all_product_names = set(current_inventory.keys()) | set(suggestion_map.keys())
-
-        # 正確邏輯：最大補貨總數量是補貨後的目標庫存量
-        warning = None
-        total_current = sum(current_inventory.get(name, 0) for name in all_product_names)
-        
-        # 先將所有產品的建議數量設為不低於當前庫存
-        for name in all_product_names:
-            current_qty = current_inventory.get(name, 0)
-            suggested_qty = max(current_qty, suggestion_map.get(name, current_qty))
-            final_suggestion.append({
-                'productName': name,
-                'currentQty': current_qty,
-                'suggestedQty': suggested_qty,
-                'salesCount30d': sales_counts.get(name, 0)
-            })
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error in replenishment suggestion for {store_key}: {e}", exc_info=True)
+        return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        db.close()
 
-        # 按照調整量（建議數量-當前數量）排序，只保留前7個需要調整的項目
-        final_suggestion.sort(key=lambda x: (
-            x['suggestedQty'] - x['currentQty'],  # 首要條件：調整量
-            x['salesCount30d']  # 次要條件：銷量
-        ), reverse=True)
-
-        # 只保留需要調整的前7個項目，其他項目的建議數量設為當前庫存
-        needs_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] > 0]
-        no_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] <= 0]
-
-        if len(needs_adjustment) > 7:
-            for item in needs_adjustment[7:]:
-                item['suggestedQty'] = item['currentQty']
-
-        final_suggestion = needs_adjustment[:7] + no_adjustment
-        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
-
-        if total_current >= machine_capacity:
-            warning = f"現有庫存總和({total_current})已達最大補貨總數量({machine_capacity})，無需補貨。"
-            for name in all_product_names:
-                final_suggestion.append({
-                    'productName': name,
-                    'currentQty': current_inventory.get(name, 0),
-                    'suggestedQty': current_inventory.get(name, 0),
-                    'salesCount30d': sales_counts.get(name, 0)
-                })
-            final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
-            return jsonify({
-                "success": True,
-                "store_key": store_key,
-                "strategy_used": strategy,
-                "suggestion": final_suggestion,
-                "warning": warning
-            })
 
-        # 剩餘可補貨空間
-        available_replenish = machine_capacity - total_current
-        # 依策略分配這些空間
-        # 重新計算分配：每個產品的補貨量 = 分配量，建議數量 = 現有庫存 + 分配量
-        # 先依照策略分配比例
-        # 取得有銷量的產品分配比例
-        if strategy == 'stable':
-            total_sales_volume = sum(sales_counts.values())
-            temp_suggestions = []
-            for p, c in sales_counts.items():
-                temp_suggestions.append({'productName': p, 'suggestedQty_float': (c / total_sales_volume) * available_replenish, 'sales_count': c})
-            distributed = distribute_remainder(temp_suggestions, available_replenish)
-        elif strategy == 'aggressive':
-            sorted_sales = sorted(sales_counts.items(), key=lambda item: item[1], reverse=True)
-            top_3_products = sorted_sales[:3]
-            other_products = sorted_sales[3:]
-            top_3_sales_volume = sum(c for _, c in top_3_products)
-            other_sales_volume = sum(c for _, c in other_products)
-            slots_for_top_3 = round(available_replenish * 0.8)
-            slots_for_others = available_replenish - slots_for_top_3
-            temp_suggestions = []
-            if top_3_sales_volume > 0:
-                temp_suggestions.extend([{'productName': p, 'suggestedQty_float': (c / top_3_sales_volume) * slots_for_top_3, 'sales_count': c} for p, c in top_3_products])
-            if other_sales_volume > 0 and len(other_products) > 0:
-                temp_suggestions.extend([{'productName': p, 'suggestedQty_float': (c / other_sales_volume) * slots_for_others, 'sales_count': c} for p, c in other_products])
-            distributed = distribute_remainder(temp_suggestions, available_replenish)
-        elif strategy == 'exploratory':
-            total_sales_volume = sum(sales_counts.values())
-            slots_for_existing = round(available_replenish * 0.8)
-            temp_suggestions = [{'productName': p, 'suggestedQty_float': (c / total_sales_volume) * slots_for_existing, 'sales_count': c} for p, c in sales_counts.items()]
-            distributed = distribute_remainder(temp_suggestions, slots_for_existing)
-        else:
-            distributed = []
-
-        # 將分配結果轉為 dict
-        distributed_map = {item['productName']: item['suggestedQty'] for item in distributed}
-
-        # 組合最終建議：建議數量 = 現有庫存 + 分配到的補貨量
-        for name in all_product_names:
-            current_qty = current_inventory.get(name, 0)
-            add_qty = distributed_map.get(name, 0)
-            suggested_qty = current_qty + add_qty
-            # 只補貨模式下，不建議減少現有庫存
-            if only_add and suggested_qty < current_qty:
-                suggested_qty = current_qty
-            final_suggestion.append({
-                'productName': name,
-                'currentQty': current_qty,
-                'suggestedQty': suggested_qty,
-                'salesCount30d': sales_counts.get(name, 0)
-            })
-        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
-
-        # 最終檢查總和，理論上不會超過 machine_capacity
-        total_final = sum(item['suggestedQty'] for item in final_suggestion)
-        if total_final > machine_capacity:
-            warning = f"分配後總庫存({total_final})超過最大補貨總數量({machine_capacity})，已自動調整至上限。"
-            # 依現有庫存排序，依序減少至符合上限
-            over = total_final - machine_capacity
-            for item in sorted(final_suggestion, key=lambda x: x['suggestedQty'], reverse=True):
-                if over <= 0:
-                    break
-                reducible = item['suggestedQty'] - item['currentQty']
-                if reducible > 0:
-                    reduce_by = min(reducible, over)
-                    item['suggestedQty'] -= reduce_by
-                    over -= reduce_by
-            # 再次排序
-            final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+@app.route('/api/replenishment-suggestions', methods=['POST'])
+def get_replenishment_suggestions():
+    """
+    批次版本：{store_keys: [...], strategy, reserve_slots, only_add, max_total_qty, warehouses, demand?}。
+    每台機台的結果與 /api/replenishment-suggestion/<store_key> 相同。
+    demand: "sales"（預設，過去30天銷量）或 "forecast"（需求預測，見 forecasting.py）。
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
 
+    strategy, reserve_slots, only_add, machine_capacity, selected_warehouses = machine_suggestion_params(data)
+    if not selected_warehouses:
         return jsonify({
-            "success": True,
-            "store_key": store_key,
-            "strategy_used": strategy,
-            "suggestion": final_suggestion,
-            "warning": warning
-        })
+            "success": False,
+            "message": "請選擇至少一個倉庫"
+        }), 400
+    store_keys = valid_store_keys(data.get("store_keys"))
+    if store_keys is None:
+        return jsonify({"success": False, "message": "store_keys must be a list of 'store-machineId' keys"}), 400
+
+    db: Session = next(get_db())
+    try:
+        inventories = load_machine_inventories(db, store_keys)
+        sales = load_demand(db, store_keys, data.get("demand"))
+        warehouse_inventory = load_warehouse_inventory(db, selected_warehouses)
+        suggestions = machine_suggestions(store_keys, strategy, reserve_slots, only_add, machine_capacity,
+                                          warehouse_inventory, inventories, sales)
+        results = [{"store_key": store_key, **body} for store_key, (body, _) in zip(store_keys, suggestions)]
+        return jsonify({"success": True, "results": results})
 
     except Exception as e:
         db.rollback()
-        logging.error(f"Error in replenishment suggestion for {store_key}: {e}", exc_info=True)
+        logging.error(f"Error in batch replenishment suggestions: {e}", exc_info=True)
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
         db.close()
@@ -2474,25 +1607,85 @@ def serve_static_files(path):
 
 
 # --- Scheduler Setup ---
-def run_scheduler():
+# Every worker process runs the scheduler loop, but only the holder of this lease fires jobs
+scheduler_lease = LeaderElection(SessionLocal, 'scheduler')
+
+
+def follow_scheduler_lease(leader):
     """
-    Sets up and runs the scheduler in a loop.
+    JOB_WORKER_MODE=inline: the job runner of every gunicorn worker starts paused and
+    only the lease holder's runner claims jobs, so there is one dispatcher and at most
+    one warm Chrome per deployment. A worker that loses the lease stops claiming, lets
+    its running jobs finish and then closes its browser.
     """
+    if leader:
+        job_runner.resume()
+        return
+    if not job_runner.paused:
+        job_runner.pause()
+    if job_runner.running_count() == 0 and browser_manager.is_warm:
+        browser_manager.shutdown()
+
+
+def submit_scheduled_job(job_type):
+    """Queues a scheduled run (the slot claim in LeaderSchedule.every_run already made it unique)."""
+    job, created = job_runner.submit(job_type)
+    if not created:
+        logging.warning(f"Scheduled {job_type} job skipped: job {job['id']} is still {job['status']}.")
+
+
+def submit_mail_drain():
+    """Queues a 'mail' job when a message in the mail queue is due, e.g. a retry after its backoff."""
+    db = SessionLocal()
+    try:
+        due = mail_drain_due(db)
+    finally:
+        db.close()
+    if due:
+        job, created = job_runner.submit('mail')
+        if not created:
+            logging.info(f"Mail queue drain already pending as job {job['id']}.")
+
+
+def register_scheduled_jobs(leader_schedule):
+    """The scheduled runs; registered each time this worker becomes the scheduler leader."""
+    every = leader_schedule.scheduler.every
+
     # Schedule the inventory scraper to run at 1 minute past the hour.
-    schedule.every().hour.at(":01").do(run_inventory_scraper_background)
+    leader_schedule.every_run(every().hour.at(":01"), 'inventory', submit_scheduled_job, 'inventory')
     logging.info("Scheduler started for inventory: will run every hour at 1 minute past.")
 
     # Schedule the sales scraper to run daily at 23:55 Taiwan Time (UTC+8), which is 15:55 UTC.
-    schedule.every().day.at("15:55").do(run_sales_scraper_background)
+    leader_schedule.every_run(every().day.at("15:55"), 'sales', submit_scheduled_job, 'sales')
     logging.info("Scheduler started for sales: will run daily at 15:55 UTC (23:55 Taiwan Time).")
     
     # Schedule the warehouse scraper to run daily at 23:50 Taiwan Time (UTC+8), which is 15:50 UTC.
-    schedule.every().day.at("15:50").do(run_warehouse_scraper_background)
+    leader_schedule.every_run(every().day.at("15:50"), 'warehouse', submit_scheduled_job, 'warehouse')
     logging.info("Scheduler started for warehouse: will run daily at 15:50 UTC (23:50 Taiwan Time).")
+
+    # Refit the demand forecasts after the day's sales are in: 16:30 UTC (00:30 Taiwan Time).
+    leader_schedule.every_run(every().day.at("16:30"), 'forecast', submit_scheduled_job, 'forecast')
+    logging.info("Scheduler started for demand forecasts: will run daily at 16:30 UTC (00:30 Taiwan Time).")
     
-    # Run the scheduler loop
+    # Send mail queue retries on their backoff schedule, not only when the next notification run drains
+    every(MAIL_QUEUE_CHECK_MINUTES).minutes.do(submit_mail_drain)
+    logging.info(f"Scheduler started for the mail queue: checks for due emails every {MAIL_QUEUE_CHECK_MINUTES} minutes.")
+
+
+scheduled_jobs = LeaderSchedule(SessionLocal, scheduler_lease, register_scheduled_jobs)
+
+
+def run_scheduler():
+    """
+    Runs the scheduler loop. Scheduled runs are queued as jobs.
+    Runs in every gunicorn worker; the scheduler_lease makes sure only one of them
+    fires, and another worker takes over within LEADER_LEASE_SECONDS if it dies
+    (see LeaderSchedule for what fires at a takeover).
+    """
     while True:
-        schedule.run_pending()
+        leader = scheduled_jobs.tick()
+        if JOB_WORKER_MODE == 'inline':
+            follow_scheduler_lease(leader)
         time.sleep(1)
 
 
@@ -2510,7 +1703,8 @@ def debug_db_stats():
             "inventory_count": inv_count,
             "warehouse_count": wh_count,
             "store_count": store_count,
-            "uses_external_database": bool(os.getenv('DATABASE_URL'))
+            "uses_external_database": bool(os.getenv('DATABASE_URL')),
+            "engine": describe_engine()
         })
     except Exception as e:
         logging.exception('Error while gathering DB stats')
@@ -2523,25 +1717,22 @@ def debug_db_stats():
 def test_run_warehouse_scraper():
     """用於手動觸發倉庫爬蟲的測試端點。"""
     logging.info("收到手動觸發倉庫爬蟲的請求。")
-    thread = threading.Thread(target=run_warehouse_scraper_background)
-    thread.start()
-    return "倉庫爬蟲工作已手動觸發進行測試。"
+    job, _ = job_runner.submit('warehouse')
+    return f"倉庫爬蟲工作已手動觸發進行測試。(job {job['id']})"
 
 @app.route('/test-run-inventory-scraper', methods=['GET'])
 def test_run_inventory_scraper():
     """A simple endpoint to manually trigger the inventory scraper for testing."""
     logging.info("Manual trigger for inventory scraper received.")
-    thread = threading.Thread(target=run_inventory_scraper_background)
-    thread.start()
-    return "Inventory scraper job manually triggered for testing."
+    job, _ = job_runner.submit('inventory')
+    return f"Inventory scraper job manually triggered for testing (job {job['id']})."
 
 @app.route('/test-run-sales-scraper', methods=['GET'])
 def test_run_sales_scraper():
     """A simple endpoint to manually trigger the sales scraper for testing."""
     logging.info("Manual trigger for sales scraper received.")
-    thread = threading.Thread(target=run_sales_scraper_background)
-    thread.start()
-    return "Sales scraper job manually triggered for testing."
+    job, _ = job_runner.submit('sales')
+    return f"Sales scraper job manually triggered for testing (job {job['id']})."
 
 
 # --- 補貨單生成相關功能 ---
@@ -2667,310 +1858,29 @@ def generate_sales_detail():
             # 設定日期範圍的結束時間為當天的最後一刻
             end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
             
-            # 獲取指定日期範圍內的所有交易
-            transactions_query = db.query(Transaction).filter(
-                Transaction.transaction_time >= start_date,
-                Transaction.transaction_time <= end_date
-            )
-
-            # 如果前端有提供分店過濾，將 store_key 的店名部分比對
-            if selected_stores:
-                # store_key 格式為 'StoreName-machineId'，因此比對以 store_key.startswith(storeName)
-                store_filters = [Transaction.store_key.startswith(s) for s in selected_stores]
-                # SQLAlchemy 不能直接使用 python list of expressions like this; 使用 OR 組合
-                from sqlalchemy import or_
-                or_conditions = [Transaction.store_key.startswith(s) for s in selected_stores]
-                transactions_query = transactions_query.filter(or_(*or_conditions))
-
-            # 如果前端有提供產品過濾
-            if selected_products:
-                from sqlalchemy import or_
-                prod_conditions = [Transaction.product_name == p for p in selected_products]
-                transactions_query = transactions_query.filter(or_(*prod_conditions))
-
-            transactions = transactions_query.order_by(Transaction.store_key, Transaction.product_name).all()
-
-            if not transactions:
+            # 從每日銷售彙總表 (sales_daily) 取得指定日期範圍內的數量與營收，
+            # 已按店家 / 產品 / 還原後的單價分組，分店與產品過濾在查詢中完成
+            rollup_rows = sales_detail_rows(db, start_date.date(), end_date.date(), selected_stores, selected_products)
+
+            if not rollup_rows:
                 return jsonify({'success': False, 'message': '指定日期範圍內沒有交易記錄'}), 404
                 
             # 記錄查詢到的交易記錄範圍
             logging.info(f"Query date range: from {start_date} to {end_date}")
-            logging.info(f"Found {len(transactions)} transactions after applying filters (stores/products)")
-
-            # 建立 Excel 工作簿
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "銷售明細"
-
-            # 設置標題行
-            ws['A1'] = '商品'
-            ws['B1'] = '單價'
-            ws['C1'] = '份數'
-            ws['D1'] = '小計'
-
-            # 統計數據
-            sales_summary = {}
-            total_amount = 0  # 用於驗證總金額
-            transaction_count = 0  # 用於驗證交易筆數
-            
-            # 第一次遍歷：找出每個產品的最新單價（用於單價回復），
-            # 但我們允許同一產品存在多個不同的已還原單價，
-            # 因此此階段只負責計算單筆交易的還原單價。
-            def normalized_unit_price(amount):
-                try:
-                    price = int(round(amount))
-                except Exception:
-                    price = int(amount)
-                last_digit = price % 10
-                if last_digit in (1, 2):
-                    return price - 2
-                return price
-            
-            # 第二次遍歷：計算每個店家的每個產品在不同（還原後）單價下的數量與營收
-            # 結構：sales_summary[store][product][price] -> {'count': n, 'total': x}
-            sales_summary = {}
-            for t in transactions:
-                transaction_count += 1
-                store_name = t.store_key.split('-')[0]
-                product_name = t.product_name or 'UNKNOWN'
-
-                # 每筆交易金額 = 實際交易金額
-                transaction_amount = t.amount or 0
-                total_amount += transaction_amount
-
-                # 以還原後的單價作為 group key
-                unit_price = normalized_unit_price(t.amount)
-
-                store_map = sales_summary.setdefault(store_name, {})
-                product_map = store_map.setdefault(product_name, {})
-                price_entry = product_map.setdefault(unit_price, {'count': 0, 'total': 0})
-                price_entry['count'] += 1
-                price_entry['total'] += transaction_amount
-            
-            # 詳細的日誌記錄
-            logging.info(f"Total transactions: {transaction_count}")
-            logging.info(f"Total amount: {total_amount}")
-
-            # 計算唯一的 product-price 組合數與驗證總金額
-            unique_price_combinations = 0
-            summary_total = 0
-            for store_name, products in sales_summary.items():
-                for product_name, price_map in products.items():
-                    for price, rec in price_map.items():
-                        unique_price_combinations += 1
-                        summary_total += rec.get('total', 0)
-
-            logging.info(f"Unique product-price combinations: {unique_price_combinations}")
-            if summary_total != total_amount:
-                logging.error(f"Amount mismatch! Summary: {summary_total}, Transactions: {total_amount}")
-
-            # 按店鋪匯總統計以供日誌顯示
-            store_totals = {}
-            for store_name, products in sales_summary.items():
-                store_totals.setdefault(store_name, {'total': 0, 'transactions': 0})
-                for product_name, price_map in products.items():
-                    for price, rec in price_map.items():
-                        store_totals[store_name]['total'] += rec.get('total', 0)
-                        store_totals[store_name]['transactions'] += rec.get('count', 0)
-            
-            for store, stats in store_totals.items():
-                logging.info(f"Store: {store}")
-                logging.info(f"  - Total amount: {stats['total']}")
-                logging.info(f"  - Transaction count: {stats['transactions']}")
-                logging.info(f"  - Average transaction: {stats['total'] / stats['transactions']:.2f}")
-
-            # 按店家分組並支援每個產品多個價格（以還原後的單價為鍵）
-            # sales_summary 現在以 store->product->price 聚合
-            store_groups = {}
-            for store_name in sorted(sales_summary.keys()):
-                store_entry = {'sales': [], 'total_count': 0, 'total_amount': 0}
-                for product_name in sorted(sales_summary[store_name].keys()):
-                    price_map = sales_summary[store_name][product_name]
-                    # 將不同價格按價格高到低排序
-                    price_rows = []
-                    for price in sorted(price_map.keys(), reverse=True):
-                        rec = price_map[price]
-                        price_rows.append({'price': price, 'count': rec['count'], 'total': rec['total']})
-                        store_entry['total_count'] += rec['count']
-                        store_entry['total_amount'] += rec['total']
-
-                    store_entry['sales'].append({'product': product_name, 'prices': price_rows})
-
-                # 根據店內總收入排序產品（主要顯示順序）
-                store_entry['sales'].sort(key=lambda p: sum(r['total'] for r in p['prices']), reverse=True)
-                store_groups[store_name] = store_entry
-
-            # 設置樣式
-            from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-            
-            # 字體樣式
-            header_font = Font(bold=True, size=11, name='微軟正黑體')
-            normal_font = Font(size=10, name='微軟正黑體')
-            store_font = Font(bold=True, size=11, name='微軟正黑體')  # 調整為與標題相同大小
-            
-            # 填充顏色
-            header_fill = PatternFill(start_color='2F75B5', end_color='2F75B5', fill_type='solid')  # 主題藍
-            subtotal_fill = PatternFill(start_color='BDD7EE', end_color='BDD7EE', fill_type='solid')  # 淺藍色
-            total_fill = PatternFill(start_color='8EA9DB', end_color='8EA9DB', fill_type='solid')    # 中藍色
-            alternate_fill = PatternFill(start_color='F5F5F5', end_color='F5F5F5', fill_type='solid') # 淺灰色
-            
-            # 邊框樣式
-            thin_border = Border(
-                left=Side(style='thin', color='BFBFBF'),
-                right=Side(style='thin', color='BFBFBF'),
-                top=Side(style='thin', color='BFBFBF'),
-                bottom=Side(style='thin', color='BFBFBF')
-            )
-            
-            # 特殊邊框樣式（用於標題和小計行）
-            bottom_border = Border(
-                left=Side(style='thin', color='BFBFBF'),
-                right=Side(style='thin', color='BFBFBF'),
-                top=Side(style='thin', color='BFBFBF'),
-                bottom=Side(style='medium', color='2F75B5')  # 底部使用較粗的藍色邊框
-            )
-            
-            # 對齊方式
-            center_alignment = Alignment(horizontal='center', vertical='center')
-            right_alignment = Alignment(horizontal='right', vertical='center')
-            
-            # 設置標題樣式
-            headers = ['商品', '單價', '份數', '小計']  # 移除店鋪欄位
-            for col, header in zip(['A1', 'B1', 'C1', 'D1'], headers):
-                cell = ws[col]
-                cell.value = header
-                cell.font = Font(bold=True, size=11, name='微軟正黑體', color='FFFFFF')
-                cell.fill = header_fill
-                cell.border = bottom_border
-                cell.alignment = center_alignment
-
-            # 填入數據，包括每個店家的小計
-            current_row = 2
-            grand_total_count = 0
-            grand_total_amount = 0
-
-            for store, data in store_groups.items():
-                # 店家名稱行
-                ws.merge_cells(f'A{current_row}:D{current_row}')
-                ws[f'A{current_row}'] = store
-                ws[f'A{current_row}'].font = store_font
-                ws[f'A{current_row}'].fill = subtotal_fill
-                ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
-                for col in ['A', 'B', 'C', 'D']:
-                    ws[f'{col}{current_row}'].border = thin_border
-                
-                last_header_row = current_row  # 記錄店家標題行的位置
-                current_row += 1
-
-                # 填入該店家的所有商品數據（支援同商品多價格）
-                # 使用 product_block_idx 來對整個商品區塊進行交替底色，
-                # 以避免因為同商品多價格造成的列數差異而導致視覺上跨店家錯位。
-                product_block_idx = 0
-                for sale in data['sales']:
-                    product_name = sale['product']
-                    price_rows = sale.get('prices', [])
-                    if not price_rows:
-                        # 若沒有價格資料，跳過（且不計入交替序列）
-                        continue
-
-                    # 決定該商品區塊是否需要填充背景（保持整個商品區塊同色）
-                    should_fill_block = (product_block_idx % 2 == 1)
-
-                    start_row_for_product = current_row
-                    # 為每個價格列寫入一行
-                    for pr in price_rows:
-                        ws[f'B{current_row}'] = pr['price']
-                        ws[f'C{current_row}'] = pr['count']
-                        ws[f'D{current_row}'] = pr['total']
-
-                        # 設定樣式
-                        for col, value in [(f'B{current_row}', pr['price']), (f'C{current_row}', pr['count']), (f'D{current_row}', pr['total'])]:
-                            ws[col].font = normal_font
-                            ws[col].border = thin_border
-                            ws[col].alignment = Alignment(horizontal='right', vertical='center')
-                            if col.startswith('B'):
-                                ws[col].number_format = '#,##0'
-                            else:
-                                ws[col].number_format = '#,##0'
-
-                        # 如果該商品區塊需要填色，對整行所有列填充
-                        if should_fill_block:
-                            for col in ['A', 'B', 'C', 'D']:
-                                ws[f'{col}{current_row}'].fill = PatternFill(start_color='F5F5F5', end_color='F5F5F5', fill_type='solid')
-
-                        current_row += 1
-
-                    end_row_for_product = current_row - 1
-                    # 合併 A 欄為產品名稱以提高可讀性（整個商品區塊不另加空行）
-                    ws.merge_cells(start_row=start_row_for_product, start_column=1, end_row=end_row_for_product, end_column=1)
-                    ws[f'A{start_row_for_product}'] = product_name
-                    ws[f'A{start_row_for_product}'].font = normal_font
-                    ws[f'A{start_row_for_product}'].alignment = Alignment(horizontal='left', vertical='center')
-
-                    # 商品區塊處理完畢，移動到下一個商品塊
-                    product_block_idx += 1
-
-                # 添加該店家的小計
-                ws[f'A{current_row}'] = f"{store} 小計"
-                ws[f'C{current_row}'] = data['total_count']
-                ws[f'D{current_row}'] = data['total_amount']
-                
-                # 設置小計行的樣式
-                for col in ['A', 'B', 'C', 'D']:
-                    ws[f'{col}{current_row}'].fill = subtotal_fill
-                    ws[f'{col}{current_row}'].font = header_font
-                    ws[f'{col}{current_row}'].border = thin_border
-                    ws[f'{col}{current_row}'].alignment = right_alignment
-                
-                # 為小計的數字設置格式
-                ws[f'C{current_row}'].number_format = '#,##0'  # 總份數使用千分位
-                ws[f'D{current_row}'].number_format = '#,##0'  # 總金額使用千分位
-                ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
-
-                current_row += 2  # 添加一個空行
-
-                # 累加到總計
-                grand_total_count += data['total_count']
-                grand_total_amount += data['total_amount']
-
-            current_row -= 1  # 移除最後一個多餘的空行
-
-            # 添加總計行
-            ws[f'A{current_row}'] = "總計"
-            ws[f'C{current_row}'] = grand_total_count
-            ws[f'D{current_row}'] = grand_total_amount
-
-            # 設置總計行的樣式
-            for col in ['A', 'B', 'C', 'D']:
-                ws[f'{col}{current_row}'].fill = total_fill
-                ws[f'{col}{current_row}'].font = header_font
-                ws[f'{col}{current_row}'].border = thin_border
-                ws[f'{col}{current_row}'].alignment = right_alignment
-            
-            # 為總計的數字設置格式
-            ws[f'C{current_row}'].number_format = '#,##0'  # 總份數使用千分位
-            ws[f'D{current_row}'].number_format = '#,##0'  # 總金額使用千分位
-            ws[f'A{current_row}'].alignment = Alignment(horizontal='left', vertical='center')
-
-            # 設置欄寬
-            ws.column_dimensions['A'].width = 45  # 商品名稱（增加寬度）
-            ws.column_dimensions['B'].width = 15  # 單價
-            ws.column_dimensions['C'].width = 12  # 份數
-            ws.column_dimensions['D'].width = 18  # 小計
-
-            # 設置列高
-            ws.row_dimensions[1].height = 25  # 標題列加高
-            
-            # 設置工作表其他屬性
-            ws.freeze_panes = 'A2'  # 凍結首行
-            ws.sheet_view.showGridLines = False  # 隱藏網格線
+            logging.info(f"Found {len(rollup_rows)} store/product/price rows after applying filters (stores/products)")
+
+            # 按店家分組（同店名的機台合併），每個產品可有多個還原後的單價（見 sales_report.py）
+            store_groups = group_sales(rollup_rows)
+            logging.info(f"Sales detail: {len(store_groups)} stores, "
+                         f"{sum(group[2] for group in store_groups)} transactions, "
+                         f"total amount {sum(group[3] for group in store_groups)}")
 
             # 生成日期範圍字串
             start_str = start_date.strftime('%Y%m%d')
             end_str = end_date.strftime('%Y%m%d')
             filename = f'sales_detail_{start_str}-{end_str}.xlsx'
             output_path = os.path.join(script_dir, filename)
-            wb.save(output_path)
+            write_sales_detail(output_path, store_groups)
 
             return jsonify({
                 'success': True,
@@ -3003,9 +1913,18 @@ if __name__ == '__main__':
     logging.info("Starting Flask development server for local testing...")
     app.run(host='0.0.0.0', port=5001, debug=False)
 
-# --- Start the scheduler thread when the application module is loaded ---
-# This ensures it runs even when started by Gunicorn on Render.
+# --- Start the job runner and scheduler thread when the application module is loaded ---
+# This ensures they run even when started by Gunicorn on Render.
+if JOB_WORKER_MODE == 'inline':
+    # Paused until the scheduler thread finds this worker holding the scheduler lease
+    job_runner.pause()
+    job_runner.start()
+else:
+    logging.info("JOB_WORKER_MODE=external: jobs are queued for the worker process, not run here.")
+
 logging.info("Starting the background scheduler thread...")
+# Hand the scheduler lease to another worker right away when this one shuts down
+atexit.register(scheduler_lease.release)
 scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
 scheduler_thread.start()
 logging.info("Background scheduler thread has been started.") 
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+In-process snapshots of the data every replenishment suggestion reads: product totals
+per warehouse and 30-day product sales (or forecasts) per store name. Planners click through machine
+after machine with the same warehouses and stores, so those are loaded once and reused.
+
+Entries are tagged with the data versions they were built from (see bump_data_version),
+which keeps them correct across processes: after a warehouse upload or a sales ingest in
+any process the next lookup is a miss. They also expire after SNAPSHOT_TTL_SECONDS, and
+the ingest paths call invalidate() so this process drops them right away.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from response_cache import register_cache
+
+
+SNAPSHOT_TTL_SECONDS = float(os.getenv('SNAPSHOT_TTL_SECONDS', '600'))
+
+
+class SnapshotCache:
+    """Values per key, valid while the data versions match and the TTL has not run out."""
+
+    def __init__(self, name, ttl=SNAPSHOT_TTL_SECONDS, max_entries=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def get_many(self, keys, versions, load):
+        """
+        {key: value} for `keys`. Missing or stale keys are fetched together with
+        load(missing_keys), which must return a value for each of them.
+        """
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry['versions'] == versions:
+                    if now - entry['stored'] < self.ttl:
+                        self._entries.move_to_end(key)
+                        found[key] = entry['value']
+                        self.hits += 1
+                        continue
+                    self.expired += 1
+                missing.append(key)
+                self.misses += 1
+        if missing:
+            loaded = load(missing)
+            with self._lock:
+                for key in missing:
+                    self._entries[key] = {'versions': versions, 'stored': now, 'value': loaded[key]}
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'invalidations': self.invalidations,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None,
+                'entries': len(self._entries),
+                'ttlSeconds': self.ttl
+            }
+
+
+# {warehouse_name: {product: quantity}}, tagged with the 'warehouse' version
+warehouse_totals = register_cache(SnapshotCache('warehouse-totals'))
+# {(store_name, since_day): {product: units sold} over whole days}, tagged with the 'transactions' version
+store_sales = register_cache(SnapshotCache('store-sales-30d'))
+# {store_name: {product: units expected in 30 days}}, tagged with the 'forecasts' version
+store_forecasts = register_cache(SnapshotCache('store-forecasts-30d'))
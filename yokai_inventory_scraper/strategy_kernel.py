@@ -0,0 +1,230 @@
+"""
+Replenishment strategy math on NumPy arrays, shared by every suggestion endpoint.
+
+Everything works on (products × machines) matrices, so one call covers a whole batch of
+machines. No database access and no dicts: replenishment.py turns the loaded data into
+arrays and the results back into response bodies. The rules, their rounding and the
+order of the listed products are those of the per-machine code the endpoints ran before
+(kept in tests/fixtures/legacy_replenishment.py); tests/strategy_kernel_test.py checks
+that every machine gets the same suggestion from both.
+
+    positions             where every row lands in a machine's sorted list
+    even_split            space split evenly, the remainder to the first rows
+    distribute_remainder  truncated quotas, the remainder to the largest fractions
+    tab_additions         what the replenishment tab adds per product and machine
+    target_quantities     the presentation page's targets from the available slots
+    replenish_quantities  what the presentation page adds on top of the current stock
+    no_sales_quantities   the presentation page's suggestion without any sales
+
+"Order" matrices give each machine's list order of the products: a rank per row
+(lower first) and inf for rows that are not in that machine's list.
+"""
+import numpy as np
+
+
+TOP_PRODUCTS = 3
+TOP_SHARE = 0.8
+EXISTING_SHARE = 0.8
+# Share of the slots each of the best-stocked products gets when a machine has no sales
+NO_SALES_TOP_SHARE = 0.3
+NO_SALES_TRIAL_QTY = 2
+
+
+def _columns(values, machines):
+    return np.broadcast_to(np.asarray(values), (machines,))
+
+
+def positions(members, *keys):
+    """
+    Position of every member row in its column's list, sorted by `keys` (most
+    significant first), ties by row; -1 for the other rows.
+    """
+    members = np.asarray(members, dtype=bool)
+    rows = members.shape[0]
+    keys = [np.broadcast_to(key, members.shape) for key in keys]
+    order = np.lexsort(keys[::-1] + [~members], axis=0)
+    result = np.empty(members.shape, dtype=int)
+    np.put_along_axis(result, order, np.broadcast_to(np.arange(rows)[:, None], members.shape), axis=0)
+    return np.where(members, result, -1)
+
+
+def even_split(members, space, *keys):
+    """space // n for each of a column's n member rows, one more for the first space % n rows by `keys`."""
+    members = np.asarray(members, dtype=bool)
+    space = _columns(space, members.shape[1]).astype(int)
+    count = np.maximum(members.sum(axis=0), 1)
+    extra = positions(members, *keys) < space % count
+    return np.where(members, space // count + extra, 0)
+
+
+def distribute_remainder(quotas, totals, members, *keys):
+    """
+    Integer quantities from fractional quotas, and the rows' positions in the resulting list:
+    every member row gets its quota truncated, then the first (totals - truncated sum)
+    rows by largest fractional part (ties by `keys`) one unit more. As in the per-machine
+    code, that can be a row without any fraction, and nothing is taken back when the
+    truncated quotas already exceed the totals.
+    """
+    members = np.asarray(members, dtype=bool)
+    quotas = np.where(members, quotas, 0.0)
+    base = np.trunc(quotas)
+    fraction = quotas - base
+    order = positions(members, -fraction, *keys)
+    remainder = _columns(totals, members.shape[1]) - base.sum(axis=0)
+    return np.where(members, base + (order < remainder), 0).astype(int), order
+
+
+def _share(values, total):
+    """values / total per column, 0 for columns whose total is 0."""
+    total = np.broadcast_to(total, values.shape[1:])
+    return np.divide(values, total, out=np.zeros(values.shape), where=total != 0)
+
+
+def tab_additions(strategy, sales, stock, held_order, free):
+    """
+    Units the replenishment tab adds per product (rows) and machine (columns), and the
+    position of every product in the tab's list (-1: not listed).
+
+    sales: 30-day sales per product and machine; stock: warehouse quantity per product,
+    rows in warehouse order; held_order: order of the machine's own inventory; free:
+    capacity minus the machine's current total.
+        stable       the free space in proportion to the sales of the in-stock products
+                     (rounded, then the difference ±1 over the first products, which
+                     can leave -1 on a product rounded to 0), evenly without any
+                     sales; lists the in-stock products
+        aggressive   80% evenly over the 3 best-selling in-stock products the machine
+                     does not hold, the rest evenly over the others it does not hold
+        exploratory  80% evenly over the in-stock sellers the machine does not hold,
+                     the rest evenly over the in-stock products without sales (also
+                     any other strategy name)
+    aggressive and exploratory list the machine's own products first.
+    """
+    sales = np.asarray(sales, dtype=float)
+    held_order = np.asarray(held_order, dtype=float)
+    free = _columns(free, sales.shape[1]).astype(int)
+    in_stock = np.broadcast_to((np.asarray(stock) > 0)[:, None], sales.shape)
+    space = free > 0
+
+    if strategy == 'stable':
+        listed = in_stock & space
+        total = np.where(listed, sales, 0.0).sum(axis=0)
+        rounded = np.where(listed, np.round(_share(sales, total) * free), 0).astype(int)
+        diff = free - rounded.sum(axis=0)
+        rounded += np.where(listed & (positions(listed) < np.abs(diff)), np.sign(diff), 0)
+        additions = np.where(total > 0, rounded, even_split(listed, free))
+        return additions, positions(listed)
+
+    held = np.isfinite(held_order)
+    new = in_stock & ~held
+    if strategy == 'aggressive':
+        by_sales = positions(new, -sales)
+        fill = space & new.any(axis=0)
+        top = new & (by_sales < TOP_PRODUCTS) & fill
+        top_space = np.where(fill, np.round(free * TOP_SHARE), 0).astype(int)
+        others = new & (by_sales >= TOP_PRODUCTS) & (free - top_space > 0)
+        additions = even_split(top, top_space, by_sales) + even_split(others, free - top_space, by_sales)
+        listed = held | top | others
+        return additions, positions(listed, held_order, by_sales)
+
+    sellers = new & (sales > 0) & space
+    existing_space = np.where(space, np.round(free * EXISTING_SHARE), 0).astype(int)
+    untried = new & ~sellers & (free - existing_space > 0)
+    additions = even_split(sellers, existing_space) + even_split(untried, free - existing_space)
+    listed = held | sellers | untried
+    return additions, positions(listed, held_order, untried)
+
+
+def target_quantities(strategy, sales, sales_order, stock, in_warehouse, slots):
+    """
+    The presentation page's target quantity per product and machine for `slots`
+    available slots, and the rows' positions in the target list (-1: no target).
+
+    sales_order: order of the store's sales (inf: no sales); stock: warehouse quantity
+    per product; in_warehouse: products the selected warehouses carry at all.
+        stable       in proportion to the sales of products in the warehouses,
+                     capped by the stock
+        aggressive   80% evenly over the 3 best sellers in the warehouses, the rest
+                     evenly over the other sellers there, capped by the stock
+        exploratory  80% of the slots in proportion to all sales
+    Other strategy names give no targets. The stock caps the quotas before
+    distribute_remainder, so a row can end one unit above it.
+    """
+    sales = np.asarray(sales, dtype=float)
+    sales_order = np.asarray(sales_order, dtype=float)
+    slots = _columns(slots, sales.shape[1]).astype(int)
+    stock = np.asarray(stock, dtype=float)[:, None]
+    sellers = np.isfinite(sales_order)
+    warehouse_sellers = sellers & np.asarray(in_warehouse, dtype=bool)[:, None]
+
+    if strategy == 'stable':
+        total = np.where(warehouse_sellers, sales, 0.0).sum(axis=0)
+        quotas = np.minimum(_share(sales, total) * slots, stock)
+        return distribute_remainder(quotas, slots, warehouse_sellers, sales_order)
+    if strategy == 'aggressive':
+        by_sales = positions(warehouse_sellers, -sales, sales_order)
+        top = warehouse_sellers & (by_sales < TOP_PRODUCTS)
+        others = warehouse_sellers & ~top
+        top_slots = np.round(slots * TOP_SHARE)
+        quotas = np.where(top, _share(np.broadcast_to(top_slots, sales.shape), top.sum(axis=0)),
+                          _share(np.broadcast_to(slots - top_slots, sales.shape), others.sum(axis=0)))
+        return distribute_remainder(np.minimum(quotas, stock), slots, warehouse_sellers, by_sales)
+    if strategy == 'exploratory':
+        existing_slots = np.round(slots * EXISTING_SHARE)
+        total = np.where(sellers, sales, 0.0).sum(axis=0)
+        return distribute_remainder(_share(sales, total) * existing_slots, existing_slots, sellers, sales_order)
+    return distribute_remainder(np.zeros(sales.shape), 0, np.zeros(sales.shape, dtype=bool))
+
+
+def replenish_quantities(strategy, sales, sales_order, space):
+    """
+    Units the presentation page adds per product and machine to fill `space`, the
+    capacity left above the current stock, by the store's sales (no warehouse caps):
+        stable       in proportion to sales
+        aggressive   80% to the 3 best sellers and the rest to the others, in
+                     proportion to sales within each group
+        exploratory  80% of the space in proportion to sales
+    Other strategy names add nothing.
+    """
+    sales = np.asarray(sales, dtype=float)
+    sales_order = np.asarray(sales_order, dtype=float)
+    space = _columns(space, sales.shape[1]).astype(int)
+    sellers = np.isfinite(sales_order)
+
+    if strategy == 'stable':
+        total = np.where(sellers, sales, 0.0).sum(axis=0)
+        return distribute_remainder(_share(sales, total) * space, space, sellers, sales_order)[0]
+    if strategy == 'aggressive':
+        by_sales = positions(sellers, -sales, sales_order)
+        top = sellers & (by_sales < TOP_PRODUCTS)
+        others = sellers & ~top
+        top_total = np.where(top, sales, 0.0).sum(axis=0)
+        others_total = np.where(others, sales, 0.0).sum(axis=0)
+        top_space = np.round(space * TOP_SHARE)
+        quotas = np.where(top, _share(sales, top_total) * top_space, _share(sales, others_total) * (space - top_space))
+        members = (top & (top_total > 0)) | (others & (others_total > 0))
+        return distribute_remainder(quotas, space, members, by_sales)[0]
+    if strategy == 'exploratory':
+        existing_space = np.round(space * EXISTING_SHARE)
+        total = np.where(sellers, sales, 0.0).sum(axis=0)
+        return distribute_remainder(_share(sales, total) * existing_space, existing_space, sellers, sales_order)[0]
+    return np.zeros(sales.shape, dtype=int)
+
+
+def no_sales_quantities(strategy, stock, slots):
+    """
+    (rows, quantities) suggested to machines without any sales, in list order: stable
+    splits the slots evenly over the warehouse products, aggressive gives 30% each to
+    the 3 best-stocked products, exploratory tries 2 of everything; never more than the
+    stock.
+    """
+    stock = np.asarray(stock, dtype=int)
+    if strategy == 'stable':
+        rows = np.arange(len(stock))
+        quantities = np.full(len(stock), slots // max(len(stock), 1))
+    elif strategy == 'aggressive':
+        rows = np.argsort(-stock, kind='stable')[:TOP_PRODUCTS]
+        quantities = np.full(len(rows), round(slots * NO_SALES_TOP_SHARE))
+    else:  # exploratory
+        rows = np.arange(len(stock))
+        quantities = np.full(len(stock), NO_SALES_TRIAL_QTY)
+    return rows, np.minimum(quantities, stock[rows])
@@ -0,0 +1,472 @@
+import os
+import time
+import shutil
+import logging
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError
+
+from database import get_db, SessionLocal, UpdateLog, Warehouse, bump_data_version
+from scraper import run_scraper as run_inventory_scraper_function, parse_inventory_from_text, save_to_database, save_to_json, describe_incremental_stats, describe_sync_counts
+from salesscraper import run_sales_scraper
+from warehousescraper import run_warehouse_scraper
+from vendor_astra import fetch_astra_sales, build_transactions_from_astra_rows
+from inventory_api import fetch_inventory_via_api, UNVERIFIED_WARNING
+from browser_manager import browser_manager, describe_browser_stats
+from sales_ingest import ingest_transactions, describe_ingest_counts, get_sales_export_start_date
+from notifications import run_low_inventory_notifications
+from mailer import drain_outbound_queue, get_sendgrid_client
+from jobs import JobFailed, JOB_TYPES
+from snapshot_cache import warehouse_totals, store_forecasts
+from forecasting import train_forecasts
+
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def fetch_inventory_rows(browser_stats=None):
+    """
+    Returns structured inventory rows for the hourly refresh.
+    When the browser scraper runs, details about the shared browser session are
+    written into `browser_stats`.
+    INVENTORY_FETCH_MODE selects the source:
+      - 'browser' (default): Selenium scraper only
+      - 'auto': JSON API first, Selenium scraper if the API fails or returns nothing
+      - 'api': JSON API only
+    The API endpoints and response shapes (inventory_api.py) have not been verified
+    against the live backend yet, so the API is opt-in and logs a warning on every run.
+    """
+    fetch_mode = os.getenv('INVENTORY_FETCH_MODE', 'browser').lower()
+    if fetch_mode in ('auto', 'api'):
+        logging.warning(f"INVENTORY_FETCH_MODE={fetch_mode}: {UNVERIFIED_WARNING}")
+        try:
+            rows = fetch_inventory_via_api()
+            if rows:
+                logging.info(f"Fetched {len(rows)} inventory rows via the backend API.")
+                return rows
+            logging.warning("Backend API returned no inventory rows.")
+        except Exception as e:
+            if fetch_mode == 'api':
+                raise
+            logging.warning(f"Backend API inventory fetch failed, falling back to the browser scraper: {e}")
+        if fetch_mode == 'api':
+            return []
+
+    # 1. Execute the web scraper to get raw text, on the warm shared browser when available.
+    # Machines are read during the run, so it counts as of its start for the sales check
+    # of the next incremental scrape (a sale after a machine was read is re-checked).
+    started_at = datetime.now(pytz.timezone('Asia/Taipei'))
+    with browser_manager.borrow('inventory') as (driver, stats):
+        raw_inventory_text = run_inventory_scraper_function(headless=True, driver=driver)
+    if browser_stats is not None:
+        browser_stats.update(stats)
+        browser_stats['incremental'] = describe_incremental_stats()
+    if not raw_inventory_text:
+        return []
+    # 2. Parse the raw text into structured data
+    return parse_inventory_from_text(raw_inventory_text, scraped_at=started_at)
+
+
+def run_inventory_scraper_job(job):
+    """
+    Job 'inventory': fetches and saves the inventory, then queues the low-inventory notifications.
+    """
+    browser_stats = {}
+    try:
+        # We need to call the actual scraper logic here.
+        # Since scraper.py's main execution block is complex,
+        # we directly call the necessary functions.
+        
+        # 1. Fetch structured rows straight from the backend API when possible,
+        #    otherwise execute the web scraper and parse its raw text.
+        job.progress('Fetching inventory')
+        structured_data = fetch_inventory_rows(browser_stats)
+        
+        if structured_data:
+            # --- Define output paths ---
+            output_json_path = os.path.join(script_dir, 'structured_inventory.json')
+            
+            # 3. Save to JSON and Database
+            # Convert datetime objects for JSON serialization
+            json_serializable_data = []
+            for item in structured_data:
+                item_copy = item.copy()
+                if 'process_time' in item_copy and hasattr(item_copy['process_time'], 'isoformat'):
+                    item_copy['process_time'] = item_copy['process_time'].isoformat()
+                json_serializable_data.append(item_copy)
+            
+            save_to_json(json_serializable_data, output_json_path)
+            
+            # The data is already parsed with datetime objects, so we can save it directly
+            job.progress(f'Saving {len(structured_data)} inventory rows')
+            items_saved_count = len(structured_data)
+            sync_counts = save_to_database(structured_data)
+
+            # After saving inventory to database, queue the low-inventory notifications
+            # as their own job so they don't delay the scraper
+            try:
+                notify_job, _ = job.runner.submit('notify_low_inventory')
+                notify_note = f"Notifications queued as job {notify_job['id']}."
+            except Exception as e:
+                logging.error(f"Failed to queue notification job: {e}", exc_info=True)
+                notify_note = "Notifications could not be queued."
+
+            output = f"Scraper finished successfully. Processed {items_saved_count} items ({describe_sync_counts(sync_counts)}). {notify_note}"
+            status = "success"
+        else:
+            output = "Scraper ran but returned no data."
+            status = "error"
+            
+    except Exception as e:
+        output = f"An error occurred in background scraper: {str(e)}"
+        status = "error"
+        logging.error(output, exc_info=True)
+    
+    output = f"{output} {describe_browser_stats(browser_stats)} {browser_stats.get('incremental', '')}".strip()
+
+    # Log the update to the database with a retry mechanism
+    log_db_update(scraper_type='inventory', status=status, details=output)
+    if status != 'success':
+        raise JobFailed(output)
+    return output
+
+
+def run_sales_scraper_job(job):
+    """
+    Job 'sales': runs the sales scraper, processes the downloaded file,
+    and updates the database with a retry mechanism.
+    """
+    downloaded_file_path = None
+    browser_stats = {}
+    try:
+        # 1. Run the scraper to download the file, starting from the last ingested transaction
+        db: Session = next(get_db())
+        try:
+            start_date = get_sales_export_start_date(db)
+        finally:
+            db.close()
+        logging.info(f"Sales export start date: {start_date or 'full history'}")
+        job.progress(f"Downloading sales export from {start_date or 'full history'}")
+        # We explicitly set headless=True to ensure it runs without a GUI on the server.
+        with browser_manager.borrow('sales') as (driver, browser_stats):
+            downloaded_file_path = run_sales_scraper(headless=True, driver=driver, start_date=start_date)
+        
+        # 2. Process the downloaded Excel file
+        if downloaded_file_path:
+            job.progress('Ingesting sales export')
+            df = pd.read_excel(downloaded_file_path)
+            df.rename(columns={
+                'Shop name': 'shopName',
+                'Product': 'product',
+                'Trasaction Date': 'date',
+                'Total Transaction Amount': 'amount',
+                'Pay type': 'payType'
+            }, inplace=True)
+            transactions_data = df.to_dict('records')
+            
+            # 3. Add transactions to the DB with retry logic
+            max_retries = 3
+            retry_delay_seconds = 5
+            for attempt in range(max_retries):
+                db: Session = next(get_db())
+                try:
+                    # Append-only: rows already stored (same natural key) are skipped
+                    ingest_counts = ingest_transactions(db, transactions_data)
+                    
+                    db.commit()
+                    output = f"Sales scraper finished successfully. Transactions: {describe_ingest_counts(ingest_counts)}."
+                    status = "success"
+                    logging.info(f"Database operation successful on attempt {attempt + 1}.")
+                    db.close()
+                    break # Exit retry loop on success
+                except OperationalError as e:
+                    db.rollback()
+                    db.close()
+                    logging.error(f"Sales DB error (Attempt {attempt + 1}/{max_retries}): {e}")
+                    if attempt + 1 >= max_retries:
+                        output = f"Sales scraper failed after {max_retries} attempts: {e}"
+                        status = "error"
+                        raise
+                    logging.info(f"Retrying in {retry_delay_seconds} seconds...")
+                    time.sleep(retry_delay_seconds)
+                finally:
+                    # Ensure db is closed if it's still open
+                    if 'db' in locals() and db.is_active:
+                         db.close()
+        else:
+            output = "Sales scraper ran but did not return a file path."
+            status = "error"
+            
+    except Exception as e:
+        output = f"An error occurred in background sales scraper: {str(e)}"
+        status = "error"
+        logging.error(output, exc_info=True)
+    finally:
+        # 4. Clean up downloaded file and temp directory
+        if downloaded_file_path:
+            download_dir = os.path.dirname(downloaded_file_path)
+            try:
+                shutil.rmtree(download_dir)
+                logging.info(f"Successfully cleaned up temporary directory: {download_dir}")
+            except OSError as e:
+                logging.error(f"Error removing directory {download_dir}: {e.strerror}")
+                
+        output = f"{output} {describe_browser_stats(browser_stats)}".strip()
+
+        # Log the update to the database with a retry mechanism
+        log_db_update(scraper_type='sales', status=status, details=output)
+    if status != 'success':
+        raise JobFailed(output)
+    return output
+
+
+def log_db_update(scraper_type, status, details):
+    """Logs an update record to the database with a retry mechanism."""
+    max_retries = 3
+    retry_delay = 5
+    for attempt in range(max_retries):
+        db_log: Session = next(get_db())
+        try:
+            log_entry = UpdateLog(scraper_type=scraper_type, status=status, details=details)
+            db_log.add(log_entry)
+            db_log.commit()
+            logging.info(f"Successfully logged '{status}' for '{scraper_type}' scraper.")
+            return
+        except OperationalError as e:
+            db_log.rollback()
+            logging.error(f"Failed to write to update_logs (Attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt + 1 >= max_retries:
+                logging.error(f"Giving up on logging after {max_retries} attempts.")
+            else:
+                logging.info(f"Retrying log write in {retry_delay} seconds...")
+                time.sleep(retry_delay)
+        except Exception as e:
+            db_log.rollback()
+            logging.error(f"An unexpected error occurred while writing to update_logs: {e}", exc_info=True)
+            return # Don't retry on unexpected errors
+        finally:
+            db_log.close()
+
+
+# --- Warehouse Scraper Background Function ---
+def run_warehouse_scraper_job(job):
+    """
+    Job 'warehouse': 執行倉庫爬蟲，處理下載的檔案並更新資料庫。
+    """
+    downloaded_file_path = None
+    browser_stats = {}
+    try:
+        # 1. 執行爬蟲下載檔案（優先使用共用的已登入瀏覽器）
+        with browser_manager.borrow('warehouse') as (driver, browser_stats):
+            downloaded_file_path = run_warehouse_scraper(headless=True, driver=driver)
+        
+        # 2. 處理下載的 Excel 檔案
+        if downloaded_file_path:
+            job.progress('Processing warehouse export')
+            df = pd.read_excel(downloaded_file_path)
+            
+            # 確保必要的欄位存在
+            required_columns = ['Warehouse name', 'Product name', 'Remain quantity']
+            missing_columns = [col for col in required_columns if col not in df.columns]
+            if missing_columns:
+                raise ValueError(f"Excel 檔案缺少必要欄位: {', '.join(missing_columns)}")
+            
+            # 更新資料庫
+            max_retries = 3
+            retry_delay_seconds = 5
+            
+            for attempt in range(max_retries):
+                db: Session = next(get_db())
+                try:
+                    # 記錄當前時間作為更新時間
+                    update_time = datetime.now()
+                    
+                    # 將資料轉換為資料庫記錄
+                    warehouse_records = []
+                    for _, row in df.iterrows():
+                        warehouse_records.append(Warehouse(
+                            warehouse_name=row['Warehouse name'],
+                            product_name=row['Product name'],
+                            quantity=int(row['Remain quantity']),
+                            updated_at=update_time
+                        ))
+                    
+                    # 刪除舊的倉庫資料
+                    db.query(Warehouse).delete()
+                    
+                    # 新增新的倉庫資料
+                    db.bulk_save_objects(warehouse_records)
+                    bump_data_version(db, 'warehouse')
+                    db.commit()
+                    warehouse_totals.invalidate()
+                    
+                    output = f"成功更新倉庫資料。處理了 {len(warehouse_records)} 筆記錄。"
+                    status = "success"
+                    break
+                    
+                except OperationalError as e:
+                    db.rollback()
+                    if attempt + 1 >= max_retries:
+                        raise
+                    logging.error(f"資料庫操作失敗 (嘗試 {attempt + 1}/{max_retries}): {e}")
+                    time.sleep(retry_delay_seconds)
+                finally:
+                    db.close()
+        else:
+            output = "倉庫爬蟲執行完成但未返回檔案路徑。"
+            status = "error"
+            
+    except Exception as e:
+        output = f"倉庫爬蟲過程中發生錯誤: {str(e)}"
+        status = "error"
+        logging.error(output, exc_info=True)
+    finally:
+        # 清理下載的檔案和暫存目錄
+        if downloaded_file_path:
+            download_dir = os.path.dirname(downloaded_file_path)
+            try:
+                shutil.rmtree(download_dir)
+                logging.info(f"成功清理暫存目錄: {download_dir}")
+            except OSError as e:
+                logging.error(f"移除目錄時發生錯誤 {download_dir}: {e.strerror}")
+                
+        output = f"{output} {describe_browser_stats(browser_stats)}".strip()
+
+        # 記錄更新到資料庫
+        log_db_update(scraper_type='warehouse', status=status, details=output)
+    if status != 'success':
+        raise JobFailed(output)
+    return output
+
+
+# --- Astra Vendor Sales Background Function ---
+def run_astra_sales_job(job, start_date=None, end_date=None):
+    """Job 'astra_sales': fetches sales from Astra API and writes transactions to DB."""
+    try:
+        # Default to last 7 days if not provided
+        if not end_date:
+            end_date = datetime.now().strftime('%Y-%m-%d')
+        if not start_date:
+            start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+
+        # Fetch rows from Astra
+        logging.info(f"Fetching Astra sales between {start_date} and {end_date}")
+        job.progress(f"Fetching Astra sales {start_date} -> {end_date}")
+        rows = fetch_astra_sales(start_date=start_date, end_date=end_date)
+        transactions_data = build_transactions_from_astra_rows(rows, store_key=os.getenv('ASTRA_STORE_KEY', 'ASTRA-provisional'))
+
+        if not transactions_data:
+            output = 'Astra API returned no rows.'
+            status = 'error'
+            logging.warning(output)
+        else:
+            # Insert transactions into DB (clear and replace similar to other flows)
+            max_retries = 3
+            retry_delay_seconds = 5
+            for attempt in range(max_retries):
+                db: Session = next(get_db())
+                try:
+                    # Astra rows are daily aggregates: replace the fetched window instead of appending
+                    ingest_counts = ingest_transactions(db, transactions_data, replace_window=True)
+
+                    db.commit()
+                    output = f"Astra sales fetch finished successfully. Transactions: {describe_ingest_counts(ingest_counts)}."
+                    status = 'success'
+                    logging.info(output)
+                    db.close()
+                    break
+
+                except OperationalError as e:
+                    db.rollback()
+                    db.close()
+                    logging.error(f"Astra DB error (Attempt {attempt + 1}/{max_retries}): {e}")
+                    if attempt + 1 >= max_retries:
+                        output = f"Astra sales fetch failed after {max_retries} attempts: {e}"
+                        status = 'error'
+                        raise
+                    logging.info(f"Retrying in {retry_delay_seconds} seconds...")
+                    time.sleep(retry_delay_seconds)
+                finally:
+                    if 'db' in locals() and db.is_active:
+                        db.close()
+
+    except Exception as e:
+        output = f"An error occurred in Astra sales background job: {str(e)}"
+        status = 'error'
+        logging.error(output, exc_info=True)
+    finally:
+        log_db_update(scraper_type='astra_sales', status=status, details=output)
+    if status != 'success':
+        raise JobFailed(output)
+    return output
+
+
+def run_notify_low_inventory_job(job):
+    """Job 'notify_low_inventory': queued after every inventory refresh."""
+    result = notify_low_inventory()
+    if result.get('error'):
+        raise JobFailed(result['error'])
+    return f"{len(result['notifications'])} low-inventory emails for {result['users']} users. Mail: {result.get('mail')}"
+
+
+def notify_low_inventory():
+    """Runs the low-inventory notifications once; returns the result dict or {'error': ...}."""
+    db: Session = next(get_db())
+    try:
+        return run_low_inventory_notifications(db, SessionLocal)
+    except Exception as e:
+        logging.error(f"Error in notify-low-inventory internal: {e}", exc_info=True)
+        return {'error': str(e)}
+    finally:
+        db.close()
+
+
+def run_mail_job(job):
+    """
+    Job 'mail': drains the outbound mail queue, queued by the scheduler whenever a message
+    is due (e.g. a retry whose backoff ran past the drain of the run that queued it).
+    """
+    client = get_sendgrid_client()
+    if not client.configured:
+        raise JobFailed('SendGrid API key or from address missing')
+    return f"Mail queue drained: {drain_outbound_queue(SessionLocal, client=client)}"
+
+
+def run_forecast_job(job):
+    """Job 'forecast': refits the demand forecasts of every store and product (see forecasting.py)."""
+    db: Session = next(get_db())
+    try:
+        summary = train_forecasts(db, progress=job.progress)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Demand forecast training failed: {e}", exc_info=True)
+        raise JobFailed(f"Demand forecast training failed: {e}")
+    finally:
+        db.close()
+    store_forecasts.invalidate()
+    output = (f"Trained {summary['series']} demand forecasts ({summary['croston']} Croston) "
+              f"through {summary['trainedThrough']} in {summary['seconds']}s.")
+    backtest = summary['backtest']
+    if backtest:
+        output += (f" Backtest over {backtest['horizonDays']} days: WAPE {backtest['forecast']['wape']}"
+                   f" (30-day counts: {backtest['last30Days']['wape']}).")
+    return output
+
+
+def register_tasks(runner):
+    """Registers the function of every job type in JOB_TYPES on `runner`."""
+    functions = {
+        'inventory': run_inventory_scraper_job,
+        'sales': run_sales_scraper_job,
+        'warehouse': run_warehouse_scraper_job,
+        'astra_sales': run_astra_sales_job,
+        'notify_low_inventory': run_notify_low_inventory_job,
+        'forecast': run_forecast_job,
+        'mail': run_mail_job,
+    }
+    for job_type, concurrency in JOB_TYPES.items():
+        runner.register(job_type, functions[job_type], concurrency=concurrency)
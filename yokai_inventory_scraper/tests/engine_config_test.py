@@ -0,0 +1,72 @@
+import sys, tempfile, os, threading
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from database import make_engine, engine_options, describe_engine, Base, Feedback
+
+print('TEST START')
+tmp_dir = tempfile.mkdtemp()
+engine = make_engine(f"sqlite:///{os.path.join(tmp_dir, 'engine_config_test.db')}")
+info = describe_engine(engine)
+print('sqlite:', info)
+if info['pool'] != 'QueuePool' or info['journal_mode'] != 'wal' or info['synchronous'] != 1 or info['busy_timeout'] != 15000:
+    print('FAILED: SQLite engine not tuned')
+    sys.exit(1)
+
+# Sessions reuse pooled connections instead of opening the file every time
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+connects = []
+from sqlalchemy import event
+event.listen(engine, 'connect', lambda *args: connects.append(1))
+for _ in range(50):
+    db = Session()
+    db.execute(text('SELECT 1'))
+    db.close()
+print('connections opened for 50 sessions:', len(connects))
+if len(connects) > 1:
+    print('FAILED: connections are not pooled')
+    sys.exit(1)
+
+# Concurrent writers wait on the busy timeout instead of failing with 'database is locked'
+errors = []
+
+
+def writer(n):
+    try:
+        for i in range(20):
+            db = Session()
+            db.add(Feedback(user_id=f"w{n}", rating=1 + i % 5, comment='x'))
+            db.commit()
+            db.close()
+    except Exception as e:
+        errors.append(e)
+
+
+threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+db = Session()
+rows = db.query(Feedback).count()
+db.close()
+print('concurrent writes:', rows, 'errors:', errors[:1])
+if errors or rows != 160:
+    print('FAILED: concurrent writes failed')
+    sys.exit(1)
+
+# PostgreSQL options are built from the environment (no server needed)
+os.environ.update({'DB_POOL_SIZE': '7', 'DB_STATEMENT_TIMEOUT_MS': '15000', 'DB_POOL_RECYCLE': '600'})
+options, pragmas = engine_options('postgresql://user:pw@localhost/db')
+for name in ('DB_POOL_SIZE', 'DB_STATEMENT_TIMEOUT_MS', 'DB_POOL_RECYCLE'):
+    os.environ.pop(name)
+print('postgres:', options)
+if (options['pool_size'] != 7 or options['pool_recycle'] != 600 or not options['pool_pre_ping']
+        or options['connect_args'] != {'sslmode': 'require', 'options': '-c statement_timeout=15000'} or pragmas):
+    print('FAILED: PostgreSQL engine options')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,518 @@
+"""
+The per-machine replenishment suggestions as they were before strategy_kernel.py
+(replenishment.py of the batch endpoints, user-020 to user-022), kept verbatim as the
+reference for tests/strategy_kernel_test.py and tests/strategy_kernel_benchmark.py.
+Do not fix anything here: the kernel has to give the same answers, quirks included.
+"""
+
+
+def distribute_remainder(items, total_slots):
+    """
+    一個輔助函數，用於處理補貨建議數量計算中的小數問題。
+    它會確保所有產品的建議數量加總後剛好等於機台的目標總容量。
+    """
+    # 根據小數部分由大到小排序，小數越大的越優先獲得 +1
+    items.sort(key=lambda x: x['suggestedQty_float'] - int(x['suggestedQty_float']), reverse=True)
+    
+    # 計算所有品項無條件捨去後的總和
+    current_total = sum(int(item['suggestedQty_float']) for item in items)
+    remainder = total_slots - current_total
+    
+    result = []
+    for i, item in enumerate(items):
+        qty = int(item['suggestedQty_float'])
+        # 將餘下的數量逐一分配給排序最前面的品項
+        if i < remainder:
+            qty += 1
+        result.append({'productName': item['productName'], 'suggestedQty': qty, 'sales_count': item.get('sales_count', 0)})
+    
+    return result
+
+
+def warehouse_tab_suggestion(store_key, strategy, machine_capacity, selected_warehouses,
+                             warehouse_inventory, current_inventory, sales_counts):
+    """Suggestion for the replenishment tab (/api/warehouse-replenishment-suggestion)."""
+    if not warehouse_inventory:
+        return {
+            "success": False,
+            "message": "選擇的倉庫中沒有可用庫存"
+        }, 400
+
+    # 4. 根據策略生成建議
+    suggestion_list = []
+    warning = None
+
+    # 根據不同策略生成建議
+    if strategy == 'stable':
+        # 穩健策略：根據銷量比例分配剩餘空間
+        sales_products = []
+        current_total = sum(current_inventory.values())  # 當前總數
+        remaining_space = machine_capacity - current_total  # 剩餘可用空間
+
+        for product, warehouse_qty in warehouse_inventory.items():
+            current_qty = current_inventory.get(product, 0)
+            sales = sales_counts.get(product, 0)
+
+            if warehouse_qty > 0:  # 只考慮倉庫有庫存的產品
+                sales_products.append({
+                    'productName': product,
+                    'currentQty': current_qty,
+                    'warehouseQty': warehouse_qty,
+                    'salesCount30d': sales,
+                    'suggestedQty': current_qty  # 初始設為當前數量
+                })
+
+        if sales_products and remaining_space > 0:
+            # 根據銷量計算額外分配
+            total_sales = sum(p['salesCount30d'] for p in sales_products)
+            products_to_add = [p for p in sales_products if p['warehouseQty'] > 0]
+
+            if total_sales > 0 and products_to_add:
+                # 有銷量的產品按比例分配剩餘空間
+                base_additions = []
+                for product in products_to_add:
+                    ratio = product['salesCount30d'] / total_sales
+                    addition = round(ratio * remaining_space)
+                    base_additions.append((product, addition))
+
+                # 調整以確保總數正確
+                total_addition = sum(addition for _, addition in base_additions)
+                if total_addition != remaining_space:
+                    diff = remaining_space - total_addition
+                    # 按比例調整差異
+                    for i, (product, _) in enumerate(base_additions):
+                        if i < abs(diff):
+                            base_additions[i] = (product, base_additions[i][1] + (1 if diff > 0 else -1))
+
+                # 應用調整後的數量
+                for product, addition in base_additions:
+                    product['suggestedQty'] = product['currentQty'] + addition
+            else:
+                # 無銷量時平均分配剩餘空間
+                base_qty = remaining_space // len(products_to_add)
+                remainder = remaining_space % len(products_to_add)
+                for i, product in enumerate(products_to_add):
+                    addition = base_qty + (1 if i < remainder else 0)
+                    product['suggestedQty'] = product['currentQty'] + addition
+
+            suggestion_list.extend(sales_products)
+
+    elif strategy == 'aggressive':
+        # 積極策略：優先分配給熱銷品，確保總量為50
+        current_total = sum(current_inventory.values())
+        remaining_space = machine_capacity - current_total
+
+        # 先加入所有現有產品
+        suggestion_list = [{
+            'productName': product,
+            'currentQty': qty,
+            'suggestedQty': qty,  # 初始設為當前數量
+            'warehouseQty': warehouse_inventory.get(product, 0),
+            'salesCount30d': sales_counts.get(product, 0)
+        } for product, qty in current_inventory.items()]
+
+        # 根據銷量排序所有可能的新增產品
+        available_products = [(p, warehouse_inventory.get(p, 0), sales_counts.get(p, 0))
+                            for p in warehouse_inventory.keys()
+                            if p not in current_inventory and warehouse_inventory.get(p, 0) > 0]
+
+        sorted_products = sorted(available_products,
+                              key=lambda x: x[2],  # 按銷量排序
+                              reverse=True)
+
+        if remaining_space > 0 and sorted_products:
+            # 新產品中的前3名分配80%的剩餘空間
+            top_3 = sorted_products[:3]
+            top_3_space = round(remaining_space * 0.8)
+            base_qty = top_3_space // len(top_3)
+            remainder = top_3_space % len(top_3)
+
+            for i, (product, warehouse_qty, sales) in enumerate(top_3):
+                suggested_qty = base_qty + (1 if i < remainder else 0)
+                suggestion_list.append({
+                    'productName': product,
+                    'currentQty': 0,
+                    'suggestedQty': suggested_qty,
+                    'warehouseQty': warehouse_qty,
+                    'salesCount30d': sales
+                })
+
+        # 剩餘產品分配剩餘空間
+        other_products = sorted_products[3:]
+        remaining_space_for_others = remaining_space - top_3_space
+
+        if other_products and remaining_space_for_others > 0:
+            base_qty = remaining_space_for_others // len(other_products)
+            remainder = remaining_space_for_others % len(other_products)
+
+            for i, (product, warehouse_qty, sales) in enumerate(other_products):
+                suggested_qty = base_qty + (1 if i < remainder else 0)
+                suggestion_list.append({
+                    'productName': product,
+                    'currentQty': 0,
+                    'suggestedQty': suggested_qty,
+                    'warehouseQty': warehouse_qty,
+                    'salesCount30d': sales
+                })
+
+    else:  # exploratory
+        # 探索策略：80%空間給現有產品，20%給新產品
+        suggestion_list = []
+        current_total = sum(current_inventory.values())
+        remaining_space = machine_capacity - current_total
+
+        # 先加入所有現有產品
+        for product, qty in current_inventory.items():
+            suggestion_list.append({
+                'productName': product,
+                'currentQty': qty,
+                'suggestedQty': qty,  # 保持當前數量
+                'warehouseQty': warehouse_inventory.get(product, 0),
+                'salesCount30d': sales_counts.get(product, 0)
+            })
+
+        if remaining_space > 0:
+            # 處理有銷量但不在當前庫存的產品（佔剩餘空間的80%）
+            existing_space = round(remaining_space * 0.8)
+            sales_products = [(p, warehouse_inventory[p], sales_counts.get(p, 0))
+                            for p in warehouse_inventory.keys()
+                            if p not in current_inventory and sales_counts.get(p, 0) > 0 and warehouse_inventory[p] > 0]
+
+            if sales_products:
+                base_qty = existing_space // len(sales_products)
+                remainder = existing_space % len(sales_products)
+
+                for i, (product, warehouse_qty, sales) in enumerate(sales_products):
+                    suggested_qty = base_qty + (1 if i < remainder else 0)
+                    suggestion_list.append({
+                        'productName': product,
+                        'currentQty': 0,
+                        'suggestedQty': suggested_qty,
+                        'warehouseQty': warehouse_qty,
+                        'salesCount30d': sales
+                    })
+
+        # 處理新產品（沒有銷量的產品）
+        new_space = remaining_space - existing_space  # 剩餘20%空間給新產品
+        new_products = [(p, warehouse_inventory[p])
+                      for p in warehouse_inventory.keys()
+                      if p not in current_inventory and p not in [x['productName'] for x in suggestion_list] 
+                      and warehouse_inventory[p] > 0]
+
+        if new_products and new_space > 0:
+            base_qty = new_space // len(new_products)
+            remainder = new_space % len(new_products)
+
+            for i, (product, warehouse_qty) in enumerate(new_products):
+                suggested_qty = base_qty + (1 if i < remainder else 0)
+                suggestion_list.append({
+                    'productName': product,
+                    'currentQty': 0,
+                    'suggestedQty': suggested_qty,
+                    'warehouseQty': warehouse_qty,
+                    'salesCount30d': 0
+                })
+
+    # 5. 排序並返回結果
+    suggestion_list.sort(key=lambda x: (x['suggestedQty'] - x['currentQty']), reverse=True)
+
+    return {
+        "success": True,
+        "store_key": store_key,
+        "strategy_used": strategy,
+        "suggestion": suggestion_list,
+        "warning": warning,
+        "warehouse_info": [{
+            "name": w,
+            "products": len([p for p in warehouse_inventory if w in selected_warehouses])
+        } for w in selected_warehouses]
+    }, 200
+
+
+def machine_suggestion(store_key, strategy, reserve_slots, only_add, machine_capacity,
+                       warehouse_inventory, current_inventory, sales_counts):
+    """Suggestion for the presentation page (/api/replenishment-suggestion)."""
+    available_slots = machine_capacity - reserve_slots
+
+    total_sales_volume = sum(sales_counts.values())
+
+    if not warehouse_inventory:
+        return {
+            "success": False,
+            "message": "選擇的倉庫中沒有可用庫存"
+        }, 400
+
+    if total_sales_volume == 0:
+        # 如果沒有銷售數據，則根據倉庫庫存情況提供建議
+        available_products = list(warehouse_inventory.items())
+        if strategy == 'stable':
+            # 平均分配倉庫中有的商品
+            slots_per_product = available_slots // len(available_products)
+            suggestion_list = [
+                {'productName': p, 'suggestedQty': min(slots_per_product, q)} 
+                for p, q in available_products
+            ]
+        elif strategy == 'aggressive':
+            # 按倉庫庫存量排序，優先分配庫存量大的商品
+            sorted_products = sorted(available_products, key=lambda x: x[1], reverse=True)
+            top_products = sorted_products[:3]
+            suggestion_list = [
+                {'productName': p, 'suggestedQty': min(round(available_slots * 0.3), q)} 
+                for p, q in top_products
+            ]
+        else:  # exploratory
+            # 少量嘗試倉庫中的所有商品
+            suggestion_list = [
+                {'productName': p, 'suggestedQty': min(2, q)} 
+                for p, q in available_products
+            ]
+
+        return {
+            "success": True,
+            "strategy_used": f"{strategy}_no_sales",
+            "suggestion": suggestion_list,
+            "message": "根據倉庫庫存生成建議"
+        }, 200
+
+    # 3. 應用不同策略（考慮銷售數據和倉庫庫存）
+    suggestion_list = []
+    # 只考慮倉庫中有庫存的產品的銷售數據
+    filtered_sales = {
+        product: count for product, count in sales_counts.items() 
+        if product in warehouse_inventory
+    }
+    if not filtered_sales:
+        return {
+            "success": False,
+            "message": "倉庫中沒有任何有銷售記錄的產品"
+        }, 400
+
+    total_filtered_sales = sum(filtered_sales.values())
+    sorted_sales = sorted(filtered_sales.items(), key=lambda item: item[1], reverse=True)
+
+    if strategy == 'stable':
+        # 穩健策略：根據銷售比例分配，但受倉庫庫存限制
+        temp_suggestions = []
+        for p, c in filtered_sales.items():
+            suggested_qty = (c / total_filtered_sales) * available_slots
+            # 確保不超過倉庫庫存
+            warehouse_qty = warehouse_inventory.get(p, 0)
+            suggested_qty = min(suggested_qty, warehouse_qty)
+            temp_suggestions.append({
+                'productName': p,
+                'suggestedQty_float': suggested_qty,
+                'sales_count': c,
+                'warehouse_qty': warehouse_qty
+            })
+        suggestion_list = distribute_remainder(temp_suggestions, available_slots)
+
+    elif strategy == 'aggressive':
+        # 積極策略：優先分配銷量前三的產品，但受倉庫庫存限制
+        top_3_products = sorted_sales[:3]
+        other_products = sorted_sales[3:]
+
+        slots_for_top_3 = round(available_slots * 0.8)
+        slots_for_others = available_slots - slots_for_top_3
+
+        temp_suggestions = []
+        # 處理前三名產品
+        for p, c in top_3_products:
+            warehouse_qty = warehouse_inventory.get(p, 0)
+            suggested_qty = min(slots_for_top_3 / len(top_3_products), warehouse_qty)
+            temp_suggestions.append({
+                'productName': p,
+                'suggestedQty_float': suggested_qty,
+                'sales_count': c,
+                'warehouse_qty': warehouse_qty
+            })
+
+        # 處理其他產品
+        if other_products:
+            qty_per_other = slots_for_others / len(other_products)
+            for p, c in other_products:
+                warehouse_qty = warehouse_inventory.get(p, 0)
+                suggested_qty = min(qty_per_other, warehouse_qty)
+                temp_suggestions.append({
+                    'productName': p,
+                    'suggestedQty_float': suggested_qty,
+                    'sales_count': c,
+                    'warehouse_qty': warehouse_qty
+                })
+
+        suggestion_list = distribute_remainder(temp_suggestions, available_slots)
+
+    elif strategy == 'exploratory':
+        # 探索策略：保留20%空間給新產品，其餘根據銷量分配
+        slots_for_existing = round(available_slots * 0.8)
+        slots_for_new = available_slots - slots_for_existing
+
+        # 處理現有產品
+        temp_suggestions = []
+        for p, c in filtered_sales.items():
+            warehouse_qty = warehouse_inventory.get(p, 0)
+            suggested_qty = min(
+                (c / total_filtered_sales) * slots_for_existing,
+                warehouse_qty
+            )
+            temp_suggestions.append({
+                'productName': p,
+                'suggestedQty_float': suggested_qty,
+                'sales_count': c,
+                'warehouse_qty': warehouse_qty
+            })
+
+        # 尋找倉庫中有庫存但尚未銷售的新產品
+        new_products = [
+            p for p in warehouse_inventory.keys()
+            if p not in filtered_sales and warehouse_inventory[p] > 0
+        ]
+
+        # 為新產品分配空間
+        if new_products:
+            slots_per_new = slots_for_new / len(new_products)
+            for p in new_products:
+                warehouse_qty = warehouse_inventory[p]
+                suggested_qty = min(slots_per_new, warehouse_qty)
+                temp_suggestions.append({
+                    'productName': p,
+                    'suggestedQty_float': suggested_qty,
+                    'sales_count': 0,
+                    'warehouse_qty': warehouse_qty
+                })
+
+        suggestion_list = distribute_remainder(temp_suggestions, available_slots)
+        temp_suggestions = [{'productName': p, 'suggestedQty_float': (c / total_sales_volume) * slots_for_existing, 'sales_count': c} for p, c in sales_counts.items()]
+        suggestion_list = distribute_remainder(temp_suggestions, slots_for_existing)
+
+    # 4. 組合最終結果
+    final_suggestion = []
+    suggestion_map = {item['productName']: item['suggestedQty'] for item in suggestion_list}
+    all_product_names = set(current_inventory.keys()) | set(suggestion_map.keys())
+
+    # 正確邏輯：最大補貨總數量是補貨後的目標庫存量
+    warning = None
+    total_current = sum(current_inventory.get(name, 0) for name in all_product_names)
+
+    # 先將所有產品的建議數量設為不低於當前庫存
+    for name in all_product_names:
+        current_qty = current_inventory.get(name, 0)
+        suggested_qty = max(current_qty, suggestion_map.get(name, current_qty))
+        final_suggestion.append({
+            'productName': name,
+            'currentQty': current_qty,
+            'suggestedQty': suggested_qty,
+            'salesCount30d': sales_counts.get(name, 0)
+        })
+
+    # 按照調整量（建議數量-當前數量）排序，只保留前7個需要調整的項目
+    final_suggestion.sort(key=lambda x: (
+        x['suggestedQty'] - x['currentQty'],  # 首要條件：調整量
+        x['salesCount30d']  # 次要條件：銷量
+    ), reverse=True)
+
+    # 只保留需要調整的前7個項目，其他項目的建議數量設為當前庫存
+    needs_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] > 0]
+    no_adjustment = [x for x in final_suggestion if x['suggestedQty'] - x['currentQty'] <= 0]
+
+    if len(needs_adjustment) > 7:
+        for item in needs_adjustment[7:]:
+            item['suggestedQty'] = item['currentQty']
+
+    final_suggestion = needs_adjustment[:7] + no_adjustment
+    final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+
+    if total_current >= machine_capacity:
+        warning = f"現有庫存總和({total_current})已達最大補貨總數量({machine_capacity})，無需補貨。"
+        for name in all_product_names:
+            final_suggestion.append({
+                'productName': name,
+                'currentQty': current_inventory.get(name, 0),
+                'suggestedQty': current_inventory.get(name, 0),
+                'salesCount30d': sales_counts.get(name, 0)
+            })
+        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+        return {
+            "success": True,
+            "store_key": store_key,
+            "strategy_used": strategy,
+            "suggestion": final_suggestion,
+            "warning": warning
+        }, 200
+
+    # 剩餘可補貨空間
+    available_replenish = machine_capacity - total_current
+    # 依策略分配這些空間
+    # 重新計算分配：每個產品的補貨量 = 分配量，建議數量 = 現有庫存 + 分配量
+    # 先依照策略分配比例
+    # 取得有銷量的產品分配比例
+    if strategy == 'stable':
+        total_sales_volume = sum(sales_counts.values())
+        temp_suggestions = []
+        for p, c in sales_counts.items():
+            temp_suggestions.append({'productName': p, 'suggestedQty_float': (c / total_sales_volume) * available_replenish, 'sales_count': c})
+        distributed = distribute_remainder(temp_suggestions, available_replenish)
+    elif strategy == 'aggressive':
+        sorted_sales = sorted(sales_counts.items(), key=lambda item: item[1], reverse=True)
+        top_3_products = sorted_sales[:3]
+        other_products = sorted_sales[3:]
+        top_3_sales_volume = sum(c for _, c in top_3_products)
+        other_sales_volume = sum(c for _, c in other_products)
+        slots_for_top_3 = round(available_replenish * 0.8)
+        slots_for_others = available_replenish - slots_for_top_3
+        temp_suggestions = []
+        if top_3_sales_volume > 0:
+            temp_suggestions.extend([{'productName': p, 'suggestedQty_float': (c / top_3_sales_volume) * slots_for_top_3, 'sales_count': c} for p, c in top_3_products])
+        if other_sales_volume > 0 and len(other_products) > 0:
+            temp_suggestions.extend([{'productName': p, 'suggestedQty_float': (c / other_sales_volume) * slots_for_others, 'sales_count': c} for p, c in other_products])
+        distributed = distribute_remainder(temp_suggestions, available_replenish)
+    elif strategy == 'exploratory':
+        total_sales_volume = sum(sales_counts.values())
+        slots_for_existing = round(available_replenish * 0.8)
+        temp_suggestions = [{'productName': p, 'suggestedQty_float': (c / total_sales_volume) * slots_for_existing, 'sales_count': c} for p, c in sales_counts.items()]
+        distributed = distribute_remainder(temp_suggestions, slots_for_existing)
+    else:
+        distributed = []
+
+    # 將分配結果轉為 dict
+    distributed_map = {item['productName']: item['suggestedQty'] for item in distributed}
+
+    # 組合最終建議：建議數量 = 現有庫存 + 分配到的補貨量
+    for name in all_product_names:
+        current_qty = current_inventory.get(name, 0)
+        add_qty = distributed_map.get(name, 0)
+        suggested_qty = current_qty + add_qty
+        # 只補貨模式下，不建議減少現有庫存
+        if only_add and suggested_qty < current_qty:
+            suggested_qty = current_qty
+        final_suggestion.append({
+            'productName': name,
+            'currentQty': current_qty,
+            'suggestedQty': suggested_qty,
+            'salesCount30d': sales_counts.get(name, 0)
+        })
+    final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+
+    # 最終檢查總和，理論上不會超過 machine_capacity
+    total_final = sum(item['suggestedQty'] for item in final_suggestion)
+    if total_final > machine_capacity:
+        warning = f"分配後總庫存({total_final})超過最大補貨總數量({machine_capacity})，已自動調整至上限。"
+        # 依現有庫存排序，依序減少至符合上限
+        over = total_final - machine_capacity
+        for item in sorted(final_suggestion, key=lambda x: x['suggestedQty'], reverse=True):
+            if over <= 0:
+                break
+            reducible = item['suggestedQty'] - item['currentQty']
+            if reducible > 0:
+                reduce_by = min(reducible, over)
+                item['suggestedQty'] -= reduce_by
+                over -= reduce_by
+        # 再次排序
+        final_suggestion.sort(key=lambda x: x['suggestedQty'], reverse=True)
+
+    return {
+        "success": True,
+        "store_key": store_key,
+        "strategy_used": strategy,
+        "suggestion": final_suggestion,
+        "warning": warning
+    }, 200
@@ -0,0 +1,43 @@
+import sys, os, time, random
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from fleet_planner import plan_fleet, MAX_ITEMS_PER_MACHINE
+
+# A route of 500 machines (FLEET_MACHINES) over 250 stores, 120 products, with warehouse
+# stock for only about half of the fleet's free slots, so the plan has to ration.
+MACHINES = int(os.environ.get('FLEET_MACHINES', 500))
+PRODUCTS = 120
+random.seed(11)
+
+store_keys = [f"門市 {m // 2:03d}-M{m:04d}" for m in range(MACHINES)]
+products = [f"商品 {p:03d}" for p in range(PRODUCTS)]
+inventories = {k: {p: random.randint(0, 4) for p in random.sample(products, 8)} for k in store_keys}
+sales = {f"門市 {s:03d}": {p: random.randint(0, 60) for p in random.sample(products, 25)} for s in range((MACHINES + 1) // 2)}
+free_slots = sum(50 - sum(inventory.values()) for inventory in inventories.values())
+warehouse = {p: random.randint(0, free_slots // PRODUCTS) for p in products}
+capacities = {k: 50 for k in store_keys}
+
+print('TEST START')
+print(f"{MACHINES} machines, {PRODUCTS} products, {free_slots} free slots, {sum(warehouse.values())} units in stock")
+for strategy in ('stable', 'aggressive', 'exploratory'):
+    started = time.perf_counter()
+    results, summary = plan_fleet(store_keys, strategy, capacities, warehouse, inventories, sales)
+    seconds = time.perf_counter() - started
+    print(f"  {strategy:12s} {seconds:6.3f}s  {summary['allocated']} units allocated, {summary['unfilledSlots']} slots unfilled")
+    handed_out = {}
+    for result in results:
+        items = [item for item in result['suggestion'] if item['suggestedQty'] > item['currentQty']]
+        for item in items:
+            handed_out[item['productName']] = handed_out.get(item['productName'], 0) + item['suggestedQty'] - item['currentQty']
+        if len(items) > MAX_ITEMS_PER_MACHINE or sum(item['suggestedQty'] for item in result['suggestion']) > 50:
+            print(f"FAILED: {result['store_key']} breaks the item or capacity limit")
+            sys.exit(1)
+    if any(units > warehouse[product] for product, units in handed_out.items()):
+        print('FAILED: more units planned than the warehouse has')
+        sys.exit(1)
+    if seconds > 1.0:
+        print('FAILED: planning took over a second')
+        sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
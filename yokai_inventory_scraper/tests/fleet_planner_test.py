@@ -0,0 +1,93 @@
+import sys, tempfile, os
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'fleet_planner_test.db')}"
+from sqlalchemy import insert
+from server import app
+from database import SessionLocal, Store, Inventory, Transaction, Warehouse
+from sales_rollup import rebuild_sales_daily
+from fleet_planner import plan_fleet, MAX_ITEMS_PER_MACHINE
+
+
+def added(result):
+    return {item['productName']: item['suggestedQty'] - item['currentQty'] for item in result['suggestion']
+            if item['suggestedQty'] > item['currentQty']}
+
+
+print('TEST START')
+# Ten machines all selling 可口可樂, which the warehouse only has 20 of
+store_keys = [f"台北店-{m}" for m in range(10)]
+results, summary = plan_fleet(store_keys, 'stable', {k: 50 for k in store_keys}, {'可口可樂': 20, '綠茶': 500},
+                              {k: {} for k in store_keys}, {'台北店': {'可口可樂': 100, '綠茶': 100}})
+cola = sum(added(r).get('可口可樂', 0) for r in results)
+print('scarce stock:', cola, summary)
+if cola != 20 or summary['warehouseRemaining'].get('可口可樂') or any(sum(added(r).values()) != 50 for r in results):
+    print('FAILED: scarce stock must be handed out exactly once and machines filled with what is left')
+    sys.exit(1)
+
+# Stable is proportional to sales, counting what the machine already holds
+results, _ = plan_fleet(['A-1'], 'stable', {'A-1': 40}, {'P1': 99, 'P2': 99}, {'A-1': {'P2': 4}}, {'A': {'P1': 30, 'P2': 10}})
+print('stable:', added(results[0]))
+if added(results[0]) != {'P1': 30, 'P2': 6}:
+    print('FAILED: stable allocation')
+    sys.exit(1)
+
+# Aggressive gives the top 3 sellers 80%, exploratory keeps 20% for products without sales
+products = {f"P{p}": 99 for p in range(10)}
+sales = {'A': {f"P{p}": 10 for p in range(5)}}
+aggressive = added(plan_fleet(['A-1'], 'aggressive', {'A-1': 50}, products, {'A-1': {}}, sales)[0][0])
+exploratory = added(plan_fleet(['A-1'], 'exploratory', {'A-1': 50}, products, {'A-1': {}}, sales)[0][0])
+print('aggressive:', aggressive, 'exploratory:', exploratory)
+top = sum(aggressive.get(f"P{p}", 0) for p in range(3))
+new = sum(exploratory.get(f"P{p}", 0) for p in range(5, 10))
+if top != 40 or sum(aggressive.values()) != 50 or new != 10 or len(exploratory) > MAX_ITEMS_PER_MACHINE:
+    print('FAILED: strategy weighting')
+    sys.exit(1)
+
+# At most 7 products topped up per machine; machines without sales follow the fleet's demand
+products = {f"P{p}": 99 for p in range(20)}
+results, _ = plan_fleet(['A-1', 'B-1'], 'stable', {'A-1': 50, 'B-1': 20}, products, {'A-1': {}, 'B-1': {'P0': 25}},
+                        {'A': {f"P{p}": 20 - p for p in range(20)}})
+print('item limit:', added(results[0]), results[1]['warning'])
+if len(added(results[0])) != MAX_ITEMS_PER_MACHINE or added(results[1]) or not results[1]['warning']:
+    print('FAILED: item limit / full machine')
+    sys.exit(1)
+results, _ = plan_fleet(['A-1', 'B-1'], 'stable', {'A-1': 50, 'B-1': 20}, products, {'A-1': {}, 'B-1': {}},
+                        {'A': {'P3': 5}})
+if added(results[1]) != {'P3': 20}:
+    print('FAILED: machine without sales should follow the fleet demand')
+    sys.exit(1)
+
+# Through the API, with stock, inventories and sales from the database
+now = datetime.now().replace(microsecond=0)
+db = SessionLocal()
+db.add_all([Store(store_key=k) for k in ('台北店-1', '台北店-2', '高雄店-1')])
+db.add(Inventory(store='台北店', machine_id='1', product_name='可口可樂', quantity=10, process_time=now))
+db.add_all([Warehouse(warehouse_name='總倉', product_name='可口可樂', quantity=12, updated_at=now),
+            Warehouse(warehouse_name='總倉', product_name='綠茶', quantity=6, updated_at=now)])
+db.execute(insert(Transaction), [
+    {'store_key': '台北店-1' if i % 3 else '高雄店-1', 'transaction_time': now - timedelta(hours=i),
+     'product_name': '可口可樂' if i % 2 else '綠茶', 'amount': 30, 'payment_type': 'LINE Pay'}
+    for i in range(60)
+])
+rebuild_sales_daily(db)
+db.commit()
+db.close()
+
+client = app.test_client()
+body = client.post('/api/fleet-replenishment-plan', json={
+    'store_keys': ['台北店-1', '台北店-2', '高雄店-1'], 'strategy': 'stable', 'warehouses': ['總倉'], 'max_total_qty': 30,
+    'capacities': {'台北店-1': 12}}).get_json()
+print('api:', {r['store_key']: added(r) for r in body['results']}, body['summary'])
+if not body['success'] or body['summary']['allocated'] != 18 or sum(added(body['results'][0]).values()) != 2:
+    print('FAILED: fleet plan endpoint')
+    sys.exit(1)
+if client.post('/api/fleet-replenishment-plan', json={'store_keys': ['台北店-1'], 'warehouses': ['沒有這個倉']}).status_code != 400:
+    print('FAILED: empty warehouses should be rejected')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,55 @@
+import sys, os, time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import numpy as np
+from forecasting import fit_forecasts, backtest, FORECAST_WORKERS
+
+# Fits a synthetic fleet (FORECAST_SERIES store x product series, default 300 machines x
+# 80 products, over a year of days) and backtests it against the 30-day counts. Series mix:
+# steady sellers, intermittent ones, products whose sales grow or drop, and new listings.
+SERIES = int(os.environ.get('FORECAST_SERIES', 24000))
+DAYS = int(os.environ.get('FORECAST_DAYS', 365))
+# The job has to finish well within its nightly slot
+LIMIT_SECONDS = 120
+rng = np.random.default_rng(11)
+
+base = rng.gamma(0.7, 1.5, SERIES)
+kind = rng.choice(['steady', 'intermittent', 'shift', 'new'], SERIES, p=[0.4, 0.3, 0.2, 0.1])
+rate = np.tile(base[:, None], (1, DAYS))
+rate[kind == 'intermittent'] *= 0.15
+shift_day = rng.integers(DAYS - 120, DAYS - 40, SERIES)
+after_shift = np.arange(DAYS)[None, :] >= shift_day[:, None]
+factor = np.where(rng.random(SERIES) < 0.5, 2.0, 0.5)
+rate = np.where((kind == 'shift')[:, None] & after_shift, rate * factor[:, None], rate)
+rate = np.where((kind == 'new')[:, None] & ~after_shift, 0.0, rate)
+# Weekly pattern: more sales on weekends
+rate *= np.where(np.arange(DAYS) % 7 >= 5, 1.3, 0.88)[None, :]
+sales = rng.poisson(rate).astype(float)
+sales[kind == 'intermittent'] *= rng.integers(1, 5, (int((kind == 'intermittent').sum()), 1))
+
+print('TEST START')
+print(f"{SERIES} series x {DAYS} days, {os.cpu_count()} CPUs")
+timings = {}
+for workers in sorted({1, FORECAST_WORKERS}):
+    started = time.perf_counter()
+    fitted = fit_forecasts(sales, workers)
+    timings[workers] = time.perf_counter() - started
+    print(f"  fit, {workers} worker(s): {timings[workers]:.2f}s ({int(fitted['croston'].sum())} Croston series)")
+
+started = time.perf_counter()
+scores = backtest(sales)
+print(f"  backtest over the last {scores['horizonDays']} days ({scores['series']} series, {time.perf_counter() - started:.2f}s):")
+for name in ('forecast', 'last30Days'):
+    print(f"    {name:11s} MAE {scores[name]['mae']:6.2f}  WAPE {scores[name]['wape']:.3f}  bias {scores[name]['bias']:+.3f}")
+for label in ('steady', 'intermittent', 'shift', 'new'):
+    part = backtest(sales[kind == label])
+    print(f"    {label:12s} forecast WAPE {part['forecast']['wape']:.3f} vs 30-day counts {part['last30Days']['wape']:.3f}")
+
+if min(timings.values()) > LIMIT_SECONDS:
+    print(f"FAILED: fitting took over {LIMIT_SECONDS}s")
+    sys.exit(1)
+if scores['forecast']['wape'] > scores['last30Days']['wape']:
+    print('FAILED: forecasts are worse than the 30-day counts')
+    sys.exit(1)
+print('TEST PASS')
+print('TEST END')
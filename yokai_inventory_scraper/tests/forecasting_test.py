@@ -0,0 +1,136 @@
+import sys, tempfile, os
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'forecasting_test.db')}"
+import numpy as np
+from server import app, job_runner
+from database import SessionLocal, Store, Inventory, Warehouse, DemandForecast
+from sales_ingest import ingest_transactions
+import forecasting
+import replenishment
+from forecasting import fit_ses, fit_croston, fit_forecasts, backtest
+
+
+def fail(message):
+    print(f"FAILED: {message}")
+    sys.exit(1)
+
+
+print('TEST START')
+# The recursions on known series
+rate, _ = fit_ses(np.full((1, 60), 3.0))
+if not np.allclose(rate, 3.0):
+    fail(f"SES of a constant series: {rate[:, 0]}")
+rate, _ = fit_ses(np.concatenate([np.zeros((1, 100)), np.full((1, 20), 2.0)], axis=1))
+if not np.allclose(rate, 2.0):
+    fail('SES counts the days before the first sale')
+every_fourth = np.zeros((1, 120))
+every_fourth[0, ::4] = 4
+rate, _ = fit_croston(every_fourth)
+expected = 1 - np.asarray(forecasting.ALPHAS) / 2  # 1 unit a day, with the SBA correction
+if not np.allclose(rate[:, 0], expected):
+    fail(f"Croston of 4 units every 4th day: {rate[:, 0]}")
+
+# Method per series, and the same fit however the rows are split over blocks and threads
+rng = np.random.default_rng(3)
+sales = np.concatenate([rng.poisson(5, (40, 90)), rng.poisson(0.2, (40, 90)) * 3]).astype(float)
+fitted = fit_forecasts(sales, workers=1)
+print('croston rows:', int(fitted['croston'][:40].sum()), '/', int(fitted['croston'][40:].sum()))
+if fitted['croston'][:40].any() or not fitted['croston'][40:].all():
+    fail('daily sellers must use SES, intermittent ones Croston')
+if abs(fitted['rate'][:40].mean() - 5) > 0.5 or abs(fitted['rate'][40:].mean() - 0.6) > 0.15:
+    fail(f"rates off: {fitted['rate'][:40].mean():.2f}, {fitted['rate'][40:].mean():.2f}")
+forecasting.BLOCK_ROWS = 7
+blocked = fit_forecasts(sales, workers=3)
+forecasting.BLOCK_ROWS = 2048
+if any(not np.array_equal(blocked[name], fitted[name]) for name in fitted):
+    fail('blocked / threaded fit differs')
+# A product whose sales doubled: the forecast follows, the 30-day counts lag behind
+trend = np.concatenate([np.full((1, 100), 2.0), np.full((1, 50), 4.0)], axis=1)
+scores = backtest(trend)
+print('backtest:', scores)
+if scores['forecast']['wape'] >= scores['last30Days']['wape']:
+    fail('forecast not better than the 30-day counts after a level shift')
+
+# The job on real rows: one daily seller and one sold every 5th day, up to yesterday
+now = datetime.now().replace(microsecond=0)
+
+class Clock(datetime):
+    """Pins the clock of the forecast job and of the 30-day sales window to `now`."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return now
+
+
+forecasting.datetime = replenishment.datetime = Clock
+db = SessionLocal()
+db.add_all([Store(store_key='台北店-1'), Store(store_key='高雄店-1')])
+db.add_all([Inventory(store='台北店', machine_id='1', product_name='可口可樂', quantity=5, process_time=now),
+            Inventory(store='高雄店', machine_id='1', product_name='綠茶', quantity=5, process_time=now)])
+db.add_all([Warehouse(warehouse_name='總倉', product_name='可口可樂', quantity=200, updated_at=now),
+            Warehouse(warehouse_name='總倉', product_name='綠茶', quantity=200, updated_at=now)])
+db.commit()
+items = []
+for day in range(1, 91):
+    when = now - timedelta(days=day)
+    for n in range(4 if day > 30 else 2):  # cola sold 4 a day, 2 a day in the last month
+        items.append({'shopName': '台北店', 'product': '可口可樂', 'date': (when + timedelta(minutes=n)).strftime('%Y-%m-%d %H:%M:%S'),
+                      'amount': 30, 'payType': 'LINE Pay'})
+    if day % 5 == 0:
+        items += [{'shopName': '台北店', 'product': '綠茶', 'date': (when + timedelta(minutes=n)).strftime('%Y-%m-%d %H:%M:%S'),
+                   'amount': 25, 'payType': 'LINE Pay'} for n in range(5)]
+# 高雄店 only sold today, so it has no forecast and keeps its 30-day sales
+items.append({'shopName': '高雄店', 'product': '綠茶', 'date': now.strftime('%Y-%m-%d %H:%M:%S'), 'amount': 25, 'payType': 'LINE Pay'})
+ingest_transactions(db, items)
+db.commit()
+db.close()
+
+client = app.test_client()
+response = client.post('/run-forecast')
+job_runner.wait_idle(timeout=60)
+status = client.get('/forecast-status').get_json()
+print(response.status_code, status['status'], status['last_run_output'])
+if response.status_code != 202 or status['status'] != 'success':
+    fail('forecast job did not succeed')
+db = SessionLocal()
+forecasts = {row.product_name: row for row in db.query(DemandForecast)}
+db.close()
+print({product: (row.method, round(row.daily_rate, 2)) for product, row in forecasts.items()})
+if forecasts['可口可樂'].method != 'ses' or abs(forecasts['可口可樂'].daily_rate - 2) > 0.2:
+    fail('daily seller forecast')
+if forecasts['綠茶'].method != 'croston' or abs(forecasts['綠茶'].daily_rate - 1) > 0.15:
+    fail('intermittent seller forecast')
+
+
+def demand(source):
+    body = client.post('/api/replenishment-suggestions', json={
+        'store_keys': ['台北店-1', '高雄店-1'], 'strategy': 'stable', 'warehouses': ['總倉'], 'demand': source
+    }).get_json()
+    return [{item['productName']: item['salesCount30d'] for item in result['suggestion']} for result in body['results']]
+
+
+sales_counts, forecast_counts = demand('sales'), demand('forecast')
+print('sales:', sales_counts, 'forecast:', forecast_counts)
+if sales_counts[0] != {'可口可樂': 60, '綠茶': 30}:
+    fail('default demand must stay the 30-day sales')
+if abs(forecast_counts[0]['可口可樂'] - 60) > 6 or abs(forecast_counts[0]['綠茶'] - 30) > 5:
+    fail('forecast demand per 30 days')
+if forecast_counts[1] != sales_counts[1]:
+    fail('a store without forecasts must fall back to its sales')
+
+# Retraining bumps the 'forecasts' version, so cached forecasts are not served afterwards
+db = SessionLocal()
+db.query(DemandForecast).filter(DemandForecast.product_name == '綠茶').update({'daily_rate': 3.0})
+from database import bump_data_version
+bump_data_version(db, 'forecasts')
+db.commit()
+db.close()
+if demand('forecast')[0]['綠茶'] != 90:
+    fail('forecast snapshot not refreshed after a new version')
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from server import app, get_data_cache
+
+client = app.test_client()
+store_key = 'cache-test-store-1'
+print('TEST START')
+
+try:
+    get_data_cache.clear()
+    r1 = client.get('/get-data')
+    etag = r1.headers.get('ETag')
+    print('first:', r1.status_code, etag, get_data_cache.stats())
+    if r1.status_code != 200 or not etag or not r1.get_json().get('success'):
+        print('FAILED: first request')
+        sys.exit(1)
+
+    r2 = client.get('/get-data')
+    if r2.status_code != 200 or r2.get_data() != r1.get_data() or get_data_cache.hits != 1:
+        print('FAILED: second request was not served from cache', get_data_cache.stats())
+        sys.exit(1)
+
+    r3 = client.get('/get-data', headers={'If-None-Match': etag})
+    print('conditional:', r3.status_code)
+    if r3.status_code != 304 or r3.get_data():
+        print('FAILED: expected an empty 304')
+        sys.exit(1)
+
+    # a store edit bumps the 'stores' version, so the next request is rebuilt
+    misses = get_data_cache.misses
+    client.post(f'/api/stores/{store_key}', json={'note': 'cache test'})
+    r4 = client.get('/get-data')
+    print('after store edit:', r4.status_code, get_data_cache.stats())
+    if get_data_cache.misses != misses + 1:
+        print('FAILED: store edit did not invalidate the cache')
+        sys.exit(1)
+
+    stats = client.get('/api/cache-stats').get_json()
+    print('cache-stats:', stats)
+    if stats['caches']['get-data']['notModified'] < 1:
+        print('FAILED: cache-stats missing counters')
+        sys.exit(1)
+    print('TEST PASS')
+finally:
+    client.delete(f'/api/inventory/{store_key}')
+
+print('TEST END')
@@ -0,0 +1,109 @@
+import sys, tempfile, os
+from pathlib import Path
+from datetime import datetime
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'incremental_scrape_test.db')}"
+from database import Base, engine, SessionLocal, Store, Transaction
+from scraper import IncrementalPlan, parse_inventory_from_text, sync_inventory
+
+# Store list rows as the texts of their cells; no browser needed.
+
+known = {
+    ('TW Lion HQ 1.0', '551'): {
+        'last_updated': '2025-08-18 10:21:04 (Asia/Taipei)',
+        'scraped_at': datetime(2025, 8, 18, 11, 0, 0),
+        'rows': [('日本卡樂比薯條', 6), ('樂天小熊餅乾', 12)],
+    },
+    ('台北天文館 左邊', 'TW-0320'): {
+        'last_updated': '2025-08-18 09:00:00 (Asia/Taipei)',
+        'scraped_at': datetime(2025, 8, 18, 11, 0, 0),
+        'rows': [('日本卡樂比薯條', 4)],
+    },
+    ('台北天文館 右邊', 'TW-0321'): {
+        'last_updated': '2025-08-17 09:00:00 (Asia/Taipei)',
+        'scraped_at': datetime(2025, 8, 18, 11, 0, 0),
+        'rows': [('可口可樂 330ml', 3)],
+    },
+}
+last_sale_by_store = {'台北天文館 右邊': datetime(2025, 8, 18, 11, 30, 0)}
+
+print('TEST START')
+plan = IncrementalPlan(known, last_sale_by_store)
+cases = [
+    (['TW Lion HQ 1.0', '551', '台北市', '2025-08-18 10:21:04', 'Inventory inquiry'], False),  # unchanged
+    (['台北天文館 左邊', 'TW-0320', '台北市', '2025-08-18 12:05:00', 'Inventory inquiry'], True),  # replenished
+    (['台北天文館 右邊', 'TW-0321', '台北市', '2025-08-17 09:00:00', 'Inventory inquiry'], True),  # sold since
+    (['新店面', 'TW-0999', '新北市', '2025-08-18 10:00:00', 'Inventory inquiry'], True),  # unknown machine
+    (['TW Lion HQ 1.0', '551', '台北市', '', 'Inventory inquiry'], True),  # no timestamp shown
+    # Known names and ids inside other cells are not that machine
+    (['TW Lion HQ 1.0', '5510', '台北市', '2025-08-18 10:21:04', 'Inventory inquiry'], True),
+    (['TW Lion HQ 1.0 二館', '551', '台北市', '2025-08-18 10:21:04', 'Inventory inquiry'], True),
+]
+for cells, expected in cases:
+    got = plan.should_scrape(cells)
+    print(f'{" | ".join(cells)[:40]:<42} scrape={got}')
+    if got != expected:
+        print('FAILED: wrong decision')
+        sys.exit(1)
+
+print('stats:', plan.stats)
+if plan.stats != {'visited': 6, 'skipped': 1, 'new': 3, 'replenished': 1, 'sold': 1, 'no_timestamp': 1}:
+    print('FAILED: unexpected stats')
+    sys.exit(1)
+
+# Carried-forward machines must come back out of the normal parser unchanged
+rows = parse_inventory_from_text(plan.carry_forward_text())
+got = sorted((r['store'], r['machine_id'], r['product_name'], r['quantity'], r['last_updated']) for r in rows)
+expected = sorted([
+    ('TW Lion HQ 1.0', '551', '日本卡樂比薯條', 6, '2025-08-18 10:21:04 (Asia/Taipei)'),
+    ('TW Lion HQ 1.0', '551', '樂天小熊餅乾', 12, '2025-08-18 10:21:04 (Asia/Taipei)'),
+])
+print('carried rows:', got)
+if got != expected or not all(r['carried'] for r in rows):
+    print('FAILED: carried-forward rows differ')
+    sys.exit(1)
+
+# Against the database: the machine is read at 10:00, carried forward at 11:00, and only then
+# the nightly ingest brings in a sale from 10:30. The sale is newer than the last real read.
+Base.metadata.create_all(bind=engine)
+row = ['TW Lion HQ 1.0', '551', '台北市', '2025-08-18 10:21:04', 'Inventory inquiry']
+machine_text = ('--- Store #1 ---\n上次補貨時間 : 2025-08-18 10:21:04 (Asia/Taipei)\n'
+                'Store name Machine name Product name Inventory quantity\nTW Lion HQ 1.0\n551\n日本卡樂比薯條\n6\n')
+
+
+def sync(rows):
+    db = SessionLocal()
+    sync_inventory(db, rows)
+    db.commit()
+    db.close()
+
+
+sync(parse_inventory_from_text(machine_text, scraped_at=datetime(2025, 8, 18, 10)))
+plan = IncrementalPlan.from_database()
+if plan.should_scrape(row):
+    print('FAILED: an unchanged machine without sales was visited')
+    sys.exit(1)
+sync(parse_inventory_from_text(plan.carry_forward_text(), scraped_at=datetime(2025, 8, 18, 11)))
+
+db = SessionLocal()
+db.add(Store(store_key='TW Lion HQ 1.0-551'))
+db.add(Transaction(store_key='TW Lion HQ 1.0-551', transaction_time=datetime(2025, 8, 18, 10, 30), amount=30,
+                   product_name='日本卡樂比薯條', payment_type='LINE Pay'))
+db.commit()
+db.close()
+plan = IncrementalPlan.from_database()
+print('after the sale:', plan.known[('TW Lion HQ 1.0', '551')]['scraped_at'], plan.should_scrape(row), plan.stats)
+if plan.stats['sold'] != 1:
+    print('FAILED: a sale after the last real read did not trigger a visit')
+    sys.exit(1)
+
+# Reading the machine again covers the sale
+sync(parse_inventory_from_text(machine_text, scraped_at=datetime(2025, 8, 18, 12)))
+if IncrementalPlan.from_database().should_scrape(row):
+    print('FAILED: the sale was still counted after the machine was read again')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
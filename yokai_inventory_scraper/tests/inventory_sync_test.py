@@ -0,0 +1,83 @@
+import sys, tempfile, os
+from pathlib import Path
+from datetime import datetime
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from database import Base, Inventory, InventorySync, latest_inventory_sync
+from scraper import sync_inventory
+
+# Runs sync_inventory against a throwaway SQLite file, so the real inventory.db is untouched.
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'sync_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+statements = []
+event.listen(engine, 'before_cursor_execute', lambda conn, cursor, sql, params, context, many: statements.append(' '.join(sql.split()[:3])))
+
+
+def row(machine, product, qty, updated='2025-08-18 10:00:00 (Asia/Taipei)', hour=10):
+    return {'store': 'TW Lion HQ 1.0', 'machine_id': machine, 'product_name': product,
+            'quantity': qty, 'last_updated': updated, 'process_time': datetime(2025, 8, 18, hour)}
+
+
+def run(data):
+    db = Session()
+    try:
+        counts = sync_inventory(db, data)
+        db.commit()
+        return counts
+    finally:
+        db.close()
+
+
+def snapshot():
+    db = Session()
+    try:
+        return {(r.machine_id, r.product_name): (r.id, r.quantity, r.process_time) for r in db.query(Inventory)}
+    finally:
+        db.close()
+
+
+print('TEST START')
+counts = run([row('551', 'A', 5), row('551', 'B', 3), row('552', 'A', 7)])
+print('first sync:', counts)
+if counts != {'inserted': 3, 'updated': 0, 'unchanged': 0, 'deleted': 0}:
+    print('FAILED: unexpected first sync counts')
+    sys.exit(1)
+before = snapshot()
+
+statements.clear()
+counts = run([row('551', 'A', 5, hour=11), row('551', 'B', 2, hour=11), row('553', 'C', 1, hour=11)])
+after = snapshot()
+print('second sync:', counts, 'statements:', statements)
+if counts != {'inserted': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1}:
+    print('FAILED: unexpected second sync counts')
+    sys.exit(1)
+if statements.count('DELETE FROM inventory') != 1 or any(sql.startswith('UPDATE') for sql in statements):
+    print('FAILED: expected one targeted DELETE and no UPDATE of unchanged rows')
+    sys.exit(1)
+# rows keep their ids (no delete-all-and-reinsert), unchanged rows are not written at all
+if after[('551', 'A')][0] != before[('551', 'A')][0] or after[('551', 'B')][0] != before[('551', 'B')][0]:
+    print('FAILED: existing rows were re-created')
+    sys.exit(1)
+if after[('551', 'A')][2] != datetime(2025, 8, 18, 10) or after[('551', 'B')][1:] != (2, datetime(2025, 8, 18, 11)):
+    print('FAILED: unchanged row rewritten or changed row not applied', after)
+    sys.exit(1)
+if ('552', 'A') in after or ('553', 'C') not in after:
+    print('FAILED: delete/insert not applied', after)
+    sys.exit(1)
+
+# The sync time is recorded once per sync, with its counts
+db = Session()
+syncs = [(s.synced_at, s.inserted, s.updated, s.unchanged, s.deleted) for s in db.query(InventorySync).order_by(InventorySync.id)]
+synced_at = latest_inventory_sync(db)
+db.close()
+print('syncs:', syncs)
+if syncs != [(datetime(2025, 8, 18, 10), 3, 0, 0, 0), (datetime(2025, 8, 18, 11), 1, 1, 1, 1)] or synced_at != datetime(2025, 8, 18, 11):
+    print('FAILED: sync times not recorded')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
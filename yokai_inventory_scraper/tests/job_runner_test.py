@@ -0,0 +1,163 @@
+import sys, tempfile, os, threading, time
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, Job
+from jobs import JobRunner, JobFailed, legacy_status
+import jobs
+
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'job_runner_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+active = {'slow': 0, 'parallel': 0}
+peak = {'slow': 0, 'parallel': 0}
+lock = threading.Lock()
+
+
+def sleeper(name):
+    def sleep_job(job, seconds=0.2):
+        with lock:
+            active[name] += 1
+            peak[name] = max(peak[name], active[name])
+        job.progress('sleeping')
+        time.sleep(seconds)
+        with lock:
+            active[name] -= 1
+        return f"slept {seconds}s"
+    return sleep_job
+
+
+def failing_job(job):
+    raise JobFailed('nothing to do')
+
+
+def crashing_job(job):
+    raise RuntimeError('boom')
+
+
+def make_runner():
+    runner = JobRunner(Session, workers=4, poll_seconds=0.05)
+    runner.register('slow', sleeper('slow'), concurrency=1)
+    runner.register('parallel', sleeper('parallel'), concurrency=3)
+    runner.register('failing', failing_job)
+    runner.register('crashing', crashing_job)
+    return runner
+
+
+print('TEST START')
+# Jobs queued before any runner exists (e.g. before a restart) are picked up later
+queued_early = [make_runner().submit('slow', {'seconds': 0.1}, dedupe=False)[0]['id'] for _ in range(3)]
+runner = make_runner()
+if legacy_status(runner.latest('slow'))['status'] != 'running':
+    print('FAILED: a queued job must look running to the old status endpoints')
+    sys.exit(1)
+
+dup, created = runner.submit('slow')
+if created or dup['id'] != queued_early[0]:
+    print('FAILED: submit should dedupe against the active job of the same type')
+    sys.exit(1)
+
+parallel = [runner.submit('parallel', {'seconds': 0.3}, dedupe=False)[0]['id'] for _ in range(3)]
+failing = runner.submit('failing')[0]['id']
+crashing = runner.submit('crashing')[0]['id']
+
+started = time.monotonic()
+runner.start()
+if not runner.wait_idle(timeout=10):
+    print('FAILED: jobs did not finish')
+    sys.exit(1)
+elapsed = time.monotonic() - started
+runner.stop()
+
+results = {job_id: runner.get(job_id) for job_id in queued_early + parallel + [failing, crashing]}
+print('elapsed:', round(elapsed, 2), 'peak:', peak)
+for job in results.values():
+    print(job['id'], job['type'], job['status'], job['durationSeconds'], job['output'])
+if peak['slow'] != 1 or peak['parallel'] < 2:
+    print('FAILED: per-type concurrency limits not respected')
+    sys.exit(1)
+if any(results[i]['status'] != 'succeeded' or results[i]['durationSeconds'] is None for i in queued_early + parallel):
+    print('FAILED: jobs did not succeed with a duration')
+    sys.exit(1)
+if results[queued_early[0]]['output'] != 'slept 0.1s':
+    print('FAILED: params were not passed to the job function')
+    sys.exit(1)
+if results[failing]['status'] != 'failed' or results[failing]['output'] != 'nothing to do':
+    print('FAILED: JobFailed should end the job as failed with its message')
+    sys.exit(1)
+if results[crashing]['status'] != 'failed' or 'boom' not in results[crashing]['output']:
+    print('FAILED: exceptions should end the job as failed')
+    sys.exit(1)
+# three 'slow' jobs in sequence (0.3s) overlap with three parallel ones (0.3s)
+if elapsed > 2.5:
+    print('FAILED: parallel job types did not run concurrently')
+    sys.exit(1)
+
+# A running job left behind by a dead process is failed and frees its type
+db = Session()
+old = datetime.now(pytz.utc) - timedelta(seconds=jobs.JOB_STALE_SECONDS + 60)
+db.add(Job(job_type='slow', status='running', worker_id='dead-host:1', started_at=old, heartbeat_at=old))
+db.commit()
+db.close()
+runner = make_runner()
+next_job = runner.submit('slow', dedupe=False)[0]['id']
+runner.start()
+runner.wait_idle(timeout=10)
+runner.stop()
+db = Session()
+abandoned = db.query(Job).filter(Job.worker_id == 'dead-host:1').one()
+print('abandoned:', abandoned.status, abandoned.output)
+if abandoned.status != 'failed' or runner.get(next_job)['status'] != 'succeeded':
+    print('FAILED: stale running job was not recovered')
+    sys.exit(1)
+db.close()
+
+# A paused runner (a gunicorn worker without the scheduler lease) leaves jobs queued
+runner = make_runner()
+runner.pause()
+runner.start()
+waiting = runner.submit('slow', {'seconds': 0.05}, dedupe=False)[0]['id']
+time.sleep(0.3)
+if runner.get(waiting)['status'] != 'queued':
+    print('FAILED: a paused runner claimed a job')
+    sys.exit(1)
+runner.resume()
+runner.wait_idle(timeout=10)
+runner.stop()
+if runner.get(waiting)['status'] != 'succeeded':
+    print('FAILED: the resumed runner did not run the queued job')
+    sys.exit(1)
+
+# Dispatchers of several processes and concurrent deduplicated submits take the per-type
+# lock first: a burst of submits queues one job, and a type never runs above its limit
+runners = [make_runner() for _ in range(4)]
+created = []
+threads = [threading.Thread(target=lambda r=r: created.append(r.submit('slow', {'seconds': 0.05})[1]))
+           for r in runners * 3]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+if created.count(True) != 1:
+    print('FAILED: concurrent deduplicated submits queued', created.count(True), 'jobs')
+    sys.exit(1)
+peak['slow'] = 0
+for _ in range(8):
+    runners[0].submit('slow', {'seconds': 0.05}, dedupe=False)
+for r in runners:
+    r.start()
+idle = all(r.wait_idle(timeout=20) for r in runners)
+for r in runners:
+    r.stop()
+print('several dispatchers, peak:', peak['slow'])
+if not idle or peak['slow'] != 1:
+    print('FAILED: concurrency limit not held across dispatchers')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
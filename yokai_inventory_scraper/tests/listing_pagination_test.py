@@ -0,0 +1,103 @@
+import sys, tempfile, os, json, tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'pagination_test.db')}"
+from sqlalchemy import insert
+from server import app
+from database import SessionLocal, Store, Inventory, InventorySync, Transaction, Warehouse, UpdateLog
+from sales_rollup import rebuild_sales_daily
+
+TRANSACTIONS = 30000
+START = datetime(2025, 8, 1)
+
+db = SessionLocal()
+db.add_all([Store(store_key=f"Store {s}-M{s}", note=f"note {s}") for s in range(20)])
+db.flush()
+db.add_all([Inventory(store=f"Store {s}", machine_id=f"M{s}", product_name=f"P{p}", quantity=p, process_time=START)
+            for s in range(20) for p in range(7)])
+# A later sync confirmed every row without rewriting it: /get-data serves its time as processTime
+db.add(InventorySync(synced_at=START + timedelta(hours=5), unchanged=140))
+db.add_all([Warehouse(warehouse_name=f"W{w % 3}", product_name=f"P{w}", quantity=w, updated_at=START) for w in range(25)])
+# Several logs share a timestamp, so paging must fall back to the id
+db.add_all([UpdateLog(scraper_type='sales', ran_at=START + timedelta(hours=i // 3), status='success', details=f"run {i}")
+            for i in range(120)])
+db.execute(insert(Transaction), [
+    {'store_key': f"Store {i % 20}-M{i % 20}", 'transaction_time': START + timedelta(minutes=i // 2),
+     'product_name': f"P{i % 7}", 'amount': 30 + i % 3, 'payment_type': 'LINE Pay'}
+    for i in range(TRANSACTIONS)
+])
+rebuild_sales_daily(db)
+db.commit()
+db.close()
+
+client = app.test_client()
+
+
+def all_pages(url, limit):
+    rows, cursor, pages = [], None, 0
+    while True:
+        separator = '&' if '?' in url else '?'
+        page = client.get(f"{url}{separator}limit={limit}" + (f"&cursor={cursor}" if cursor else '')).get_json()
+        rows += page['data']
+        pages += 1
+        cursor = page['nextCursor']
+        if not cursor:
+            return rows, pages
+
+
+def canonical(rows):
+    return sorted(json.dumps(r, sort_keys=True) for r in rows)
+
+
+print('TEST START')
+checks = {
+    '/get-data': (lambda body: body['data'], 50),
+    '/api/transactions': (lambda body: body, 4000),
+    '/api/transactions?aggregate=daily': (lambda body: body, 333),
+    '/api/warehouses': (lambda body: body, 10),
+}
+for url, (data_of, limit) in checks.items():
+    full = data_of(client.get(url).get_json())
+    paged, pages = all_pages(url, limit)
+    separator = '&' if '?' in url else '?'
+    streamed = data_of(json.loads(client.get(f"{url}{separator}stream=1").get_data()))
+    print(f"{url}: {len(full)} rows, {pages} pages, {len(streamed)} streamed")
+    if canonical(paged) != canonical(full) or canonical(streamed) != canonical(full):
+        print(f"FAILED: pages or stream of {url} differ from the full response")
+        sys.exit(1)
+    if url == '/get-data' and {row['processTime'] for row in full} != {app.json.dumps(START + timedelta(hours=5)).strip('"')}:
+        print('FAILED: /get-data does not serve the latest sync time as processTime')
+        sys.exit(1)
+
+# Update logs: the first page is the old "last 50", later pages go further back
+latest = client.get('/api/update-logs').get_json()
+paged, pages = all_pages('/api/update-logs', 50)
+streamed = json.loads(client.get('/api/update-logs?stream=1').get_data())
+print('update logs:', len(latest), len(paged), pages, len(streamed))
+if paged[:50] != latest or len(paged) != 120 or paged != streamed or len({r['details'] for r in paged}) != 120:
+    print('FAILED: update log pages')
+    sys.exit(1)
+
+if client.get('/api/warehouses?cursor=not-a-cursor').status_code != 400 or client.get('/get-data?limit=x').status_code != 400:
+    print('FAILED: bad cursor / limit should be rejected')
+    sys.exit(1)
+
+# Streaming keeps peak memory well below building the whole response
+tracemalloc.start()
+client.get('/api/transactions').get_data()
+full_peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.reset_peak()
+for chunk in client.get('/api/transactions?stream=1', buffered=False).response:
+    pass
+stream_peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.stop()
+print(f"peak memory for {TRANSACTIONS} transactions: full {full_peak / 1e6:.1f} MB, streamed {stream_peak / 1e6:.1f} MB")
+if stream_peak > full_peak / 3:
+    print('FAILED: streaming did not reduce peak memory')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
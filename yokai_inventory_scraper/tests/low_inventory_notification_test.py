@@ -0,0 +1,102 @@
+import sys, tempfile, os
+from datetime import datetime
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from database import Base, User, Store, Inventory, bump_data_version
+from notifications import load_notification_inputs, notification_day_start, run_low_inventory_notifications
+
+# Synthetic franchisees on a throwaway SQLite DB: user N owns machines of "Shop N";
+# even shops are low (3 machines x 1), odd shops are full (3 x 50). As before, a store's
+# total is the quantity of every machine whose store name contains the store_key's name.
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'notify_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+NOW = datetime(2025, 8, 10, 3, 0)
+
+statements = []
+event.listen(engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+
+def add_users(db, start, count):
+    for n in range(start, start + count):
+        stores = []
+        for m in range(3):
+            store_key = f"Shop {n:03d}-M{m}"
+            stores.append(Store(store_key=store_key, is_hidden=(n == 4)))
+            db.add(Inventory(store=f"Shop {n:03d}", machine_id=f"M{m}", product_name='P', quantity=1 if n % 2 == 0 else 50,
+                             process_time=NOW))
+        db.add(User(username=f"user{n}", password_hash='x', email=f"user{n}@example.com" if n != 2 else None,
+                    low_inventory_threshold=10, stores=stores))
+    bump_data_version(db, 'inventory', 'stores', 'users')
+    db.commit()
+
+
+def count_load_queries(db):
+    load_notification_inputs(db, notification_day_start(NOW))  # builds the scope once
+    statements.clear()
+    load_notification_inputs(db, notification_day_start(NOW))
+    return len(statements)
+
+
+sent = []
+
+
+class FakeClient:
+    """Accepts every email (the retry paths are covered by mail_queue_test.py)."""
+    configured = True
+
+    def send(self, recipients, subject, body, html_content=False):
+        sent.extend((to_email, subject) for to_email in recipients)
+        return {'ok': True, 'status': 202, 'error': None, 'retryAfter': None}
+
+
+fake_send = FakeClient()
+
+
+print('TEST START')
+db = Session()
+add_users(db, 0, 20)
+small = count_load_queries(db)
+add_users(db, 20, 180)
+large = count_load_queries(db)
+print('load queries for 20 users:', small, 'for 200 users:', large)
+if small != large:
+    print('FAILED: query count grows with the number of users')
+    sys.exit(1)
+
+result = run_low_inventory_notifications(db, Session, client=fake_send, now_utc=NOW)
+print('first run:', len(result['notifications']), 'emails, timing', result['timing'])
+# even users are low; user 2 has no email and user 4's stores are hidden
+expected = {f"user{n}@example.com" for n in range(0, 200, 2) if n not in (2, 4)}
+if {to for to, _ in sent} != expected or len(sent) != len(expected):
+    print('FAILED: unexpected recipients')
+    sys.exit(1)
+first = result['notifications'][0]
+if len(first['lowStores']) != 3 or first['allLowStores'][0]['total'] != 3 or not set(result['timing']) >= {'load', 'plan', 'dispatch', 'total'}:
+    print('FAILED: unexpected notification payload', first)
+    sys.exit(1)
+
+sent.clear()
+result = run_low_inventory_notifications(db, Session, client=fake_send, now_utc=NOW)
+print('second run:', len(result['notifications']), 'emails')
+if sent or result['notifications']:
+    print('FAILED: stores were notified twice on the same day')
+    sys.exit(1)
+
+# DAILY_EMAIL_LIMIT is global: with 98 emails out today, a limit of 103 leaves room for 5
+add_users(db, 200, 20)
+os.environ['DAILY_EMAIL_LIMIT'] = '103'
+sent.clear()
+result = run_low_inventory_notifications(db, Session, client=fake_send)
+os.environ.pop('DAILY_EMAIL_LIMIT')
+print('10 new low users with 5 emails left today:', len(result['notifications']), 'emails')
+if len(result['notifications']) != 5 or len(sent) != 5:
+    print('FAILED: daily limit not applied')
+    sys.exit(1)
+db.close()
+
+print('TEST PASS')
+print('TEST END')
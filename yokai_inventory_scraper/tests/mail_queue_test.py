@@ -0,0 +1,135 @@
+import sys, tempfile, os, json, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ['MAIL_RETRY_BASE_SECONDS'] = '0.1'
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, User, OutboundEmail, NotificationSent
+from mailer import SendGridClient, enqueue_email, drain_outbound_queue, mail_drain_due
+from notifications import dispatch_notification_plan
+
+# A local stand-in for SendGrid's /v3/mail/send: records every request and answers
+# from a script per recipient (default 202).
+script = {
+    'ratelimited@example.com': [(429, {'Retry-After': '0.2'}), (202, {})],
+    'flaky@example.com': [(503, {}), (202, {})],
+    'bad@example.com': [(400, {})] * 5,
+    'slow@example.com': [(429, {'Retry-After': '1'}), (202, {})],
+}
+requests_seen = []
+connections = set()
+lock = threading.Lock()
+
+
+class FakeSendGrid(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        recipients = [p['to'][0]['email'] for p in payload['personalizations']]
+        with lock:
+            requests_seen.append({'auth': self.headers['Authorization'], 'to': recipients, 'subject': payload['subject']})
+            connections.add(self.client_address)
+            steps = script.get(recipients[0])
+            status, headers = steps.pop(0) if steps else (202, {})
+        body = b'' if status == 202 else b'{"errors":[{"message":"scripted"}]}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSendGrid)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+client = SendGridClient(api_key='test-key', from_email='noreply@example.com',
+                        url=f"http://127.0.0.1:{server.server_address[1]}/v3/mail/send")
+
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'mail_queue_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+print('TEST START')
+db = Session()
+user = User(username='owner', password_hash='x', email='ratelimited@example.com')
+db.add(user)
+db.flush()
+for to_email in ('a@example.com', 'b@example.com', 'c@example.com'):
+    enqueue_email(db, to_email, 'Same news', 'Hello everyone')
+enqueue_email(db, 'ratelimited@example.com', 'Low stock', '<p>1</p>', html_content=True, user_id=user.id, store_keys=['Shop-M1'])
+enqueue_email(db, 'flaky@example.com', 'Low stock', '<p>2</p>', html_content=True)
+enqueue_email(db, 'bad@example.com', 'Low stock', '<p>3</p>', html_content=True, user_id=user.id, store_keys=['Shop-M2'])
+db.commit()
+
+counts = drain_outbound_queue(Session, client=client, max_wait=5)
+print('drain:', counts)
+statuses = {e.to_email: (e.status, e.attempts) for e in db.query(OutboundEmail)}
+print('statuses:', statuses)
+expected = {
+    'a@example.com': ('sent', 1), 'b@example.com': ('sent', 1), 'c@example.com': ('sent', 1),
+    'ratelimited@example.com': ('sent', 2), 'flaky@example.com': ('sent', 2), 'bad@example.com': ('failed', 1)
+}
+if statuses != expected:
+    print('FAILED: unexpected delivery statuses')
+    sys.exit(1)
+
+batched = [r for r in requests_seen if r['subject'] == 'Same news']
+print('requests:', len(requests_seen), 'connections:', len(connections))
+if len(batched) != 1 or sorted(batched[0]['to']) != ['a@example.com', 'b@example.com', 'c@example.com']:
+    print('FAILED: identical messages were not batched into one request')
+    sys.exit(1)
+if any(r['auth'] != 'Bearer test-key' for r in requests_seen) or len(connections) > 4:
+    print('FAILED: requests were not authorized or connections were not reused')
+    sys.exit(1)
+
+notified = [(n.user_id, n.store_key) for n in db.query(NotificationSent)]
+print('notified:', notified)
+if notified != [(user.id, 'Shop-M1')]:
+    print('FAILED: NotificationSent must only be written for delivered emails')
+    sys.exit(1)
+
+# DAILY_EMAIL_LIMIT is global across runs: 5 sent today, limit 6 -> one more goes out
+for n in range(3):
+    enqueue_email(db, f"late{n}@example.com", f"Late {n}", 'x')
+db.commit()
+os.environ['DAILY_EMAIL_LIMIT'] = '6'
+counts = drain_outbound_queue(Session, client=client, max_wait=1)
+os.environ.pop('DAILY_EMAIL_LIMIT')
+db.expire_all()
+late = sorted(e.status for e in db.query(OutboundEmail).filter(OutboundEmail.to_email.like('late%')))
+print('limited drain:', counts, late)
+if counts['sent'] != 1 or counts['deferred'] != 2 or late != ['queued', 'queued', 'sent']:
+    print('FAILED: daily limit not enforced')
+    sys.exit(1)
+
+# A retry due after the drain gave up stays queued. Once it is due, the scheduler's check
+# sees it, and the next notification run drains it although it has no new emails to queue.
+enqueue_email(db, 'slow@example.com', 'Slow', 'x')
+db.commit()
+drain_outbound_queue(Session, client=client, max_wait=0.2)
+db.expire_all()
+slow = db.query(OutboundEmail).filter_by(to_email='slow@example.com').one()
+if slow.status != 'queued' or mail_drain_due(db):
+    print('FAILED: the retry should wait for its backoff', slow.status)
+    sys.exit(1)
+time.sleep(1.1)
+if not mail_drain_due(db):
+    print('FAILED: the due retry was not noticed')
+    sys.exit(1)
+notifications, counts = dispatch_notification_plan(db, [], Session, client=client)
+db.expire_all()
+print('drain without new emails:', counts, slow.status)
+if notifications or slow.status != 'sent' or counts['sent'] != 1 or mail_drain_due(db):
+    print('FAILED: queued retries were not drained by a run without new emails')
+    sys.exit(1)
+db.close()
+server.shutdown()
+
+print('TEST PASS')
+print('TEST END')
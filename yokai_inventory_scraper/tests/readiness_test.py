@@ -0,0 +1,75 @@
+import sys, json, time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from readiness import StepTimer, wait_for_network_idle, wait_for_stable_row_count, wait_for_page_ready
+
+# Fake driver: replays a scripted DevTools performance log and a growing table, no Chrome needed.
+
+
+def net_event(method, request_id, type_='XHR'):
+    return {'message': json.dumps({'message': {'method': method, 'params': {'requestId': request_id, 'type': type_}}})}
+
+
+class FakeDriver:
+    def __init__(self, log_batches, row_counts):
+        self.log_batches = list(log_batches)
+        self.row_counts = list(row_counts)
+
+    def get_log(self, name):
+        return self.log_batches.pop(0) if self.log_batches else []
+
+    def find_elements(self, by, xpath):
+        count = self.row_counts.pop(0) if len(self.row_counts) > 1 else self.row_counts[0]
+        return [object()] * count
+
+    def execute_script(self, script):
+        return False  # no loading mask
+
+
+print('TEST START')
+
+# 1) one XHR open for three polls, an image that never finishes (ignored) -> idle after it finishes
+driver = FakeDriver([
+    [net_event('Network.requestWillBeSent', '1'), net_event('Network.requestWillBeSent', '2', 'Image')],
+    [], [],
+    [net_event('Network.loadingFinished', '1')],
+], [0])
+started = time.monotonic()
+if not wait_for_network_idle(driver, timeout=5):
+    print('FAILED: network never went idle')
+    sys.exit(1)
+elapsed = time.monotonic() - started
+print(f'network idle after {elapsed:.2f}s')
+if elapsed < 0.3 or elapsed > 2:
+    print('FAILED: unexpected idle timing')
+    sys.exit(1)
+
+# 2) request that never finishes -> bounded by timeout, returns False
+driver = FakeDriver([[net_event('Network.requestWillBeSent', 'hang')]], [0])
+started = time.monotonic()
+if wait_for_network_idle(driver, timeout=0.5):
+    print('FAILED: hanging request reported idle')
+    sys.exit(1)
+print(f'hanging request timed out after {time.monotonic() - started:.2f}s')
+
+# 3) table renders rows progressively: 0, 3, 7, 10 then stays at 10
+driver = FakeDriver([], [0, 3, 7, 10])
+count = wait_for_stable_row_count(driver, '//tr', timeout=5)
+print('stable row count:', count)
+if count != 10:
+    print('FAILED: expected 10 rows')
+    sys.exit(1)
+
+# 4) timing report separates waiting from working
+timer = StepTimer('fake')
+wait_for_page_ready(FakeDriver([], [5]), timer, 'store_list_page', rows_xpath='//tr')
+wait_for_page_ready(FakeDriver([], [5]), timer, 'store_list_page', rows_xpath='//tr')
+time.sleep(0.1)  # "work"
+report = timer.report()
+print(report)
+if timer.steps['store_list_page'][0] != 2 or 'working' not in report:
+    print('FAILED: timing report incomplete')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
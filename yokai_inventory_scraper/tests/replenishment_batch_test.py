@@ -0,0 +1,89 @@
+import sys, tempfile, os, json
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'replenishment_batch_test.db')}"
+from sqlalchemy import insert
+from server import app
+from database import SessionLocal, Store, Inventory, Transaction, Warehouse
+from sales_rollup import rebuild_sales_daily
+import replenishment
+
+PRODUCTS = [f"商品{p}" for p in range(14)]
+# '台北店' and '台北店二館' share a prefix, like the old startswith() sales lookup
+STORES = ['台北店', '台北店二館', 'TW Lion HQ 1.0', '空店']
+MACHINES = [f"{s}-{m}" for s in STORES for m in ('1', '2')]
+
+db = SessionLocal()
+db.add_all([Store(store_key=key) for key in MACHINES])
+now = datetime.now().replace(microsecond=0)
+
+
+class Clock(datetime):
+    """Pins the 30-day sales window to `now`, so singles and batches count the same rows."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return now
+
+
+replenishment.datetime = Clock
+
+for i, key in enumerate(MACHINES[:-2]):
+    store, machine_id = key.split('-', 1)
+    db.add_all([Inventory(store=store, machine_id=machine_id, product_name=PRODUCTS[(i + p) % len(PRODUCTS)],
+                          quantity=(i * 3 + p) % 9, process_time=now) for p in range(6 + i % 4)])
+db.add_all([Warehouse(warehouse_name=f"W{w % 2}", product_name=PRODUCTS[w % len(PRODUCTS)], quantity=w % 11,
+                      updated_at=now) for w in range(24)])
+db.execute(insert(Transaction), [
+    {'store_key': MACHINES[i % 6], 'transaction_time': now - timedelta(hours=i * 5),
+     'product_name': PRODUCTS[(i * 7) % 11], 'amount': 30, 'payment_type': 'LINE Pay'}
+    for i in range(400)
+])
+rebuild_sales_daily(db)
+db.commit()
+db.close()
+
+client = app.test_client()
+
+print('TEST START')
+requests = [
+    ('/api/warehouse-replenishment-suggestion', {'warehouses': ['W0', 'W1']}),
+    ('/api/warehouse-replenishment-suggestion', {'warehouses': ['W1'], 'max_total_qty': 30}),
+    ('/api/replenishment-suggestion', {'warehouses': ['W0', 'W1']}),
+    ('/api/replenishment-suggestion', {'warehouses': ['W0'], 'reserve_slots': 5, 'only_add': True, 'max_total_qty': 40}),
+]
+for url, params in requests:
+    for strategy in ('stable', 'aggressive', 'clearance'):
+        body = {**params, 'strategy': strategy}
+        singles = [{'store_key': key, **client.post(f"{url}/{key}", json=body).get_json()} for key in MACHINES]
+        batch = client.post(f"{url}s", json={**body, 'store_keys': MACHINES}).get_json()
+        print(f"{url}s {strategy} {params}: {sum(r['success'] for r in singles)}/{len(MACHINES)} with suggestions")
+        if not batch['success'] or batch['results'] != singles:
+            print('FAILED: batch results differ from the per-machine endpoint')
+            print(json.dumps(batch, ensure_ascii=False)[:2000])
+            sys.exit(1)
+
+# The window is rolling, as `transaction_time >= now - 30 days` on the raw rows
+db = SessionLocal()
+counts = replenishment.load_sales_counts(db, MACHINES)
+since = now - timedelta(days=30)
+raw = {store: {} for store in STORES}
+for t in db.query(Transaction).filter(Transaction.transaction_time >= since):
+    for store in STORES:
+        if t.store_key.startswith(store):
+            raw[store][t.product_name] = raw[store].get(t.product_name, 0) + 1
+db.close()
+if counts != raw:
+    print('FAILED: the 30-day sales differ from counting the raw transactions', counts, raw)
+    sys.exit(1)
+
+if client.post('/api/replenishment-suggestions', json={'warehouses': ['W0'], 'store_keys': 'x'}).status_code != 400 or \
+        client.post('/api/warehouse-replenishment-suggestions', json={'store_keys': MACHINES}).status_code != 400:
+    print('FAILED: malformed batch requests should be rejected')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
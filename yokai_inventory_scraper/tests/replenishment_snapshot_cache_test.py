@@ -0,0 +1,98 @@
+import sys, tempfile, os, io
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'snapshot_cache_test.db')}"
+import pandas as pd
+from server import app
+from database import SessionLocal, Store, Inventory, Warehouse, bump_data_version
+from sales_ingest import ingest_transactions
+from snapshot_cache import warehouse_totals, store_sales
+
+now = datetime.now().replace(microsecond=0)
+db = SessionLocal()
+db.add_all([Store(store_key='台北店-1'), Store(store_key='台北店-2'), Store(store_key='高雄店-1')])
+db.add_all([Inventory(store='台北店', machine_id='1', product_name='可口可樂', quantity=3, process_time=now),
+            Inventory(store='高雄店', machine_id='1', product_name='綠茶', quantity=2, process_time=now)])
+db.add_all([Warehouse(warehouse_name='總倉', product_name='可口可樂', quantity=20, updated_at=now),
+            Warehouse(warehouse_name='總倉', product_name='綠茶', quantity=10, updated_at=now)])
+db.commit()
+db.close()
+
+
+def ingest(items):
+    db = SessionLocal()
+    try:
+        ingest_transactions(db, items)
+        db.commit()
+    finally:
+        db.close()
+
+
+def sale(hours_ago, product, shop='台北店'):
+    return {'shopName': shop, 'product': product, 'date': (now - timedelta(hours=hours_ago)).strftime('%Y-%m-%d %H:%M:%S'),
+            'amount': 30, 'payType': 'LINE Pay'}
+
+
+def suggestion(store_key):
+    body = client.post(f"/api/warehouse-replenishment-suggestion/{store_key}",
+                       json={'strategy': 'stable', 'warehouses': ['總倉']}).get_json()
+    return {item['productName']: item for item in body['suggestion']}
+
+
+ingest([sale(h, '可口可樂') for h in range(1, 6)] + [sale(2, '綠茶', shop='高雄店')])
+client = app.test_client()
+
+print('TEST START')
+# Clicking through the machines of one store reuses the warehouse totals and the store's sales
+for store_key in ('台北店-1', '台北店-2', '台北店-1', '高雄店-1'):
+    items = suggestion(store_key)
+stats = client.get('/api/cache-stats').get_json()['caches']
+print('after 4 suggestions:', stats['warehouse-totals'], stats['store-sales-30d'])
+if stats['warehouse-totals']['hits'] != 3 or stats['store-sales-30d']['hits'] != 2 or stats['store-sales-30d']['misses'] != 2:
+    print('FAILED: snapshots were not reused')
+    sys.exit(1)
+
+# A sales ingest invalidates the store's counts
+ingest([sale(1, '可口可樂', shop='台北店') | {'amount': 31}])
+counted = suggestion('台北店-1')['可口可樂']['salesCount30d']
+print('sales after ingest:', counted, store_sales.stats())
+if counted != 6 or store_sales.stats()['invalidations'] < 1:
+    print('FAILED: sales snapshot not refreshed after ingest')
+    sys.exit(1)
+
+# A warehouse upload invalidates the totals
+upload = io.BytesIO()
+pd.DataFrame({'Warehouse name': ['總倉'], 'Product name': ['可口可樂'], 'Remain quantity': [7]}).to_excel(upload, index=False)
+upload.seek(0)
+client.post('/upload-warehouse-file', data={'file': (upload, 'warehouse.xlsx')}, content_type='multipart/form-data')
+items = suggestion('台北店-1')
+print('warehouse after upload:', {p: i['warehouseQty'] for p, i in items.items()})
+if items['可口可樂']['warehouseQty'] != 7 or '綠茶' in items:
+    print('FAILED: warehouse snapshot not refreshed after upload')
+    sys.exit(1)
+
+# Writes from another process only bump the data version; that alone must be enough
+warehouse_hits = warehouse_totals.stats()['hits']
+db = SessionLocal()
+db.query(Warehouse).update({'quantity': 9})
+bump_data_version(db, 'warehouse')
+db.commit()
+db.close()
+if suggestion('台北店-1')['可口可樂']['warehouseQty'] != 9 or warehouse_totals.stats()['hits'] != warehouse_hits:
+    print('FAILED: data version change not detected')
+    sys.exit(1)
+
+# Entries expire after the TTL even when nothing was bumped
+warehouse_totals.ttl = 0
+suggestion('台北店-1')
+warehouse_totals.ttl = 600
+print('after TTL:', warehouse_totals.stats())
+if warehouse_totals.stats()['expired'] != 1:
+    print('FAILED: TTL expiry')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,84 @@
+import sys, tempfile, os, gzip, json, time
+from datetime import datetime
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'compression_test.db')}"
+from server import app
+from database import SessionLocal, Store, Inventory, Warehouse
+import response_layer
+
+db = SessionLocal()
+for s in range(40):
+    db.add(Store(store_key=f"台北 信義 {s} 號店-M{s}", note='靠近捷運站出口'))
+    db.add_all([Inventory(store=f"台北 信義 {s} 號店", machine_id=f"M{s}", product_name=f"可口可樂 {p} 號 限定口味",
+                          quantity=p, process_time=datetime(2025, 8, 1, 9, 30)) for p in range(10)])
+db.add(Warehouse(warehouse_name='總倉', product_name='綠茶', quantity=3, updated_at=datetime(2025, 8, 2, 10, 0, 5)))
+db.commit()
+db.close()
+
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['logged_in'] = True
+
+print('TEST START')
+plain = client.get('/get-data')
+gzipped = client.get('/get-data', headers={'Accept-Encoding': 'gzip'})
+print('get-data:', len(plain.get_data()), 'bytes plain,', len(gzipped.get_data()), 'gzip')
+if plain.headers.get('Content-Encoding') or gzipped.headers.get('Content-Encoding') != 'gzip':
+    print('FAILED: Accept-Encoding negotiation')
+    sys.exit(1)
+if json.loads(gzip.decompress(gzipped.get_data())) != plain.get_json() or len(gzipped.get_data()) * 4 > len(plain.get_data()):
+    print('FAILED: gzip body')
+    sys.exit(1)
+
+# The cached /get-data keeps answering 304 to the (now weak) ETag of a compressed response
+etag = gzipped.headers['ETag']
+revalidated = client.get('/get-data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+print('etag:', etag, '->', revalidated.status_code)
+if not etag.startswith('W/') or revalidated.status_code != 304:
+    print('FAILED: conditional request on a compressed response')
+    sys.exit(1)
+
+if response_layer.brotli is not None:
+    import brotli
+    br = client.get('/get-data', headers={'Accept-Encoding': 'gzip, deflate, br'})
+    print('brotli:', len(br.get_data()), 'bytes')
+    if br.headers.get('Content-Encoding') != 'br' or json.loads(brotli.decompress(br.get_data())) != plain.get_json():
+        print('FAILED: brotli negotiation')
+        sys.exit(1)
+
+# Small bodies stay uncompressed; datetimes come out as ISO 8601 without manual isoformat()
+small = client.get('/api/warehouses', headers={'Accept-Encoding': 'gzip'})
+print('warehouses:', small.headers.get('Content-Encoding'), small.get_json())
+if small.headers.get('Content-Encoding') or small.get_json()[0]['updatedAt'] != '2025-08-02T10:00:05':
+    print('FAILED: small response / datetime encoding')
+    sys.exit(1)
+
+# Streamed responses are compressed chunk by chunk
+streamed = client.get('/get-data?stream=1', headers={'Accept-Encoding': 'gzip'})
+if streamed.headers.get('Content-Encoding') != 'gzip' or json.loads(gzip.decompress(streamed.get_data()))['data'] != plain.get_json()['data']:
+    print('FAILED: streamed response compression')
+    sys.exit(1)
+
+stats = client.get('/api/response-stats').get_json()['routes']
+print('stats:', stats['/get-data'])
+if stats['/get-data']['compressed'] < 3 or stats['/get-data']['bytesOut'] >= stats['/get-data']['bytesIn']:
+    print('FAILED: per-route metrics')
+    sys.exit(1)
+
+# Encoder comparison on the /get-data payload
+payload = plain.get_json()
+started = time.perf_counter()
+for _ in range(50):
+    response_layer.dumps_bytes(payload)
+fast = time.perf_counter() - started
+started = time.perf_counter()
+for _ in range(50):
+    json.dumps(payload, sort_keys=True)
+stdlib = time.perf_counter() - started
+print(f"encode x50: {'orjson' if response_layer.orjson else 'json'} {fast:.3f}s, stdlib (sort_keys, like jsonify) {stdlib:.3f}s")
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,145 @@
+import sys, os, time, json, tempfile, subprocess
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file shared by the old and the new server, each run in its own process
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'sales_report_benchmark.db')}"
+import numpy as np
+from openpyxl import load_workbook
+from database import Base, engine, SessionLocal, Store, bump_data_version
+from sales_rollup import aggregate, apply_sales_delta, ROLLUP_MARKER
+
+# /api/generate-sales-detail over 90 days of TRANSACTIONS sales (default 500k) on 200
+# machines of 100 stores and 150 products, with the workbook renderer of this tree and of
+# the last commit that built the sheet cell by cell: the parent of the commit that added
+# sales_report.py, found in git history (or LEGACY_REF), read with git archive.
+# Each runs in a fresh process; memory is its peak RSS during the request (Linux: the peak
+# is reset through /proc/self/clear_refs first) above the RSS before it.
+TRANSACTIONS = int(os.environ.get('TRANSACTIONS', 500000))
+DAYS = 90
+package_dir = Path(__file__).resolve().parents[1]
+
+RUN = r'''
+import sys, os, json, time, logging
+sys.path.insert(0, os.getcwd())
+from server import app
+logging.disable(logging.CRITICAL)
+
+
+def status_kb(field):
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith(field))
+
+
+client = app.test_client()
+with open('/proc/self/clear_refs', 'w') as clear_refs:
+    clear_refs.write('5')
+before = status_kb('VmRSS')
+started = time.perf_counter()
+response = client.post('/api/generate-sales-detail', json={'startDate': sys.argv[1], 'endDate': sys.argv[2]})
+seconds = time.perf_counter() - started
+peak = status_kb('VmHWM')
+body = response.get_json()
+print(json.dumps({'status': response.status_code, 'seconds': seconds, 'peakMb': (peak - before) / 1024,
+                  'path': os.path.join(os.getcwd(), body.get('filename', ''))}))
+'''
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    rng = np.random.default_rng(8)
+    store_keys = [f"店{s:03d}-{m}" for s in range(100) for m in (1, 2)]
+    products = [f"商品{p:03d}" for p in range(150)]
+    prices = rng.choice([25, 30, 35, 45, 60], len(products))
+    end = datetime(2025, 8, 31, 22)
+    machine = rng.integers(0, len(store_keys), TRANSACTIONS)
+    product = rng.zipf(1.3, TRANSACTIONS) % len(products)
+    minutes = rng.integers(0, DAYS * 24 * 60, TRANSACTIONS)
+    # Card / e-payment surcharges end in 1 or 2 and are folded back onto the list price
+    surcharge = rng.choice([0, 1, 2], TRANSACTIONS, p=[0.6, 0.3, 0.1])
+    rows = [(store_keys[m], end - timedelta(minutes=int(t)), products[p], int(prices[p] + s))
+            for m, p, t, s in zip(machine, product, minutes, surcharge)]
+    db = SessionLocal()
+    db.add_all([Store(store_key=store_key) for store_key in store_keys])
+    apply_sales_delta(db, aggregate(rows))
+    # The rollup is complete: the servers must not rebuild it from the (empty) transactions table
+    bump_data_version(db, ROLLUP_MARKER)
+    db.commit()
+    db.close()
+    return (end - timedelta(days=DAYS)).date().isoformat(), end.date().isoformat()
+
+
+def run(tree, start_day, end_day):
+    env = dict(os.environ, JOB_WORKER_MODE='external', PYTHONPATH=str(tree))
+    result = subprocess.run([sys.executable, '-c', RUN, start_day, end_day], cwd=tree, env=env,
+                            capture_output=True, text=True, timeout=900)
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if not lines:
+        print(result.stdout[-2000:], result.stderr[-2000:])
+        print(f"FAILED: the report did not run in {tree}")
+        sys.exit(1)
+    return json.loads(lines[-1])
+
+
+def git(*args, **kwargs):
+    return subprocess.run(['git', *args], cwd=package_dir, capture_output=True, check=True, **kwargs).stdout
+
+
+def legacy_tree():
+    """The old tree, extracted to a temp dir; without it there is nothing to compare, so the benchmark fails."""
+    target = Path(tmp_dir) / 'legacy'
+    target.mkdir()
+    try:
+        ref = os.environ.get('LEGACY_REF')
+        if not ref:
+            added = git('log', '--diff-filter=A', '--format=%H', '--', 'sales_report.py', text=True).split()
+            if not added:
+                raise LookupError('no commit adding sales_report.py in git history')
+            ref = f"{added[-1]}^"
+        subprocess.run(['tar', '-x', '-C', str(target)], input=git('archive', ref, '.'), check=True)
+    except (OSError, LookupError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.decode(errors='replace').strip() if getattr(e, 'stderr', None) else e
+        print(f"FAILED: the cell-by-cell report code could not be read from git ({detail}); set LEGACY_REF to its commit")
+        sys.exit(1)
+    return target
+
+
+def layout(path):
+    """Values, styles of the written cells and merged ranges (more than one cell) of a workbook."""
+    ws = load_workbook(path).active
+    cells = {}
+    for row in ws.iter_rows():
+        for cell in row:
+            if cell.value is not None:
+                cells[cell.coordinate] = (cell.value, cell.font.b, cell.font.sz, cell.fill.fgColor.rgb,
+                                          getattr(cell.border.bottom, 'style', None), cell.alignment.horizontal,
+                                          cell.number_format)
+    merged = {str(r) for r in ws.merged_cells.ranges if r.min_row != r.max_row or r.min_col != r.max_col}
+    return cells, merged, (ws.max_row, ws.freeze_panes, ws.column_dimensions['A'].width, ws.row_dimensions[1].height)
+
+
+print('TEST START')
+started = time.perf_counter()
+start_day, end_day = seed()
+print(f"{TRANSACTIONS} transactions seeded in {time.perf_counter() - started:.1f}s")
+new = run(package_dir, start_day, end_day)
+# The server writes the workbook next to its code; whatever happens next, it must not stay in the source tree
+try:
+    report = {'streamed (write-only)': new}
+    report['cell by cell (old)'] = run(legacy_tree(), start_day, end_day)
+    for name, result in report.items():
+        print(f"  {name:22s} {result['seconds']:6.2f}s  +{result['peakMb']:6.1f} MB peak RSS")
+    if new['status'] != 200:
+        print('FAILED: report request')
+        sys.exit(1)
+    streamed = layout(new['path'])
+    print(f"  {streamed[2][0]} rows, {len(streamed[1])} merged ranges")
+    if streamed != layout(report['cell by cell (old)']['path']):
+        print('FAILED: the streamed workbook differs from the old one')
+        sys.exit(1)
+finally:
+    if os.path.isfile(new['path']):
+        os.remove(new['path'])
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,71 @@
+import sys, tempfile, os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'sales_report_test.db')}"
+from openpyxl import load_workbook
+from server import app, script_dir
+from database import SessionLocal, Store
+from sales_ingest import ingest_transactions
+
+
+def sale(shop, product, amount, minute):
+    return {'shopName': shop, 'product': product, 'date': f"2025-08-0{1 + minute % 3} 10:{minute:02d}:00",
+            'amount': amount, 'payType': 'LINE Pay'}
+
+
+db = SessionLocal()
+db.add_all([Store(store_key='台北店-1'), Store(store_key='台北店-2'), Store(store_key='高雄店-1')])
+db.commit()
+# 可口可樂 at 35, at 30 and at 32 (card surcharge, folded back onto 30)
+items = [sale('台北店', '可口可樂', 30, m) for m in range(3)] + [sale('台北店', '可口可樂', 32, m) for m in range(3, 5)]
+items += [sale('台北店', '可口可樂', 35, m) for m in range(30, 32)]
+items += [sale('台北店', '綠茶', 25, m) for m in range(5, 15)] + [sale('高雄店', '綠茶', 25, 20)]
+ingest_transactions(db, items)
+db.commit()
+db.close()
+
+print('TEST START')
+client = app.test_client()
+body = client.post('/api/generate-sales-detail', json={'startDate': '2025-08-01', 'endDate': '2025-08-03'}).get_json()
+path = os.path.join(script_dir, body['filename'])
+try:
+    ws = load_workbook(path).active
+    rows = [[cell.value for cell in row] for row in ws.iter_rows()]
+    merged = sorted(str(r) for r in ws.merged_cells.ranges)
+finally:
+    os.remove(path)
+for row in rows:
+    print(row)
+print('merged:', merged)
+
+expected = [
+    ['商品', '單價', '份數', '小計'],
+    ['台北店', None, None, None],
+    ['綠茶', 25, 10, 250],            # best seller by amount first
+    ['可口可樂', 35, 2, 70],          # prices from high to low, the name merged over them
+    [None, 30, 5, 154],               # 32 is folded back onto 30
+    ['台北店 小計', None, 17, 474],
+    [None, None, None, None],
+    ['高雄店', None, None, None],
+    ['綠茶', 25, 1, 25],
+    ['高雄店 小計', None, 1, 25],
+    ['總計', None, 18, 499],
+]
+if rows != expected:
+    print('FAILED: sheet contents')
+    sys.exit(1)
+if merged != ['A2:D2', 'A4:A5', 'A8:D8']:
+    print('FAILED: merged store rows / product names')
+    sys.exit(1)
+shaded = ws['A4'].fill.fgColor.rgb == ws['D5'].fill.fgColor.rgb == '00F5F5F5'
+if not shaded or ws['C3'].number_format != '#,##0' or not ws['A1'].font.b:
+    print('FAILED: styles')
+    sys.exit(1)
+if ws.freeze_panes != 'A2' or ws.column_dimensions['A'].width != 45:
+    print('FAILED: sheet settings')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,112 @@
+import sys, tempfile, os
+from datetime import date, datetime
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, Store, SalesDaily, Transaction
+from sales_ingest import ingest_transactions
+from sales_rollup import rebuild_sales_daily, ensure_sales_daily, sales_counts_by_product, sales_detail_rows
+
+# Runs against a throwaway SQLite file, so the real inventory.db is untouched.
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'sales_rollup_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+db = Session()
+db.add_all([Store(store_key='TW Lion HQ 1.0-551'), Store(store_key='TW Lion HQ 1.0-552'), Store(store_key='台北店-7')])
+db.commit()
+db.close()
+
+
+def ingest(items, **kwargs):
+    db = Session()
+    try:
+        counts = ingest_transactions(db, items, **kwargs)
+        db.commit()
+        return counts
+    finally:
+        db.close()
+
+
+def sale(date, product='可口可樂', amount=30, shop='TW Lion HQ 1.0', pay='LINE Pay'):
+    return {'shopName': shop, 'product': product, 'date': date, 'amount': amount, 'payType': pay}
+
+
+def rollup():
+    db = Session()
+    try:
+        return sorted((r.store_key, r.product_name, r.day, r.unit_price, r.count, r.amount) for r in db.query(SalesDaily))
+    finally:
+        db.close()
+
+
+def rebuilt():
+    db = Session()
+    try:
+        rebuild_sales_daily(db)
+        db.commit()
+    finally:
+        db.close()
+    return rollup()
+
+
+print('TEST START')
+export = [sale('2025-08-01 10:00:00'), sale('2025-08-01 11:00:00'), sale('2025-08-01 12:00:00', amount=32),
+          sale('2025-08-02 09:30:00', product='綠茶', amount=25), sale('2025-08-02 10:00:00', shop='台北店')]
+ingest(export)
+# Re-ingesting the same rows must not count them twice
+ingest(export + [sale('2025-08-03 08:00:00')])
+incremental = rollup()
+print('incremental:', incremental)
+coke_day1 = [r for r in incremental if r[1] == '可口可樂' and r[2] == date(2025, 8, 1)]
+if coke_day1 != [('TW Lion HQ 1.0-551', '可口可樂', date(2025, 8, 1), 30, 3, 92)]:
+    print('FAILED: surcharged amounts were not folded onto the list price')
+    sys.exit(1)
+
+# Daily aggregates (Astra) replace the day: the rollup drops the old figures
+ingest([sale('2025-08-03', product='A-咖啡', amount=60, pay='ASTRA_API')], replace_window=True)
+ingest([sale('2025-08-03', product='A-咖啡', amount=90, pay='ASTRA_API')], replace_window=True)
+incremental = rollup()
+if incremental != rebuilt():
+    print('FAILED: incrementally maintained rollup differs from a rebuild', incremental)
+    sys.exit(1)
+
+db = Session()
+counts = sales_counts_by_product(db, 'TW Lion HQ 1.0', date(2025, 8, 2))
+detail = sales_detail_rows(db, date(2025, 8, 1), date(2025, 8, 3), stores=['TW Lion HQ 1.0'], products=['可口可樂'])
+db.close()
+print('counts:', counts, 'detail:', detail)
+if counts != {'綠茶': 1, '可口可樂': 1, 'A-咖啡': 1}:
+    print('FAILED: unexpected per-product sales counts')
+    sys.exit(1)
+if [tuple(r) for r in detail] != [('TW Lion HQ 1.0-551', '可口可樂', 30, 4, 122)]:
+    print('FAILED: unexpected sales detail rows')
+    sys.exit(1)
+
+# A rolling cutoff counts the same rows as `transaction_time >= since` on the raw table
+db = Session()
+since = datetime(2025, 8, 1, 10, 30)
+rolling = sales_counts_by_product(db, 'TW Lion HQ 1.0', since)
+raw = {}
+for t in db.query(Transaction).filter(Transaction.store_key.startswith('TW Lion HQ 1.0'), Transaction.transaction_time >= since):
+    raw[t.product_name] = raw.get(t.product_name, 0) + 1
+db.close()
+print('rolling:', rolling)
+if rolling != raw or rolling['可口可樂'] != 3:
+    print('FAILED: the rolling window differs from counting the raw transactions', raw)
+    sys.exit(1)
+
+# Existing databases get the rollup built once, then ensure is a no-op
+db = Session()
+db.query(SalesDaily).delete()
+db.commit()
+built_first, built_again = ensure_sales_daily(db), ensure_sales_daily(db)
+db.close()
+if not built_first or built_again or rollup() != incremental:
+    print('FAILED: ensure_sales_daily did not build the rollup exactly once')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
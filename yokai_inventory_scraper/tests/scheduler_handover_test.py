@@ -0,0 +1,101 @@
+import sys, tempfile, os, types
+import datetime as dt
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import schedule
+import leader
+from database import Base, ScheduledSlot
+from leader import LeaderElection, LeaderSchedule, claim_slot
+
+# Drives LeaderSchedule (the loop behind server.run_scheduler) across leader handovers on
+# a fake clock: the old leader fires the 15:55 run and dies, the follower takes over a
+# minute later. The takeover must not re-fire the overdue run, and must not use up the
+# slot of the next night's run either.
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'scheduler_handover_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+
+class Clock(dt.datetime):
+    current = dt.datetime(2026, 10, 17, 15, 54, 30)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+# schedule and the leases both run on the fake clock
+schedule.datetime = types.SimpleNamespace(**{**vars(dt), 'datetime': Clock})
+leader.datetime = Clock
+
+fired = []
+
+
+def register(leader_schedule):
+    every = leader_schedule.scheduler.every
+    leader_schedule.every_run(every().hour.at(":01"), 'inventory', fired.append, 'inventory')
+    leader_schedule.every_run(every().day.at("15:50"), 'warehouse', fired.append, 'warehouse')
+    leader_schedule.every_run(every().day.at("15:55"), 'sales', fired.append, 'sales')
+
+
+old_leader = LeaderElection(Session, 'scheduler', holder='A')
+follower = LeaderSchedule(Session, LeaderElection(Session, 'scheduler', lease_seconds=60, holder='B'), register)
+
+
+def tick_at(*when):
+    Clock.current = dt.datetime(*when)
+    follower.lease._checked_at = None  # ask the database on every tick, not every lease/3 seconds
+    return follower.tick()
+
+
+def check(expected, message):
+    print(f"{Clock.current}: fired {fired}")
+    if fired != expected:
+        print(f"FAILED: {message}")
+        sys.exit(1)
+    fired.clear()
+
+
+print('TEST START')
+old_leader.acquire()
+if tick_at(2026, 10, 17, 15, 54, 30) or follower.scheduler.get_jobs():
+    print('FAILED: a follower should hold no scheduled runs')
+    sys.exit(1)
+# The old leader fires tonight's sales run, then dies
+claim_slot(Session, 'sales', '2026-10-17T15:55', holder='A')
+old_leader.release()
+
+if not tick_at(2026, 10, 17, 15, 56, 10):
+    print('FAILED: the follower did not take the lease over')
+    sys.exit(1)
+check([], 'the takeover re-fired a run the old leader had fired, or an older one')
+tick_at(2026, 10, 17, 16, 1, 5)
+check(['inventory'], 'the hourly run after the takeover did not fire')
+tick_at(2026, 10, 18, 15, 50, 5)
+tick_at(2026, 10, 18, 15, 55, 5)
+check(['inventory', 'warehouse', 'sales'], "the next night's runs were skipped")
+
+# A second handover where the old leader dies right before 15:55: the new leader fires
+# the run that fell into the failover gap, once
+follower.lease.release()
+Clock.current = dt.datetime(2026, 10, 19, 15, 54, 40)
+old_leader.acquire()
+tick_at(2026, 10, 19, 15, 54, 50)
+old_leader.release()
+tick_at(2026, 10, 19, 15, 55, 40)
+tick_at(2026, 10, 19, 15, 55, 50)
+check(['sales'], 'the run missed during the failover gap was not fired exactly once')
+
+db = Session()
+slots = sorted(slot for slot, in db.query(ScheduledSlot.slot).filter(ScheduledSlot.name == 'sales'))
+db.close()
+print('sales slots:', slots)
+if slots != ['2026-10-17T15:55', '2026-10-18T15:55', '2026-10-19T15:55']:
+    print('FAILED: sales slots should be keyed on the scheduled run time')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
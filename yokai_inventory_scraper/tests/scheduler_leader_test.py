@@ -0,0 +1,82 @@
+import sys, tempfile, os, time, signal
+import multiprocessing
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, ScheduledSlot
+from leader import LeaderElection, claim_slot
+
+# Three "gunicorn workers" run the scheduler loop against one database. Slots are a
+# quarter second long; the leader fires every slot, the parent kills it halfway.
+SLOTS_PER_SECOND = 4
+LEASE_SECONDS = 1.0
+RUN_SECONDS = 5.0
+
+
+def scheduler_process(db_url, deadline):
+    engine = create_engine(db_url, connect_args={'timeout': 30})
+    Session = sessionmaker(bind=engine)
+    lease = LeaderElection(Session, 'scheduler', lease_seconds=LEASE_SECONDS, holder=f"pid-{os.getpid()}")
+    while time.time() < deadline:
+        if lease.is_leader():
+            claim_slot(Session, 'tick', str(int(time.time() * SLOTS_PER_SECOND)), holder=lease.holder)
+        time.sleep(0.02)
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    db_url = f"sqlite:///{os.path.join(tmp_dir, 'scheduler_leader_test.db')}"
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    print('TEST START')
+    started = time.time()
+    deadline = started + RUN_SECONDS
+    processes = [multiprocessing.Process(target=scheduler_process, args=(db_url, deadline)) for _ in range(3)]
+    for p in processes:
+        p.start()
+
+    time.sleep(RUN_SECONDS / 2)
+    first_leader = LeaderElection(Session, 'scheduler').current_holder()
+    print('leader before kill:', first_leader)
+    if first_leader is None:
+        print('FAILED: nobody took the scheduler lease')
+        sys.exit(1)
+    killed_at = time.time()
+    # SIGKILL: no atexit release, the lease has to lapse
+    os.kill(int(first_leader.split('-')[1]), signal.SIGKILL)
+    for p in processes:
+        p.join()
+
+    db = Session()
+    fires = [(int(slot), fired_by) for slot, fired_by in db.query(ScheduledSlot.slot, ScheduledSlot.fired_by).filter(ScheduledSlot.name == 'tick')]
+    db.close()
+    fires.sort()
+    holders = {}
+    for slot, fired_by in fires:
+        holders.setdefault(fired_by, []).append(slot)
+    print('fires per holder:', {h: len(s) for h, s in holders.items()})
+
+    kill_slot = int(killed_at * SLOTS_PER_SECOND)
+    before = {fired_by for slot, fired_by in fires if slot < kill_slot}
+    after = {fired_by for slot, fired_by in fires if slot > kill_slot}
+    if before != {first_leader}:
+        print('FAILED: more than one process fired before the kill', before)
+        sys.exit(1)
+    if not after or first_leader in after or len(after) != 1:
+        print('FAILED: exactly one other process should take over', after)
+        sys.exit(1)
+
+    # Slots are unique per name (primary key), so a slot never fires twice; check that
+    # every slot fired apart from the failover window of about one lease.
+    expected = set(range(int(started * SLOTS_PER_SECOND) + 2, int(deadline * SLOTS_PER_SECOND) - 1))
+    missing = sorted(expected - {slot for slot, _ in fires})
+    print('missing slots:', len(missing), 'of', len(expected))
+    if len(missing) > (LEASE_SECONDS + 0.5) * SLOTS_PER_SECOND or any(slot < kill_slot for slot in missing):
+        print('FAILED: scheduled slots were skipped outside the failover window')
+        sys.exit(1)
+
+    print('TEST PASS')
+    print('TEST END')
@@ -0,0 +1,64 @@
+import sys, os, time, random
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'fixtures'))
+import numpy as np
+from replenishment import machine_suggestions, warehouse_tab_suggestions
+from strategy_kernel import tab_additions
+import legacy_replenishment as legacy
+
+# The NumPy strategy kernel vs. the per-machine dict code it replaced, on 300 machines
+# (BENCH_MACHINES) over 150 stores and 80 products. The old code is the copy kept in
+# tests/fixtures/legacy_replenishment.py.
+MACHINES = int(os.environ.get('BENCH_MACHINES', 300))
+PRODUCTS = 80
+REPEAT = 3
+random.seed(5)
+
+store_keys = [f"門市 {m // 2:03d}-M{m:04d}" for m in range(MACHINES)]
+products = [f"商品 {p:02d}" for p in range(PRODUCTS)]
+warehouse = {p: random.randint(0, 80) for p in products}
+inventories = {k: {p: random.randint(0, 5) for p in random.sample(products, 9)} for k in store_keys}
+sales = {k.split('-', 1)[0]: {p: random.randint(1, 60) for p in random.sample(products, 30)} for k in store_keys}
+
+
+def best_of(run):
+    times = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def legacy_loop(function, *args):
+    def run():
+        for k in store_keys:
+            try:
+                function(k, *args[:-2], dict(warehouse), inventories[k], sales[k.split('-', 1)[0]])
+            except Exception:  # the old aggressive/exploratory code crashes on full machines
+                pass
+    return run
+
+
+print('TEST START')
+print(f"{MACHINES} machines, {PRODUCTS} products")
+for strategy in ('stable', 'aggressive', 'exploratory'):
+    rows = {}
+    rows['presentation, kernel'] = best_of(lambda: machine_suggestions(store_keys, strategy, 0, False, 50, warehouse, inventories, sales))
+    rows['replenishment tab, kernel'] = best_of(lambda: warehouse_tab_suggestions(store_keys, strategy, 50, ['W'], warehouse, inventories, sales))
+    rows['presentation, per machine (old)'] = best_of(legacy_loop(legacy.machine_suggestion, strategy, 0, False, 50, None, None))
+    rows['replenishment tab, per machine (old)'] = best_of(legacy_loop(legacy.warehouse_tab_suggestion, strategy, 50, ['W'], None, None))
+    print(f"  {strategy}")
+    for name, seconds in rows.items():
+        print(f"    {name:38s} {seconds * 1000:8.1f} ms")
+
+# The kernel alone (arrays in, arrays out), which is what a batch of machines costs
+sold = np.random.default_rng(5).integers(0, 60, (PRODUCTS, MACHINES)).astype(float)
+stock = np.array(list(warehouse.values()), dtype=float)
+held_order = np.where(sold > 40, np.arange(PRODUCTS)[:, None], np.inf)
+seconds = best_of(lambda: tab_additions('stable', sold, stock, held_order, np.full(MACHINES, 40)))
+print(f"  tab_additions only, {PRODUCTS}x{MACHINES}: {seconds * 1000:.1f} ms")
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,179 @@
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'fixtures'))
+import numpy as np
+from strategy_kernel import (TOP_PRODUCTS, EXISTING_SHARE, positions, even_split, distribute_remainder, tab_additions,
+                             target_quantities, replenish_quantities, no_sales_quantities)
+from replenishment import warehouse_tab_suggestions, machine_suggestions
+import legacy_replenishment as legacy
+
+# Every machine of a batch must get exactly the body the per-machine code gave it
+# (tests/fixtures/legacy_replenishment.py), over seeded random fleets.
+CASES = 300
+MACHINES = 8
+STRATEGIES = ('stable', 'aggressive', 'exploratory', 'clearance')
+rng = np.random.default_rng(23)
+
+
+def fail(message, case):
+    print(f"FAILED (case {case}): {message}")
+    sys.exit(1)
+
+
+def shuffled(items):
+    items = list(items)
+    return [items[i] for i in rng.permutation(len(items))]
+
+
+def random_fleet():
+    products = [f"商品{p:02d}" for p in range(rng.integers(1, 20))]
+    low = rng.random() < 0.5
+    warehouse = {p: int(rng.integers(0, 8) if low else rng.integers(0, 60))
+                 for p in shuffled(products) if rng.random() < 0.7}
+    store_keys = [f"店{m // 2}-{m}" for m in range(MACHINES)]
+    inventories, sales = {}, {}
+    for store_key in store_keys:
+        held = shuffled(products)[:rng.integers(0, len(products) + 1)]
+        inventories[store_key] = {p: int(rng.integers(0, 10)) for p in held}
+        store_name = store_key.split('-', 1)[0]
+        if store_name not in sales:
+            sold = [] if rng.random() < 0.15 else shuffled(products)[:rng.integers(0, len(products) + 1)]
+            # few distinct counts, so the tie-breaking is exercised too
+            sales[store_name] = {p: int(rng.integers(1, 6) * rng.choice([1, 5])) for p in sold}
+    return store_keys, warehouse, inventories, sales
+
+
+def legacy_bodies(function, store_keys, inventories, sales, *args):
+    """(body, status) per machine, None where the old code raised."""
+    results = []
+    for store_key in store_keys:
+        try:
+            results.append(function(store_key, *args, inventories[store_key], sales[store_key.split('-', 1)[0]]))
+        except Exception:
+            results.append(None)
+    return results
+
+
+print('TEST START')
+# The rounding helpers on hand-checked columns
+got = even_split(np.array([[1, 1], [0, 1], [1, 1]], dtype=bool), [5, 5], np.array([[0, 2], [0, 1], [1, 0]]))
+if got.tolist() != [[3, 1], [0, 2], [2, 2]]:
+    fail(f"even_split {got.tolist()}", 'fixed')
+quantities, order = distribute_remainder(np.array([[1.5], [2.25], [0.0], [0.75]]), [7], np.ones((4, 1), dtype=bool))
+if quantities[:, 0].tolist() != [2, 3, 1, 1] or order[:, 0].tolist() != [1, 2, 3, 0]:
+    fail(f"distribute_remainder {quantities.tolist()} {order.tolist()}", 'fixed')
+rows, quantities = no_sales_quantities('aggressive', np.array([5, 0, 30, 12, 30, 1]), 50)
+if rows.tolist() != [2, 4, 3] or quantities.tolist() != [15, 15, 12]:
+    fail('no-sales aggressive', 'fixed')
+
+# Invariants of the rounding and the strategies on random matrices. Where the per-machine
+# code breaks one, the kernel keeps its behaviour and the check names that deliberate
+# exception:
+#   A  distribute_remainder takes nothing back when the truncated quotas already exceed
+#      the totals, and hands out the remainder by position, so a row without any
+#      fraction can get a unit while the total stays short when the remainder exceeds
+#      the member rows.
+#   B  the stable tab corrects its rounding by ±1 over the first listed products, which
+#      can take a unit from a product that rounded to 0 (an addition of -1).
+#   C  targets are capped by the stock before the remainder is handed out (A), so a row
+#      can end one unit above the stock.
+#   D  the tab does not cap additions by the warehouse stock, only skips products
+#      without any; no_sales_quantities is the only step that caps by the stock itself.
+quirks = {'A': 0, 'B': 0, 'C': 0}
+for case in range(CASES):
+    products, machines = int(rng.integers(1, 15)), MACHINES
+    sales = rng.integers(0, 6, (products, machines)) * rng.choice([0, 1, 5], (products, machines))
+    stock = rng.integers(0, 30, products) * (rng.random(products) < 0.7)
+    held_order = np.where(rng.random((products, machines)) < 0.4, rng.permutation(products)[:, None] * 1.0, np.inf)
+    sales_order = np.where(sales > 0, positions(sales > 0, -sales), np.inf)
+    free = rng.integers(-3, 40, machines)
+    slots = rng.integers(0, 40, machines)
+    in_warehouse = rng.random(products) < 0.8
+    members = rng.random((products, machines)) < 0.6
+    count = members.sum(axis=0)
+
+    split = even_split(members, slots, sales)
+    spread = np.where(members, split, 0).max(axis=0) - np.where(members, split, np.inf).min(axis=0)
+    if (split[~members] != 0).any() or (split.sum(axis=0)[count > 0] != slots[count > 0]).any() or \
+            (spread[count > 0] > 1).any():
+        fail('even_split must split the whole space over the members, at most one unit apart', case)
+
+    quotas = rng.random((products, machines)) * rng.integers(0, 12)
+    totals = rng.integers(0, 40, machines)
+    quantities, _ = distribute_remainder(quotas, totals, members)
+    base = np.where(members, np.trunc(quotas), 0)
+    if (quantities[~members] != 0).any() or not np.isin(quantities - base, (0, 1)).all():
+        fail('distribute_remainder must give every member its truncated quota or one more', case)
+    # Exactly the totals when the remainder fits the members; otherwise as documented in A
+    expected = base.sum(axis=0) + np.clip(totals - base.sum(axis=0), 0, count)
+    if (quantities.sum(axis=0) != expected).any():
+        fail('distribute_remainder totals', case)
+    quirks['A'] += int((expected != totals).any() or ((quantities > base) & (quotas == base) & members).any())
+
+    held = np.isfinite(held_order)
+    listed = (stock > 0)[:, None] & (free > 0)
+    for strategy in STRATEGIES:
+        additions, order = tab_additions(strategy, sales, stock, held_order, free)
+        if (additions[stock <= 0] != 0).any() or (additions.sum(axis=0) > np.maximum(free, 0)).any():
+            fail(f"{strategy} tab: additions to products out of stock, or beyond the free space", case)
+        if strategy == 'stable':
+            if (additions.sum(axis=0)[listed.any(axis=0)] != free[listed.any(axis=0)]).any() or (additions < -1).any():
+                fail('stable tab: the free space must be filled exactly, at most -1 per product (B)', case)
+            quirks['B'] += int((additions < 0).any())
+        elif (additions < 0).any() or (additions[held] != 0).any() or ((additions > 0) & (order < 0)).any():
+            fail(f"{strategy} tab: additions must go to listed products the machine does not hold", case)
+
+        targets, _ = target_quantities(strategy, sales, sales_order, stock, in_warehouse, slots)
+        if (targets < 0).any() or (targets.sum(axis=0) > slots).any():
+            fail(f"{strategy} targets beyond the slots", case)
+        if strategy in ('stable', 'aggressive') and (targets > stock[:, None] + 1).any():
+            fail(f"{strategy} targets more than one unit above the stock (C)", case)
+        quirks['C'] += int(strategy in ('stable', 'aggressive') and (targets > stock[:, None]).any())
+        if strategy in ('stable', 'aggressive') and (targets[~in_warehouse] != 0).any():
+            fail(f"{strategy} targets for products the warehouses do not carry", case)
+
+        added = replenish_quantities(strategy, sales, sales_order, slots)
+        sellers = np.isfinite(sales_order).sum(axis=0)
+        space = {'stable': slots, 'exploratory': np.round(slots * EXISTING_SHARE)}.get(strategy, slots)
+        if (added < 0).any() or (added.sum(axis=0) > space).any():
+            fail(f"{strategy} replenishment beyond the space", case)
+        # Aggressive fills the whole space only when there are products beyond the top 3
+        filled = sellers > (TOP_PRODUCTS if strategy == 'aggressive' else 0)
+        if strategy != 'clearance' and (added.sum(axis=0)[filled] != space[filled]).any():
+            fail(f"{strategy} replenishment must fill the space", case)
+
+        rows, quantities = no_sales_quantities(strategy, stock, int(slots[0]))
+        if (quantities > stock[rows]).any() or (quantities < 0).any():
+            fail(f"{strategy} suggestion without sales beyond the stock", case)
+print(f"invariants hold on {CASES} random cases; cases with the legacy exceptions: {quirks}")
+
+compared = raised = 0
+for case in range(CASES):
+    store_keys, warehouse, inventories, sales = random_fleet()
+    capacity = int(rng.integers(1, 51))
+    reserve = int(rng.integers(-2, 12))
+    only_add = bool(rng.random() < 0.5)
+    for strategy in STRATEGIES:
+        new = warehouse_tab_suggestions(store_keys, strategy, capacity, ['W'], warehouse, inventories, sales)
+        old = legacy_bodies(legacy.warehouse_tab_suggestion, store_keys, inventories, sales, strategy, capacity, ['W'], warehouse)
+        new += machine_suggestions(store_keys, strategy, reserve, only_add, capacity, warehouse, inventories, sales)
+        old += legacy_bodies(legacy.machine_suggestion, store_keys, inventories, sales, strategy, reserve, only_add, capacity, warehouse)
+        for m, (got, expected) in enumerate(zip(new, old)):
+            if expected is None:
+                # The old code crashed here (a full machine, or no new products for aggressive);
+                # such machines now get their current stock back
+                raised += 1
+                body, status = got
+                if status != 200 or any(item['suggestedQty'] != item['currentQty'] for item in body['suggestion']):
+                    fail(f"{strategy}, machine {m}: expected the current stock where the old code raised", case)
+                continue
+            compared += 1
+            if got != expected:
+                print('kernel:', got)
+                print('legacy:', expected)
+                fail(f"{strategy}, machine {m % MACHINES} of the {'presentation page' if m >= MACHINES else 'replenishment tab'} differs", case)
+
+print(f"{CASES} random fleets: {compared} machine suggestions identical, {raised} the old code raised on")
+print('TEST PASS')
+print('TEST END')
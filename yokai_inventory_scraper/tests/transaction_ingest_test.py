@@ -0,0 +1,73 @@
+import sys, tempfile, os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base, Store, Transaction
+from sales_ingest import ingest_transactions, get_sales_export_start_date
+
+# Runs the ingest against a throwaway SQLite file, so the real inventory.db is untouched.
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'ingest_test.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+
+db = Session()
+db.add(Store(store_key='TW Lion HQ 1.0-551'))
+db.commit()
+db.close()
+
+
+def ingest(items, **kwargs):
+    db = Session()
+    try:
+        counts = ingest_transactions(db, items, **kwargs)
+        db.commit()
+        return counts
+    finally:
+        db.close()
+
+
+def sale(date, product='可口可樂', amount=30, shop='TW Lion HQ 1.0', pay='LINE Pay'):
+    return {'shopName': shop, 'product': product, 'date': date, 'amount': amount, 'payType': pay}
+
+
+print('TEST START')
+first_export = [sale('2025-08-01 10:00:00'), sale('2025-08-01 11:00:00'), sale('2025-08-02 09:30:00', amount=45),
+                sale('2025-08-02 12:00:00', shop='新店面'), {'shopName': None, 'date': '2025-08-02'}]
+counts = ingest(first_export)
+print('first run:', counts)
+if counts['new'] != 4 or counts['duplicate'] != 0 or counts['skipped'] != 1:
+    print('FAILED: unexpected first run counts')
+    sys.exit(1)
+
+# Same export again plus one later sale: only the later sale is new
+counts = ingest(first_export + [sale('2025-08-03 08:00:00')])
+print('second run:', counts)
+if counts['new'] != 1 or counts['duplicate'] != 4:
+    print('FAILED: re-ingest was not idempotent')
+    sys.exit(1)
+
+db = Session()
+total = db.query(Transaction).count()
+provisional = db.query(Store).filter(Store.store_key == '新店面-provisional_sales').count()
+start_date = get_sales_export_start_date(db)
+db.close()
+print('stored:', total, 'provisional store:', provisional, 'next export starts:', start_date)
+if total != 5 or provisional != 1 or start_date != '2025-08-02':
+    print('FAILED: unexpected stored state')
+    sys.exit(1)
+
+# Daily aggregates (Astra): the day is replaced, not appended, and other payment types stay
+ingest([sale('2025-08-03', product='A-咖啡', amount=60, pay='ASTRA_API')], replace_window=True)
+counts = ingest([sale('2025-08-03', product='A-咖啡', amount=90, pay='ASTRA_API')], replace_window=True)
+db = Session()
+day_rows = sorted((t.payment_type, t.amount) for t in db.query(Transaction).filter(Transaction.transaction_time >= '2025-08-03'))
+db.close()
+print('replace window:', counts, day_rows)
+if counts['replaced'] != 1 or counts['new'] != 1 or day_rows != [('ASTRA_API', 90), ('LINE Pay', 30)]:
+    print('FAILED: replace_window did not replace the day')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
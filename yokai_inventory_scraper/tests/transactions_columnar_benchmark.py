@@ -0,0 +1,84 @@
+import sys, tempfile, os, time, random, json, gzip
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from database import Base, Store, Transaction
+from transaction_columns import transactions_select, columnar_json_chunks, arrow_ipc_chunks, arrow_available
+from response_layer import compress_chunks
+
+# Row-per-transaction JSON (/api/transactions) vs. the columnar export on a throwaway
+# SQLite DB: 1M transactions (BENCH_ROWS) over 200 machines, 80 products, 4 payment types.
+ROWS = int(os.environ.get('BENCH_ROWS', 1_000_000))
+MACHINES, PRODUCTS = 200, 80
+PAY_TYPES = ('LINE Pay', '現金', '悠遊卡', '信用卡')
+
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'columnar_benchmark.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+random.seed(7)
+START = datetime(2024, 1, 1)
+
+store_keys = [f"門市 {m // 2:03d} 購物中心-M{m:04d}" for m in range(MACHINES)]
+products = [f"商品 {p:02d} 口味限定版" for p in range(PRODUCTS)]
+db = Session()
+db.add_all([Store(store_key=k) for k in store_keys])
+db.commit()
+for start in range(0, ROWS, 50000):
+    db.execute(insert(Transaction), [
+        {'store_key': random.choice(store_keys), 'transaction_time': START + timedelta(seconds=i * 31),
+         'product_name': random.choice(products), 'amount': random.choice((25, 30, 32, 45, 60)),
+         'payment_type': random.choice(PAY_TYPES)}
+        for i in range(start, min(start + 50000, ROWS))
+    ])
+db.commit()
+
+
+def row_api(db):
+    """What GET /api/transactions does: ORM objects -> list of dicts -> JSON."""
+    stores = {s.store_key: s.store_key.rsplit('-', 1)[0] for s in db.query(Store).all()}
+    result = [{"shopName": stores.get(t.store_key, t.store_key), "date": t.transaction_time.isoformat(),
+               "amount": t.amount, "product": t.product_name, "payType": t.payment_type}
+              for t in db.query(Transaction).all()]
+    return json.dumps(result).encode('utf-8')
+
+
+def timed(build):
+    db = Session()
+    try:
+        started = time.perf_counter()
+        body = build(db)
+        return body, time.perf_counter() - started
+    finally:
+        db.close()
+
+
+print('TEST START')
+results = {}
+row_body, results['rows (json)'] = timed(row_api)
+row_gzip = b''.join(compress_chunks([row_body]))
+columnar_body, results['columnar (json)'] = timed(lambda db: b''.join(columnar_json_chunks(db, transactions_select())))
+columnar_gzip, results['columnar (json+gzip)'] = timed(lambda db: b''.join(compress_chunks(columnar_json_chunks(db, transactions_select()))))
+sizes = {'rows (json)': len(row_body), 'rows (json+gzip)': len(row_gzip),
+         'columnar (json)': len(columnar_body), 'columnar (json+gzip)': len(columnar_gzip)}
+if arrow_available():
+    arrow_body, results['columnar (arrow)'] = timed(lambda db: b''.join(arrow_ipc_chunks(db, transactions_select())))
+    sizes['columnar (arrow)'] = len(arrow_body)
+
+print(f"{ROWS:,} transactions")
+for name, size in sizes.items():
+    seconds = results.get(name)
+    print(f"  {name:22s} {size / 1e6:8.1f} MB  {'' if seconds is None else f'{seconds:6.2f}s'}")
+
+payload = json.loads(gzip.decompress(columnar_gzip))
+if payload['length'] != ROWS or len(json.loads(row_body)) != ROWS:
+    print('FAILED: exports are incomplete')
+    sys.exit(1)
+if sizes['columnar (json+gzip)'] >= sizes['rows (json)'] / 5:
+    print('FAILED: columnar payload is not substantially smaller')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
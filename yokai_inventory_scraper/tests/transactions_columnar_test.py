@@ -0,0 +1,80 @@
+import sys, tempfile, os, gzip, json
+from datetime import datetime, timedelta
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+# Throwaway SQLite file, so the real inventory.db is untouched
+tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'columnar_test.db')}"
+from server import app
+from database import SessionLocal, Store, Transaction
+from transaction_columns import arrow_available
+
+db = SessionLocal()
+db.add_all([Store(store_key='TW Lion HQ 1.0-551'), Store(store_key='台北店-7')])
+for day in range(1, 6):
+    db.add(Transaction(store_key='TW Lion HQ 1.0-551', transaction_time=datetime(2025, 8, day, 10, 30), amount=30,
+                       product_name='可口可樂', payment_type='LINE Pay'))
+    db.add(Transaction(store_key='台北店-7', transaction_time=datetime(2025, 8, day, 18), amount=25 + day,
+                       product_name='綠茶' if day % 2 else '可口可樂', payment_type='現金'))
+db.commit()
+db.close()
+
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['logged_in'] = True
+
+
+def decode(payload):
+    """Python version of transactions_columnar.js"""
+    dictionaries = payload['dictionaries']
+    rows = []
+    for batch in payload['batches']:
+        for j in range(batch['length']):
+            rows.append({'shopName': dictionaries['shopName'][batch['shopName'][j]],
+                         'date': (datetime(1970, 1, 1) + timedelta(seconds=batch['date'][j])).isoformat(),
+                         'amount': batch['amount'][j],
+                         'product': dictionaries['product'][batch['product'][j]],
+                         'payType': dictionaries['payType'][batch['payType'][j]]})
+    return rows
+
+
+def key(row):
+    return row['date'], row['shopName']
+
+
+print('TEST START')
+rows = sorted(client.get('/api/transactions').get_json(), key=key)
+response = client.get('/api/transactions/columnar', headers={'Accept-Encoding': 'gzip'})
+payload = json.loads(gzip.decompress(response.get_data()))
+print('encoding:', response.headers.get('Content-Encoding'), 'dictionaries:', payload['dictionaries'])
+if response.headers.get('Content-Encoding') != 'gzip' or payload['length'] != 10:
+    print('FAILED: columnar response not gzip-compressed or incomplete')
+    sys.exit(1)
+if sorted(decode(payload), key=key) != rows:
+    print('FAILED: decoded columnar rows differ from /api/transactions')
+    sys.exit(1)
+
+# Day range (inclusive) and shop filters; no gzip without Accept-Encoding
+response = client.get('/api/transactions/columnar?start=2025-08-02&end=2025-08-03&store=台北店')
+filtered = decode(response.get_json())
+print('filtered:', filtered)
+if response.headers.get('Content-Encoding') or [r['date'] for r in filtered] != ['2025-08-02T18:00:00', '2025-08-03T18:00:00']:
+    print('FAILED: date / store filters')
+    sys.exit(1)
+if client.get('/api/transactions/columnar?start=08/02/2025').status_code != 400:
+    print('FAILED: invalid dates should be rejected')
+    sys.exit(1)
+
+if arrow_available():
+    import pyarrow
+    table = pyarrow.ipc.open_stream(client.get('/api/transactions/columnar?format=arrow').get_data()).read_all()
+    print('arrow:', table.num_rows, table.schema.names)
+    if table.num_rows != 10 or sorted(table.column('shopName').to_pylist()) != sorted(r['shopName'] for r in rows):
+        print('FAILED: Arrow stream')
+        sys.exit(1)
+elif client.get('/api/transactions/columnar?format=arrow').status_code != 400:
+    print('FAILED: Arrow requested without pyarrow should be rejected')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
@@ -0,0 +1,59 @@
+import sys, tempfile, os
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import text
+from database import make_engine, ensure_unique_index
+
+# An inventory table from before the unique key, with duplicate rows, in a throwaway SQLite file
+tmp_dir = tempfile.mkdtemp()
+engine = make_engine(f"sqlite:///{os.path.join(tmp_dir, 'unique_index_migration_test.db')}")
+with engine.begin() as conn:
+    conn.execute(text("CREATE TABLE inventory (id INTEGER PRIMARY KEY, store VARCHAR, machine_id VARCHAR, "
+                      "product_name VARCHAR, quantity INTEGER)"))
+    conn.execute(text("INSERT INTO inventory (store, machine_id, product_name, quantity) VALUES (:s, :m, :p, :q)"), [
+        {'s': '台北店', 'm': str(n % 40), 'p': f"商品{n % 7}", 'q': n} for n in range(2600)
+    ])
+
+
+def rows():
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT store, machine_id, product_name, quantity FROM inventory")).fetchall()
+
+
+print('TEST START')
+if not ensure_unique_index('inventory', 'uq_inventory_store_machine_product', ('store', 'machine_id', 'product_name'),
+                           keep_newest=True, target=engine):
+    print('FAILED: the migration did not run on a table without the index')
+    sys.exit(1)
+left = rows()
+print(len(left), 'rows left')
+# 280 distinct keys; the newest copy of each holds the largest quantity
+if len(left) != 280 or any(quantity < 2600 - 280 for *_, quantity in left):
+    print('FAILED: duplicates were not reduced to the newest row per key')
+    sys.exit(1)
+
+# Once the index exists the migration does not touch the table again
+with engine.begin() as conn:
+    conn.execute(text("INSERT INTO inventory (store, machine_id, product_name, quantity) VALUES ('高雄店', '1', '綠茶', 1)"))
+if ensure_unique_index('inventory', 'uq_inventory_store_machine_product', ('store', 'machine_id', 'product_name'),
+                       keep_newest=True, target=engine):
+    print('FAILED: the migration ran again although the index exists')
+    sys.exit(1)
+with engine.begin() as conn:
+    conn.execute(text("INSERT INTO inventory (store, machine_id, product_name, quantity) VALUES ('高雄店', '1', '綠茶', 5) "
+                      "ON CONFLICT (store, machine_id, product_name) DO UPDATE SET quantity = excluded.quantity"))
+if [row for row in rows() if row[0] == '高雄店'] != [('高雄店', '1', '綠茶', 5)]:
+    print('FAILED: upserts need the unique index')
+    sys.exit(1)
+
+# A failed migration raises instead of leaving the upserts to fail later
+try:
+    ensure_unique_index('inventory', 'uq_inventory_missing_column', ('store', 'no_such_column'), keep_newest=True, target=engine)
+except RuntimeError as e:
+    print('raised:', str(e)[:80])
+else:
+    print('FAILED: a failed migration must raise')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
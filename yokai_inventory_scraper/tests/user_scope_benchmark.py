@@ -0,0 +1,128 @@
+import sys, tempfile, os, time, random
+from datetime import datetime
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from sqlalchemy import create_engine, or_, and_
+from sqlalchemy.orm import sessionmaker
+from database import Base, User, Store, Inventory, Transaction, bump_data_version
+from user_scope import ensure_scope, scoped_inventory_query, scoped_transactions_query, notify_store_totals
+
+# Old (ILIKE OR-chain) vs. new (scope table) user filtering on a throwaway SQLite DB:
+# 300 users, 3000 machines in 600 stores, each user assigned 5-15 machines.
+USERS, STORES, MACHINES_PER_STORE = 300, 600, 5
+
+tmp_dir = tempfile.mkdtemp()
+engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'user_scope_benchmark.db')}")
+Base.metadata.create_all(bind=engine)
+Session = sessionmaker(bind=engine)
+random.seed(7)
+NOW = datetime(2025, 8, 10, 12, 0)
+
+
+def old_inventory(db, user):
+    filters = []
+    for sk in [s.store_key for s in user.stores]:
+        if '-' in sk:
+            left, right = sk.rsplit('-', 1)
+            filters.append(and_(Inventory.store == left, Inventory.machine_id == right))
+            filters.append(Inventory.store.ilike(left))
+            filters.append(Inventory.store.ilike(f"{left}%"))
+            filters.append(Inventory.store.ilike(f"%{left}%"))
+        else:
+            filters.append(Inventory.store.ilike(sk))
+            filters.append(Inventory.store.ilike(f"{sk}%"))
+            filters.append(Inventory.store.ilike(f"%{sk}%"))
+    return db.query(Inventory).filter(or_(*filters)).all() if filters else []
+
+
+def old_transactions(db, user):
+    trans_filters = []
+    for sk in [s.store_key for s in user.stores]:
+        if '-' in sk:
+            left = sk.rsplit('-', 1)[0]
+            trans_filters.append(Transaction.store_key == sk)
+            trans_filters.append(Transaction.store_key.ilike(f"{left}%"))
+            trans_filters.append(Transaction.store_key.ilike(f"%{left}%"))
+        else:
+            trans_filters.append(Transaction.store_key.ilike(sk))
+            trans_filters.append(Transaction.store_key.ilike(f"%{sk}%"))
+    return db.query(Transaction).filter(or_(*trans_filters)).all()
+
+
+def old_notify_totals(db, store_keys):
+    totals = {}
+    for sk in store_keys:
+        left = sk.split('-')[0]
+        qty_rows = db.query(Inventory).filter(Inventory.store.ilike(f"%{left}%")).with_entities(Inventory.quantity).all()
+        totals[sk] = sum([q[0] or 0 for q in qty_rows])
+    return totals
+
+
+db = Session()
+store_keys = []
+for s in range(STORES):
+    name = f"Store {s:03d} Mall"
+    for m in range(MACHINES_PER_STORE):
+        machine_id = f"M{s:03d}{m}"
+        store_keys.append(f"{name}-{machine_id}")
+        db.add(Store(store_key=f"{name}-{machine_id}"))
+        for p in range(3):
+            db.add(Inventory(store=name, machine_id=machine_id, product_name=f"P{p}", quantity=random.randint(0, 9),
+                               process_time=NOW))
+        db.add(Transaction(store_key=f"{name}-{machine_id}", transaction_time=datetime(2025, 8, m + 1, 10),
+                           product_name='P0', amount=30, payment_type='LINE Pay'))
+db.flush()
+stores_by_key = {s.store_key: s for s in db.query(Store)}
+for u in range(USERS):
+    user = User(username=f"user{u}", password_hash='x')
+    user.stores = [stores_by_key[k] for k in random.sample(store_keys, random.randint(5, 15))]
+    db.add(user)
+bump_data_version(db, 'inventory', 'stores', 'users')
+db.commit()
+
+print('TEST START')
+users = db.query(User).all()
+assigned = sorted({s.store_key for u in users for s in u.stores})
+
+started = time.perf_counter()
+old_inv = {u.id: sorted(i.id for i in old_inventory(db, u)) for u in users}
+old_trans = {u.id: sorted(t.id for t in old_transactions(db, u)) for u in users}
+old_totals = old_notify_totals(db, assigned)
+old_seconds = time.perf_counter() - started
+
+started = time.perf_counter()
+rebuilt = ensure_scope(db)
+build_seconds = time.perf_counter() - started
+
+started = time.perf_counter()
+new_inv = {u.id: sorted(i.id for i in scoped_inventory_query(db, u.id)) for u in users}
+new_trans = {u.id: sorted(t.id for t in scoped_transactions_query(db, u.id)) for u in users}
+new_totals = notify_store_totals(db)
+new_seconds = time.perf_counter() - started
+
+print(f"old ILIKE OR-chains: {old_seconds:.2f}s | scope build: {build_seconds:.2f}s | scope joins: {new_seconds:.2f}s "
+      f"({old_seconds / max(new_seconds, 1e-9):.1f}x)")
+if not rebuilt or ensure_scope(db):
+    print('FAILED: scope should be built once and then reused')
+    sys.exit(1)
+if old_inv != new_inv or old_trans != new_trans:
+    print('FAILED: scoped results differ from the ILIKE filters')
+    sys.exit(1)
+if {k: v for k, v in old_totals.items() if v} != {k: v for k, v in new_totals.items() if v}:
+    print('FAILED: notification totals differ')
+    sys.exit(1)
+
+# Assigning a machine of a new store is picked up after the 'users' bump
+user = users[0]
+db.add(Inventory(store='Brand New Store', machine_id='N1', product_name='P0', quantity=4, process_time=NOW))
+new_store = Store(store_key='Brand New Store-N1')
+user.stores.append(new_store)
+bump_data_version(db, 'inventory', 'stores', 'users')
+db.commit()
+if not ensure_scope(db) or 'Brand New Store' not in {i.store for i in scoped_inventory_query(db, user.id)}:
+    print('FAILED: scope was not rebuilt after the assignment changed')
+    sys.exit(1)
+db.close()
+
+print('TEST PASS')
+print('TEST END')
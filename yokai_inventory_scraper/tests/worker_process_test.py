@@ -0,0 +1,42 @@
+import sys, os, time, signal, subprocess
+from pathlib import Path
+package_dir = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(package_dir))
+os.environ['JOB_WORKER_MODE'] = 'external'
+from server import app, job_runner
+
+client = app.test_client()
+print('TEST START')
+
+# The web process only queues: the job stays queued while no worker runs
+job, _ = job_runner.submit('notify_low_inventory')
+time.sleep(1.5)
+status = client.get(f"/jobs/{job['id']}").get_json()['job']
+print('before worker:', status['status'])
+if status['status'] != 'queued':
+    print('FAILED: the web process ran a job in external mode')
+    sys.exit(1)
+
+worker = subprocess.Popen([sys.executable, '-m', 'worker', '--workers', '1'], cwd=str(package_dir),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+try:
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job['id']}").get_json()['job']
+        if status['status'] in ('succeeded', 'failed'):
+            break
+        time.sleep(0.5)
+    print('after worker:', status['status'], status['durationSeconds'], status['output'])
+    if status['status'] != 'succeeded' or status['durationSeconds'] is None:
+        print('FAILED: the worker process did not run the queued job')
+        sys.exit(1)
+finally:
+    worker.send_signal(signal.SIGTERM)
+    code = worker.wait(timeout=30)
+print('worker exit code:', code)
+if code != 0:
+    print('FAILED: worker did not shut down cleanly on SIGTERM')
+    sys.exit(1)
+
+print('TEST PASS')
+print('TEST END')
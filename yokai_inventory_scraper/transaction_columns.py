@@ -0,0 +1,135 @@
+"""
+Column-oriented transaction export for the dashboards (GET /api/transactions/columnar).
+
+Rows are read with a plain select() in batches and written out batch by batch, so
+neither ORM objects nor the whole result are held in memory. Each batch carries one
+array per column; the repeated strings (shop, product, payment type) are sent as
+integer codes into dictionaries that follow the last batch:
+
+    {"format": "columnar", "columns": [...],
+     "batches": [{"length": n, "shopName": [0, 0, 1], "date": [...], "amount": [...], ...}, ...],
+     "dictionaries": {"shopName": [...], "product": [...], "payType": [...]},
+     "length": total}
+
+`date` is whole seconds since 1970-01-01 of the stored (naive, local) transaction time.
+The same batches can be written as an Apache Arrow IPC stream when pyarrow is installed.
+"""
+import io
+from datetime import datetime
+
+from sqlalchemy import select, or_
+
+from database import Transaction
+from user_scope import view_prefix
+from response_layer import dumps_bytes
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+BATCH_ROWS = 50000
+COLUMNS = ('shopName', 'date', 'amount', 'product', 'payType')
+ENCODED_COLUMNS = ('shopName', 'product', 'payType')
+EPOCH = datetime(1970, 1, 1)
+
+
+def arrow_available():
+    return pyarrow is not None
+
+
+def transactions_select(start=None, end=None, stores=None, store_keys=None):
+    """
+    Raw rows (store_key, transaction_time, amount, product_name, payment_type) with
+    transaction_time in [start, end), store_key starting with one of `stores`, and
+    store_key in `store_keys` (a list or subquery, e.g. user_scope.visible_transaction_keys).
+    """
+    stmt = select(Transaction.store_key, Transaction.transaction_time, Transaction.amount,
+                  Transaction.product_name, Transaction.payment_type)
+    if start is not None:
+        stmt = stmt.where(Transaction.transaction_time >= start)
+    if end is not None:
+        stmt = stmt.where(Transaction.transaction_time < end)
+    if stores:
+        stmt = stmt.where(or_(*[Transaction.store_key.startswith(s) for s in stores]))
+    if store_keys is not None:
+        stmt = stmt.where(Transaction.store_key.in_(store_keys))
+    return stmt.order_by(Transaction.transaction_time, Transaction.id)
+
+
+class _Dictionary:
+    """Assigns each distinct string the next integer code."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def iter_column_batches(db, stmt, batch_rows=BATCH_ROWS):
+    """
+    Yields (batch, dictionaries) per `batch_rows` rows. `dictionaries` grows as new
+    strings appear and is complete after the last batch; codes never change.
+    """
+    dictionaries = {name: _Dictionary() for name in ENCODED_COLUMNS}
+    shop, product, pay = (dictionaries[name].encode for name in ENCODED_COLUMNS)
+    shop_names = {}
+    result = db.execute(stmt.execution_options(yield_per=batch_rows))
+    for rows in result.partitions():
+        shop_codes, dates, amounts, product_codes, pay_codes = [], [], [], [], []
+        for store_key, transaction_time, amount, product_name, payment_type in rows:
+            shop_name = shop_names.get(store_key)
+            if shop_name is None:
+                shop_name = shop_names[store_key] = view_prefix(store_key)
+            shop_codes.append(shop(shop_name))
+            dates.append(int((transaction_time - EPOCH).total_seconds()))
+            amounts.append(amount)
+            product_codes.append(product(product_name))
+            pay_codes.append(pay(payment_type))
+        batch = {'length': len(dates), 'shopName': shop_codes, 'date': dates, 'amount': amounts,
+                 'product': product_codes, 'payType': pay_codes}
+        yield batch, dictionaries
+
+
+def columnar_json_chunks(db, stmt, batch_rows=BATCH_ROWS):
+    """The export as JSON, one bytes chunk per batch."""
+    yield b'{"format":"columnar","columns":' + dumps_bytes(list(COLUMNS)) + b',"batches":['
+    total = 0
+    dictionaries = None
+    for batch, dictionaries in iter_column_batches(db, stmt, batch_rows):
+        yield (b',' if total else b'') + dumps_bytes(batch)
+        total += batch['length']
+    values = {name: dictionaries[name].values if dictionaries else [] for name in ENCODED_COLUMNS}
+    yield b'],"dictionaries":' + dumps_bytes(values) + b',"length":%d}' % total
+
+
+def arrow_ipc_chunks(db, stmt, batch_rows=BATCH_ROWS):
+    """The export as an Arrow IPC stream (dictionary columns, deltas for new strings)."""
+    pa = pyarrow
+    string_dictionary = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([('shopName', string_dictionary), ('date', pa.timestamp('s')), ('amount', pa.int64()),
+                        ('product', string_dictionary), ('payType', string_dictionary)])
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+    def take():
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return chunk
+
+    for batch, dictionaries in iter_column_batches(db, stmt, batch_rows):
+        columns = [pa.DictionaryArray.from_arrays(pa.array(batch[name], pa.int32()), pa.array(dictionaries[name].values))
+                   if name in ENCODED_COLUMNS else batch[name] for name in COLUMNS]
+        writer.write_batch(pa.record_batch(columns, schema=schema))
+        yield take()
+    writer.close()
+    yield take()
+
@@ -0,0 +1,20 @@
+// Decodes GET /api/transactions/columnar back into the row objects /api/transactions returns
+// ({ shopName, date, amount, product, payType }), so the dashboards keep their existing code.
+function decodeColumnarTransactions(payload) {
+    const dictionaries = payload.dictionaries;
+    const rows = new Array(payload.length);
+    let i = 0;
+    payload.batches.forEach(batch => {
+        for (let j = 0; j < batch.length; j++) {
+            rows[i++] = {
+                shopName: dictionaries.shopName[batch.shopName[j]],
+                // seconds since 1970-01-01 of the stored local time -> 'YYYY-MM-DDTHH:MM:SS' like the row API
+                date: new Date(batch.date[j] * 1000).toISOString().slice(0, 19),
+                amount: batch.amount[j],
+                product: dictionaries.product[batch.product[j]],
+                payType: dictionaries.payType[batch.payType[j]],
+            };
+        }
+    });
+    return rows;
+}
@@ -0,0 +1,126 @@
+import re
+import time
+import logging
+from datetime import datetime
+
+import pytz
+from sqlalchemy import func, select
+
+from database import (Inventory, Store, Transaction, DataVersion, StoreInventoryScope, StoreTransactionScope,
+                      user_stores, dialect_insert, get_data_versions)
+
+
+# The scope tables are derived from these data sets (see DataVersion).
+SCOPE_SOURCES = ('inventory', 'stores', 'users')
+# Holds sum(source versions) + 1 of the last rebuild. Versions only ever go up, so any
+# bump of any source changes the sum; the +1 makes a never-built DB (all zeros) stale.
+SCOPE_MARKER = 'user_scope_built'
+INSERT_CHUNK_SIZE = 500
+
+
+def view_prefix(store_key):
+    """Name part used by get-data / transactions: everything before the last '-'."""
+    return store_key.rsplit('-', 1)[0] if '-' in store_key else store_key
+
+
+def notify_prefix(store_key):
+    """Name part used by low-inventory notifications: everything before the first '-'."""
+    return store_key.split('-')[0]
+
+
+def _ilike_contains(text):
+    """Returns a predicate equivalent to `value ILIKE '%text%'` (LIKE wildcards in `text` included)."""
+    if '%' not in text and '_' not in text:
+        needle = text.lower()
+        return lambda value: needle in value.lower()
+    pattern = ''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch) for ch in text)
+    regex = re.compile(f'.*{pattern}.*', re.IGNORECASE | re.DOTALL)
+    return lambda value: regex.fullmatch(value) is not None
+
+
+def _matching(candidates, prefix, cache):
+    # Many machines of one store share a prefix, so each prefix is matched only once
+    if prefix not in cache:
+        matches = _ilike_contains(prefix)
+        cache[prefix] = [value for value in candidates if matches(value)]
+    return cache[prefix]
+
+
+def _insert_all(db, model, rows):
+    insert = dialect_insert(db, model)
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.execute(insert.values(rows[start:start + INSERT_CHUNK_SIZE]).on_conflict_do_nothing())
+
+
+def rebuild_scope(db):
+    """Recomputes both scope tables for every store_key that is assigned to a user."""
+    started = time.monotonic()
+    assigned = [row[0] for row in db.query(user_stores.c.store_key).distinct()]
+    inventory_stores = [row[0] for row in db.query(Inventory.store).distinct() if row[0]]
+    # transactions.store_key references stores, and every new store bumps 'stores'
+    transaction_store_keys = [row[0] for row in db.query(Store.store_key)]
+
+    inventory_rows, transaction_rows = [], []
+    inventory_matches, transaction_matches = {}, {}
+    for store_key in assigned:
+        for rule, prefix in (('view', view_prefix(store_key)), ('notify', notify_prefix(store_key))):
+            inventory_rows.extend({'store_key': store_key, 'rule': rule, 'inventory_store': name}
+                                  for name in _matching(inventory_stores, prefix, inventory_matches))
+        keys = set(_matching(transaction_store_keys, view_prefix(store_key), transaction_matches))
+        keys.add(store_key)
+        transaction_rows.extend({'store_key': store_key, 'transaction_store_key': key} for key in keys)
+
+    db.query(StoreInventoryScope).delete(synchronize_session=False)
+    db.query(StoreTransactionScope).delete(synchronize_session=False)
+    _insert_all(db, StoreInventoryScope, inventory_rows)
+    _insert_all(db, StoreTransactionScope, transaction_rows)
+    logging.info(f"Rebuilt user scope for {len(assigned)} assigned stores: {len(inventory_rows)} inventory "
+                 f"and {len(transaction_rows)} transaction mappings in {time.monotonic() - started:.2f}s.")
+
+
+def ensure_scope(db):
+    """Rebuilds the scope tables (and commits) if users, stores or inventory changed since the last build."""
+    *source_versions, built = get_data_versions(db, SCOPE_SOURCES + (SCOPE_MARKER,))
+    expected = sum(source_versions) + 1
+    if built == expected:
+        return False
+    rebuild_scope(db)
+    stmt = dialect_insert(db, DataVersion).values(name=SCOPE_MARKER, version=expected, updated_at=datetime.now(pytz.utc))
+    db.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'version': expected, 'updated_at': stmt.excluded.updated_at}))
+    db.commit()
+    return True
+
+
+def scoped_inventory_query(db, user_id):
+    """Inventory rows visible to a user, as an indexed semi-join instead of OR'd ILIKEs."""
+    visible_stores = (
+        select(StoreInventoryScope.inventory_store)
+        .join(user_stores, user_stores.c.store_key == StoreInventoryScope.store_key)
+        .where(user_stores.c.user_id == user_id, StoreInventoryScope.rule == 'view')
+    )
+    return db.query(Inventory).filter(Inventory.store.in_(visible_stores))
+
+
+def visible_transaction_keys(user_id):
+    """Subquery of the transaction store_keys a user may see."""
+    return (
+        select(StoreTransactionScope.transaction_store_key)
+        .join(user_stores, user_stores.c.store_key == StoreTransactionScope.store_key)
+        .where(user_stores.c.user_id == user_id)
+    )
+
+
+def scoped_transactions_query(db, user_id, model=Transaction):
+    """Transactions visible to a user (or rows of another table keyed by store_key, e.g. SalesDaily)."""
+    return db.query(model).filter(model.store_key.in_(visible_transaction_keys(user_id)))
+
+
+def notify_store_totals(db):
+    """{assigned store_key: total quantity of the machines it covers} for notifications, in one query."""
+    rows = (
+        db.query(StoreInventoryScope.store_key, func.sum(Inventory.quantity))
+        .join(Inventory, Inventory.store == StoreInventoryScope.inventory_store)
+        .filter(StoreInventoryScope.rule == 'notify')
+        .group_by(StoreInventoryScope.store_key)
+    )
+    return {store_key: int(total or 0) for store_key, total in rows}
@@ -10,6 +10,9 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 from dotenv import load_dotenv
 
+from browser_manager import set_download_dir
+from readiness import StepTimer, enable_performance_log, wait_for_page_ready, wait_for_download_start
+
 # --- 可配置變數 ---
 URL = "https://manager.yokaiexpress.com/#/standStoreManager"
 
@@ -21,7 +24,7 @@ def get_credentials():
         raise ValueError("錯誤：環境變數 YOKAI_USERNAME 或 YOKAI_PASSWORD 未設定。")
     return username, password
 
-def run_warehouse_scraper(headless=False):
+def run_warehouse_scraper(headless=False, driver=None):
     """
     啟動瀏覽器、登入、導航並下載倉庫庫存報告。
     可以在無頭模式（伺服器默認）或有頭模式（本地調試）下運行。
@@ -30,46 +33,58 @@ def run_warehouse_scraper(headless=False):
     os.makedirs(download_dir, exist_ok=True)
     logging.info(f"已建立臨時下載目錄：{download_dir}")
 
-    options = webdriver.ChromeOptions()
-    if headless:
-        options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("window-size=1920,1080")
+    # 沿用 BrowserManager 借出的已登入瀏覽器時，只需切換下載目錄
+    owns_driver = driver is None
+    timer = StepTimer("warehouse")
+    if owns_driver:
+        options = webdriver.ChromeOptions()
+        if headless:
+            options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-gpu")
+        options.add_argument("window-size=1920,1080")
+        enable_performance_log(options)
     
-    prefs = {
-        "download.default_directory": download_dir,
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "plugins.always_open_pdf_externally": True
-    }
-    options.add_experimental_option("prefs", prefs)
-
-    driver = webdriver.Chrome(options=options)
+        prefs = {
+            "download.default_directory": download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "plugins.always_open_pdf_externally": True
+        }
+        options.add_experimental_option("prefs", prefs)
+
+        driver = webdriver.Chrome(options=options)
+    else:
+        set_download_dir(driver, download_dir)
     
     try:
-        # --- 登入（只執行一次） ---
-        username, password = get_credentials()
-        driver.get(URL)
-        wait = WebDriverWait(driver, 30)
+        if owns_driver:
+            # --- 登入（只執行一次） ---
+            username, password = get_credentials()
+            driver.get(URL)
+            wait = WebDriverWait(driver, 30)
         
-        logging.info("步驟 1：正在登入...")
-        logging.info("等待使用者名稱欄位...")
-        username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
-        logging.info("找到使用者名稱欄位。輸入中...")
-        username_field.send_keys(username)
+            logging.info("步驟 1：正在登入...")
+            logging.info("等待使用者名稱欄位...")
+            username_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='User name']")))
+            logging.info("找到使用者名稱欄位。輸入中...")
+            username_field.send_keys(username)
         
-        logging.info("等待密碼欄位...")
-        password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
-        logging.info("找到密碼欄位。輸入中...")
-        password_field.send_keys(password)
-
-        logging.info("等待登入按鈕...")
-        login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
-        logging.info("找到登入按鈕。點擊中...")
-        login_button.click()
-        logging.info("登入成功。")
+            logging.info("等待密碼欄位...")
+            password_field = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Password']")))
+            logging.info("找到密碼欄位。輸入中...")
+            password_field.send_keys(password)
+
+            logging.info("等待登入按鈕...")
+            login_button = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(., 'Login') or contains(., 'Sign in')]")))
+            logging.info("找到登入按鈕。點擊中...")
+            login_button.click()
+            logging.info("登入成功。")
+        else:
+            driver.get(URL)
+            wait = WebDriverWait(driver, 30)
+            logging.info("步驟 1：沿用已登入的瀏覽器工作階段。")
 
         try:
             logging.info("--- 開始倉庫庫存下載 ---")
@@ -82,7 +97,6 @@ def run_warehouse_scraper(headless=False):
             warehouse_menu = wait.until(EC.element_to_be_clickable((By.XPATH, warehouse_menu_xpath)))
             warehouse_menu.click()
             logging.info(" > Warehouse 主選單已點擊")
-            time.sleep(0.5)  # 給選單展開一些時間
             
             try:
                 # 嘗試點擊子選單項目
@@ -104,6 +118,7 @@ def run_warehouse_scraper(headless=False):
                 logging.info(" > 展開選單並點擊項目。")
 
             logging.info("導航點擊已發送。等待頁面載入...")
+            wait_for_page_ready(driver, timer, 'open_page')
             # 檢查當前選擇的 region
             region_input = wait.until(EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Select region']")))
             current_region = region_input.get_attribute("value")
@@ -112,7 +127,6 @@ def run_warehouse_scraper(headless=False):
                 logging.info(f"Current region is {current_region}, changing to TW...")
                 # 點擊 region 選擇器
                 region_input.click()
-                time.sleep(0.5)
                 
                 # 在下拉選單中找到並點擊 TW 選項
                 tw_option = wait.until(EC.element_to_be_clickable((
@@ -120,7 +134,13 @@ def run_warehouse_scraper(headless=False):
                     "//li[contains(@class, 'el-select-dropdown__item')]//span[text()='TW']"
                 )))
                 driver.execute_script("arguments[0].click();", tw_option.find_element(By.XPATH, ".."))
-                time.sleep(1.5)  # 增加等待時間確保選擇生效
+                # 等待選擇生效（最多 10 秒）
+                with timer.waiting('select_region'):
+                    try:
+                        WebDriverWait(driver, 10).until(lambda d: region_input.get_attribute("value") == "TW")
+                    except TimeoutException:
+                        pass
+                wait_for_page_ready(driver, timer, 'select_region')
                 
                 # 確認 region 已經變更為 TW
                 if region_input.get_attribute("value") != "TW":
@@ -146,26 +166,16 @@ def run_warehouse_scraper(headless=False):
                 except Exception as e:
                     logging.error(f" > 無法在嘗試 {attempt + 1} 中點擊匯出按鈕：{e}", exc_info=True)
                     if attempt + 1 < max_export_attempts:
-                        time.sleep(2)  # 等待下一次主要嘗試
+                        wait_for_page_ready(driver, timer, 'export_retry')  # 等待下一次主要嘗試
                         continue  # 進行下一次匯出嘗試
                     else:
                         raise Exception("多次嘗試後仍無法點擊匯出按鈕。")
 
-                # 2. 等待並檢查檔案系統以確認下載是否開始
-                logging.info(" > 等待 3 秒後檢查檔案系統...")
-                time.sleep(3)
-
-                max_file_checks = 5
-                download_started = False
-                for check_num in range(max_file_checks):
-                    # 如果有任何檔案（.xlsx 或 .crdownload）存在，表示下載已開始
-                    if os.listdir(download_dir):
-                        logging.info(" > 成功：在下載目錄中檢測到檔案。下載已開始。")
-                        download_started = True
-                        break  # 退出檔案系統檢查迴圈
-                    
-                    logging.info(f" > 檔案系統檢查 {check_num + 1}/{max_file_checks}... 未找到檔案。等待 2 秒。")
-                    time.sleep(2)
+                # 2. 檢查檔案系統以確認下載是否開始（與原本 3 秒 + 5x2 秒相同的 13 秒上限）
+                logging.info(" > 等待下載目錄中出現檔案...")
+                download_started = wait_for_download_start(download_dir, 13, timer)
+                if download_started:
+                    logging.info(" > 成功：在下載目錄中檢測到檔案。下載已開始。")
 
                 if download_started:
                     # 3. 如果下載已開始，輪詢完成情況並返回路徑
@@ -185,8 +195,10 @@ def run_warehouse_scraper(headless=False):
             raise  # 重新拋出異常以供 server.py 背景作業運行器處理
 
     finally:
-        driver.quit()
-        logging.info("瀏覽器已關閉。")
+        logging.info(timer.report())
+        if owns_driver:
+            driver.quit()
+            logging.info("瀏覽器已關閉。")
 
 
 def poll_for_download(download_dir, timeout_seconds):
@@ -207,8 +219,8 @@ def poll_for_download(download_dir, timeout_seconds):
         else:
             logging.info("下載目錄為空。等待下載開始...")
         
-        time.sleep(2)
-        time_waited += 2
+        time.sleep(0.5)
+        time_waited += 0.5
     
     raise Exception(f"下載輪詢在 {timeout_seconds} 秒後超時。")
 
@@ -0,0 +1,60 @@
+"""
+Standalone job worker: runs the scraper / ingest / notification jobs that the web
+process queues in the `jobs` table, so Chrome, pandas and the parsing load stay out
+of the process answering HTTP requests.
+
+    JOB_WORKER_MODE=external gunicorn ... server:app    # web: only queues jobs
+    python -m worker [--workers N]                      # worker, same DATABASE_URL
+
+Several workers (also on other machines) may run at once; the per-type concurrency
+limits are enforced through the database.
+"""
+import os
+import signal
+import logging
+import argparse
+import threading
+
+from dotenv import load_dotenv
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# Like server.py: the .env has to be loaded before database.py reads DATABASE_URL
+dotenv_path = os.path.join(script_dir, '.env')
+if os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path=dotenv_path)
+
+from database import init_db, SessionLocal
+from jobs import JobRunner
+from tasks import register_tasks
+from browser_manager import browser_manager
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs queued background jobs.')
+    parser.add_argument('--workers', type=int, default=None, help='parallel jobs in this process (default: JOB_WORKERS)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    init_db()
+    runner = JobRunner(SessionLocal, workers=args.workers)
+    register_tasks(runner)
+
+    stop = threading.Event()
+
+    def _shutdown(signum, frame):
+        logging.info(f"Received signal {signum}, finishing running jobs...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    runner.start()
+    stop.wait()
+    # Waits for the jobs in progress; queued ones stay queued for the next worker
+    runner.stop(wait=True)
+    browser_manager.shutdown()
+    logging.info("Worker stopped.")
+
+
+if __name__ == '__main__':
+    main()